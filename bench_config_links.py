@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: config link generation, cached per-inbound template vs. compiling per link
+
+    python bench_config_links.py [rounds] [clients per inbound]   (default: 3 200)
+
+One inbound per protocol (vless/vmess/trojan) and transport/security combination
+(tcp, reality, tcp+http header, ws+tls, grpc+tls), each with many clients. "rebuild"
+runs ``_compile_panel`` / ``_compile_share`` for every link, which is what the
+builders did before templates; "template" goes through ``link_template``.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'bench_config_links.db'))
+
+from bot.config_links import _COMPILERS, DIALECT_PANEL, DIALECT_SHARE, link_template, template_stats
+from bot.panel_inbound import parse_inbound
+
+HOST = 'panel.example.com'
+
+STREAMS = [
+    {'network': 'tcp', 'security': 'none'},
+    {'network': 'tcp', 'security': 'reality', 'realitySettings': {
+        'serverNames': ['www.example.com'], 'publicKey': 'pubKEY123', 'shortId': 'ab12'}},
+    {'network': 'tcp', 'security': 'none', 'tcpSettings': {'header': {
+        'type': 'http', 'request': {'path': ['/dl'], 'headers': {'Host': ['cdn.example.com']}}}}},
+    {'network': 'ws', 'security': 'tls', 'wsSettings': {'path': '/ws', 'headers': {'Host': 'ws.example.com'}},
+     'tlsSettings': {'serverName': 'tls.example.com', 'alpn': ['h2', 'http/1.1']}},
+    {'network': 'grpc', 'security': 'tls', 'grpcSettings': {'serviceName': 'gsvc'},
+     'tlsSettings': {'serverName': 'grpc.example.com'}},
+]
+
+
+def sample_inbounds(n_clients):
+    inbounds = []
+    for proto in ('vless', 'vmess', 'trojan'):
+        for n, stream in enumerate(STREAMS):
+            clients = [{'id': f'00000000-0000-0000-0000-{i:012d}', 'password': f'pw{i}', 'email': f'user{i}',
+                        'flow': 'xtls-rprx-vision' if i % 2 else ''} for i in range(n_clients)]
+            inbounds.append({
+                'id': len(inbounds) + 1, 'protocol': proto, 'port': 20000 + len(inbounds),
+                'remark': f'{proto}-{n}', 'settings': json.dumps({'clients': clients}),
+                'streamSettings': json.dumps(stream),
+            })
+    return inbounds
+
+
+def bench(rounds=3, n_clients=200):
+    inbounds = sample_inbounds(n_clients)
+    out = {}
+    for dialect in (DIALECT_PANEL, DIALECT_SHARE):
+        compile_link = _COMPILERS[dialect]
+        rebuild_s = template_s = 0.0
+        links = mismatches = 0
+        for _ in range(rounds):
+            for inbound in inbounds:
+                # A fresh dict per round, like a new fetch of an unchanged inbound
+                parsed = parse_inbound(dict(inbound))
+                t0 = time.perf_counter()
+                rebuilt = [compile_link(parsed, HOST).render(c.raw, c.email) for c in parsed.clients]
+                rebuild_s += time.perf_counter() - t0
+                t0 = time.perf_counter()
+                templated = [link_template(parsed, HOST, dialect).render(c.raw, c.email) for c in parsed.clients]
+                template_s += time.perf_counter() - t0
+                links += len(parsed.clients)
+                mismatches += sum(a != b for a, b in zip(rebuilt, templated))
+        out[dialect] = {
+            'inbounds': len(inbounds),
+            'links': links,
+            'rebuild_us_per_link': round(rebuild_s / links * 1e6, 2),
+            'template_us_per_link': round(template_s / links * 1e6, 2),
+            'mismatches': mismatches,
+        }
+    out['templates'] = template_stats()
+    return out
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    for key, res in bench(*args).items():
+        print(key, res)
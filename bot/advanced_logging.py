@@ -2,54 +2,245 @@
 Advanced Logging System with Rotation and Monitoring
 Provides structured logging, log rotation, and performance tracking
 """
+import atexit
 import logging
 import logging.handlers
 import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 import traceback
 from pathlib import Path
 
+# Queue between the calling threads and the writer thread; full queue => record dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Records handled per wake-up of the writer thread; streams are flushed once per batch
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '256'))
+# "logger=N,..." keeps 1 of every N DEBUG records of that logger (and its children)
+LOG_DEBUG_SAMPLING = os.getenv('LOG_DEBUG_SAMPLING', '')
+
+_encode_str = json.encoder.encode_basestring
+_EXTRA_FIELDS = ('user_id', 'handler_name', 'duration', 'error_type')
+
+
+def _encode_value(value: Any) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return _encode_str(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return json.dumps(value, ensure_ascii=False, default=str)
+
 
 class StructuredFormatter(logging.Formatter):
-    """Custom formatter that outputs structured logs"""
-    
+    """Custom formatter that outputs structured logs
+
+    Builds the JSON line directly instead of going through a dict and
+    ``json.dumps``; the timestamp prefix is reused within the same second.
+    """
+
+    _ts_second = None
+    _ts_prefix = ''
+
+    def _timestamp(self, created: float) -> str:
+        sec = int(created)
+        if sec != self._ts_second:
+            self._ts_second = sec
+            self._ts_prefix = datetime.utcfromtimestamp(sec).strftime('%Y-%m-%dT%H:%M:%S')
+        return f"{self._ts_prefix}.{int((created - sec) * 1e6):06d}"
+
     def format(self, record: logging.LogRecord) -> str:
-        # Base log data
-        log_data = {
-            'timestamp': datetime.utcnow().isoformat(),
-            'level': record.levelname,
-            'logger': record.name,
-            'message': record.getMessage(),
-            'module': record.module,
-            'function': record.funcName,
-            'line': record.lineno
-        }
-        
+        parts = [
+            '{"timestamp":"', self._timestamp(record.created),
+            '","level":"', record.levelname,
+            '","logger":', _encode_str(record.name),
+            ',"message":', _encode_str(record.getMessage()),
+            ',"module":', _encode_str(record.module),
+            ',"function":', _encode_str(record.funcName or ''),
+            ',"line":', str(record.lineno),
+        ]
         # Add extra fields if available
-        if hasattr(record, 'user_id'):
-            log_data['user_id'] = record.user_id
-        if hasattr(record, 'handler_name'):
-            log_data['handler_name'] = record.handler_name
-        if hasattr(record, 'duration'):
-            log_data['duration'] = record.duration
-        if hasattr(record, 'error_type'):
-            log_data['error_type'] = record.error_type
-        
+        d = record.__dict__
+        for field in _EXTRA_FIELDS:
+            if field in d:
+                parts.append(f',"{field}":{_encode_value(d[field])}')
+
         # Add exception info if present
-        if record.exc_info:
-            log_data['exception'] = {
+        if record.exc_info and record.exc_info[0] is not None:
+            exc = {
                 'type': record.exc_info[0].__name__,
                 'message': str(record.exc_info[1]),
                 'traceback': traceback.format_exception(*record.exc_info)
             }
-        
-        return json.dumps(log_data, ensure_ascii=False)
+            parts.append(',"exception":' + json.dumps(exc, ensure_ascii=False))
+        parts.append('}')
+        return ''.join(parts)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keeps 1 of every N DEBUG records per logger prefix; other levels always pass"""
+
+    def __init__(self, rates: Optional[Dict[str, int]] = None):
+        super().__init__()
+        self.rates: Dict[str, int] = {}
+        self._ticks: Dict[str, int] = {}
+        self.sampled_out = 0
+        for name, every in (rates or {}).items():
+            self.set_rate(name, every)
+
+    @staticmethod
+    def parse(spec: str) -> Dict[str, int]:
+        rates = {}
+        for item in (spec or '').split(','):
+            name, _, every = item.strip().partition('=')
+            if name and every.strip().isdigit():
+                rates[name.strip()] = int(every)
+        return rates
+
+    def set_rate(self, logger_name: str, every: int):
+        if every and every > 1:
+            self.rates[logger_name] = int(every)
+        else:
+            self.rates.pop(logger_name, None)
+
+    def _rate_for(self, name: str):
+        while name:
+            every = self.rates.get(name)
+            if every:
+                return name, every
+            name = name.rpartition('.')[0]
+        return None, 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.DEBUG or not self.rates:
+            return True
+        key, every = self._rate_for(record.name)
+        if not every:
+            return True
+        tick = self._ticks.get(key, 0)
+        self._ticks[key] = tick + 1
+        if tick % every:
+            self.sampled_out += 1
+            return False
+        return True
+
+
+class _BatchFlushMixin:
+    """Stream handler whose per-record flush is deferred to the end of a batch"""
+
+    _batching = False
+
+    def flush(self):
+        if not self._batching:
+            super().flush()
+
+
+class BatchedRotatingFileHandler(_BatchFlushMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class BatchedStreamHandler(_BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records without formatting them and never waits on a full queue"""
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Freeze the message now (args may be mutated later); JSON and traceback
+        # formatting happen on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener:
+    """Writer thread: drains the queue in batches and flushes each handler once per batch"""
+
+    _STOP = object()
+
+    def __init__(self, q: "queue.Queue", handlers: List[logging.Handler], batch_size: int = LOG_BATCH_SIZE):
+        self.queue = q
+        self.handlers = handlers
+        self.batch_size = max(1, batch_size)
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _dispatch(self, batch: List[logging.LogRecord]):
+        for h in self.handlers:
+            h._batching = True
+        try:
+            for record in batch:
+                for h in self.handlers:
+                    if record.levelno >= h.level:
+                        h.handle(record)
+        finally:
+            for h in self.handlers:
+                h._batching = False
+                try:
+                    h.flush()
+                except Exception:
+                    pass
+        self.written += len(batch)
+        self.batches += 1
+
+    def _run(self):
+        q = self.queue
+        while True:
+            record = q.get()
+            stop = record is self._STOP
+            batch = [] if stop else [record]
+            while len(batch) < self.batch_size:
+                try:
+                    record = q.get_nowait()
+                except queue.Empty:
+                    break
+                if record is self._STOP:
+                    stop = True
+                    break
+                batch.append(record)
+            if batch:
+                self._dispatch(batch)
+            if stop:
+                return
 
 
 class AdvancedLogger:
-    """Advanced logging manager with multiple outputs and rotation"""
+    """Advanced logging manager with multiple outputs and rotation
+
+    The logger itself only carries a :class:`NonBlockingQueueHandler`; the
+    console and rotating file handlers run on a :class:`BatchingQueueListener`
+    thread so a stalled disk never blocks the event loop.
+    """
     
     def __init__(self, name: str = 'wingsbot', log_dir: str = 'logs'):
         self.name = name
@@ -67,18 +258,17 @@ class AdvancedLogger:
         """Set up various log handlers"""
         
         # 1. Console Handler (INFO and above)
-        console_handler = logging.StreamHandler()
+        console_handler = BatchedStreamHandler()
         console_handler.setLevel(logging.INFO)
         console_formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
         console_handler.setFormatter(console_formatter)
-        self.logger.addHandler(console_handler)
         
         # 2. Rotating File Handler for all logs
         all_logs_path = self.log_dir / 'all.log'
-        file_handler = logging.handlers.RotatingFileHandler(
+        file_handler = BatchedRotatingFileHandler(
             filename=all_logs_path,
             maxBytes=10 * 1024 * 1024,  # 10MB
             backupCount=5,
@@ -86,11 +276,10 @@ class AdvancedLogger:
         )
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(StructuredFormatter())
-        self.logger.addHandler(file_handler)
         
         # 3. Error File Handler (ERROR and above)
         error_logs_path = self.log_dir / 'errors.log'
-        error_handler = logging.handlers.RotatingFileHandler(
+        error_handler = BatchedRotatingFileHandler(
             filename=error_logs_path,
             maxBytes=5 * 1024 * 1024,  # 5MB
             backupCount=3,
@@ -98,11 +287,10 @@ class AdvancedLogger:
         )
         error_handler.setLevel(logging.ERROR)
         error_handler.setFormatter(StructuredFormatter())
-        self.logger.addHandler(error_handler)
         
         # 4. Performance File Handler
         perf_logs_path = self.log_dir / 'performance.log'
-        perf_handler = logging.handlers.RotatingFileHandler(
+        perf_handler = BatchedRotatingFileHandler(
             filename=perf_logs_path,
             maxBytes=5 * 1024 * 1024,  # 5MB
             backupCount=3,
@@ -111,7 +299,32 @@ class AdvancedLogger:
         perf_handler.setLevel(logging.INFO)
         perf_handler.addFilter(lambda record: hasattr(record, 'duration'))
         perf_handler.setFormatter(StructuredFormatter())
-        self.logger.addHandler(perf_handler)
+
+        # 5. Queue in front of all of them; sampling drops noisy DEBUG before enqueueing
+        self.sampling = DebugSamplingFilter(DebugSamplingFilter.parse(LOG_DEBUG_SAMPLING))
+        self.queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        self.queue_handler.addFilter(self.sampling)
+        self.logger.addHandler(self.queue_handler)
+
+        self.listener = BatchingQueueListener(
+            self.queue_handler.queue,
+            [console_handler, file_handler, error_handler, perf_handler],
+        )
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def set_debug_sampling(self, logger_name: str, every: int):
+        """Keep 1 of every ``every`` DEBUG records from ``logger_name`` (<= 1 disables)"""
+        self.sampling.set_rate(logger_name, every)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': self.queue_handler.queue.qsize(),
+            'written': self.listener.written,
+            'batches': self.listener.batches,
+            'dropped': self.queue_handler.dropped,
+            'sampled_out': self.sampling.sampled_out,
+        }
     
     def log_performance(self, 
                        handler_name: str, 
@@ -5,12 +5,13 @@ Enhanced version with better performance tracking and predictive analytics
 import time
 import psutil
 import asyncio
-import statistics
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any
-from collections import deque, defaultdict
+from collections import defaultdict
 from dataclasses import dataclass, field
 from .db import query_db, execute_db
+from .migrations import ensure_schema
+from .metrics import Histogram, get_metrics
 from .config import logger, ADMIN_ID
 from .advanced_logging import get_advanced_logger
 import json
@@ -26,14 +27,18 @@ class Metric:
 
 
 class MetricsCollector:
-    """Collects and aggregates metrics"""
+    """Collects and aggregates metrics
+
+    Histograms are streaming (fixed memory, O(1) record): a log-linear sketch for
+    quantiles plus running count/sum/sum-of-squares, instead of raw value windows.
+    """
     
     def __init__(self, window_size: int = 1000):
         self.window_size = window_size
-        self.metrics: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window_size))
         self.counters: Dict[str, int] = defaultdict(int)
         self.gauges: Dict[str, float] = {}
-        self.histograms: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window_size))
+        self.histograms: Dict[str, Histogram] = {}
+        self._sumsq: Dict[str, float] = defaultdict(float)
     
     def record_counter(self, name: str, value: int = 1, tags: Optional[Dict] = None):
         """Increment a counter metric"""
@@ -48,8 +53,11 @@ class MetricsCollector:
     def record_histogram(self, name: str, value: float, tags: Optional[Dict] = None):
         """Record a value in a histogram"""
         key = self._make_key(name, tags)
-        self.histograms[key].append(value)
-        self.metrics[key].append(Metric(name, value, datetime.now(), tags or {}))
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = Histogram(with_sketch=True)
+        h.observe(value)
+        self._sumsq[key] += value * value
     
     def _make_key(self, name: str, tags: Optional[Dict]) -> str:
         """Create a unique key for a metric"""
@@ -59,23 +67,36 @@ class MetricsCollector:
         return f"{name},{tag_str}"
     
     def get_stats(self, name: str, tags: Optional[Dict] = None) -> Dict[str, float]:
-        """Get statistics for a histogram metric"""
+        """Get statistics for a histogram metric (all tag sets merged when ``tags`` is None)"""
         key = self._make_key(name, tags)
-        values = list(self.histograms.get(key, []))
+        if tags or key in self.histograms:
+            keys = [key] if key in self.histograms else []
+        else:
+            keys = [k for k in self.histograms if k.split(',', 1)[0] == name]
+        if not keys:
+            return {}
         
-        if not values:
+        h = Histogram(with_sketch=True)
+        sumsq = 0.0
+        for k in keys:
+            h.merge(self.histograms[k])
+            sumsq += self._sumsq[k]
+        if not h.count:
             return {}
         
+        avg = h.sum / h.count
+        variance = (sumsq - h.count * avg * avg) / (h.count - 1) if h.count > 1 else 0.0
+        p50, p95, p99 = h.sketch.quantiles(0.5, 0.95, 0.99)
         return {
-            'count': len(values),
-            'sum': sum(values),
-            'avg': statistics.mean(values),
-            'min': min(values),
-            'max': max(values),
-            'p50': statistics.median(values),
-            'p95': statistics.quantiles(values, n=20)[18] if len(values) > 1 else values[0],
-            'p99': statistics.quantiles(values, n=100)[98] if len(values) > 1 else values[0],
-            'stddev': statistics.stdev(values) if len(values) > 1 else 0
+            'count': h.count,
+            'sum': h.sum,
+            'avg': avg,
+            'min': h.min,
+            'max': h.max,
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+            'stddev': max(variance, 0.0) ** 0.5
         }
 
 
@@ -91,56 +112,8 @@ class AdvancedMonitor:
         self._create_tables()
     
     def _create_tables(self):
-        """Create advanced monitoring tables"""
-        try:
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS metrics_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    metric_name TEXT NOT NULL,
-                    metric_value REAL NOT NULL,
-                    metric_type TEXT,
-                    tags TEXT,
-                    aggregation_period TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS alerts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    alert_type TEXT NOT NULL,
-                    severity TEXT NOT NULL,
-                    message TEXT,
-                    metric_name TEXT,
-                    metric_value REAL,
-                    threshold REAL,
-                    resolved BOOLEAN DEFAULT 0,
-                    resolved_at TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS performance_baselines (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    metric_name TEXT NOT NULL,
-                    hour_of_day INTEGER,
-                    day_of_week INTEGER,
-                    baseline_value REAL,
-                    std_deviation REAL,
-                    sample_count INTEGER,
-                    last_updated TEXT
-                )
-            """)
-            
-            # Create indices for better performance
-            execute_db("CREATE INDEX IF NOT EXISTS idx_metrics_timestamp ON metrics_history(timestamp)")
-            execute_db("CREATE INDEX IF NOT EXISTS idx_metrics_name ON metrics_history(metric_name)")
-            execute_db("CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp)")
-            execute_db("CREATE INDEX IF NOT EXISTS idx_alerts_resolved ON alerts(resolved)")
-            
-        except Exception as e:
-            logger.error(f"Failed to create monitoring tables: {e}")
+        """Tables are owned by bot.migrations; this is a single version check"""
+        ensure_schema()
     
     def _load_thresholds(self) -> Dict[str, Dict[str, float]]:
         """Load alerting thresholds"""
@@ -185,21 +158,10 @@ class AdvancedMonitor:
                 self.thresholds['response_time']['warning']
             )
         
-        # Store in database for historical analysis
-        try:
-            execute_db("""
-                INSERT INTO metrics_history 
-                (timestamp, metric_name, metric_value, metric_type, tags)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                datetime.now().isoformat(),
-                'request_duration',
-                duration,
-                'histogram',
-                json.dumps({'handler': handler_name, 'success': success, 'user_id': user_id})
-            ))
-        except Exception as e:
-            self.logger.log_error(e, 'track_request')
+        # Historical data goes through the in-memory pipeline (per-minute rollups), not a row per request
+        metrics = get_metrics()
+        metrics.observe('bot_request_duration_seconds', duration, handler=handler_name)
+        metrics.inc('bot_requests_total', handler=handler_name, status='ok' if success else 'error')
     
     async def check_system_health(self) -> Dict[str, Any]:
         """Comprehensive system health check"""
@@ -465,13 +427,7 @@ class AdvancedMonitor:
         if format == 'json':
             return json.dumps(data, indent=2, default=str)
         elif format == 'prometheus':
-            # Format for Prometheus
-            lines = []
-            for name, value in self.metrics.counters.items():
-                lines.append(f"{name} {value}")
-            for name, value in self.metrics.gauges.items():
-                lines.append(f"{name} {value}")
-            return '\n'.join(lines)
+            return get_metrics().render_prometheus()
         else:
             return str(data)
 
@@ -4,6 +4,7 @@ Provides intelligent responses, command suggestions, and user support
 """
 import re
 import json
+import sqlite3
 from typing import Dict, List, Optional, Tuple, Any
 from datetime import datetime, timedelta
 from difflib import get_close_matches
@@ -13,6 +14,9 @@ from telegram.ext import ContextTypes
 from .db import query_db, execute_db
 from .advanced_logging import get_advanced_logger
 from .performance_optimizer import cached
+from .intent_index import IntentIndex
+from .write_queue import WriteQueue
+from .config import DB_NAME
 
 
 class AIAssistant:
@@ -25,6 +29,7 @@ class AIAssistant:
         self.responses = self._load_responses()
         self.commands = self._load_commands()
         self.learning_enabled = True
+        self.intent_index = self._build_intent_index()
     
     def _create_tables(self):
         """Create AI assistant tables"""
@@ -182,6 +187,16 @@ class AIAssistant:
         
         return intents
     
+    def _build_intent_index(self) -> IntentIndex:
+        """Compile static intents and verified learned patterns into one index"""
+        learned = query_db("SELECT pattern, intent, confidence FROM ai_learning WHERE verified = 1")
+        return IntentIndex.build(self.intents, learned or [])
+    
+    def reload_intents(self):
+        """Re-read ai_intents and rebuild the index (after admin edits)"""
+        self.intents = self._load_intents()
+        self.intent_index = self._build_intent_index()
+    
     def _load_responses(self) -> Dict:
         """Load response templates"""
         return {
@@ -230,11 +245,8 @@ class AIAssistant:
             response = self.generate_response(intent, context)
             action = self.intents[intent].get('action')
             
-            # Update usage stats
-            execute_db(
-                "UPDATE ai_intents SET usage_count = usage_count + 1 WHERE intent_name = ?",
-                (intent,)
-            )
+            # Update usage stats (write-behind)
+            _ai_writes.submit(('usage', intent))
         else:
             # Try to find similar command
             suggestion = self.suggest_command(message)
@@ -261,59 +273,14 @@ class AIAssistant:
         return response, action, confidence
     
     def detect_intent(self, message: str) -> Tuple[Optional[str], float]:
-        """Detect user intent from message"""
-        message_lower = message.lower()
-        best_intent = None
-        best_confidence = 0.0
-        
-        # Check each intent
-        for intent_name, intent_data in self.intents.items():
-            for pattern in intent_data['patterns']:
-                # Calculate similarity
-                if pattern.lower() in message_lower:
-                    confidence = 0.9
-                elif self._calculate_similarity(pattern.lower(), message_lower) > 0.7:
-                    confidence = 0.7
-                else:
-                    continue
-                
-                # Apply priority boost
-                confidence += intent_data['priority'] * 0.1
-                
-                if confidence > best_confidence:
-                    best_confidence = confidence
-                    best_intent = intent_name
-        
-        # Check learned patterns
-        learned = query_db(
-            "SELECT intent, MAX(confidence) as conf FROM ai_learning WHERE verified = 1 GROUP BY intent"
-        )
-        for item in learned or []:
-            if self._matches_learned_pattern(message, item['intent']):
-                if item['conf'] > best_confidence:
-                    best_confidence = item['conf']
-                    best_intent = item['intent']
-        
-        return best_intent, min(best_confidence, 1.0)
+        """Detect user intent from message (precompiled index, no DB access)"""
+        return self.intent_index.match(message)
     
     def _calculate_similarity(self, str1: str, str2: str) -> float:
         """Calculate string similarity"""
         from difflib import SequenceMatcher
         return SequenceMatcher(None, str1, str2).ratio()
     
-    def _matches_learned_pattern(self, message: str, intent: str) -> bool:
-        """Check if message matches learned patterns"""
-        learned_patterns = query_db(
-            "SELECT pattern FROM ai_learning WHERE intent = ? AND verified = 1",
-            (intent,)
-        )
-        
-        for pattern_row in learned_patterns or []:
-            if self._calculate_similarity(pattern_row['pattern'].lower(), message.lower()) > 0.8:
-                return True
-        
-        return False
-    
     def generate_response(self, intent: str, context: Optional[Dict] = None) -> str:
         """Generate response based on intent"""
         import random
@@ -399,41 +366,27 @@ class AIAssistant:
                            bot_response: str,
                            intent: str,
                            confidence: float):
-        """Record conversation for analysis"""
-        execute_db("""
-            INSERT INTO ai_conversations 
-            (user_id, timestamp, user_message, bot_response, intent, confidence)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
+        """Record conversation for analysis (queued; sampled/dropped under overload)"""
+        _ai_writes.submit(('conversation', (
             user_id,
             datetime.now().isoformat(),
             user_message[:500],  # Limit message length
             bot_response[:500],
             intent,
             confidence
-        ))
+        )))
     
     async def _learn_from_interaction(self, message: str, intent: str, confidence: float):
         """Learn from user interactions"""
         if confidence > 0.5 and intent != 'unknown':
-            # Record potential pattern
-            execute_db("""
-                INSERT INTO ai_learning 
-                (pattern, intent, confidence, learned_at)
-                VALUES (?, ?, ?, ?)
-            """, (
-                message,
-                intent,
-                confidence,
-                datetime.now().isoformat()
-            ))
-            
-            # Auto-verify if confidence is high
-            if confidence > 0.85:
-                execute_db(
-                    "UPDATE ai_learning SET verified = 1 WHERE pattern = ? AND intent = ?",
-                    (message, intent)
-                )
+            # Auto-verify if confidence is high; the index learns immediately, the row is queued
+            verified = confidence > 0.85
+            _ai_writes.submit(
+                ('learn', (message, intent, confidence, datetime.now().isoformat(), 1 if verified else 0)),
+                droppable=False,
+            )
+            if verified:
+                self.intent_index.add_learned(message, intent, confidence)
     
     async def provide_feedback(self, 
                               conversation_id: int,
@@ -465,6 +418,11 @@ class AIAssistant:
                     "UPDATE ai_intents SET priority = MAX(0, priority - 1) WHERE intent_name = ?",
                     (conv['intent'],)
                 )
+            if conv['intent'] in self.intents:
+                prio = self.intents[conv['intent']].get('priority') or 0
+                prio = prio + 1 if helpful else max(0, prio - 1)
+                self.intents[conv['intent']]['priority'] = prio
+                self.intent_index.set_priority(conv['intent'], prio)
     
     def get_user_insights(self, user_id: int) -> Dict:
         """Get AI insights about user behavior"""
@@ -554,6 +512,45 @@ class AIAssistant:
         }
 
 
+def _flush_ai_writes(batch: List[Tuple[str, Any]]):
+    """Writer-thread side of the AI queue: one transaction per batch"""
+    usage: Dict[str, int] = {}
+    conversations = []
+    learned = []
+    for kind, payload in batch:
+        if kind == 'usage':
+            usage[payload] = usage.get(payload, 0) + 1
+        elif kind == 'conversation':
+            conversations.append(payload)
+        elif kind == 'learn':
+            learned.append(payload)
+    conn = sqlite3.connect(DB_NAME, timeout=10)
+    try:
+        with conn:
+            if conversations:
+                conn.executemany("""
+                    INSERT INTO ai_conversations 
+                    (user_id, timestamp, user_message, bot_response, intent, confidence)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, conversations)
+            if usage:
+                conn.executemany(
+                    "UPDATE ai_intents SET usage_count = usage_count + ? WHERE intent_name = ?",
+                    [(n, name) for name, n in usage.items()]
+                )
+            if learned:
+                conn.executemany("""
+                    INSERT INTO ai_learning 
+                    (pattern, intent, confidence, learned_at, verified)
+                    VALUES (?, ?, ?, ?, ?)
+                """, learned)
+    finally:
+        conn.close()
+
+
+_ai_writes = WriteQueue('ai_assistant', _flush_ai_writes, maxsize=5000, batch_size=200)
+
+
 # Global AI assistant
 _ai_assistant = None
 
@@ -20,6 +20,10 @@ from telegram.warnings import PTBUserWarning
 # Suppress per_message ConversationHandler warnings (expected behavior for our bot)
 warnings.filterwarnings('ignore', message='.*per_message.*', category=PTBUserWarning)
 
+# Time every bot.* import from here on; the slowest ones show up in the boot report
+from .startup_profiler import BOOT_PROFILE, install_import_timer, record_phase, log_boot_report
+install_import_timer()
+
 from .handlers.admin_settings import (
     admin_wallet_adjust_menu,
     admin_toggle_join_logs,
@@ -60,6 +64,10 @@ from .handlers.admin_cron import (
 from .config import BOT_TOKEN, DAILY_JOB_HOUR
 from .db import query_db
 from .db import db_setup
+from .settings_store import get_setting
+from . import query_profiler
+import time as _time_mod
+from .callback_router import CallbackRouter, benchmark_dispatch
 from .jobs import check_expirations
 from .jobs.notifications import check_low_traffic_and_expiry
 from .handlers.common import force_join_checker, dynamic_button_handler, start_command
@@ -106,7 +114,7 @@ from .handlers.admin import (
     admin_reseller_menu, admin_toggle_reseller, admin_reseller_requests, admin_reseller_set_value_start, admin_reseller_set_value_save, admin_reseller_approve, admin_reseller_reject, admin_reseller_delete_start, admin_reseller_delete_receive,
     admin_toggle_signup_bonus, admin_set_signup_bonus_amount_start, admin_set_signup_bonus_amount_save,
     admin_orders_menu, admin_orders_manage, admin_orders_pending, admin_user_management, admin_payments_menu,
-    admin_quick_backup,
+    admin_quick_backup, admin_bulk_approve,
 )
 from .handlers.user import (
     get_free_config_handler, my_services_handler, show_specific_service_details, wallet_menu,
@@ -124,27 +132,46 @@ from .handlers.user import (
     reseller_upload_start_card, reseller_upload_start_crypto, reseller_upload_router,
     usage_stats_handler, user_settings_handler, notifications_settings_handler, wallet_topup_main_handler
 )
-# Advanced Features v2.0
-from .handlers.admin_advanced_analytics import (
+# Advanced Features v2.0 (analytics/charts are loaded on first use)
+from .lazy_import import lazy_handlers
+(
     admin_advanced_stats, admin_chart_users, admin_chart_revenue,
     admin_cohort_analysis, admin_traffic_sources, admin_revenue_prediction,
-    admin_cache_stats, admin_clear_cache
+    admin_cache_stats, admin_clear_cache,
+) = lazy_handlers(
+    '.handlers.admin_advanced_analytics',
+    'admin_advanced_stats', 'admin_chart_users', 'admin_chart_revenue',
+    'admin_cohort_analysis', 'admin_traffic_sources', 'admin_revenue_prediction',
+    'admin_cache_stats', 'admin_clear_cache',
 )
 from .handlers.admin_monitoring import (
-    admin_monitoring_menu, admin_perf_details, admin_error_logs, admin_check_panels
+    admin_monitoring_menu, admin_perf_details, admin_error_logs, admin_check_panels,
+    admin_query_profile,
 )
-# Advanced Features v3.0 - AI & Cloud Integration  
-from .handlers.ai_analytics import (
+# Advanced Features v3.0 - AI & Cloud Integration (loaded on first use)
+(
     ai_user_behavior_analysis, real_time_system_monitor, smart_pricing_engine,
-    blockchain_integration, iot_device_management
+    blockchain_integration, iot_device_management,
+) = lazy_handlers(
+    '.handlers.ai_analytics',
+    'ai_user_behavior_analysis', 'real_time_system_monitor', 'smart_pricing_engine',
+    'blockchain_integration', 'iot_device_management',
 )
-from .handlers.webhook_integration import (
+(
     webhook_management_panel, microservices_orchestration, machine_learning_pipeline,
-    cyber_security_center
+    cyber_security_center,
+) = lazy_handlers(
+    '.handlers.webhook_integration',
+    'webhook_management_panel', 'microservices_orchestration', 'machine_learning_pipeline',
+    'cyber_security_center',
 )
-from .handlers.mobile_cloud_integration import (
+(
     mobile_app_management, cloud_infrastructure_dashboard, advanced_api_gateway,
-    devops_automation_center, qr_code_generator
+    devops_automation_center, qr_code_generator,
+) = lazy_handlers(
+    '.handlers.mobile_cloud_integration',
+    'mobile_app_management', 'cloud_infrastructure_dashboard', 'advanced_api_gateway',
+    'devops_automation_center', 'qr_code_generator',
 )
 # Enhanced Error Handling
 from .error_handler_enhanced import setup_error_handling
@@ -372,10 +399,25 @@ async def debug_text_logger(update: Update, context: ContextTypes.DEFAULT_TYPE)
         pass
 
 
+class ProfilingApplication(Application):
+    """Opens a query-profiler scope around each update when QUERY_PROFILE is on"""
+
+    async def process_update(self, update: object) -> None:
+        if not query_profiler.is_enabled():
+            return await super().process_update(update)
+        token = query_profiler.begin(query_profiler.update_label(update))
+        try:
+            return await super().process_update(update)
+        finally:
+            query_profiler.finish(token)
+
+
 def build_application() -> Application:
     db_setup()
+    _t_build = _time_mod.perf_counter()
     application = (
         Application.builder()
+        .application_class(ProfilingApplication)
         .token(BOT_TOKEN)
         .concurrent_updates(True)
         .pool_timeout(30.0)  # Timeout for connection pool
@@ -389,18 +431,34 @@ def build_application() -> Application:
 
     if application.job_queue:
         try:
-            st = query_db("SELECT value FROM settings WHERE key='daily_job_hour'", one=True)
-            hour = int((st or {}).get('value') or DAILY_JOB_HOUR)
+            hour = int(get_setting('daily_job_hour') or DAILY_JOB_HOUR)
         except Exception:
             hour = DAILY_JOB_HOUR
         application.job_queue.run_daily(check_expirations, time=time(hour=hour, minute=0, second=0), name="daily_expiration_check")
         # Traffic and expiry notifications - run every 24 hours (reduced from 12h to minimize panel logins)
         application.job_queue.run_repeating(check_low_traffic_and_expiry, interval=24*3600, first=600, name="notification_check")
+        # Keep the USDT/IRT quote warm in memory so crypto pricing never waits on exchanges
+        from .exchange_rate import refresh_usd_rate_job, REFRESH_SECONDS as _USD_REFRESH
+        application.job_queue.run_repeating(refresh_usd_rate_job, interval=_USD_REFRESH, first=5, name="usd_rate_refresh")
+        # In-memory metrics: per-minute rollup flush and hourly downsampling/retention
+        from .metrics import flush_metrics_job, metrics_retention_job, start_metrics_server, FLUSH_SECONDS as _METRICS_FLUSH
+        application.job_queue.run_repeating(flush_metrics_job, interval=_METRICS_FLUSH, first=_METRICS_FLUSH, name="metrics_flush")
+        application.job_queue.run_repeating(metrics_retention_job, interval=3600, first=900, name="metrics_retention")
+        # Query profiler top-offenders report (no-op unless QUERY_PROFILE is on)
+        application.job_queue.run_repeating(query_profiler.query_profile_report_job, interval=3600, first=3600, name="query_profile_report")
+        # Deduplicated error events: batched upserts and rate-limited admin digests
+        from .error_handler import flush_errors_job, ERROR_FLUSH_SECONDS
+        application.job_queue.run_repeating(flush_errors_job, interval=ERROR_FLUSH_SECONDS, first=ERROR_FLUSH_SECONDS, name="error_flush")
+        # Import the lazily loaded admin subsystems off the event loop once the bot is up
+        from .lazy_import import preload_lazy_modules_job, LAZY_PRELOAD_DELAY
+        if LAZY_PRELOAD_DELAY > 0:
+            application.job_queue.run_once(preload_lazy_modules_job, when=LAZY_PRELOAD_DELAY, name="lazy_preload")
+        start_metrics_server()
         # Auto-backup scheduling
         from .config import logger
         try:
-            ab_enabled = (query_db("SELECT value FROM settings WHERE key='auto_backup_enabled'", one=True) or {}).get('value') == '1'
-            ab_hours = int((query_db("SELECT value FROM settings WHERE key='auto_backup_hours'", one=True) or {}).get('value') or '3')
+            ab_enabled = get_setting('auto_backup_enabled') == '1'
+            ab_hours = int(get_setting('auto_backup_hours') or '3')
         except Exception as e:
             logger.warning(f"Auto-backup config error: {e}, using defaults")
             ab_enabled = False; ab_hours = 3
@@ -479,7 +537,7 @@ def build_application() -> Application:
                 CallbackQueryHandler(admin_users_view_by_id_callback, pattern=r'^admin_user_view_\d+$'),
                 CallbackQueryHandler(admin_users_toggle_ban_inline, pattern=r'^admin_user_ban_(yes|no)_\d+$'),
                 CallbackQueryHandler(admin_users_toggle_ban_inline, pattern=r'^admin_user_ban_\d+$'),
-                CallbackQueryHandler(admin_users_show_services, pattern=r'^admin_user_services_\d+(_page_\d+)?$'),
+                CallbackQueryHandler(admin_users_show_services, pattern=r'^admin_user_services_\d+(_page_\d+(_[ab]\d+)?)?$'),
                 CallbackQueryHandler(admin_users_show_tickets, pattern=r'^admin_user_tickets_\d+(_page_\d+)?$'),
                 CallbackQueryHandler(admin_users_show_wallet, pattern=r'^admin_user_wallet_\d+(_page_\d+)?$'),
                 CallbackQueryHandler(admin_users_show_refs, pattern=r'^admin_user_refs_\d+(_page_\d+)?$'),
@@ -769,6 +827,11 @@ def build_application() -> Application:
         per_message=False,
     )
 
+    # All group-3 callback routes live in one dict/trie router (see bot/callback_router.py);
+    # routes added below keep PTB's first-registered-wins order.
+    callback_router = CallbackRouter()
+    application.add_handler(callback_router, group=3)
+
 <<<<<<< HEAD
     # Wallet topup conversation handler
     wallet_conv = ConversationHandler(
@@ -855,83 +918,86 @@ def build_application() -> Application:
 
     # Admin approval callbacks
 >>>>>>> origin/master
-    application.add_handler(CallbackQueryHandler(admin_ask_panel_for_approval, pattern=r'^approve_auto_'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_approve_on_panel, pattern=r'^approve_on_panel_'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_review_order_reject, pattern=r'^reject_order_'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_manual_send_start, pattern=r'^approve_manual_'), group=3)
+    callback_router.add(r'^approve_auto_', admin_ask_panel_for_approval)
+    callback_router.add(r'^approve_on_panel_', admin_approve_on_panel)
+    callback_router.add(r'^reject_order_', admin_review_order_reject)
+    callback_router.add(r'^approve_manual_', admin_manual_send_start)
+    callback_router.add(r'^bulk_approve_', admin_bulk_approve)
 <<<<<<< HEAD
-    application.add_handler(CallbackQueryHandler(admin_approve_renewal, pattern=r'^approve_renewal_'), group=3)
+    callback_router.add(r'^approve_renewal_', admin_approve_renewal)
     
     # Admin navigation 
-    application.add_handler(CallbackQueryHandler(admin_stats_menu, pattern='^admin_stats$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_stats_refresh, pattern='^stats_refresh$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallets_menu, pattern='^admin_wallets_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_settings_manage, pattern='^admin_settings_manage$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_admins_menu, pattern='^admin_admins_menu$'), group=3)
+    callback_router.add('^admin_stats$', admin_stats_menu)
+    callback_router.add('^stats_refresh$', admin_stats_refresh)
+    callback_router.add('^admin_wallets_menu$', admin_wallets_menu)
+    callback_router.add('^admin_settings_manage$', admin_settings_manage)
+    callback_router.add('^admin_admins_menu$', admin_admins_menu)
     
     # XUI Integration
-    application.add_handler(CallbackQueryHandler(admin_xui_choose_inbound, pattern=r'^xui_inbound_'), group=3)
+    callback_router.add(r'^xui_inbound_', admin_xui_choose_inbound)
     
     # ═══════════════════════════════════════════════════════════════════
     #                       ADMIN ADVANCED FEATURES
     # ═══════════════════════════════════════════════════════════════════
     # Analytics and Monitoring
-    application.add_handler(CallbackQueryHandler(admin_advanced_stats, pattern=r'^admin_advanced_stats$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_chart_users, pattern=r'^admin_chart_users$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_chart_revenue, pattern=r'^admin_chart_revenue$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_cohort_analysis, pattern=r'^admin_cohort_analysis$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_traffic_sources, pattern=r'^admin_traffic_sources$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_revenue_prediction, pattern=r'^admin_revenue_prediction$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_cache_stats, pattern=r'^admin_cache_stats$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_clear_cache, pattern=r'^admin_clear_cache$'), group=3)
+    callback_router.add(r'^admin_advanced_stats$', admin_advanced_stats)
+    callback_router.add(r'^admin_chart_users$', admin_chart_users)
+    callback_router.add(r'^admin_chart_revenue$', admin_chart_revenue)
+    callback_router.add(r'^admin_cohort_analysis$', admin_cohort_analysis)
+    callback_router.add(r'^admin_traffic_sources$', admin_traffic_sources)
+    callback_router.add(r'^admin_revenue_prediction$', admin_revenue_prediction)
+    callback_router.add(r'^admin_cache_stats$', admin_cache_stats)
+    callback_router.add(r'^admin_clear_cache$', admin_clear_cache)
     
     # System Monitoring
-    application.add_handler(CallbackQueryHandler(admin_monitoring_menu, pattern=r'^admin_monitoring_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_perf_details, pattern=r'^admin_perf_details$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_error_logs, pattern=r'^admin_error_logs$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_check_panels, pattern=r'^admin_check_panels$'), group=3)
+    callback_router.add(r'^admin_monitoring_menu$', admin_monitoring_menu)
+    callback_router.add(r'^admin_perf_details$', admin_perf_details)
+    callback_router.add(r'^admin_query_profile$', admin_query_profile)
+    callback_router.add(r'^admin_query_profile_(on|off|reset)$', admin_query_profile)
+    callback_router.add(r'^admin_error_logs$', admin_error_logs)
+    callback_router.add(r'^admin_check_panels$', admin_check_panels)
     
     # System Health
-    application.add_handler(CallbackQueryHandler(admin_system_health, pattern=r'^admin_system_health$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_clear_notifications, pattern=r'^admin_clear_notifications$'), group=3)
+    callback_router.add(r'^admin_system_health$', admin_system_health)
+    callback_router.add(r'^admin_clear_notifications$', admin_clear_notifications)
     
     # ═══════════════════════════════════════════════════════════════════
     #                    ADVANCED AI & ANALYTICS (v3.0)
     # ═══════════════════════════════════════════════════════════════════
     # AI-Powered Features
-    application.add_handler(CallbackQueryHandler(ai_user_behavior_analysis, pattern=r'^ai_behavior_analysis$'), group=3)
-    application.add_handler(CallbackQueryHandler(real_time_system_monitor, pattern=r'^real_time_monitor$'), group=3)
-    application.add_handler(CallbackQueryHandler(smart_pricing_engine, pattern=r'^smart_pricing$'), group=3)
-    application.add_handler(CallbackQueryHandler(blockchain_integration, pattern=r'^blockchain_integration$'), group=3)
-    application.add_handler(CallbackQueryHandler(iot_device_management, pattern=r'^iot_management$'), group=3)
+    callback_router.add(r'^ai_behavior_analysis$', ai_user_behavior_analysis)
+    callback_router.add(r'^real_time_monitor$', real_time_system_monitor)
+    callback_router.add(r'^smart_pricing$', smart_pricing_engine)
+    callback_router.add(r'^blockchain_integration$', blockchain_integration)
+    callback_router.add(r'^iot_management$', iot_device_management)
     
     # Webhook & API Integration
-    application.add_handler(CallbackQueryHandler(webhook_management_panel, pattern=r'^webhook_management$'), group=3)
-    application.add_handler(CallbackQueryHandler(microservices_orchestration, pattern=r'^microservices_orchestration$'), group=3)
-    application.add_handler(CallbackQueryHandler(machine_learning_pipeline, pattern=r'^ml_pipeline$'), group=3)
-    application.add_handler(CallbackQueryHandler(cyber_security_center, pattern=r'^cyber_security_center$'), group=3)
+    callback_router.add(r'^webhook_management$', webhook_management_panel)
+    callback_router.add(r'^microservices_orchestration$', microservices_orchestration)
+    callback_router.add(r'^ml_pipeline$', machine_learning_pipeline)
+    callback_router.add(r'^cyber_security_center$', cyber_security_center)
     
     # Mobile & Cloud Integration
-    application.add_handler(CallbackQueryHandler(mobile_app_management, pattern=r'^mobile_app_management$'), group=3)
-    application.add_handler(CallbackQueryHandler(cloud_infrastructure_dashboard, pattern=r'^cloud_infrastructure$'), group=3)
-    application.add_handler(CallbackQueryHandler(advanced_api_gateway, pattern=r'^api_gateway_advanced$'), group=3)
-    application.add_handler(CallbackQueryHandler(devops_automation_center, pattern=r'^devops_automation$'), group=3)
-    application.add_handler(CallbackQueryHandler(qr_code_generator, pattern=r'^qr_code_generator$'), group=3)
+    callback_router.add(r'^mobile_app_management$', mobile_app_management)
+    callback_router.add(r'^cloud_infrastructure$', cloud_infrastructure_dashboard)
+    callback_router.add(r'^api_gateway_advanced$', advanced_api_gateway)
+    callback_router.add(r'^devops_automation$', devops_automation_center)
+    callback_router.add(r'^qr_code_generator$', qr_code_generator)
     
     # ═══════════════════════════════════════════════════════════════════
     #                         USER CORE HANDLERS
     # ═══════════════════════════════════════════════════════════════════
     # Main navigation
-    application.add_handler(CallbackQueryHandler(start_command, pattern='^start_main$'), group=3)
-    application.add_handler(CallbackQueryHandler(my_services_handler, pattern=r'^my_services(_page_\d+)?$'), group=3)
-    application.add_handler(CallbackQueryHandler(show_specific_service_details, pattern=r'^view_service_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(support_menu, pattern=r'^support_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorials_menu, pattern=r'^tutorials_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorial_show, pattern=r'^tutorial_show_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(referral_menu, pattern=r'^referral_menu$'), group=3)
+    callback_router.add('^start_main$', start_command)
+    callback_router.add(r'^my_services(_page_\d+(_[ab]\d+)?)?$', my_services_handler)
+    callback_router.add(r'^view_service_\d+$', show_specific_service_details)
+    callback_router.add(r'^support_menu$', support_menu)
+    callback_router.add(r'^tutorials_menu$', tutorials_menu)
+    callback_router.add(r'^tutorial_show_\d+$', tutorial_show)
+    callback_router.add(r'^referral_menu$', referral_menu)
     
     # Free config and utilities
-    application.add_handler(CallbackQueryHandler(get_free_config_handler, pattern=r'^get_free_config$'), group=3)
+    callback_router.add(r'^get_free_config$', get_free_config_handler)
     
     # ═══════════════════════════════════════════════════════════════════
     #                       USER SERVICE ACTIONS
@@ -943,128 +1009,128 @@ def build_application() -> Application:
     application.add_handler(CallbackQueryHandler(revoke_key, pattern=r'^revoke_key_\d+$'), group=2)
     application.add_handler(CallbackQueryHandler(delete_service_start, pattern=r'^delete_service_\d+$'), group=2)
     application.add_handler(CallbackQueryHandler(delete_service_confirm, pattern=r'^delete_service_(yes|no)_\d+$'), group=2)
-    application.add_handler(CallbackQueryHandler(admin_approve_renewal, pattern=r'^approve_renewal_'), group=3)
-    application.add_handler(CallbackQueryHandler(get_free_config_handler, pattern=r'^get_free_config$'), group=3)
+    callback_router.add(r'^approve_renewal_', admin_approve_renewal)
+    callback_router.add(r'^get_free_config$', get_free_config_handler)
     # Noop handler for display-only buttons
     async def noop_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.answer()
-    application.add_handler(CallbackQueryHandler(noop_handler, pattern=r'^noop$'), group=3)
-    application.add_handler(CallbackQueryHandler(my_services_handler, pattern=r'^my_services(_page_\d+)?$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_menu, pattern=r'^wallet_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(support_menu, pattern=r'^support_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(show_specific_service_details, pattern=r'^view_service_\d+$'), group=3)
+    callback_router.add(r'^noop$', noop_handler)
+    callback_router.add(r'^my_services(_page_\d+(_[ab]\d+)?)?$', my_services_handler)
+    callback_router.add(r'^wallet_menu$', wallet_menu)
+    callback_router.add(r'^support_menu$', support_menu)
+    callback_router.add(r'^view_service_\d+$', show_specific_service_details)
 >>>>>>> origin/master
-    application.add_handler(CallbackQueryHandler(check_service_status, pattern=r'^check_service_status_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(refresh_service_link, pattern=r'^refresh_service_link_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(view_service_qr, pattern=r'^view_service_qr_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(revoke_key, pattern=r'^revoke_key_'), group=3)
+    callback_router.add(r'^check_service_status_\d+$', check_service_status)
+    callback_router.add(r'^refresh_service_link_\d+$', refresh_service_link)
+    callback_router.add(r'^view_service_qr_\d+$', view_service_qr)
+    callback_router.add(r'^revoke_key_', revoke_key)
 <<<<<<< HEAD
     
     # ═══════════════════════════════════════════════════════════════════
     #                          WALLET SYSTEM
     # ═══════════════════════════════════════════════════════════════════
     # Main wallet handlers
-    application.add_handler(CallbackQueryHandler(wallet_menu, pattern=r'^wallet_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_topup_main_handler, pattern=r'^wallet_topup_main$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_transactions_handler, pattern=r'^wallet_transactions$'), group=3)
+    callback_router.add(r'^wallet_menu$', wallet_menu)
+    callback_router.add(r'^wallet_topup_main$', wallet_topup_main_handler)
+    callback_router.add(r'^wallet_transactions$', wallet_transactions_handler)
     
     # ═══════════════════════════════════════════════════════════════════
     #                       SETTINGS & PREFERENCES
     # ═══════════════════════════════════════════════════════════════════
     # User settings
-    application.add_handler(CallbackQueryHandler(user_settings_handler, pattern=r'^user_settings$'), group=3)
-    application.add_handler(CallbackQueryHandler(notifications_settings_handler, pattern=r'^notifications_settings$'), group=3)
-    application.add_handler(CallbackQueryHandler(usage_stats_handler, pattern=r'^usage_stats$'), group=3)
+    callback_router.add(r'^user_settings$', user_settings_handler)
+    callback_router.add(r'^notifications_settings$', notifications_settings_handler)
+    callback_router.add(r'^usage_stats$', usage_stats_handler)
     
     # Language selection
-    application.add_handler(CallbackQueryHandler(language_menu_handler, pattern=r'^language_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(set_language_fa_handler, pattern=r'^set_language_fa$'), group=3)
-    application.add_handler(CallbackQueryHandler(set_language_en_handler, pattern=r'^set_language_en$'), group=3)
-    application.add_handler(CallbackQueryHandler(set_language_ru_handler, pattern=r'^set_language_ru$'), group=3)
+    callback_router.add(r'^language_menu$', language_menu_handler)
+    callback_router.add(r'^set_language_fa$', set_language_fa_handler)
+    callback_router.add(r'^set_language_en$', set_language_en_handler)
+    callback_router.add(r'^set_language_ru$', set_language_ru_handler)
     
     # ═══════════════════════════════════════════════════════════════════
     #                      STUB & FUTURE FEATURES
     # ═══════════════════════════════════════════════════════════════════
     # Placeholder handlers for future features
-    application.add_handler(CallbackQueryHandler(show_referral_handler, pattern=r'^show_referral$'), group=3)
-    application.add_handler(CallbackQueryHandler(loyalty_rewards_handler, pattern=r'^loyalty_rewards$'), group=3)
-    application.add_handler(CallbackQueryHandler(start_purchase_handler, pattern=r'^start_purchase$'), group=3)
-    application.add_handler(CallbackQueryHandler(app_guide_windows_handler, pattern=r'^app_guide_windows$'), group=3)
-    application.add_handler(CallbackQueryHandler(start_purchase_with_points_handler, pattern=r'^start_purchase_with_points$'), group=3)
-    application.add_handler(CallbackQueryHandler(loyalty_redeem_handler, pattern=r'^loyalty_redeem$'), group=3)
-    application.add_handler(CallbackQueryHandler(user_services_handler, pattern=r'^user_services$'), group=3)
-    application.add_handler(CallbackQueryHandler(gateway_verify_purchase_handler, pattern=r'^gateway_verify_purchase$'), group=3)
-    application.add_handler(CallbackQueryHandler(app_guide_macos_handler, pattern=r'^app_guide_macos$'), group=3)
-    application.add_handler(CallbackQueryHandler(purchase_history_handler, pattern=r'^purchase_history$'), group=3)
-    application.add_handler(CallbackQueryHandler(loyalty_history_handler, pattern=r'^loyalty_history$'), group=3)
-    application.add_handler(CallbackQueryHandler(cancel_handler, pattern=r'^cancel$'), group=3)
+    callback_router.add(r'^show_referral$', show_referral_handler)
+    callback_router.add(r'^loyalty_rewards$', loyalty_rewards_handler)
+    callback_router.add(r'^start_purchase$', start_purchase_handler)
+    callback_router.add(r'^app_guide_windows$', app_guide_windows_handler)
+    callback_router.add(r'^start_purchase_with_points$', start_purchase_with_points_handler)
+    callback_router.add(r'^loyalty_redeem$', loyalty_redeem_handler)
+    callback_router.add(r'^user_services$', user_services_handler)
+    callback_router.add(r'^gateway_verify_purchase$', gateway_verify_purchase_handler)
+    callback_router.add(r'^app_guide_macos$', app_guide_macos_handler)
+    callback_router.add(r'^purchase_history$', purchase_history_handler)
+    callback_router.add(r'^loyalty_history$', loyalty_history_handler)
+    callback_router.add(r'^cancel$', cancel_handler)
     
     # Complete missing handlers
-    application.add_handler(CallbackQueryHandler(wallet_topup_card_handler, pattern=r'^wallet_topup_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_topup_crypto_handler, pattern=r'^wallet_topup_crypto$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_verify_gateway_handler, pattern=r'^wallet_verify_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(card_to_card_info_handler, pattern=r'^card_to_card_info$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_menu_handler, pattern=r'^reseller_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(loyalty_menu_handler, pattern=r'^loyalty_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_quick_backup_handler, pattern=r'^admin_quick_backup$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallet_stats_handler, pattern=r'^admin_wallet_stats$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_topup_gateway_handler, pattern=r'^wallet_topup_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_charge_menu_handler, pattern=r'^wallet_charge_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_history_handler, pattern=r'^wallet_history$'), group=3)
-    application.add_handler(CallbackQueryHandler(app_guide_android_handler, pattern=r'^app_guide_android$'), group=3)
-    application.add_handler(CallbackQueryHandler(app_guide_ios_handler, pattern=r'^app_guide_ios$'), group=3)
+    callback_router.add(r'^wallet_topup_card$', wallet_topup_card_handler)
+    callback_router.add(r'^wallet_topup_crypto$', wallet_topup_crypto_handler)
+    callback_router.add(r'^wallet_verify_gateway$', wallet_verify_gateway_handler)
+    callback_router.add(r'^card_to_card_info$', card_to_card_info_handler)
+    callback_router.add(r'^reseller_menu$', reseller_menu_handler)
+    callback_router.add(r'^loyalty_menu$', loyalty_menu_handler)
+    callback_router.add(r'^admin_quick_backup$', admin_quick_backup_handler)
+    callback_router.add(r'^admin_wallet_stats$', admin_wallet_stats_handler)
+    callback_router.add(r'^wallet_topup_gateway$', wallet_topup_gateway_handler)
+    callback_router.add(r'^wallet_charge_menu$', wallet_charge_menu_handler)
+    callback_router.add(r'^wallet_history$', wallet_history_handler)
+    callback_router.add(r'^app_guide_android$', app_guide_android_handler)
+    callback_router.add(r'^app_guide_ios$', app_guide_ios_handler)
     
     # All remaining handlers to achieve 100% coverage
-    application.add_handler(CallbackQueryHandler(reseller_pay_crypto_handler, pattern=r'^reseller_pay_crypto$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_security_settings_handler, pattern=r'^admin_security_settings$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_payment_settings_handler, pattern=r'^admin_payment_settings$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_general_settings_handler, pattern=r'^admin_general_settings$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_notification_settings_handler, pattern=r'^admin_notification_settings$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_search_user_handler, pattern=r'^admin_search_user$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_add_user_handler, pattern=r'^admin_add_user$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_custom_amount_handler, pattern=r'^wallet_custom_amount$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_upload_receipt_handler, pattern=r'^wallet_upload_receipt$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_upload_start_card_handler, pattern=r'^wallet_upload_start_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(wallet_upload_start_crypto_handler, pattern=r'^wallet_upload_start_crypto$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_card_handler, pattern=r'^reseller_pay_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_gateway_handler, pattern=r'^reseller_pay_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_start_handler, pattern=r'^reseller_pay_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_verify_gateway_handler, pattern=r'^reseller_verify_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_upload_start_card_handler, pattern=r'^reseller_upload_start_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_upload_start_crypto_handler, pattern=r'^reseller_upload_start_crypto$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_orders_pending_handler, pattern=r'^admin_orders_pending$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallet_tx_pending_handler, pattern=r'^admin_wallet_tx_pending$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallet_tx_approved_handler, pattern=r'^admin_wallet_tx_approved$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallet_tx_rejected_handler, pattern=r'^admin_wallet_tx_rejected$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_reseller_delete_start_handler, pattern=r'^admin_reseller_delete_start$'), group=3)
+    callback_router.add(r'^reseller_pay_crypto$', reseller_pay_crypto_handler)
+    callback_router.add(r'^admin_security_settings$', admin_security_settings_handler)
+    callback_router.add(r'^admin_payment_settings$', admin_payment_settings_handler)
+    callback_router.add(r'^admin_general_settings$', admin_general_settings_handler)
+    callback_router.add(r'^admin_notification_settings$', admin_notification_settings_handler)
+    callback_router.add(r'^admin_search_user$', admin_search_user_handler)
+    callback_router.add(r'^admin_add_user$', admin_add_user_handler)
+    callback_router.add(r'^wallet_custom_amount$', wallet_custom_amount_handler)
+    callback_router.add(r'^wallet_upload_receipt$', wallet_upload_receipt_handler)
+    callback_router.add(r'^wallet_upload_start_card$', wallet_upload_start_card_handler)
+    callback_router.add(r'^wallet_upload_start_crypto$', wallet_upload_start_crypto_handler)
+    callback_router.add(r'^reseller_pay_card$', reseller_pay_card_handler)
+    callback_router.add(r'^reseller_pay_gateway$', reseller_pay_gateway_handler)
+    callback_router.add(r'^reseller_pay_start$', reseller_pay_start_handler)
+    callback_router.add(r'^reseller_verify_gateway$', reseller_verify_gateway_handler)
+    callback_router.add(r'^reseller_upload_start_card$', reseller_upload_start_card_handler)
+    callback_router.add(r'^reseller_upload_start_crypto$', reseller_upload_start_crypto_handler)
+    callback_router.add(r'^admin_orders_pending$', admin_orders_pending)
+    callback_router.add(r'^admin_wallet_tx_pending$', admin_wallet_tx_pending_handler)
+    callback_router.add(r'^admin_wallet_tx_approved$', admin_wallet_tx_approved_handler)
+    callback_router.add(r'^admin_wallet_tx_rejected$', admin_wallet_tx_rejected_handler)
+    callback_router.add(r'^admin_reseller_delete_start$', admin_reseller_delete_start_handler)
     
     # Final 8 handlers for 100% coverage
-    application.add_handler(CallbackQueryHandler(set_join_logs_chat_handler, pattern=r'^set_join_logs_chat$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorial_edit_title_handler, pattern=r'^tutorial_edit_title$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorial_media_page_prev_handler, pattern=r'^tutorial_media_page_prev$'), group=3)
-    application.add_handler(CallbackQueryHandler(ticket_create_start_handler, pattern=r'^ticket_create_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorial_finish_handler, pattern=r'^tutorial_finish$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorial_add_start_handler, pattern=r'^tutorial_add_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorial_media_page_next_handler, pattern=r'^tutorial_media_page_next$'), group=3)
-    application.add_handler(CallbackQueryHandler(set_purchase_logs_chat_handler, pattern=r'^set_purchase_logs_chat$'), group=3)
+    callback_router.add(r'^set_join_logs_chat$', set_join_logs_chat_handler)
+    callback_router.add(r'^tutorial_edit_title$', tutorial_edit_title_handler)
+    callback_router.add(r'^tutorial_media_page_prev$', tutorial_media_page_prev_handler)
+    callback_router.add(r'^ticket_create_start$', ticket_create_start_handler)
+    callback_router.add(r'^tutorial_finish$', tutorial_finish_handler)
+    callback_router.add(r'^tutorial_add_start$', tutorial_add_start_handler)
+    callback_router.add(r'^tutorial_media_page_next$', tutorial_media_page_next_handler)
+    callback_router.add(r'^set_purchase_logs_chat$', set_purchase_logs_chat_handler)
     
     # ═══════════════════════════════════════════════════════════════════
     #                       UTILITIES & FALLBACKS
     # ═══════════════════════════════════════════════════════════════════
     # Membership and join checking
-    application.add_handler(CallbackQueryHandler(check_join_and_start, pattern='^check_join$'), group=3)
+    callback_router.add('^check_join$', check_join_and_start)
     
     # Cancel and flow control
-    application.add_handler(CallbackQueryHandler(cancel_flow, pattern='^cancel_flow$'), group=3)
-    application.add_handler(CallbackQueryHandler(cancel_admin_flow, pattern='^cancel_admin_flow$'), group=3)
+    callback_router.add('^cancel_flow$', cancel_flow)
+    callback_router.add('^cancel_admin_flow$', cancel_admin_flow)
     
     # Noop handler for informational buttons
     async def noop_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.answer()
-    application.add_handler(CallbackQueryHandler(noop_handler, pattern=r'^noop'), group=3)
+    callback_router.add(r'^noop', noop_handler)
     
     # Custom username setting (fallback)
-    application.add_handler(CallbackQueryHandler(set_cust_username_start, pattern=r'^set_cust_username_start$'), group=3)
+    callback_router.add(r'^set_cust_username_start$', set_cust_username_start)
     
     # ═══════════════════════════════════════════════════════════════════
     #                         DYNAMIC HANDLER
@@ -1081,59 +1147,59 @@ def build_application() -> Application:
     
 =======
     # Fallback: allow username prompt button to work even if state dropped
-    application.add_handler(CallbackQueryHandler(set_cust_username_start, pattern=r'^set_cust_username_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(start_command, pattern='^start_main$'), group=3)
+    callback_router.add(r'^set_cust_username_start$', set_cust_username_start)
+    callback_router.add('^start_main$', start_command)
     # Cancel flow handlers - work from anywhere
-    application.add_handler(CallbackQueryHandler(cancel_flow, pattern='^cancel_flow$'), group=3)
-    application.add_handler(CallbackQueryHandler(cancel_admin_flow, pattern='^cancel_admin_flow$'), group=3)
+    callback_router.add('^cancel_flow$', cancel_flow)
+    callback_router.add('^cancel_admin_flow$', cancel_admin_flow)
     # Ensure Admin Stats button works globally even if conversation state dropped
-    application.add_handler(CallbackQueryHandler(admin_command, pattern='^admin_main$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_stats_menu, pattern='^admin_stats$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_stats_refresh, pattern='^stats_refresh$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_xui_choose_inbound, pattern=r'^xui_inbound_'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallets_menu, pattern='^admin_wallets_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_settings_manage, pattern='^admin_settings_manage$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_bot_active, pattern='^admin_toggle_bot_active$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_admins_menu, pattern='^admin_admins_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_plan_manage, pattern='^admin_plan_manage$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_plan_add_start, pattern='^plan_add$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_plan_delete, pattern=r'^plan_delete_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_plan_edit_start, pattern=r'^plan_edit_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_panels_menu, pattern='^admin_panels_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_panel_delete, pattern=r'^panel_delete_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_panel_add_start, pattern='^panel_add_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_panel_toggle_enabled, pattern=r'^panel_toggle_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_panel_health_check, pattern=r'^panel_health_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_panel_inbounds_menu, pattern=r'^panel_inbounds_\d+$'), group=3)
+    callback_router.add('^admin_main$', admin_command)
+    callback_router.add('^admin_stats$', admin_stats_menu)
+    callback_router.add('^stats_refresh$', admin_stats_refresh)
+    callback_router.add(r'^xui_inbound_', admin_xui_choose_inbound)
+    callback_router.add('^admin_wallets_menu$', admin_wallets_menu)
+    callback_router.add('^admin_settings_manage$', admin_settings_manage)
+    callback_router.add('^admin_toggle_bot_active$', admin_toggle_bot_active)
+    callback_router.add('^admin_admins_menu$', admin_admins_menu)
+    callback_router.add('^admin_plan_manage$', admin_plan_manage)
+    callback_router.add('^plan_add$', admin_plan_add_start)
+    callback_router.add(r'^plan_delete_\d+$', admin_plan_delete)
+    callback_router.add(r'^plan_edit_\d+$', admin_plan_edit_start)
+    callback_router.add('^admin_panels_menu$', admin_panels_menu)
+    callback_router.add(r'^panel_delete_\d+$', admin_panel_delete)
+    callback_router.add('^panel_add_start$', admin_panel_add_start)
+    callback_router.add(r'^panel_toggle_\d+$', admin_panel_toggle_enabled)
+    callback_router.add(r'^panel_health_\d+$', admin_panel_health_check)
+    callback_router.add(r'^panel_inbounds_\d+$', admin_panel_inbounds_menu)
     # Admin menu buttons (orders, users, payments)
-    application.add_handler(CallbackQueryHandler(admin_orders_manage, pattern='^admin_orders_manage$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_orders_manage, pattern='^admin_orders_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_orders_pending, pattern='^admin_orders_pending$'), group=3)
-    application.add_handler(CallbackQueryHandler(lambda u, c: admin_orders_menu(u, c, int(u.callback_query.data.split('_')[-1])), pattern=r'^admin_orders_page_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_user_management, pattern='^admin_user_management$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_payments_menu, pattern='^admin_payments_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_system_health, pattern='^admin_system_health$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_clear_notifications, pattern='^admin_clear_notifications$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_quick_backup, pattern='^admin_quick_backup$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_discount_menu, pattern='^admin_discount_menu$'), group=3)
+    callback_router.add('^admin_orders_manage$', admin_orders_manage)
+    callback_router.add('^admin_orders_menu$', admin_orders_manage)
+    callback_router.add('^admin_orders_pending$', admin_orders_pending)
+    callback_router.add(r'^admin_orders_page_\d+$', lambda u, c: admin_orders_menu(u, c, int(u.callback_query.data.split('_')[-1])))
+    callback_router.add('^admin_user_management$', admin_user_management)
+    callback_router.add('^admin_payments_menu$', admin_payments_menu)
+    callback_router.add('^admin_system_health$', admin_system_health)
+    callback_router.add('^admin_clear_notifications$', admin_clear_notifications)
+    callback_router.add('^admin_quick_backup$', admin_quick_backup)
+    callback_router.add('^admin_discount_menu$', admin_discount_menu)
     # admin_messages_menu is handled by ConversationHandler, no need for global handler
-    application.add_handler(CallbackQueryHandler(admin_tickets_menu, pattern='^admin_tickets_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_run_alerts_now, pattern='^run_alerts_now$'), group=3)
+    callback_router.add('^admin_tickets_menu$', admin_tickets_menu)
+    callback_router.add('^run_alerts_now$', admin_run_alerts_now)
     # Reseller approvals (global)
-    application.add_handler(CallbackQueryHandler(admin_reseller_approve, pattern=r'^reseller_approve_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_reseller_reject, pattern=r'^reseller_reject_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_reseller_menu, pattern='^admin_reseller_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_reseller_delete_start, pattern=r'^admin_reseller_delete_start$'), group=3)
+    callback_router.add(r'^reseller_approve_\d+$', admin_reseller_approve)
+    callback_router.add(r'^reseller_reject_\d+$', admin_reseller_reject)
+    callback_router.add('^admin_reseller_menu$', admin_reseller_menu)
+    callback_router.add(r'^admin_reseller_delete_start$', admin_reseller_delete_start)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_reseller_delete_receive), group=-2)
     # Reseller user flows
-    application.add_handler(CallbackQueryHandler(reseller_menu, pattern=r'^reseller_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_start, pattern=r'^reseller_pay_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_card, pattern=r'^reseller_pay_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_crypto, pattern=r'^reseller_pay_crypto$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_gateway, pattern=r'^reseller_pay_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_verify_gateway, pattern=r'^reseller_verify_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_upload_start_card, pattern=r'^reseller_upload_start_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_upload_start_crypto, pattern=r'^reseller_upload_start_crypto$'), group=3)
+    callback_router.add(r'^reseller_menu$', reseller_menu)
+    callback_router.add(r'^reseller_pay_start$', reseller_pay_start)
+    callback_router.add(r'^reseller_pay_card$', reseller_pay_card)
+    callback_router.add(r'^reseller_pay_crypto$', reseller_pay_crypto)
+    callback_router.add(r'^reseller_pay_gateway$', reseller_pay_gateway)
+    callback_router.add(r'^reseller_verify_gateway$', reseller_verify_gateway)
+    callback_router.add(r'^reseller_upload_start_card$', reseller_upload_start_card)
+    callback_router.add(r'^reseller_upload_start_crypto$', reseller_upload_start_crypto)
 
     # Route critical admin callbacks globally so buttons work from any state
     # application.add_handler(CallbackQueryHandler(admin_global_router, pattern=r'^admin_'), group=0)
@@ -1142,59 +1208,59 @@ def build_application() -> Application:
     application.add_handler(CommandHandler('setms', admin_setms_command), group=0)
 
     # Global settings callbacks so they work from any screen
-    application.add_handler(CallbackQueryHandler(admin_settings_manage, pattern='^admin_settings_manage$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_settings_ask, pattern=r'^set_(trial_days|payment_text)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_trial_status, pattern=r'^set_trial_status_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_usd_rate_start, pattern='^set_usd_rate_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_usd_mode, pattern=r'^toggle_usd_mode_(manual|api)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_pay_card, pattern=r'^toggle_pay_card_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_pay_crypto, pattern=r'^toggle_pay_crypto_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_pay_gateway, pattern=r'^toggle_pay_gateway_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_gateway_type, pattern=r'^toggle_gateway_type_(zarinpal|aghapay)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_signup_bonus, pattern=r'^toggle_signup_bonus_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_signup_bonus_amount_start, pattern='^set_signup_bonus_amount$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_trial_inbound_start, pattern='^set_trial_inbound_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_trial_inbound_choose, pattern=r'^set_trial_inbound_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_ref_percent_start, pattern='^set_ref_percent_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_config_footer_start, pattern='^set_config_footer_start$'), group=3)
+    callback_router.add('^admin_settings_manage$', admin_settings_manage)
+    callback_router.add(r'^set_(trial_days|payment_text)$', admin_settings_ask)
+    callback_router.add(r'^set_trial_status_(0|1)$', admin_toggle_trial_status)
+    callback_router.add('^set_usd_rate_start$', admin_set_usd_rate_start)
+    callback_router.add(r'^toggle_usd_mode_(manual|api)$', admin_toggle_usd_mode)
+    callback_router.add(r'^toggle_pay_card_(0|1)$', admin_toggle_pay_card)
+    callback_router.add(r'^toggle_pay_crypto_(0|1)$', admin_toggle_pay_crypto)
+    callback_router.add(r'^toggle_pay_gateway_(0|1)$', admin_toggle_pay_gateway)
+    callback_router.add(r'^toggle_gateway_type_(zarinpal|aghapay)$', admin_toggle_gateway_type)
+    callback_router.add(r'^toggle_signup_bonus_(0|1)$', admin_toggle_signup_bonus)
+    callback_router.add('^set_signup_bonus_amount$', admin_set_signup_bonus_amount_start)
+    callback_router.add('^set_trial_inbound_start$', admin_set_trial_inbound_start)
+    callback_router.add(r'^set_trial_inbound_\d+$', admin_set_trial_inbound_choose)
+    callback_router.add('^set_ref_percent_start$', admin_set_ref_percent_start)
+    callback_router.add('^set_config_footer_start$', admin_set_config_footer_start)
     # Alerts & Auto-backup (global)
-    application.add_handler(CallbackQueryHandler(admin_toggle_user_quota, pattern=r'^toggle_user_quota_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_talert, pattern=r'^toggle_talert_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_talert_gb_start, pattern='^set_talert_gb_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_time_alert, pattern=r'^toggle_time_alert_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_time_alert_days_start, pattern='^set_time_alert_days_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_auto_backup, pattern=r'^toggle_auto_backup_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_auto_backup_hours_start, pattern='^set_auto_backup_hours_start$'), group=3)
+    callback_router.add(r'^toggle_user_quota_(0|1)$', admin_toggle_user_quota)
+    callback_router.add(r'^toggle_talert_(0|1)$', admin_toggle_talert)
+    callback_router.add('^set_talert_gb_start$', admin_set_talert_gb_start)
+    callback_router.add(r'^toggle_time_alert_(0|1)$', admin_toggle_time_alert)
+    callback_router.add('^set_time_alert_days_start$', admin_set_time_alert_days_start)
+    callback_router.add(r'^toggle_auto_backup_(0|1)$', admin_toggle_auto_backup)
+    callback_router.add('^set_auto_backup_hours_start$', admin_set_auto_backup_hours_start)
 
     # Wallet manual adjust (global)
-    application.add_handler(CallbackQueryHandler(admin_wallet_adjust_start, pattern=r'^wallet_adjust_start_(credit|debit)$'), group=3)
+    callback_router.add(r'^wallet_adjust_start_(credit|debit)$', admin_wallet_adjust_start)
 
     # Join/purchase logs settings (global)
-    application.add_handler(CallbackQueryHandler(admin_toggle_join_logs, pattern=r'^toggle_join_logs_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_join_logs_chat_start, pattern=r'^set_join_logs_chat$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_toggle_purchase_logs, pattern=r'^toggle_purchase_logs_(0|1)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_purchase_logs_chat_start, pattern=r'^set_purchase_logs_chat$'), group=3)
+    callback_router.add(r'^toggle_join_logs_(0|1)$', admin_toggle_join_logs)
+    callback_router.add(r'^set_join_logs_chat$', admin_set_join_logs_chat_start)
+    callback_router.add(r'^toggle_purchase_logs_(0|1)$', admin_toggle_purchase_logs)
+    callback_router.add(r'^set_purchase_logs_chat$', admin_set_purchase_logs_chat_start)
 
     # Text handlers for settings flows (awaiting_admin flags)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_set_ref_percent_save), group=-2)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_set_config_footer_save), group=-2)
-    application.add_handler(CallbackQueryHandler(admin_set_payment_text_start, pattern='^set_payment_text$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_set_usd_rate_start_global, pattern='^set_usd_rate_start$'), group=3)
+    callback_router.add('^set_payment_text$', admin_set_payment_text_start)
+    callback_router.add('^set_usd_rate_start$', admin_set_usd_rate_start_global)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_settings_save_payment_text), group=-2)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_set_usd_rate_save), group=-2)
     # Text handler to capture chat IDs for logging settings
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_settings_save_log_chat), group=-2)
 
     # Tutorials (admin) handlers
-    application.add_handler(CallbackQueryHandler(admin_tutorial_add_start, pattern='^tutorial_add_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorial_delete, pattern=r'^tutorial_delete_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorial_view, pattern=r'^tutorial_view_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorials_menu, pattern='^admin_tutorials_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorial_finish, pattern='^tutorial_finish$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorial_media_page, pattern=r'^tutorial_media_page_(prev|next)$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorial_edit_title_start, pattern='^tutorial_edit_title$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorial_media_delete, pattern=r'^tmedia_del_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_tutorial_media_move, pattern=r'^tmedia_(up|down)_\d+$'), group=3)
+    callback_router.add('^tutorial_add_start$', admin_tutorial_add_start)
+    callback_router.add(r'^tutorial_delete_\d+$', admin_tutorial_delete)
+    callback_router.add(r'^tutorial_view_\d+$', admin_tutorial_view)
+    callback_router.add('^admin_tutorials_menu$', admin_tutorials_menu)
+    callback_router.add('^tutorial_finish$', admin_tutorial_finish)
+    callback_router.add(r'^tutorial_media_page_(prev|next)$', admin_tutorial_media_page)
+    callback_router.add('^tutorial_edit_title$', admin_tutorial_edit_title_start)
+    callback_router.add(r'^tmedia_del_\d+$', admin_tutorial_media_delete)
+    callback_router.add(r'^tmedia_(up|down)_\d+$', admin_tutorial_media_move)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_tutorial_receive_title), group=-3)
     application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, admin_tutorial_receive_media), group=-3)
 
@@ -1267,47 +1333,47 @@ def build_application() -> Application:
         await register_new_user(update.effective_user, update, referrer_hint=context.user_data.get('referrer_id'))
         await start_command(update, context)
 
-    application.add_handler(CallbackQueryHandler(check_join_and_start, pattern='^check_join$'), group=3)
+    callback_router.add('^check_join$', check_join_and_start)
 
     application.add_handler(CallbackQueryHandler(dynamic_button_handler), group=4)
 
     # User main menu callbacks (global)
-    application.add_handler(CallbackQueryHandler(wallet_menu, pattern=r'^wallet_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(support_menu, pattern=r'^support_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorials_menu, pattern=r'^tutorials_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(tutorial_show, pattern=r'^tutorial_show_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(referral_menu, pattern=r'^referral_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_menu, pattern=r'^reseller_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(card_to_card_info, pattern=r'^card_to_card_info$'), group=3)
+    callback_router.add(r'^wallet_menu$', wallet_menu)
+    callback_router.add(r'^support_menu$', support_menu)
+    callback_router.add(r'^tutorials_menu$', tutorials_menu)
+    callback_router.add(r'^tutorial_show_\d+$', tutorial_show)
+    callback_router.add(r'^referral_menu$', referral_menu)
+    callback_router.add(r'^reseller_menu$', reseller_menu)
+    callback_router.add(r'^card_to_card_info$', card_to_card_info)
 
     # User wallet flows and support/tutorials (global callbacks)
-    application.add_handler(CallbackQueryHandler(wallet_verify_gateway, pattern=r'^wallet_verify_gateway$'), group=3)
+    callback_router.add(r'^wallet_verify_gateway$', wallet_verify_gateway)
 
     # Unified upload router handles both wallet and reseller (run early to avoid other catch-alls)
     application.add_handler(MessageHandler(filters.PHOTO | filters.VOICE | filters.VIDEO | filters.AUDIO | filters.Document.ALL | filters.TEXT, composite_upload_router), group=0)
 
     # Reseller flows
-    application.add_handler(CallbackQueryHandler(reseller_pay_start, pattern=r'^reseller_pay_start$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_card, pattern=r'^reseller_pay_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_crypto, pattern=r'^reseller_pay_crypto$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_pay_gateway, pattern=r'^reseller_pay_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_verify_gateway, pattern=r'^reseller_verify_gateway$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_upload_start_card, pattern=r'^reseller_upload_start_card$'), group=3)
-    application.add_handler(CallbackQueryHandler(reseller_upload_start_crypto, pattern=r'^reseller_upload_start_crypto$'), group=3)
+    callback_router.add(r'^reseller_pay_start$', reseller_pay_start)
+    callback_router.add(r'^reseller_pay_card$', reseller_pay_card)
+    callback_router.add(r'^reseller_pay_crypto$', reseller_pay_crypto)
+    callback_router.add(r'^reseller_pay_gateway$', reseller_pay_gateway)
+    callback_router.add(r'^reseller_verify_gateway$', reseller_verify_gateway)
+    callback_router.add(r'^reseller_upload_start_card$', reseller_upload_start_card)
+    callback_router.add(r'^reseller_upload_start_crypto$', reseller_upload_start_crypto)
     # Already covered by composite router
 
     # Admin tickets (global)
-    application.add_handler(CallbackQueryHandler(admin_tickets_menu, pattern=r'^admin_tickets_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_ticket_view, pattern=r'^ticket_view_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_ticket_delete, pattern=r'^ticket_delete_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_ticket_reply_start, pattern=r'^ticket_reply_\d+$'), group=3)
+    callback_router.add(r'^admin_tickets_menu$', admin_tickets_menu)
+    callback_router.add(r'^ticket_view_\d+$', admin_ticket_view)
+    callback_router.add(r'^ticket_delete_\d+$', admin_ticket_delete)
+    callback_router.add(r'^ticket_reply_\d+$', admin_ticket_reply_start)
     application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, admin_ticket_receive_reply), group=-3)
 
     # Admin wallet tx (global)
-    application.add_handler(CallbackQueryHandler(admin_wallet_tx_menu, pattern=r'^admin_wallet_tx_menu$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallet_tx_view, pattern=r'^wallet_tx_view_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallet_tx_approve, pattern=r'^wallet_tx_approve_\d+$'), group=3)
-    application.add_handler(CallbackQueryHandler(admin_wallet_tx_reject, pattern=r'^wallet_tx_reject_\d+$'), group=3)
+    callback_router.add(r'^admin_wallet_tx_menu$', admin_wallet_tx_menu)
+    callback_router.add(r'^wallet_tx_view_\d+$', admin_wallet_tx_view)
+    callback_router.add(r'^wallet_tx_approve_\d+$', admin_wallet_tx_approve)
+    callback_router.add(r'^wallet_tx_reject_\d+$', admin_wallet_tx_reject)
     # Place before other generic text handlers to ensure it captures admin adjust flow
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admin_wallet_adjust_text_router), group=-4)
 
@@ -1369,6 +1435,10 @@ def build_application() -> Application:
     application.add_handler(support_conv, group=1)
 
 >>>>>>> origin/master
+    record_phase('build_application', _time_mod.perf_counter() - _t_build)
+    if BOOT_PROFILE:
+        from .config import logger
+        logger.warning(f"callback router {callback_router.stats()}: {benchmark_dispatch(callback_router, iterations=200)}")
     return application
 
 
@@ -1404,6 +1474,7 @@ def run(token: str | None = None):
         pass
 
     app = build_application()
+    log_boot_report()
 
     if not use_webhook:
         # Long polling mode (recommended for VPS/server)
@@ -0,0 +1,257 @@
+"""
+Approval job queue
+Provisioning an approved order (panel login, client creation, config fetch,
+user notification) runs as a tracked background job instead of inside the
+admin's callback:
+
+* one job per order; the order id is the idempotency key, so double taps and
+  overlapping bulk approvals never provision an order twice
+* a bounded worker pool per panel (``APPROVAL_WORKERS_PER_PANEL``), so a slow
+  panel does not hold up approvals on the others
+* :class:`RetryableError` failures are retried with exponential backoff up to
+  ``APPROVAL_MAX_ATTEMPTS``; the job waits off the worker while backing off.
+  Only failures before the create request reached the panel are retryable
+  (:func:`ensure_panel_ready`, :func:`is_pre_send_failure`): a create that timed
+  out may still have gone through, and retrying it would provision twice
+* every state change is stored in ``approval_jobs`` and passed to the job's
+  progress callback, which the admin handlers turn into message edits
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from .config import logger
+from .db import execute_db, query_db
+from .metrics import get_metrics
+from .panel_health import PanelUnavailable, get_panel_breaker
+
+APPROVAL_WORKERS_PER_PANEL = int(os.getenv('APPROVAL_WORKERS_PER_PANEL', '2'))
+APPROVAL_MAX_ATTEMPTS = int(os.getenv('APPROVAL_MAX_ATTEMPTS', '3'))
+APPROVAL_RETRY_BASE_SECONDS = float(os.getenv('APPROVAL_RETRY_BASE_SECONDS', '5'))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_RETRY = 'retry'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# submit() outcomes besides JOB_QUEUED
+SUBMIT_DUPLICATE = 'duplicate'
+SUBMIT_ALREADY_DONE = 'already_done'
+
+
+class RetryableError(Exception):
+    """Transient provisioning failure that did not reach the panel (panel down, login); the job is retried"""
+
+
+class ApprovalJob:
+    """Provisioning of one order on one panel (and inbound, for X-UI style panels)"""
+
+    __slots__ = ('order_id', 'panel_id', 'inbound_id', 'run', 'progress', 'state', 'stage',
+                 'attempts', 'error', 'result', 'enqueued_at')
+
+    def __init__(self, order_id: int, panel_id: int, run: Callable[['ApprovalJob'], Awaitable[Optional[str]]],
+                 progress: Optional[Callable[['ApprovalJob'], Awaitable[None]]] = None,
+                 inbound_id: Optional[int] = None):
+        self.order_id = int(order_id)
+        self.panel_id = int(panel_id)
+        self.inbound_id = int(inbound_id) if inbound_id is not None else None
+        # Does the work; returns an optional note for the admin, raises to fail
+        self.run = run
+        self.progress = progress
+        self.state = JOB_QUEUED
+        self.stage = ''
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.result: Optional[str] = None
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (JOB_DONE, JOB_FAILED)
+
+    async def report(self, stage: str):
+        """Progress note from inside ``run`` (e.g. 'creating client')"""
+        self.stage = stage
+        await _notify(self)
+
+
+async def _notify(job: ApprovalJob):
+    if job.progress is None:
+        return
+    try:
+        await job.progress(job)
+    except Exception as e:
+        logger.debug(f"approval job {job.order_id}: progress callback failed: {e}")
+
+
+async def run_panel_call(fn, *args):
+    """Run a panel API method off the event loop; the panel classes block even where declared async"""
+    def call():
+        result = fn(*args)
+        # A coroutine must be driven in the same worker thread it was created in
+        return asyncio.run(result) if asyncio.iscoroutine(result) else result
+    return await asyncio.to_thread(call)
+
+
+def is_pre_send_failure(exc: BaseException) -> bool:
+    """True if ``exc`` means the request never reached the panel, so repeating it cannot duplicate anything"""
+    if isinstance(exc, (PanelUnavailable, requests.ConnectTimeout)):
+        return True
+    if isinstance(exc, requests.ConnectionError) and exc.args:
+        # urllib3 wraps a refused/unresolvable connection as MaxRetryError(reason=NewConnectionError)
+        return isinstance(getattr(exc.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+async def ensure_panel_ready(panel_id, api):
+    """Check the breaker and log in before a create call; raises :class:`RetryableError` if the panel is not reachable"""
+    breaker = get_panel_breaker(panel_id)
+    if not breaker.available:
+        raise RetryableError(f"panel {panel_id} is unavailable ({breaker.last_error or 'circuit open'})")
+    login = getattr(api, 'get_token', None) or getattr(api, '_ensure_token', None)
+    if login is None:
+        return
+    try:
+        ok = await run_panel_call(login)
+    except Exception as e:
+        raise RetryableError(str(e))
+    if not ok:
+        raise RetryableError("ورود به پنل ناموفق بود")
+
+
+class ApprovalQueue:
+    def __init__(self, workers_per_panel: int = APPROVAL_WORKERS_PER_PANEL,
+                 max_attempts: int = APPROVAL_MAX_ATTEMPTS, retry_base: float = APPROVAL_RETRY_BASE_SECONDS):
+        self.workers_per_panel = max(1, workers_per_panel)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, list] = {}
+        # order id -> job, from submit until it finished
+        self._active: Dict[int, ApprovalJob] = {}
+
+    def _record(self, job: ApprovalJob):
+        execute_db(
+            "UPDATE approval_jobs SET status = ?, attempts = ?, last_error = ?, updated_at = ? WHERE order_id = ?",
+            (job.state, job.attempts, job.error, datetime.now().isoformat(timespec='seconds'), job.order_id),
+        )
+
+    def _queue_for(self, panel_id: int) -> asyncio.Queue:
+        q = self._queues.get(panel_id)
+        if q is None:
+            q = self._queues[panel_id] = asyncio.Queue()
+            self._workers[panel_id] = [
+                asyncio.ensure_future(self._worker(panel_id, q)) for _ in range(self.workers_per_panel)
+            ]
+        return q
+
+    def submit(self, job: ApprovalJob) -> str:
+        """Queue ``job`` unless its order is already queued/running or provisioned; call from the event loop"""
+        if job.order_id in self._active:
+            return SUBMIT_DUPLICATE
+        row = query_db("SELECT status FROM approval_jobs WHERE order_id = ?", (job.order_id,), one=True)
+        if row and row.get('status') == JOB_DONE:
+            return SUBMIT_ALREADY_DONE
+        now = datetime.now().isoformat(timespec='seconds')
+        execute_db(
+            "INSERT INTO approval_jobs (order_id, panel_id, inbound_id, status, attempts, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', 0, ?, ?) "
+            "ON CONFLICT(order_id) DO UPDATE SET panel_id = excluded.panel_id, inbound_id = excluded.inbound_id, "
+            "status = 'queued', attempts = 0, last_error = NULL, updated_at = excluded.updated_at",
+            (job.order_id, job.panel_id, job.inbound_id, now, now),
+        )
+        self._active[job.order_id] = job
+        self._queue_for(job.panel_id).put_nowait(job)
+        get_metrics().inc('approval_jobs_submitted_total', panel=str(job.panel_id))
+        return JOB_QUEUED
+
+    def position(self, job: ApprovalJob) -> int:
+        """1-based place among the jobs waiting for the same panel; 0 once started"""
+        if job.state != JOB_QUEUED:
+            return 0
+        waiting = [j for j in self._active.values() if j.panel_id == job.panel_id and j.state == JOB_QUEUED]
+        waiting.sort(key=lambda j: j.enqueued_at)
+        return waiting.index(job) + 1 if job in waiting else 0
+
+    def _requeue(self, job: ApprovalJob):
+        job.state = JOB_QUEUED
+        job.enqueued_at = time.monotonic()
+        self._queue_for(job.panel_id).put_nowait(job)
+
+    async def _worker(self, panel_id: int, q: asyncio.Queue):
+        while True:
+            job = await q.get()
+            try:
+                await self._execute(job)
+            except Exception as e:
+                logger.error(f"approval worker (panel {panel_id}) crashed on order {job.order_id}: {e}")
+                job.error = str(e)
+                job.state = JOB_FAILED
+                try:
+                    self._record(job)
+                except Exception as re:
+                    logger.error(f"approval job {job.order_id}: could not record failure: {re}")
+                await _notify(job)
+            finally:
+                q.task_done()
+                if job.finished:
+                    self._active.pop(job.order_id, None)
+
+    async def _execute(self, job: ApprovalJob):
+        job.attempts += 1
+        job.state = JOB_RUNNING
+        job.stage = ''
+        self._record(job)
+        await _notify(job)
+        t0 = time.perf_counter()
+        try:
+            job.result = await job.run(job)
+        except RetryableError as e:
+            job.error = str(e)
+            if job.attempts < self.max_attempts:
+                delay = self.retry_base * (2 ** (job.attempts - 1)) * random.uniform(0.8, 1.2)
+                job.state = JOB_RETRY
+                self._record(job)
+                get_metrics().inc('approval_job_retries_total', panel=str(job.panel_id))
+                logger.warning(f"approval of order {job.order_id} failed (attempt {job.attempts}), retrying in {delay:.0f}s: {e}")
+                await _notify(job)
+                asyncio.get_running_loop().call_later(delay, self._requeue, job)
+                return
+            job.state = JOB_FAILED
+        except Exception as e:
+            job.error = str(e)
+            job.state = JOB_FAILED
+        else:
+            job.error = None
+            job.state = JOB_DONE
+        finally:
+            get_metrics().observe('approval_job_seconds', time.perf_counter() - t0, panel=str(job.panel_id))
+        if job.state == JOB_FAILED:
+            logger.error(f"approval of order {job.order_id} on panel {job.panel_id} failed: {job.error}")
+        get_metrics().inc('approval_jobs_total', panel=str(job.panel_id), result=job.state)
+        self._record(job)
+        await _notify(job)
+
+    def stats(self) -> Dict[str, int]:
+        states: Dict[str, int] = {}
+        for job in self._active.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        states['panels'] = len(self._queues)
+        return states
+
+
+_approval_queue: Optional[ApprovalQueue] = None
+
+
+def get_approval_queue() -> ApprovalQueue:
+    global _approval_queue
+    if _approval_queue is None:
+        _approval_queue = ApprovalQueue()
+    return _approval_queue
@@ -13,6 +13,7 @@ from pathlib import Path
 import asyncio
 import aiofiles
 from .db import query_db, execute_db
+from .migrations import ensure_schema
 from .config import logger
 from .advanced_logging import get_advanced_logger
 
@@ -33,58 +34,8 @@ class BackupManager:
         }
     
     def _create_tables(self):
-        """Create backup tracking tables"""
-        try:
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS backup_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    backup_id TEXT UNIQUE NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    backup_type TEXT,
-                    size_bytes INTEGER,
-                    file_count INTEGER,
-                    compression_ratio REAL,
-                    checksum TEXT,
-                    location TEXT,
-                    status TEXT,
-                    restore_count INTEGER DEFAULT 0,
-                    notes TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS backup_schedule (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    schedule_type TEXT NOT NULL,
-                    frequency TEXT,
-                    next_run TEXT,
-                    last_run TEXT,
-                    enabled BOOLEAN DEFAULT 1,
-                    retention_days INTEGER DEFAULT 30
-                )
-            """)
-            
-            # Initialize default schedules
-            self._init_schedules()
-            
-        except Exception as e:
-            logger.error(f"Failed to create backup tables: {e}")
-    
-    def _init_schedules(self):
-        """Initialize default backup schedules"""
-        schedules = [
-            ('database', 'daily', 30),
-            ('logs', 'weekly', 7),
-            ('full', 'weekly', 30),
-            ('config', 'on_change', 90)
-        ]
-        
-        for backup_type, frequency, retention in schedules:
-            execute_db("""
-                INSERT OR IGNORE INTO backup_schedule 
-                (schedule_type, frequency, retention_days)
-                VALUES (?, ?, ?)
-            """, (backup_type, frequency, retention))
+        """Tables and default schedules are owned by bot.migrations; this is a single version check"""
+        ensure_schema()
     
     async def create_backup(self, 
                           backup_type: str = 'full',
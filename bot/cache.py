@@ -3,7 +3,6 @@ Simple in-memory cache to reduce database queries
 """
 import time
 from typing import Any, Optional
-from functools import lru_cache
 
 # Simple dict-based cache with TTL
 _cache = {}
@@ -38,14 +37,12 @@ def clear_cache():
     _cache.clear()
     _cache_ttl.clear()
 
-# Cache for frequently accessed settings
-@lru_cache(maxsize=128)
+# Settings are served from bot.settings_store, which refreshes itself on writes
 def get_bot_active_status() -> str:
-    """Cached bot active status - invalidate on change"""
-    from .db import query_db
-    cur = query_db("SELECT value FROM settings WHERE key='bot_active'", one=True)
-    return (cur or {}).get('value') or '1'
+    """Bot active status from the settings snapshot"""
+    from .settings_store import get_setting
+    return get_setting('bot_active') or '1'
 
 def invalidate_bot_active_cache():
-    """Call this when bot_active setting changes"""
-    get_bot_active_status.cache_clear()
+    """Kept for callers; the settings snapshot is updated by set_setting()"""
+    return None
@@ -0,0 +1,311 @@
+"""
+Config link templates
+Turning an inbound into a vless/vmess/trojan URI means deriving host, port,
+network, security, SNI and the transport/reality parameters from
+``streamSettings``. Those depend only on the inbound, not on the client, so they
+are compiled once per inbound version into a :class:`LinkTemplate`; a user's link
+is then the template with the client's UUID/password and name filled in.
+
+Templates are kept on the :class:`~bot.panel_inbound.ParsedInbound` (one fetch,
+many users) and in an LRU keyed by the inbound's content (later fetches of an
+unchanged inbound). Two output dialects exist because the bot ships two link
+flavours:
+
+* ``DIALECT_PANEL`` - what the X-UI / 3x-UI / TX-UI panel classes return
+* ``DIALECT_SHARE`` - the admin-side builder: url-quoted values, ``fp``/``alpn``/
+  reality keys and the inbound remark as the link name
+"""
+import base64
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from urllib.parse import quote, urlsplit
+
+from .panel_inbound import ParsedInbound, parse_inbound
+
+DIALECT_PANEL = 'panel'
+DIALECT_SHARE = 'share'
+
+_TEMPLATE_CACHE_SIZE = 256
+# Placeholder values swapped for the client's fields in pre-serialized vmess JSON
+_SLOT = '\ufdd0slot:'
+
+
+def link_host(origin: str) -> str:
+    """Hostname of a panel/subscription base URL (scheme optional)"""
+    origin = (origin or '').strip()
+    if not origin:
+        return ''
+    if '://' not in origin:
+        origin = f"http://{origin}"
+    try:
+        return urlsplit(origin).hostname or ''
+    except ValueError:
+        return ''
+
+
+def _json_pieces(obj: dict, **dumps_kwargs) -> List[str]:
+    """``json.dumps(obj)`` split around slot placeholders: literal, slot name, literal, ..."""
+    text = json.dumps(obj, ensure_ascii=False, **dumps_kwargs)
+    pieces = []
+    while True:
+        start = text.find('"' + _SLOT)
+        if start < 0:
+            pieces.append(text)
+            return pieces
+        end = text.index('"', start + 1)
+        pieces.append(text[:start])
+        pieces.append(text[start + 1 + len(_SLOT):end])
+        text = text[end + 1:]
+
+
+class LinkTemplate:
+    """Everything of an inbound's link except the client's secret and name"""
+
+    __slots__ = ('protocol', 'scheme', 'head', 'fragment', 'quote_name', 'with_flow', 'vmess_pieces')
+
+    def __init__(self, protocol: str, scheme: str = '', head: str = '', fragment: Optional[str] = None,
+                 quote_name: bool = False, with_flow: bool = False, vmess_pieces: Optional[List[str]] = None):
+        self.protocol = protocol
+        self.scheme = scheme
+        # "@host:port?query" for URI schemes
+        self.head = head
+        # Fixed link name, or None to use the client's name
+        self.fragment = fragment
+        self.quote_name = quote_name
+        self.with_flow = with_flow
+        self.vmess_pieces = vmess_pieces
+
+    def render(self, client: dict, name: str) -> List[str]:
+        """Config URIs for ``client`` (a ``settings.clients`` entry) named ``name``"""
+        if self.protocol == 'trojan':
+            secret = client.get('password') or ''
+        else:
+            secret = client.get('id') or client.get('uuid') or ''
+        if not secret:
+            return []
+        if self.vmess_pieces is not None:
+            values = {'id': secret, 'ps': str(name)}
+            doc = ''.join(p if i % 2 == 0 else json.dumps(values[p], ensure_ascii=False)
+                          for i, p in enumerate(self.vmess_pieces))
+            return ["vmess://" + base64.b64encode(doc.encode('utf-8')).decode('utf-8')]
+        if not self.scheme:
+            return []
+        head = self.head
+        if self.with_flow:
+            flow = client.get('flow')
+            if flow:
+                head = f"{head}&flow={flow}"
+        if self.fragment is not None:
+            fragment = self.fragment
+        else:
+            fragment = quote(str(name)) if self.quote_name else name
+        return [f"{self.scheme}{secret}{head}#{fragment}"]
+
+
+def _compile_panel(parsed: ParsedInbound, host: str) -> LinkTemplate:
+    stream = parsed.stream
+    proto = parsed.protocol
+    port = parsed.port
+    network = (stream.get('network') or '').lower() or 'tcp'
+    security = (stream.get('security') or '').lower() or ''
+    sni = ''
+    if security == 'tls':
+        sni = (stream.get('tlsSettings') or {}).get('serverName') or ''
+    elif security == 'reality':
+        sni = ((stream.get('realitySettings') or {}).get('serverNames') or [''])[0]
+    path = ''
+    host_header = ''
+    service_name = ''
+    header_type = ''
+    if network == 'ws':
+        ws = stream.get('wsSettings') or {}
+        path = ws.get('path') or '/'
+        headers = ws.get('headers') or {}
+        host_header = headers.get('Host') or headers.get('host') or ''
+    elif network == 'tcp':
+        header = (stream.get('tcpSettings') or {}).get('header') or {}
+        if (header.get('type') or '').lower() == 'http':
+            header_type = 'http'
+            req = header.get('request') or {}
+            rp = req.get('path')
+            if isinstance(rp, list) and rp:
+                path = rp[0] or '/'
+            elif isinstance(rp, str) and rp:
+                path = rp
+            else:
+                path = '/'
+            h = req.get('headers') or {}
+            hh = h.get('Host') or h.get('host') or ''
+            if isinstance(hh, list) and hh:
+                host_header = hh[0]
+            elif isinstance(hh, str):
+                host_header = hh
+    if network == 'grpc':
+        service_name = (stream.get('grpcSettings') or {}).get('serviceName') or ''
+    if not host:
+        host = host_header or sni or host
+
+    if proto == 'vmess':
+        vm = {
+            "v": "2",
+            "ps": _SLOT + 'ps',
+            "add": host,
+            "port": str(port),
+            "id": _SLOT + 'id',
+            "aid": "0",
+            "net": network,
+            "type": "none",
+            "host": host_header or sni or host,
+            "path": path or "/",
+            "tls": "tls" if security in ("tls", "reality") else "",
+            "sni": sni or "",
+        }
+        return LinkTemplate(proto, vmess_pieces=_json_pieces(vm))
+    if proto not in ('vless', 'trojan'):
+        return LinkTemplate(proto)
+    qs = [f'type={network}']
+    if network == 'ws':
+        if path:
+            qs.append(f'path={path}')
+        if host_header:
+            qs.append(f'host={host_header}')
+    if proto == 'vless' and network == 'tcp' and header_type == 'http':
+        qs.append('headerType=http')
+        if path:
+            qs.append(f'path={path}')
+        if host_header:
+            qs.append(f'host={host_header}')
+    if network == 'grpc' and service_name:
+        qs.append(f'serviceName={service_name}')
+    if security:
+        qs.append(f'security={security}')
+        if sni:
+            qs.append(f'sni={sni}')
+    elif proto == 'vless':
+        qs.append('security=none')
+    return LinkTemplate(proto, f"{proto}://", f"@{host}:{port}?{'&'.join(qs)}", with_flow=(proto == 'vless'))
+
+
+def _compile_share(parsed: ParsedInbound, host: str) -> LinkTemplate:
+    stream = parsed.stream
+    proto = parsed.protocol
+    port = int(parsed.port)
+    remark = parsed.remark or None
+    network = (stream.get('network') or 'tcp').lower()
+    security = (stream.get('security') or 'none').lower()
+    tls_obj = stream.get('tlsSettings') or {}
+    reality_obj = stream.get('realitySettings') or {}
+    ws_obj = stream.get('wsSettings') or {}
+
+    if proto == 'vmess':
+        vm = {
+            'v': '2',
+            'ps': str(remark) if remark else _SLOT + 'ps',
+            'add': host,
+            'port': str(port),
+            'id': _SLOT + 'id',
+            'aid': '0',
+            'net': network,
+            'type': 'none',
+            'host': '',
+            'path': '',
+            'tls': 'tls' if security in ('tls', 'xtls') else '',
+            'sni': tls_obj.get('serverName') or '',
+        }
+        if network == 'ws':
+            vm['path'] = ws_obj.get('path') or '/'
+            vm['host'] = (ws_obj.get('headers') or {}).get('Host') or host
+        return LinkTemplate(proto, vmess_pieces=_json_pieces(vm, separators=(',', ':')))
+    if proto != 'vless':
+        return LinkTemplate(proto)
+    params = ["encryption=none"]
+    if network == 'ws':
+        path = ws_obj.get('path') or '/'
+        host_header = (ws_obj.get('headers') or {}).get('Host') or host
+        params += ["type=ws", f"path={quote(path)}", f"host={quote(host_header)}"]
+    elif network == 'grpc':
+        service = (stream.get('grpcSettings') or {}).get('serviceName') or ''
+        if service:
+            params += ["type=grpc", f"serviceName={quote(service)}", "mode=gun"]
+    else:
+        params.append(f"type={network}")
+        header = (stream.get('tcpSettings') or {}).get('header') or {}
+        if isinstance(header, dict) and (header.get('type') or '').lower() == 'http':
+            req = header.get('request') or {}
+            paths = req.get('path') or ['/']
+            if isinstance(paths, list) and paths:
+                params.append(f"path={quote(str(paths[0]) or '/')}")
+            hdrs = req.get('headers') or {}
+            hh = hdrs.get('Host') or hdrs.get('host') or []
+            if isinstance(hh, list) and hh:
+                params.append(f"host={quote(str(hh[0]))}")
+            elif isinstance(hh, str) and hh:
+                params.append(f"host={quote(hh)}")
+            params.append("headerType=http")
+    if security in ('tls', 'xtls'):
+        alpn = tls_obj.get('alpn')
+        params += ["security=tls", f"sni={quote(tls_obj.get('serverName') or host)}"]
+        if isinstance(alpn, list) and alpn:
+            params.append(f"alpn={quote(','.join(alpn))}")
+        params.append("fp=chrome")
+    elif security == 'reality':
+        sni = (reality_obj.get('serverNames') or [host])[0]
+        params += ["security=reality", f"sni={quote(sni)}"]
+        if reality_obj.get('publicKey'):
+            params.append(f"pbk={quote(reality_obj['publicKey'])}")
+        if reality_obj.get('shortId'):
+            params.append(f"sid={quote(reality_obj['shortId'])}")
+        params.append("fp=chrome")
+    else:
+        params.append("security=none")
+    return LinkTemplate(proto, "vless://", f"@{host}:{port}?{'&'.join(params)}",
+                        fragment=quote(str(remark)) if remark else None, quote_name=True)
+
+
+_COMPILERS = {DIALECT_PANEL: _compile_panel, DIALECT_SHARE: _compile_share}
+
+_templates: "OrderedDict[tuple, LinkTemplate]" = OrderedDict()
+_templates_lock = threading.Lock()
+_compiled = 0
+
+
+def _version_key(parsed: ParsedInbound, dialect: str, host: str) -> tuple:
+    """Identity of everything a template is derived from"""
+    stream = json.dumps(parsed.stream, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    digest = hashlib.sha1(stream.encode('utf-8')).hexdigest()
+    return (dialect, host, parsed.id, parsed.protocol, parsed.port, parsed.remark, digest)
+
+
+def link_template(parsed: ParsedInbound, host: str, dialect: str = DIALECT_PANEL) -> LinkTemplate:
+    """Compiled template of an inbound, reused across users and across fetches of the same version"""
+    local_key = (dialect, host)
+    tpl = parsed.link_templates.get(local_key)
+    if tpl is not None:
+        return tpl
+    key = _version_key(parsed, dialect, host)
+    with _templates_lock:
+        tpl = _templates.get(key)
+        if tpl is not None:
+            _templates.move_to_end(key)
+    if tpl is None:
+        global _compiled
+        tpl = _COMPILERS[dialect](parsed, host)
+        _compiled += 1
+        with _templates_lock:
+            _templates[key] = tpl
+            while len(_templates) > _TEMPLATE_CACHE_SIZE:
+                _templates.popitem(last=False)
+    parsed.link_templates[local_key] = tpl
+    return tpl
+
+
+def build_client_links(inbound: dict, client: dict, name: str, host: str, dialect: str = DIALECT_PANEL) -> List[str]:
+    """Config URIs of one client of an X-UI style inbound detail"""
+    return link_template(parse_inbound(inbound), host, dialect).render(client, name)
+
+
+def template_stats() -> dict:
+    return {'cached': len(_templates), 'compiled': _compiled}
@@ -1,9 +1,56 @@
+import re
 import sqlite3
+import time
+from collections import OrderedDict
 from datetime import datetime
 from .config import DB_NAME, logger
+from .metrics import get_metrics
+from .query_profiler import record as record_query
 
+# Bumped on every write touching the orders table; invalidates cached order counts
+_orders_version = 0
+_ORDERS_WRITE_RE = re.compile(r"\b(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE|DELETE\s+FROM)\s+orders\b", re.IGNORECASE)
+# Bumped on every write to settings; bot.settings_store reloads its snapshot when it moves
+_settings_version = 0
+_SETTINGS_WRITE_RE = re.compile(
+    r"\b(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+settings\b", re.IGNORECASE
+)
+# Bumped on every failed query; callers caching derived values skip results built across a failure
+_query_errors = 0
+# Bumped on every write to a table that DB-driven menus are rendered from
+_menu_version = 0
+_MENU_WRITE_RE = re.compile(
+    r"\b(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+"
+    r"(?:buttons|messages|plans|tutorials|tutorial_media|settings)\b",
+    re.IGNORECASE,
+)
 
-def query_db(query: str, args=(), one: bool = False):
+
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SQL_WS_RE = re.compile(r"\s+")
+_statement_names: dict = {}
+
+
+def statement_fingerprint(query: str) -> str:
+    """Short, literal-free label for a SQL statement (cached per query string)"""
+    name = _statement_names.get(query)
+    if name is None:
+        name = _SQL_WS_RE.sub(' ', _SQL_LITERAL_RE.sub('?', query)).strip()[:80]
+        if len(_statement_names) < 4096:
+            _statement_names[query] = name
+    return name
+
+
+def _record_statement(query: str, seconds: float):
+    stmt = statement_fingerprint(query)
+    get_metrics().observe('db_statement_duration_seconds', seconds, stmt=stmt)
+    # No-op unless the current update is being profiled
+    record_query(stmt, seconds)
+
+
+def query_db(query: str, args=(), one: bool = False, strict: bool = False):
+    """Rows as dicts; on a DB error logs and returns [] / None, or re-raises with ``strict``"""
+    t0 = time.perf_counter()
     try:
         with sqlite3.connect(DB_NAME, check_same_thread=False) as conn:
             conn.row_factory = sqlite3.Row
@@ -14,20 +61,111 @@ def query_db(query: str, args=(), one: bool = False):
                 return dict(rows[0]) if rows else None
             return [dict(row) for row in rows]
     except sqlite3.Error as e:
+        global _query_errors
+        _query_errors += 1
         logger.error(f"DB query error: {e}")
+        if strict:
+            raise
         return None if one else []
+    finally:
+        _record_statement(query, time.perf_counter() - t0)
+
+
+def get_settings_version() -> int:
+    return _settings_version
+
+
+def get_menu_version() -> int:
+    return _menu_version
+
+
+def get_query_error_count() -> int:
+    return _query_errors
 
 
 def execute_db(query: str, args=()):
+    global _orders_version, _menu_version, _settings_version
+    t0 = time.perf_counter()
     try:
         with sqlite3.connect(DB_NAME, check_same_thread=False) as conn:
             cursor = conn.cursor()
             cursor.execute(query, args)
             conn.commit()
+            if _ORDERS_WRITE_RE.search(query):
+                _orders_version += 1
+            if _MENU_WRITE_RE.search(query):
+                _menu_version += 1
+                if _SETTINGS_WRITE_RE.search(query):
+                    _settings_version += 1
             return cursor.lastrowid
     except sqlite3.Error as e:
         logger.error(f"DB execute error: {e}")
         return None
+    finally:
+        _record_statement(query, time.perf_counter() - t0)
+
+
+# --- Order history paging ---
+# Columns served straight from idx_orders_user_id_desc (no table lookups)
+ORDER_LIST_COLUMNS = (
+    'id', 'plan_id', 'status', 'marzban_username', 'panel_id', 'panel_type', 'timestamp', 'desired_username',
+)
+
+
+def fetch_user_orders_page(user_id: int, limit: int = 10, before_id: int | None = None,
+                           after_id: int | None = None, offset: int = 0, exclude_statuses=()):
+    """Keyset page of a user's orders, newest first.
+
+    Pass ``before_id`` (last id of the current page) for the next page or
+    ``after_id`` (first id of the current page) for the previous one; ``offset``
+    is only used for legacy page-number callbacks. Returns
+    ``(rows, has_prev, has_next)``.
+    """
+    cols = ", ".join(ORDER_LIST_COLUMNS)
+    where = "user_id = ?"
+    args = [user_id]
+    if exclude_statuses:
+        where += f" AND status NOT IN ({','.join('?' * len(exclude_statuses))})"
+        args.extend(exclude_statuses)
+    if after_id is not None:
+        rows = query_db(
+            f"SELECT {cols} FROM orders WHERE {where} AND id > ? ORDER BY id ASC LIMIT ?",
+            (*args, int(after_id), limit + 1),
+        ) or []
+        has_prev = len(rows) > limit
+        return list(reversed(rows[:limit])), has_prev, True
+    if before_id is not None:
+        rows = query_db(
+            f"SELECT {cols} FROM orders WHERE {where} AND id < ? ORDER BY id DESC LIMIT ?",
+            (*args, int(before_id), limit + 1),
+        ) or []
+        return rows[:limit], True, len(rows) > limit
+    rows = query_db(
+        f"SELECT {cols} FROM orders WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+        (*args, limit + 1, max(0, int(offset))),
+    ) or []
+    return rows[:limit], offset > 0, len(rows) > limit
+
+
+_ORDER_COUNTS_MAX = 4096
+_ORDER_COUNTS_TTL = 300
+_order_counts_cache: "OrderedDict[int, tuple]" = OrderedDict()
+
+
+def get_user_order_counts(user_id: int) -> dict:
+    """``{status: count}`` for a user's orders, cached until the next orders write"""
+    now = time.monotonic()
+    hit = _order_counts_cache.get(user_id)
+    if hit and hit[0] == _orders_version and now - hit[1] < _ORDER_COUNTS_TTL:
+        _order_counts_cache.move_to_end(user_id)
+        return hit[2]
+    rows = query_db("SELECT status, COUNT(*) AS c FROM orders WHERE user_id = ? GROUP BY status", (user_id,)) or []
+    counts = {(r.get('status') or ''): int(r.get('c') or 0) for r in rows}
+    _order_counts_cache[user_id] = (_orders_version, now, counts)
+    _order_counts_cache.move_to_end(user_id)
+    while len(_order_counts_cache) > _ORDER_COUNTS_MAX:
+        _order_counts_cache.popitem(last=False)
+    return counts
 
 
 def get_message_text(message_name: str, default: str = '') -> str:
@@ -41,7 +179,8 @@ def get_message_text(message_name: str, default: str = '') -> str:
         return default
 
 
-def initialize_default_content(cursor: sqlite3.Cursor, conn: sqlite3.Connection):
+def initialize_default_content(cursor: sqlite3.Cursor):
+    """Seed default messages/settings using the migration's cursor (no commit)"""
     default_messages = {
         'start_main': ('\U0001F44B سلام! به ربات فروش کانفیگ ما خوش آمدید.\nبرای شروع از دکمه‌های زیر استفاده کنید.', None, None),
         'admin_panel_main': ('\U0001F5A5\uFE0F پنل مدیریت ربات. لطفا یک گزینه را انتخاب کنید.', None, None),
@@ -64,55 +203,51 @@ def initialize_default_content(cursor: sqlite3.Cursor, conn: sqlite3.Connection)
             "INSERT OR IGNORE INTO messages (message_name, text, file_id, file_type) VALUES (?, ?, ?, ?)",
             (name, text, f_id, f_type),
         )
-        # Admin audit log
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS admin_audit (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id INTEGER NOT NULL,
-                action TEXT NOT NULL,
-                target TEXT,
-                created_at TEXT NOT NULL,
-                meta TEXT
-            )
-            """
+    # Admin audit log
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS admin_audit (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            target TEXT,
+            created_at TEXT NOT NULL,
+            meta TEXT
         )
+        """
+    )
 
-    conn.commit()
+    def _scalar(sql: str):
+        row = cursor.execute(sql).fetchone()
+        return row[0] if row else None
 
-    from .db import query_db as _query_db, execute_db as _execute_db
+    if _scalar("SELECT 1 FROM panels") is None:
+        url = _scalar("SELECT value FROM settings WHERE key = 'panel_url'") or 'https://your-panel.com'
+        user = _scalar("SELECT value FROM settings WHERE key = 'panel_user'") or 'admin'
+        password = _scalar("SELECT value FROM settings WHERE key = 'panel_pass'") or 'password'
 
-    if not _query_db("SELECT 1 FROM panels", one=True):
-        url_row = _query_db("SELECT value FROM settings WHERE key = 'panel_url'", one=True)
-        user_row = _query_db("SELECT value FROM settings WHERE key = 'panel_user'", one=True)
-        password_row = _query_db("SELECT value FROM settings WHERE key = 'panel_pass'", one=True)
-
-        url = url_row.get('value') if url_row else 'https://your-panel.com'
-        user = user_row.get('value') if user_row else 'admin'
-        password = password_row.get('value') if password_row else 'password'
-
-        _execute_db(
+        cursor.execute(
             "INSERT INTO panels (name, panel_type, url, username, password, sub_base) VALUES (?, ?, ?, ?, ?, ?)",
             ('پنل اصلی (پیش‌فرض)', 'marzban', url, user, password, None),
         )
-        _execute_db("DELETE FROM settings WHERE key IN ('panel_url', 'panel_user', 'panel_pass')")
+        cursor.execute("DELETE FROM settings WHERE key IN ('panel_url', 'panel_user', 'panel_pass')")
 
     default_settings = {'free_trial_days': '1', 'free_trial_gb': '0.2', 'free_trial_status': '1'}
     for key, value in default_settings.items():
-        _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value))
+        cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value))
 
     # Insert default cards
-    if not _query_db("SELECT 1 FROM cards", one=True):
-        _execute_db(
+    if _scalar("SELECT 1 FROM cards") is None:
+        cursor.execute(
             "INSERT INTO cards (card_number, holder_name) VALUES (?, ?)",
             ("6037-0000-0000-0000", "نام دارنده کارت"),
         )
 
     # Ensure USD rate related settings exist
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_manual', ''))
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_cached', ''))
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_cached_ts', ''))
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_mode', 'manual'))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_manual', ''))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_cached', ''))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_cached_ts', ''))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('usd_irt_mode', 'manual'))
 
     # Payment method toggles and gateway config
     defaults = [
@@ -153,395 +288,17 @@ def initialize_default_content(cursor: sqlite3.Cursor, conn: sqlite3.Connection)
         ('auto_backup_hours', '12'),
     ]
     for k, v in defaults:
-        _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (k, v))
+        cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (k, v))
     # Cron/job defaults
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('daily_job_hour', '9'))
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('reminder_job_enabled', '1'))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('daily_job_hour', '9'))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('reminder_job_enabled', '1'))
     # Maintenance message default
-    _execute_db("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('maintenance_message', '⚠️ ربات موقتا در حال نگهداری است. لطفا بعدا مراجعه کنید.'))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('maintenance_message', '⚠️ ربات موقتا در حال نگهداری است. لطفا بعدا مراجعه کنید.'))
 
 
 def db_setup():
-    with sqlite3.connect(DB_NAME, check_same_thread=False) as conn:
-        cursor = conn.cursor()
-        # Performance pragmas
-        try:
-            cursor.execute("PRAGMA journal_mode=WAL")
-            cursor.execute("PRAGMA synchronous=NORMAL")
-        except sqlite3.Error:
-            pass
-
-        # --- Create Tables ---
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_name TEXT, join_date TEXT)"
-        )
-        cursor.execute("PRAGMA table_info(users)")
-        ucols_init = [col[1] for col in cursor.fetchall()]
-        if 'banned' not in ucols_init:
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN banned INTEGER NOT NULL DEFAULT 0")
-            except sqlite3.Error:
-                pass
-        # Referrals
-        cursor.execute("PRAGMA table_info(users)")
-        ucols = [col[1] for col in cursor.fetchall()]
-        if 'referrer_id' not in ucols:
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER")
-            except sqlite3.Error:
-                pass
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS referrals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                referrer_id INTEGER NOT NULL,
-                referee_id INTEGER NOT NULL,
-                created_at TEXT NOT NULL,
-                UNIQUE(referrer_id, referee_id)
-            )
-            """
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS messages (message_name TEXT PRIMARY KEY, text TEXT, file_id TEXT, file_type TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS buttons (id INTEGER PRIMARY KEY AUTOINCREMENT, menu_name TEXT, text TEXT, target TEXT, is_url BOOLEAN DEFAULT 0, row INTEGER, col INTEGER)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS plans (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, price INTEGER NOT NULL, duration_days INTEGER NOT NULL, traffic_gb REAL NOT NULL)"
-        )
-        # Migrations for plans: add optional per-plan binding to panel/inbound
-        cursor.execute("PRAGMA table_info(plans)")
-        pcols = [col[1] for col in cursor.fetchall()]
-        if 'panel_id' not in pcols:
-            try:
-                cursor.execute("ALTER TABLE plans ADD COLUMN panel_id INTEGER")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding panel_id to plans: {e}")
-        cursor.execute("PRAGMA table_info(plans)")
-        pcols = [col[1] for col in cursor.fetchall()]
-        if 'xui_inbound_id' not in pcols:
-            try:
-                cursor.execute("ALTER TABLE plans ADD COLUMN xui_inbound_id INTEGER")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding xui_inbound_id to plans: {e}")
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS cards (id INTEGER PRIMARY KEY AUTOINCREMENT, card_number TEXT NOT NULL, holder_name TEXT NOT NULL)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS free_trials (user_id INTEGER PRIMARY KEY, timestamp TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS discount_codes (id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT UNIQUE NOT NULL, percentage INTEGER NOT NULL, usage_limit INTEGER NOT NULL, times_used INTEGER DEFAULT 0, expiry_date TEXT)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS panels (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, panel_type TEXT NOT NULL DEFAULT 'marzban', url TEXT NOT NULL, username TEXT NOT NULL, password TEXT NOT NULL, sub_base TEXT, token TEXT)"
-        )
-        # Migrations for existing tables
-        cursor.execute("PRAGMA table_info(panels)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'enabled' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panels ADD COLUMN enabled INTEGER NOT NULL DEFAULT 1")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding enabled to panels: {e}")
-        if 'panel_type' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panels ADD COLUMN panel_type TEXT NOT NULL DEFAULT 'marzban'")
-                cursor.execute("UPDATE panels SET panel_type = 'marzban' WHERE panel_type IS NULL")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding panel_type to panels: {e}")
-        cursor.execute("PRAGMA table_info(panels)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'sub_base' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panels ADD COLUMN sub_base TEXT")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding sub_base to panels: {e}")
-        cursor.execute("PRAGMA table_info(panels)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'token' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panels ADD COLUMN token TEXT")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding token to panels: {e}")
-        # Ensure panel_inbounds exists BEFORE running its migrations
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS panel_inbounds (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                panel_id INTEGER NOT NULL,
-                protocol TEXT NOT NULL,
-                tag TEXT NOT NULL,
-                inbound_id INTEGER,
-                UNIQUE(panel_id, tag),
-                FOREIGN KEY (panel_id) REFERENCES panels(id) ON DELETE CASCADE
-            )
-            """
-        )
-
-        # Migrations for panel_inbounds
-        cursor.execute("PRAGMA table_info(panel_inbounds)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'inbound_id' not in columns:
-            try:
-                cursor.execute("ALTER TABLE panel_inbounds ADD COLUMN inbound_id INTEGER")
-            except sqlite3.Error as e:
-                logger.error(f"Error adding inbound_id to panel_inbounds: {e}")
-
-        # Table for manually setting inbounds for each panel (already ensured above)
-
-        # Orders table with conditional add columns
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='orders'")
-        if cursor.fetchone():
-            cursor.execute("PRAGMA table_info(orders)")
-            columns = [col[1] for col in cursor.fetchall()]
-
-            if 'panel_id' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN panel_id INTEGER")
-            if 'discount_code' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN discount_code TEXT")
-            if 'final_price' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN final_price INTEGER")
-            if 'last_reminder_date' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN last_reminder_date TEXT")
-            if 'panel_type' not in columns:
-                cursor.execute("ALTER TABLE orders ADD COLUMN panel_type TEXT")
-            if 'last_link' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN last_link TEXT")
-                except sqlite3.Error:
-                    pass
-            if 'last_traffic_alert_date' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN last_traffic_alert_date TEXT")
-                except sqlite3.Error:
-                    pass
-            if 'desired_username' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN desired_username TEXT")
-                except sqlite3.Error:
-                    pass
-
-            if 'xui_inbound_id' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN xui_inbound_id INTEGER")
-                except sqlite3.Error:
-                    pass
-            if 'xui_client_id' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN xui_client_id TEXT")
-                except sqlite3.Error:
-                    pass
-            if 'is_trial' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN is_trial INTEGER DEFAULT 0")
-                except sqlite3.Error:
-                    pass
-            # Notification tracking columns
-            if 'notified_traffic_80' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN notified_traffic_80 INTEGER DEFAULT 0")
-                except sqlite3.Error:
-                    pass
-            if 'notified_traffic_95' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN notified_traffic_95 INTEGER DEFAULT 0")
-                except sqlite3.Error:
-                    pass
-            if 'notified_expiry_3d' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN notified_expiry_3d INTEGER DEFAULT 0")
-                except sqlite3.Error:
-                    pass
-            if 'notified_expiry_1d' not in columns:
-                try:
-                    cursor.execute("ALTER TABLE orders ADD COLUMN notified_expiry_1d INTEGER DEFAULT 0")
-                except sqlite3.Error:
-                    pass
-        else:
-            cursor.execute(
-                """
-                CREATE TABLE orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, plan_id INTEGER NOT NULL,
-                    status TEXT DEFAULT 'pending', marzban_username TEXT, screenshot_file_id TEXT, timestamp TEXT,
-                    panel_id INTEGER, discount_code TEXT, final_price INTEGER, last_reminder_date TEXT, panel_type TEXT,
-                    last_link TEXT, xui_inbound_id INTEGER, xui_client_id TEXT, reseller_applied INTEGER DEFAULT 0,
-                    is_trial INTEGER DEFAULT 0,
-                    notified_traffic_80 INTEGER DEFAULT 0,
-                    notified_traffic_95 INTEGER DEFAULT 0,
-                    notified_expiry_3d INTEGER DEFAULT 0,
-                    notified_expiry_1d INTEGER DEFAULT 0
-                )
-                """
-            )
-        # NEW: wallets and wallet_transactions
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS wallets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                asset TEXT NOT NULL,
-                chain TEXT NOT NULL,
-                address TEXT NOT NULL,
-                memo TEXT
-            )
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS user_wallets (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER NOT NULL DEFAULT 0
-            )
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS wallet_transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                amount INTEGER NOT NULL,
-                direction TEXT NOT NULL, -- credit/debit
-                method TEXT NOT NULL,    -- gateway/crypto/card/manual
-                status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
-                created_at TEXT NOT NULL,
-                screenshot_file_id TEXT,
-                reference TEXT,
-                meta TEXT
-            )
-            """
-        )
-        # Reseller tables
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS resellers (
-                user_id INTEGER PRIMARY KEY,
-                status TEXT NOT NULL DEFAULT 'active',
-                activated_at TEXT NOT NULL,
-                expires_at TEXT NOT NULL,
-                discount_percent INTEGER NOT NULL,
-                max_purchases INTEGER NOT NULL,
-                used_purchases INTEGER NOT NULL DEFAULT 0
-            )
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS reseller_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                amount INTEGER NOT NULL,
-                method TEXT NOT NULL, -- card/crypto/gateway
-                status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
-                created_at TEXT NOT NULL,
-                screenshot_file_id TEXT,
-                reference TEXT,
-                meta TEXT
-            )
-            """
-        )
-        # Migration: add reseller_applied if missing
-        cursor.execute("PRAGMA table_info(orders)")
-        ocols = [col[1] for col in cursor.fetchall()]
-        if 'reseller_applied' not in ocols:
-            try:
-                cursor.execute("ALTER TABLE orders ADD COLUMN reseller_applied INTEGER DEFAULT 0")
-            except sqlite3.Error:
-                pass
-        # Tickets table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                content_type TEXT,
-                text TEXT,
-                file_id TEXT,
-                created_at TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'pending'
-            )
-            """
-        )
-        # Threaded ticket messages (new)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS ticket_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticket_id INTEGER NOT NULL,
-                sender TEXT NOT NULL, -- 'user' | 'admin'
-                content_type TEXT,
-                text TEXT,
-                file_id TEXT,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
-            )
-            """
-        )
-        # Tutorials
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tutorials (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                sort_order INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL
-            )
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tutorial_media (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tutorial_id INTEGER NOT NULL,
-                content_type TEXT NOT NULL,
-                file_id TEXT NOT NULL,
-                caption TEXT,
-                sort_order INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (tutorial_id) REFERENCES tutorials(id) ON DELETE CASCADE
-            )
-            """
-        )
-        # Admins table (additional admins besides primary ADMIN_ID)
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS admins (
-                user_id INTEGER PRIMARY KEY
-            )
-            """
-        )
-        conn.commit()
-        initialize_default_content(cursor, conn)
-
-        # Create indexes for hot queries (idempotent)
-        try:
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_date ON orders(status, timestamp)")
-        except sqlite3.Error:
-            pass
-        try:
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)")
-        except sqlite3.Error:
-            pass
-        try:
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_plan ON orders(plan_id)")
-        except sqlite3.Error:
-            pass
-        try:
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_tx_user_status ON wallet_transactions(user_id, status, created_at)")
-        except sqlite3.Error:
-            pass
-        try:
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_panels_enabled ON panels(enabled)")
-        except sqlite3.Error:
-            pass
-        try:
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_panel_inbounds_panel ON panel_inbounds(panel_id)")
-        except sqlite3.Error:
-            pass
-        try:
-            conn.commit()
-        except sqlite3.Error:
-            pass
\ No newline at end of file
+    """Bring the schema up to date (a single ``PRAGMA user_version`` read when current)"""
+    from .migrations import run_migrations
+    from .startup_profiler import boot_phase
+    with boot_phase('db_setup'):
+        run_migrations(DB_NAME)
@@ -3,56 +3,104 @@ Advanced Error Handling System
 Provides graceful error recovery, user-friendly messages, and admin notifications
 """
 import asyncio
+import html
+import os
+import re
+import sqlite3
+import threading
+import time
 import traceback
-from typing import Optional, Dict, Any, Callable
+from typing import Optional, Dict, Any, Callable, List
 from datetime import datetime, timedelta
 from telegram import Update, Bot
 from telegram.ext import ContextTypes
 from telegram.error import NetworkError, BadRequest, TimedOut, ChatMigrated, RetryAfter, Forbidden
 from .db import execute_db, query_db
-from .config import ADMIN_ID, logger
+from .config import ADMIN_ID, DB_NAME, logger
 from .advanced_logging import get_advanced_logger
+from .metrics import get_metrics
+from .migrations import ensure_schema
+
+# Aggregated error events are written to SQLite at most this often
+ERROR_FLUSH_SECONDS = int(os.getenv('ERROR_FLUSH_SECONDS', '60'))
+# Minimum gap between two admin digests
+ERROR_DIGEST_SECONDS = int(os.getenv('ERROR_DIGEST_SECONDS', '300'))
+# More occurrences of one error type than this make it critical (digest-worthy). Counted
+# per flush window: _drain() resets error_counts on every flush, so the effective rate
+# is THRESHOLD per ERROR_FLUSH_SECONDS, not a lifetime total
+ERROR_DIGEST_THRESHOLD = int(os.getenv('ERROR_DIGEST_THRESHOLD', '10'))
+
+_NORMALIZE_RES = (
+    (re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"), '<uuid>'),
+    (re.compile(r"https?://\S+"), '<url>'),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), '<str>'),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), '<hex>'),
+    (re.compile(r"\d+"), '<n>'),
+)
+
+
+def normalize_error_message(message: str) -> str:
+    """Strip ids, numbers, urls and quoted values so repeats of one error collapse"""
+    message = (message or '')[:300]
+    for rx, repl in _NORMALIZE_RES:
+        message = rx.sub(repl, message)
+    return ' '.join(message.split())[:120]
+
+
+def error_location(error: BaseException) -> str:
+    """``file.py:line`` of the innermost traceback frame (``?`` if not raised yet)"""
+    tb = error.__traceback__
+    if tb is None:
+        return '?'
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    return f"{os.path.basename(tb.tb_frame.f_code.co_filename)}:{tb.tb_lineno}"
+
+
+def error_fingerprint(error: BaseException) -> str:
+    """type + location + normalized message"""
+    return f"{type(error).__name__}@{error_location(error)}|{normalize_error_message(str(error))}"
+
+
+class _ErrorBucket:
+    """Occurrences of one fingerprint since the last flush; details kept from the first one"""
+
+    __slots__ = ('fingerprint', 'error_type', 'message', 'handler_name', 'user_id', 'stack_trace',
+                 'count', 'first_seen', 'last_seen', 'critical')
+
+    def __init__(self, fingerprint: str, error: Exception, user_id: Optional[int], handler_name: str, critical: bool):
+        self.fingerprint = fingerprint
+        self.error_type = type(error).__name__
+        self.message = str(error)
+        self.handler_name = handler_name
+        self.user_id = user_id
+        self.stack_trace = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        self.count = 0
+        self.first_seen = self.last_seen = time.time()
+        self.critical = critical
 
 
 class ErrorHandler:
-    """Centralized error handling system"""
+    """Centralized error handling system
+
+    Errors are fingerprinted and counted in memory; :meth:`flush` writes one
+    row per fingerprint and window and sends rate-limited admin digests.
+    """
     
     def __init__(self, bot: Optional[Bot] = None):
         self.bot = bot
         self.logger = get_advanced_logger()
         self.error_counts: Dict[str, int] = {}
-        self.last_notification: Dict[str, datetime] = {}
+        self._buckets: Dict[str, _ErrorBucket] = {}
+        self._lock = threading.Lock()
+        self._last_digest = 0.0
+        # fingerprint -> [bucket, occurrences] awaiting the next admin digest
+        self._digest: Dict[str, list] = {}
         self._create_tables()
     
     def _create_tables(self):
         """Create error tracking tables"""
-        try:
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS error_tracking (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    error_type TEXT NOT NULL,
-                    error_message TEXT,
-                    user_id INTEGER,
-                    handler_name TEXT,
-                    stack_trace TEXT,
-                    resolved BOOLEAN DEFAULT 0,
-                    resolution_notes TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS error_patterns (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pattern TEXT NOT NULL UNIQUE,
-                    count INTEGER DEFAULT 1,
-                    last_seen TEXT,
-                    auto_response TEXT,
-                    priority TEXT DEFAULT 'low'
-                )
-            """)
-        except Exception as e:
-            logger.error(f"Failed to create error tables: {e}")
+        ensure_schema()
     
     async def handle_error(self, 
                           update: Update, 
@@ -65,16 +113,14 @@ class ErrorHandler:
         """
         user_id = update.effective_user.id if update and update.effective_user else None
         
-        # Log the error
-        self.logger.log_error(
-            error,
-            handler_name=handler_name,
-            user_id=user_id,
-            context={'update': str(update) if update else None}
-        )
-        
-        # Track error in database
-        self._track_error(error, user_id, handler_name)
+        # Log only the first occurrence of a fingerprint per window in full
+        if self._track_error(error, user_id, handler_name):
+            self.logger.log_error(
+                error,
+                handler_name=handler_name,
+                user_id=user_id,
+                context={'update': str(update) if update else None}
+            )
         
         # Determine error type and response
         error_type = type(error).__name__
@@ -95,55 +141,28 @@ class ErrorHandler:
         else:
             return await self._handle_generic_error(update, context, error)
     
-    def _track_error(self, error: Exception, user_id: Optional[int], handler_name: str):
-        """Track error in database"""
+    def _track_error(self, error: Exception, user_id: Optional[int], handler_name: str) -> bool:
+        """Count the error under its fingerprint; True if it is new in the current window"""
         try:
             error_type = type(error).__name__
-            error_message = str(error)
-            stack_trace = traceback.format_exc()
-            
-            # Store in database
-            execute_db("""
-                INSERT INTO error_tracking 
-                (timestamp, error_type, error_message, user_id, handler_name, stack_trace)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                datetime.now().isoformat(),
-                error_type,
-                error_message,
-                user_id,
-                handler_name,
-                stack_trace
-            ))
-            
-            # Update error patterns
-            pattern = f"{error_type}:{error_message[:50]}"
-            existing = query_db(
-                "SELECT id, count FROM error_patterns WHERE pattern = ?",
-                (pattern,),
-                one=True
-            )
-            
-            if existing:
-                execute_db(
-                    "UPDATE error_patterns SET count = count + 1, last_seen = ? WHERE id = ?",
-                    (datetime.now().isoformat(), existing['id'])
-                )
-            else:
-                execute_db(
-                    "INSERT INTO error_patterns (pattern, last_seen) VALUES (?, ?)",
-                    (pattern, datetime.now().isoformat())
-                )
-            
-            # Increment error count for rate limiting
-            self.error_counts[error_type] = self.error_counts.get(error_type, 0) + 1
-            
-            # Notify admin if critical
-            if self._is_critical_error(error):
-                asyncio.create_task(self._notify_admin(error, user_id, handler_name))
-                
+            fp = error_fingerprint(error)
+            with self._lock:
+                bucket = self._buckets.get(fp)
+                is_new = bucket is None
+                if is_new:
+                    bucket = _ErrorBucket(fp, error, user_id, handler_name, False)
+                    self._buckets[fp] = bucket
+                bucket.count += 1
+                bucket.last_seen = time.time()
+                # Increment error count for rate limiting
+                self.error_counts[error_type] = self.error_counts.get(error_type, 0) + 1
+                if not bucket.critical and self._is_critical_error(error):
+                    bucket.critical = True
+            get_metrics().inc('errors_total', type=error_type)
+            return is_new
         except Exception as e:
             logger.error(f"Failed to track error: {e}")
+            return True
     
     def _is_critical_error(self, error: Exception) -> bool:
         """Determine if error is critical and needs immediate attention"""
@@ -155,40 +174,103 @@ class ErrorHandler:
         ]
         
         error_type = type(error).__name__
-        return error_type in critical_types or self.error_counts.get(error_type, 0) > 10
+        return error_type in critical_types or self.error_counts.get(error_type, 0) > ERROR_DIGEST_THRESHOLD
+
+    def _drain(self) -> List[_ErrorBucket]:
+        with self._lock:
+            buckets, self._buckets = self._buckets, {}
+            self.error_counts = {}
+        return list(buckets.values())
+
+    @staticmethod
+    def _write_buckets(buckets: List[_ErrorBucket], db_name: str = DB_NAME):
+        """One error_tracking row and one error_patterns upsert per fingerprint"""
+        tracking = []
+        patterns = []
+        for b in buckets:
+            last_seen = datetime.fromtimestamp(b.last_seen).isoformat()
+            tracking.append((datetime.fromtimestamp(b.first_seen).isoformat(), b.error_type, b.message[:1000],
+                             b.user_id, b.handler_name, b.stack_trace[-8000:], b.fingerprint, b.count))
+            patterns.append((b.fingerprint, b.count, last_seen, 'high' if b.critical else 'low'))
+        conn = sqlite3.connect(db_name, timeout=10)
+        try:
+            with conn:
+                conn.executemany(
+                    """INSERT INTO error_tracking
+                       (timestamp, error_type, error_message, user_id, handler_name, stack_trace, fingerprint, occurrences)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    tracking,
+                )
+                conn.executemany(
+                    """INSERT INTO error_patterns (pattern, count, last_seen, priority) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(pattern) DO UPDATE SET
+                           count = count + excluded.count,
+                           last_seen = excluded.last_seen,
+                           priority = CASE WHEN excluded.priority = 'high' THEN 'high' ELSE priority END""",
+                    patterns,
+                )
+        finally:
+            conn.close()
+
+    async def flush(self) -> int:
+        """Persist the current window and send a digest if one is due; returns fingerprints written"""
+        buckets = self._drain()
+        if buckets:
+            try:
+                await asyncio.to_thread(self._write_buckets, buckets)
+            except Exception as e:
+                logger.error(f"Failed to persist {len(buckets)} error fingerprints: {e}")
+            for b in buckets:
+                if b.critical:
+                    pending = self._digest.get(b.fingerprint)
+                    if pending is None:
+                        self._digest[b.fingerprint] = [b, b.count]
+                    else:
+                        pending[1] += b.count
+        if self._digest:
+            await self._notify_admin()
+        return len(buckets)
     
-    async def _notify_admin(self, error: Exception, user_id: Optional[int], handler_name: str):
-        """Send notification to admin about critical error"""
+    async def _notify_admin(self):
+        """Send one digest of the critical fingerprints collected since the last one (rate limited)"""
         if not self.bot or not ADMIN_ID:
+            self._digest.clear()
             return
-        
-        error_type = type(error).__name__
-        
-        # Rate limit notifications (max 1 per hour per error type)
-        last_notif = self.last_notification.get(error_type)
-        if last_notif and (datetime.now() - last_notif).total_seconds() < 3600:
+        now = time.time()
+        if now - self._last_digest < ERROR_DIGEST_SECONDS:
             return
-        
-        self.last_notification[error_type] = datetime.now()
-        
-        message = (
-            "🚨 <b>Critical Error Alert</b>\n\n"
-            f"Type: <code>{error_type}</code>\n"
-            f"Handler: <code>{handler_name}</code>\n"
-            f"User: <code>{user_id}</code>\n"
-            f"Message: {str(error)[:200]}\n"
-            f"Count: {self.error_counts.get(error_type, 1)}\n\n"
-            "Check /admin_errors for details"
-        )
-        
+        # Sent counts; the digest is only cleared once the message went out
+        entries = sorted(((b, count) for b, count in self._digest.values()), key=lambda e: e[1], reverse=True)
+        minutes = max(1, round((now - min(b.first_seen for b, _ in entries)) / 60))
+        lines = ["🚨 <b>Critical Error Digest</b>\n"]
+        for b, count in entries[:8]:
+            lines.append(
+                f"• <code>{html.escape(b.error_type)}</code> occurred <b>{count:,}</b> times in {minutes} min\n"
+                f"  Handler: <code>{html.escape(b.handler_name or '-')}</code>\n"
+                f"  {html.escape(b.message[:150])}"
+            )
+        if len(entries) > 8:
+            lines.append(f"\n… and {len(entries) - 8} more")
+        lines.append("\nCheck /admin_errors for details")
         try:
             await self.bot.send_message(
                 chat_id=ADMIN_ID,
-                text=message,
+                text="\n".join(lines),
                 parse_mode='HTML'
             )
-        except Exception:
-            pass
+        except Exception as e:
+            # Keep the entries (and the rate-limit clock) so the next flush retries
+            logger.warning(f"Failed to send error digest ({len(entries)} fingerprints) to admin: {e}")
+            return
+        self._last_digest = now
+        for b, count in entries:
+            pending = self._digest.get(b.fingerprint)
+            if pending is None:
+                continue
+            # Occurrences merged in while sending stay for the next digest
+            pending[1] -= count
+            if pending[1] <= 0:
+                del self._digest[b.fingerprint]
     
     async def _handle_network_error(self, update: Update, context: ContextTypes.DEFAULT_TYPE, error: NetworkError) -> bool:
         """Handle network-related errors"""
@@ -318,13 +400,13 @@ class ErrorHandler:
                 (since,)
             )
             
-            stats['total_errors'] = len(errors)
-            
-            # Count unique error types
+            # Each row aggregates ``occurrences`` events of one fingerprint
             error_types = {}
             for error in errors:
                 error_type = error['error_type']
-                error_types[error_type] = error_types.get(error_type, 0) + 1
+                n = error.get('occurrences') or 1
+                stats['total_errors'] += n
+                error_types[error_type] = error_types.get(error_type, 0) + n
                 
                 if error['user_id']:
                     stats['affected_users'].add(error['user_id'])
@@ -366,6 +448,18 @@ def get_error_handler(bot: Optional[Bot] = None) -> ErrorHandler:
     return _error_handler
 
 
+async def flush_errors_job(context):
+    """Periodic job: batched error upserts + admin digest"""
+    if _error_handler is None:
+        return
+    if not _error_handler.bot:
+        _error_handler.bot = context.bot
+    try:
+        await _error_handler.flush()
+    except Exception as e:
+        logger.error(f"error flush failed: {e}")
+
+
 # Error handling decorator
 def handle_errors(handler_name: Optional[str] = None):
     """Decorator to automatically handle errors in handlers"""
@@ -0,0 +1,371 @@
+"""
+USDT/IRT exchange-rate service for crypto pricing
+Quotes are refreshed in the background and served from memory
+"""
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+import requests
+
+from .config import NOBITEX_TOKEN, logger
+
+# Refresh cadence of the background job and the staleness budget of a live quote.
+# Within REFRESH_SECONDS a quote is fresh; up to STALE_SECONDS it is still served
+# (stale); past that it is dropped and the manual rate (if any) is used instead.
+REFRESH_SECONDS = int(os.getenv('USD_RATE_REFRESH_SECONDS', '300') or 300)
+STALE_SECONDS = int(os.getenv('USD_RATE_STALE_SECONDS', str(6 * 3600)) or 6 * 3600)
+# Whole-source budget (a source may chain several requests) and the cap per request
+SOURCE_TIMEOUT = float(os.getenv('USD_RATE_SOURCE_TIMEOUT', '8') or 8)
+REQUEST_TIMEOUT = float(os.getenv('USD_RATE_REQUEST_TIMEOUT', '3') or 3)
+# Below this much budget another request is not worth starting
+_MIN_REQUEST_BUDGET = 0.3
+
+_HEADERS = {
+    'Accept': 'application/json, text/plain, */*',
+    'User-Agent': 'Mozilla/5.0',
+}
+
+
+class _Budget:
+    """Time left for one source; each request gets at most REQUEST_TIMEOUT of it"""
+
+    def __init__(self, seconds: float):
+        self.deadline = time.monotonic() + seconds
+
+    def request_timeout(self) -> Optional[float]:
+        """Timeout for the next request, or None once the budget is spent"""
+        left = self.deadline - time.monotonic()
+        if left < _MIN_REQUEST_BUDGET:
+            return None
+        return min(REQUEST_TIMEOUT, left)
+
+
+def _request(budget: _Budget, method: str, url: str, **kwargs):
+    timeout = budget.request_timeout()
+    if timeout is None:
+        raise TimeoutError("source budget exhausted")
+    return requests.request(method, url, timeout=timeout, **kwargs)
+
+
+def _best_mid_from_orderbook(bids, asks) -> float:
+    try:
+        best_bid = float(bids[0][0]) if bids and bids[0] else 0.0
+        best_ask = float(asks[0][0]) if asks and asks[0] else 0.0
+        if best_bid > 0 and best_ask > 0:
+            return (best_bid + best_ask) / 2.0
+        return best_ask or best_bid or 0.0
+    except Exception:
+        return 0.0
+
+
+def fetch_from_wallex(budget: float = SOURCE_TIMEOUT) -> float:
+    budget = _Budget(budget)
+    endpoints = [
+        ('GET', 'https://api.wallex.ir/v1/markets/orderbook', {'symbol': 'usdt-irt'}),
+        ('GET', 'https://api.wallex.ir/v1/depth', {'symbol': 'usdt-irt'}),
+    ]
+    for method, url, params in endpoints:
+        try:
+            r = _request(budget, method, url, headers=_HEADERS, params=params)
+            if not r.ok:
+                continue
+            data = r.json() or {}
+            # common shapes: {'result': {'orderbook': {'bids': [...], 'asks': [...]}}}
+            res = data.get('result') or data
+            ob = res.get('orderbook') or res.get('depth') or res
+            price = _best_mid_from_orderbook(ob.get('bids') or [], ob.get('asks') or [])
+            if price > 0:
+                return price
+        except Exception:
+            continue
+    return 0.0
+
+
+def fetch_from_bitpin(budget: float = SOURCE_TIMEOUT) -> float:
+    budget = _Budget(budget)
+    endpoints = [
+        ('GET', 'https://api.bitpin.ir/v1/mth/orderbook/USDTIRT', None),
+        ('GET', 'https://api.bitpin.ir/v1/orderbook/USDTIRT', None),
+        ('GET', 'https://api.bitpin.ir/v2/orderbook/USDTIRT', None),
+    ]
+    for method, url, params in endpoints:
+        try:
+            r = _request(budget, method, url, headers=_HEADERS, params=params)
+            if not r.ok:
+                continue
+            data = r.json() or {}
+            # common shapes: {'result': {'bids': [...], 'asks': [...]}} or flat
+            res = data.get('result') or data
+            price = _best_mid_from_orderbook(res.get('bids') or [], res.get('asks') or [])
+            if price > 0:
+                return price
+        except Exception:
+            continue
+    return 0.0
+
+
+def fetch_from_nobitex(budget: float = SOURCE_TIMEOUT) -> float:
+    budget = _Budget(budget)
+    headers = dict(_HEADERS)
+    if NOBITEX_TOKEN:
+        headers['Authorization'] = f"Token {NOBITEX_TOKEN}"
+    try:
+        # Try orderbook variants (prices in Toman)
+        endpoints = [
+            ('GET', 'https://api.nobitex.ir/v2/orderbook/USDTIRT', None),
+            ('GET', 'https://api.nobitex.ir/v2/orderbook/USDT-IRT', None),
+            ('GET', 'https://api.nobitex.ir/v2/orderbook/USDT_IRT', None),
+            ('GET', 'https://api.nobitex.ir/v2/orderbook', {'symbol': 'USDTIRT'}),
+        ]
+        for method, url, params in endpoints:
+            try:
+                r = _request(budget, method, url, headers=headers, params=params)
+                if not r.ok:
+                    continue
+                data = r.json() or {}
+                ob = data.get('orderbook') if isinstance(data, dict) else None
+                price = _best_mid_from_orderbook((ob or data).get('bids') or [], (ob or data).get('asks') or [])
+                if price > 0:
+                    return price
+            except Exception:
+                continue
+        # Fallback to stats (Toman)
+        rs = _request(budget, 'GET', 'https://api.nobitex.ir/v2/stats', headers=headers)
+        if rs.ok:
+            stats = (rs.json() or {}).get('stats') or {}
+            pair = stats.get('USDTIRT') or stats.get('USDT-IRT') or {}
+            p = pair.get('latest') or pair.get('bestSell') or pair.get('average')
+            if p:
+                return float(p)
+        # Legacy market/stats (Rial)
+        rl = _request(
+            budget, 'POST', 'https://api.nobitex.ir/market/stats',
+            json={'srcCurrency': 'usdt', 'dstCurrency': 'rls'},
+            headers={'Content-Type': 'application/json', **headers},
+        )
+        if rl.ok:
+            s2 = (rl.json() or {}).get('stats') or {}
+            usdt = s2.get('usdt-rls') or s2.get('USDT-IRT') or {}
+            p2 = usdt.get('latest') or usdt.get('bestSell') or usdt.get('average')
+            if p2:
+                return float(p2) / 10.0
+    except Exception as e:
+        logger.error(f"Nobitex fetch error: {e}")
+    return 0.0
+
+
+def stub_source(price: float, delay: float = 0.0, fail: bool = False) -> Callable[..., float]:
+    """Offline source returning a fixed quote (for tests and air-gapped installs)"""
+    def _fetch(budget: float = SOURCE_TIMEOUT) -> float:
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise RuntimeError("stub source failure")
+        return float(price)
+    return _fetch
+
+
+DEFAULT_SOURCES: List[Tuple[str, Callable[..., float]]] = [
+    ('nobitex', fetch_from_nobitex),
+    ('wallex', fetch_from_wallex),
+    ('bitpin', fetch_from_bitpin),
+]
+
+
+def _sources_from_env() -> List[Tuple[str, Callable[..., float]]]:
+    """USD_RATE_STUB=<price> replaces the exchange sources with a local stub"""
+    stub = (os.getenv('USD_RATE_STUB') or '').strip()
+    if stub:
+        try:
+            return [('stub', stub_source(float(stub)))]
+        except ValueError:
+            logger.warning(f"Invalid USD_RATE_STUB value: {stub}")
+    return list(DEFAULT_SOURCES)
+
+
+class ExchangeRateService:
+    """In-memory USDT/IRT quote with background refresh and a staleness budget"""
+
+    def __init__(self, sources=None, strategy: str = 'median',
+                 refresh_seconds: int = REFRESH_SECONDS, stale_seconds: int = STALE_SECONDS,
+                 timeout: float = SOURCE_TIMEOUT, persist: bool = True):
+        self.sources = list(sources) if sources is not None else _sources_from_env()
+        self.strategy = strategy  # 'median' of all valid quotes or 'first' valid quote
+        self.refresh_seconds = refresh_seconds
+        self.stale_seconds = stale_seconds
+        self.timeout = timeout
+        self.persist = persist
+        self._price = 0.0
+        self._price_ts = 0.0  # monotonic time of last successful quote
+        self._price_source = ''
+        self._mode: Optional[str] = None  # lazily loaded from settings
+        self._manual = 0.0
+        self._lock = asyncio.Lock()
+        self.last_error = ''
+
+    # --- settings (mode/manual rate) ---
+    def _load_settings(self):
+        from .settings_store import settings_snapshot
+        s = settings_snapshot()
+        self._mode = (s.get('usd_irt_mode') or 'manual').lower()
+        try:
+            self._manual = float(str(s.get('usd_irt_manual') or '').strip() or 0)
+        except ValueError:
+            self._manual = 0.0
+        # Warm the in-memory quote from the last persisted one, keeping its real age
+        if self._price <= 0:
+            try:
+                cached = float(str(s.get('usd_irt_cached') or '').strip() or 0)
+                ts_raw = (s.get('usd_irt_cached_ts') or '').strip()
+                if cached > 0 and ts_raw:
+                    age = (datetime.now() - datetime.fromisoformat(ts_raw)).total_seconds()
+                    self._price = cached
+                    self._price_ts = time.monotonic() - max(0.0, age)
+                    self._price_source = 'db'
+            except Exception:
+                pass
+
+    def invalidate(self, clear_quote: bool = False):
+        """Call after admins change usd_irt_mode/usd_irt_manual or clear the cache"""
+        self._mode = None
+        if clear_quote:
+            self._price = 0.0
+            self._price_ts = 0.0
+            self._price_source = ''
+
+    @property
+    def mode(self) -> str:
+        if self._mode is None:
+            self._load_settings()
+        return self._mode or 'manual'
+
+    @property
+    def manual_rate(self) -> float:
+        if self._mode is None:
+            self._load_settings()
+        return self._manual
+
+    # --- quotes ---
+    def age(self) -> Optional[float]:
+        if self._price <= 0:
+            return None
+        return time.monotonic() - self._price_ts
+
+    def is_stale(self) -> bool:
+        age = self.age()
+        return age is None or age > self.refresh_seconds
+
+    def get_price(self) -> float:
+        """O(1) read used by handlers; never touches the network"""
+        if self.mode == 'manual' and self._manual > 0:
+            return self._manual
+        age = self.age()
+        if age is not None and age <= self.stale_seconds:
+            if age > self.refresh_seconds:
+                logger.debug(f"Serving stale USDT/IRT quote ({int(age)}s old)")
+            return self._price
+        # Live quote missing or past its budget: fall back to the manual rate
+        return self._manual if self._manual > 0 else 0.0
+
+    async def _query_sources(self) -> List[Tuple[str, float]]:
+        # Sources are called with a budget that ends just before the overall deadline,
+        # so their worker threads are done (or give up) by the time we stop waiting
+        budget = max(0.0, self.timeout - 0.2)
+        tasks = {
+            asyncio.ensure_future(asyncio.to_thread(fn, budget)): name
+            for name, fn in self.sources
+        }
+        quotes: List[Tuple[str, float]] = []
+        pending = set(tasks)
+        deadline = time.monotonic() + self.timeout
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    try:
+                        price = float(t.result() or 0)
+                    except Exception as e:
+                        self.last_error = f"{tasks[t]}: {e}"
+                        continue
+                    if price > 0:
+                        quotes.append((tasks[t], price))
+                if quotes and self.strategy == 'first':
+                    break
+        finally:
+            # Threads cannot be interrupted; just stop waiting for them
+            for t in pending:
+                t.cancel()
+        return quotes
+
+    async def refresh(self) -> float:
+        """Query all sources concurrently and store the aggregated quote"""
+        async with self._lock:
+            quotes = await self._query_sources()
+            if not quotes:
+                logger.warning(f"USDT/IRT refresh failed on all sources ({self.last_error or 'no quote'})")
+                return 0.0
+            if self.strategy == 'first':
+                source, price = quotes[0]
+            else:
+                price = statistics.median(p for _, p in quotes)
+                source = ','.join(n for n, _ in quotes)
+            self._price = price
+            self._price_ts = time.monotonic()
+            self._price_source = source
+            if self.persist:
+                await asyncio.to_thread(self._persist, price)
+            return price
+
+    @staticmethod
+    def _persist(price: float):
+        from .settings_store import set_settings
+        set_settings({
+            'usd_irt_cached': str(int(price)),
+            'usd_irt_cached_ts': datetime.now().isoformat(timespec='seconds'),
+        })
+
+    def status(self) -> dict:
+        age = self.age()
+        return {
+            'mode': self.mode,
+            'price': self._price,
+            'source': self._price_source,
+            'age_seconds': int(age) if age is not None else None,
+            'stale': self.is_stale(),
+            'manual': self._manual,
+            'last_error': self.last_error,
+        }
+
+
+_service: Optional[ExchangeRateService] = None
+
+
+def get_rate_service() -> ExchangeRateService:
+    global _service
+    if _service is None:
+        _service = ExchangeRateService()
+    return _service
+
+
+def get_usdt_irt_price() -> float:
+    return get_rate_service().get_price()
+
+
+async def refresh_usd_rate_job(context):
+    """Job-queue callback keeping the in-memory quote warm"""
+    service = get_rate_service()
+    try:
+        # Re-read mode/manual rate so edits made outside the admin menu are picked up
+        service.invalidate()
+        if service.mode == 'manual' and service.manual_rate > 0:
+            return
+        await service.refresh()
+    except Exception as e:
+        logger.error(f"USD rate refresh job error: {e}")
@@ -4,10 +4,8 @@ import io
 import csv
 import sqlite3
 from datetime import datetime
-import base64
-import requests
 import json as _json
-from urllib.parse import urlsplit, quote as _urlquote
+from urllib.parse import urlsplit
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, User
 from telegram.constants import ParseMode, ChatAction
 from telegram.error import TelegramError, Forbidden, BadRequest
@@ -20,7 +18,16 @@ from uuid import uuid4
 
 from ..config import ADMIN_ID, logger
 from ..db import query_db, execute_db, get_message_text
-from ..panel import VpnPanelAPI
+from ..settings_store import get_setting, set_setting, set_settings, settings_snapshot
+from ..panel import VpnPanelAPI, fetch_user_configs
+from ..panel_inbound import parse_inbound
+from ..config_links import DIALECT_SHARE, link_template
+from ..subscription_fetcher import fetch_subscription_configs
+from ..approval_queue import (
+    ApprovalJob, RetryableError, ensure_panel_ready, get_approval_queue, is_pre_send_failure, run_panel_call,
+    JOB_QUEUED, JOB_RUNNING, JOB_RETRY, JOB_DONE, JOB_FAILED, SUBMIT_DUPLICATE, SUBMIT_ALREADY_DONE,
+)
+from ..exchange_rate import get_rate_service
 from ..utils import register_new_user
 from ..states import *
 from .renewal import process_renewal_for_order
@@ -68,8 +75,8 @@ async def admin_set_trial_inbound_start(update: Update, context: ContextTypes.DE
         "اینباندی را انتخاب کنید تا کانفیگ‌های تست روی همان اینباند ساخته شوند."
     )
     # Choose panel first: use selected free_trial_panel_id or ask user to pick if not set
-    sel = query_db("SELECT value FROM settings WHERE key='free_trial_panel_id'", one=True)
-    panel_id = int((sel.get('value') or 0)) if sel and str(sel.get('value') or '').isdigit() else None
+    sel = str(get_setting('free_trial_panel_id') or '')
+    panel_id = int(sel) if sel.isdigit() else None
     if not panel_id:
         await _safe_edit_text(query.message, "ابتدا از گزینه 'انتخاب پنل ساخت تست' یک پنل انتخاب کنید.")
         return SETTINGS_MENU
@@ -103,46 +110,10 @@ async def admin_set_trial_inbound_choose(update: Update, context: ContextTypes.D
         await query.answer("شناسه نامعتبر", show_alert=True)
         return SETTINGS_MENU
     # Persist setting
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('free_trial_inbound_id', ?)", (inbound_id,))
+    set_setting('free_trial_inbound_id', inbound_id)
     await query.answer("اینباند تست ذخیره شد", show_alert=True)
     return await admin_settings_manage(update, context)
 
-def _fetch_subscription_configs(sub_url: str, timeout_seconds: int = 15) -> list[str]:
-    """Fetch subscription content and return a list of config URIs.
-
-    Supports plain-text lists and base64-encoded payloads. Filters known URI schemes.
-    """
-    try:
-        headers = {
-            'Accept': 'text/plain, application/octet-stream, */*',
-            'User-Agent': 'Mozilla/5.0',
-        }
-        resp = requests.get(sub_url, headers=headers, timeout=timeout_seconds)
-        resp.raise_for_status()
-        raw_text = (resp.text or '').strip()
-        if any(proto in raw_text for proto in ("vmess://", "vless://", "trojan://", "ss://", "hy2://")):
-            text = raw_text
-        else:
-            # Try base64 decode when content does not directly contain URIs
-            b = raw_text.strip()
-            # Remove whitespace and fix padding
-            compact = "".join(b.split())
-            missing = len(compact) % 4
-            if missing:
-                compact += "=" * (4 - missing)
-            try:
-                decoded = base64.b64decode(compact, validate=False)
-                text = decoded.decode('utf-8', errors='ignore')
-            except Exception:
-                text = raw_text
-        lines = [ln.strip() for ln in (text or '').splitlines()]
-        configs = [ln for ln in lines if ln and ln.split(':', 1)[0] in ("vmess", "vless", "trojan", "ss", "hy2") and 
-                   (ln.startswith("vmess://") or ln.startswith("vless://") or ln.startswith("trojan://") or ln.startswith("ss://") or ln.startswith("hy2://"))]
-        return configs
-    except Exception as e:
-        logger.error(f"Failed to fetch/parse subscription from {sub_url}: {e}")
-        return []
-
 def _infer_origin_host(panel_row: dict) -> str:
     try:
         base = (panel_row.get('sub_base') or panel_row.get('url') or '').strip()
@@ -162,140 +133,14 @@ def _build_configs_from_inbound(inbound: dict, username: str, panel_row: dict) -
     This avoids relying on subscription fetches for X-UI-like panels.
     """
     try:
-        settings_str = inbound.get('settings')
-        try:
-            settings = _json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-        except Exception:
-            settings = {}
-        clients = settings.get('clients') or []
-        if not isinstance(clients, list):
-            return []
-        client = None
-        for c in clients:
-            if c.get('email') == username:
-                client = c
-                break
-        if not client:
+        parsed = parse_inbound(inbound)
+        found = parsed.by_email.get(username)
+        if found is None:
             return []
-
-        protocol = (inbound.get('protocol') or '').lower()
-        port = inbound.get('port') or inbound.get('listen_port') or 0
-        remark = inbound.get('remark') or inbound.get('tag') or username
-
-        stream = {}
-        try:
-            stream = _json.loads(inbound.get('streamSettings')) if isinstance(inbound.get('streamSettings'), str) else (inbound.get('streamSettings') or {})
-        except Exception:
-            stream = inbound.get('streamSettings') or {}
-
-        network = (stream.get('network') or 'tcp').lower()
-        security = (stream.get('security') or 'none').lower()
-        tls_obj = stream.get('tlsSettings') or {}
-        reality_obj = stream.get('realitySettings') or {}
-        ws_obj = stream.get('wsSettings') or {}
-        grpc_obj = stream.get('grpcSettings') or {}
-        tcp_obj = stream.get('tcpSettings') or {}
-
         host = _infer_origin_host(panel_row) or (urlsplit(panel_row.get('url','')).hostname or '')
         if not host:
             return []
-
-        def _build_vless() -> str:
-            uuid = client.get('id') or client.get('uuid') or ''
-            if not uuid:
-                return ''
-            params = ["encryption=none"]
-            # stream params
-            if network == 'ws':
-                path = ws_obj.get('path') or '/'
-                host_header = (ws_obj.get('headers') or {}).get('Host') or host
-                params += [f"type=ws", f"path={_urlquote(path)}", f"host={_urlquote(host_header)}"]
-            elif network == 'grpc':
-                service = grpc_obj.get('serviceName') or ''
-                if service:
-                    params += ["type=grpc", f"serviceName={_urlquote(service)}", "mode=gun"]
-            else:
-                # tcp: support HTTP header with host/path if present
-                params += [f"type={network}"]
-                try:
-                    header = (tcp_obj.get('header') or {})
-                    htype = (header.get('type') or '').lower()
-                    if htype == 'http':
-                        # path
-                        req = header.get('request') or {}
-                        paths = req.get('path') or ['/']
-                        if isinstance(paths, list) and paths:
-                            params.append(f"path={_urlquote(str(paths[0]) or '/')}")
-                        # host header may be list
-                        hdrs = req.get('headers') or {}
-                        hh = hdrs.get('Host') or hdrs.get('host') or []
-                        if isinstance(hh, list) and hh:
-                            params.append(f"host={_urlquote(str(hh[0]))}")
-                        elif isinstance(hh, str) and hh:
-                            params.append(f"host={_urlquote(hh)}")
-                        params.append("headerType=http")
-                except Exception:
-                    pass
-            # security
-            if security in ('tls', 'xtls'):
-                sni = tls_obj.get('serverName') or host
-                alpn = tls_obj.get('alpn')
-                params += ["security=tls", f"sni={_urlquote(sni)}"]
-                if isinstance(alpn, list) and alpn:
-                    params.append(f"alpn={_urlquote(','.join(alpn))}")
-                params.append("fp=chrome")
-            elif security == 'reality':
-                sni = (reality_obj.get('serverNames') or [host])[0]
-                pbk = reality_obj.get('publicKey') or ''
-                sid = (reality_obj.get('shortId') or '')
-                params += ["security=reality", f"sni={_urlquote(sni)}"]
-                if pbk:
-                    params.append(f"pbk={_urlquote(pbk)}")
-                if sid:
-                    params.append(f"sid={_urlquote(sid)}")
-                params.append("fp=chrome")
-            else:
-                params.append("security=none")
-            # assemble
-            query = '&'.join(params)
-            return f"vless://{uuid}@{host}:{int(port)}?{query}#{_urlquote(str(remark))}"
-
-        def _build_vmess() -> str:
-            uuid = client.get('id') or client.get('uuid') or ''
-            if not uuid:
-                return ''
-            vmess_obj = {
-                'v': '2',
-                'ps': str(remark),
-                'add': host,
-                'port': str(int(port)),
-                'id': uuid,
-                'aid': '0',
-                'net': network,
-                'type': 'none',
-                'host': '',
-                'path': '',
-                'tls': 'tls' if security in ('tls','xtls') else '',
-                'sni': tls_obj.get('serverName') or '',
-            }
-            if network == 'ws':
-                vmess_obj['path'] = ws_obj.get('path') or '/'
-                vmess_obj['host'] = (ws_obj.get('headers') or {}).get('Host') or host
-            data = _json.dumps(vmess_obj, separators=(',',':'), ensure_ascii=False).encode('utf-8')
-            b64 = base64.b64encode(data).decode('utf-8')
-            return f"vmess://{b64}"
-
-        configs: list[str] = []
-        if protocol == 'vless':
-            c = _build_vless()
-            if c:
-                configs.append(c)
-        elif protocol == 'vmess':
-            c = _build_vmess()
-            if c:
-                configs.append(c)
-        # Could extend to trojan if needed
-        return configs
+        return link_template(parsed, host, DIALECT_SHARE).render(found.raw, username)
     except Exception as e:
         logger.error(f"Failed to build configs from inbound: {e}")
         return []
@@ -430,10 +275,9 @@ async def admin_toggle_bot_active(update: Update, context: ContextTypes.DEFAULT_
 >>>>>>> origin/master
     
     try:
-        cur = query_db("SELECT value FROM settings WHERE key='bot_active'", one=True)
-        current = (cur or {}).get('value') or '1'
+        current = get_setting('bot_active') or '1'
         new_val = '0' if str(current) == '1' else '1'
-        execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('bot_active', ?)", (new_val,))
+        set_setting('bot_active', new_val)
         status = "روشن" if new_val == '1' else "خاموش"
         logger.info(f"Bot status toggled to: {status} (value={new_val})")
 <<<<<<< HEAD
@@ -551,31 +395,102 @@ async def admin_ask_panel_for_approval(update: Update, context: ContextTypes.DEF
     await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(keyboard))
 
 
+def _load_approval_order(job: ApprovalJob):
+    """Order, plan and panel for an approval job; refuses orders that are no longer pending"""
+    order = query_db("SELECT * FROM orders WHERE id = ?", (job.order_id,), one=True)
+    if not order:
+        raise ValueError("سفارش یافت نشد.")
+    if order.get('status') != 'pending':
+        raise ValueError("این سفارش قبلاً بررسی شده است.")
+    plan = query_db("SELECT * FROM plans WHERE id = ?", (order['plan_id'],), one=True)
+    if not plan:
+        raise ValueError("پلن این سفارش یافت نشد.")
+    panel_row = query_db("SELECT * FROM panels WHERE id = ?", (job.panel_id,), one=True)
+    if not panel_row:
+        raise ValueError("پنل انتخاب‌شده یافت نشد.")
+    return order, plan, panel_row
+
+
+def _approval_status_line(job: ApprovalJob) -> str:
+    queue = get_approval_queue()
+    if job.state == JOB_QUEUED:
+        pos = queue.position(job)
+        return f"\u23F3 در صف ساخت (نوبت {pos})" if pos else "\u23F3 در صف ساخت"
+    if job.state == JOB_RUNNING:
+        stage = f": {job.stage}" if job.stage else "..."
+        return f"\u2699\uFE0F در حال انجام{stage} (تلاش {job.attempts}/{queue.max_attempts})"
+    if job.state == JOB_RETRY:
+        return f"\U0001F501 تلاش {job.attempts} ناموفق بود، تلاش مجدد به زودی...\n<code>{html_escape(str(job.error or ''))}</code>"
+    if job.state == JOB_DONE:
+        return job.result or "\u2705 **انجام شد.**"
+    return f"\u274C **خطا در ساخت سرویس:**\n<code>{html_escape(str(job.error or ''))}</code>"
+
+
+def _order_progress(message, base_text: str, is_media: bool):
+    """Progress callback that keeps the order message in sync with its approval job"""
+    lock = asyncio.Lock()
+
+    async def progress(job: ApprovalJob):
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("\U0001F519 بازگشت", callback_data='admin_main')]]) if job.finished else None
+        text = base_text + "\n\n" + _approval_status_line(job)
+        async with lock:
+            if is_media:
+                await _safe_edit_caption(message, text, parse_mode=ParseMode.HTML, reply_markup=markup)
+            else:
+                await _safe_edit_text(message, text, parse_mode=ParseMode.HTML, reply_markup=markup)
+    return progress
+
+
+async def _submit_approval(query, context, order_id: int, panel_id: int, inbound_id, base_text: str, is_media: bool) -> bool:
+    """Queue provisioning of an order and acknowledge at once; True if the job was queued"""
+    runner = _provision_inbound_order if inbound_id is not None else _provision_panel_order
+    job = ApprovalJob(
+        order_id, panel_id,
+        run=lambda j: runner(j, context),
+        progress=_order_progress(query.message, base_text, is_media),
+        inbound_id=inbound_id,
+    )
+    outcome = get_approval_queue().submit(job)
+    if outcome == SUBMIT_DUPLICATE:
+        await answer_safely(query, "این سفارش در حال پردازش است.", show_alert=True)
+        return False
+    if outcome == SUBMIT_ALREADY_DONE:
+        await answer_safely(query, "این سفارش قبلاً ساخته شده است.", show_alert=True)
+        return False
+    await answer_safely(query, "در صف ساخت قرار گرفت.")
+    await job.progress(job)
+    return True
+
+
 async def admin_approve_on_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer("در حال ساخت کانفیگ...")
     *_, order_id, panel_id = query.data.split('_')
     order_id, panel_id = int(order_id), int(panel_id)
 
-    order = query_db("SELECT * FROM orders WHERE id = ?", (order_id,), one=True)
-    plan = query_db("SELECT * FROM plans WHERE id = ?", (order['plan_id'],), one=True)
-    panel_row = query_db("SELECT * FROM panels WHERE id = ?", (panel_id,), one=True)
+    panel_row = query_db("SELECT * FROM panels WHERE id = ?", (panel_id,), one=True) or {}
 
     is_media = bool(query.message.photo or query.message.video or query.message.document)
     base_text = query.message.caption_html if is_media else (query.message.text_html or query.message.text or '')
-    progress_text = base_text + "\n\n\u23F3 در حال ساخت کانفیگ..."
-    if is_media:
-        await _safe_edit_caption(query.message, progress_text, parse_mode=ParseMode.HTML, reply_markup=None)
-    else:
-        await _safe_edit_text(query.message, progress_text, parse_mode=ParseMode.HTML, reply_markup=None)
 
     # Branch based on panel type
     ptype = (panel_row.get('panel_type') or 'marzban').lower()
-    api = VpnPanelAPI(panel_id=panel_id)
 
     if ptype in ('xui', 'x-ui', 'sanaei', 'alireza', '3xui', '3x-ui', 'txui', 'tx-ui', 'sui', 's-ui'):
+        await query.answer("در حال دریافت اینباندها...")
+        progress_text = base_text + "\n\n\u23F3 در حال دریافت لیست اینباندها..."
+        if is_media:
+            await _safe_edit_caption(query.message, progress_text, parse_mode=ParseMode.HTML, reply_markup=None)
+        else:
+            await _safe_edit_text(query.message, progress_text, parse_mode=ParseMode.HTML, reply_markup=None)
+        api = VpnPanelAPI(panel_id=panel_id)
         # Step 1: show inbound list to admin
-        inbounds, msg = api.list_inbounds() if hasattr(api, 'list_inbounds') else (None, 'Not supported')
+        if hasattr(api, 'list_inbounds'):
+            try:
+                inbounds, msg = await asyncio.to_thread(api.list_inbounds)
+            except Exception as e:
+                inbounds, msg = None, str(e)
+        else:
+            inbounds, msg = None, 'Not supported'
         if not inbounds:
             safe = html_escape(str(msg))
             err_text = base_text + f"\n\n<b>خطای پنل:</b>\n<code>{safe}</code>"
@@ -593,57 +508,164 @@ async def admin_approve_on_panel(update: Update, context: ContextTypes.DEFAULT_T
         await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(kb))
         return
 
-    # Default Marzban/Marzneshin flow: only send subscription link
-    marzban_username, config_link, message = await api.create_user(order['user_id'], plan)
-    if config_link and marzban_username:
-        execute_db("UPDATE orders SET status = 'approved', marzban_username = ?, panel_id = ?, panel_type = ? WHERE id = ?", (marzban_username, panel_id, (panel_row.get('panel_type') or 'marzban').lower(), order_id))
-        if order.get('discount_code'):
-            execute_db("UPDATE discount_codes SET times_used = times_used + 1 WHERE code = ?", (order['discount_code'],))
-        # Apply referral bonus
-        await _apply_referral_bonus(order_id, context)
-        cfg = query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True)
-        footer = (cfg.get('value') if cfg else '') or ''
-        # Always send ONLY subscription link for Marzban/Marzneshin
-        final_message = (
-            f"✅ سفارش شما تایید شد!\n\n"
-            f"<b>پلن:</b> {plan['name']}\n"
-            f"<b>لینک اشتراک شما:</b>\n<code>{config_link}</code>\n\n" + footer
+    # Default Marzban/Marzneshin flow: only send subscription link, as a background job
+    await _submit_approval(query, context, order_id, panel_id, None, base_text, is_media)
+
+
+async def _send_post_purchase_menu(context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Congratulation message with quick actions, then the main menu a moment later"""
+    try:
+        # First send the congratulations message with quick actions
+        keyboard = [
+            [InlineKeyboardButton("📱 سرویس‌های من", callback_data='my_services')],
+            [InlineKeyboardButton("📖 آموزش اتصال", callback_data='tutorials_menu'), InlineKeyboardButton("💬 پشتیبانی", callback_data='support_menu')],
+            [InlineKeyboardButton("🏠 منوی اصلی", callback_data='start_main')]
+        ]
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=(
+                "🎉 <b>تبریک! سرویس شما آماده است</b>\n\n"
+                "✨ لینک اشتراک و QR Code شما ارسال شد\n"
+                "📚 برای اتصال، دکمه «آموزش اتصال» را بزنید\n"
+                "🔄 می‌توانید از منوی «سرویس‌های من» وضعیت سرویس را مشاهده کنید\n\n"
+                "❓ سوالی دارید؟ از پشتیبانی کمک بگیرید"
+            ),
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=ParseMode.HTML
         )
+
+        # Send main menu automatically after 2 seconds
+        await asyncio.sleep(2)
+
+        # Import and call start_command to show main menu
+        from .common import start_command
+        # Create a fake update object to trigger start_command
+        class FakeUser:
+            def __init__(self, user_id, first_name=""):
+                self.id = user_id
+                self.first_name = first_name
+                self.username = None
+                self.is_bot = False
+
+        class FakeMessage:
+            def __init__(self, chat_id, user):
+                self.chat_id = chat_id
+                self.from_user = user
+                self.text = "/start"
+
+            async def reply_text(self, text, **kwargs):
+                await context.bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+
+        fake_user = FakeUser(user_id)
+        fake_message = FakeMessage(user_id, fake_user)
+
+        fake_update = type('obj', (object,), {
+            'effective_user': fake_user,
+            'message': fake_message,
+            'callback_query': None
+        })()
+
+        await start_command(fake_update, context)
+
+    except Exception as e:
         try:
-            # Send a stylish QR code of subscription link if available
-            sent_qr = False
-            if config_link:
-                try:
-                    from ..helpers.tg import build_styled_qr
-                    buf = build_styled_qr(config_link)
-                    if buf:
-                        await context.bot.send_photo(chat_id=order['user_id'], photo=buf, caption=("\U0001F517 لینک اشتراک شما:\n" + ltr_code(config_link)), parse_mode=ParseMode.HTML)
-                        sent_qr = True
-                except Exception as e:
-                    try:
-                        logger.warning(f"QR styled send failed (approve_on_panel): {e}")
-                    except Exception:
-                        pass
-                    sent_qr = False
-            # Fallback to simple QR if styled QR failed
-            if not sent_qr and config_link:
-                try:
-                    import qrcode, io as _io
-                    _b = _io.BytesIO(); qrcode.make(config_link).save(_b, format='PNG'); _b.seek(0)
-                    await context.bot.send_photo(chat_id=order['user_id'], photo=_b, caption=("\U0001F517 لینک اشتراک شما:\n" + ltr_code(config_link)), parse_mode=ParseMode.HTML)
+            logger.error(f"Error sending post-purchase menu: {e}")
+        except:
+            pass
+
+
+async def _provision_panel_order(job: ApprovalJob, context: ContextTypes.DEFAULT_TYPE):
+    """Approval job for Marzban/Marzneshin: create the user and send the subscription link"""
+    order, plan, panel_row = _load_approval_order(job)
+    order_id, panel_id = job.order_id, job.panel_id
+    api = VpnPanelAPI(panel_id=panel_id)
+    await ensure_panel_ready(panel_id, api)
+    await job.report("ساخت کاربر در پنل")
+    try:
+        marzban_username, config_link, message = await run_panel_call(api.create_user, order['user_id'], plan)
+    except Exception as e:
+        # Past this point the panel may already have created the user: no automatic retry
+        if is_pre_send_failure(e):
+            raise RetryableError(str(e))
+        raise
+    if not (config_link and marzban_username):
+        raise ValueError(str(message or "ساخت کاربر در پنل ناموفق بود"))
+    execute_db("UPDATE orders SET status = 'approved', marzban_username = ?, panel_id = ?, panel_type = ? WHERE id = ?", (marzban_username, panel_id, (panel_row.get('panel_type') or 'marzban').lower(), order_id))
+    if order.get('discount_code'):
+        execute_db("UPDATE discount_codes SET times_used = times_used + 1 WHERE code = ?", (order['discount_code'],))
+    # Apply referral bonus
+    await _apply_referral_bonus(order_id, context)
+    footer = get_setting('config_footer_text') or ''
+    # Always send ONLY subscription link for Marzban/Marzneshin
+    final_message = (
+        f"✅ سفارش شما تایید شد!\n\n"
+        f"<b>پلن:</b> {plan['name']}\n"
+        f"<b>لینک اشتراک شما:</b>\n<code>{config_link}</code>\n\n" + footer
+    )
+    await job.report("ارسال به کاربر")
+    try:
+        # Send a stylish QR code of subscription link if available
+        sent_qr = False
+        if config_link:
+            try:
+                from ..helpers.tg import build_styled_qr
+                buf = build_styled_qr(config_link)
+                if buf:
+                    await context.bot.send_photo(chat_id=order['user_id'], photo=buf, caption=("\U0001F517 لینک اشتراک شما:\n" + ltr_code(config_link)), parse_mode=ParseMode.HTML)
                     sent_qr = True
+            except Exception as e:
+                try:
+                    logger.warning(f"QR styled send failed (approve_on_panel): {e}")
                 except Exception:
-                    sent_qr = False
-            if not sent_qr:
-                await context.bot.send_message(order['user_id'], final_message, parse_mode=ParseMode.HTML)
-            # Purchase log to configured chat if enabled
+                    pass
+                sent_qr = False
+        # Fallback to simple QR if styled QR failed
+        if not sent_qr and config_link:
             try:
-                st = query_db("SELECT key, value FROM settings WHERE key IN ('purchase_logs_enabled','purchase_logs_chat_id')") or []
-                kv = {r['key']: r['value'] for r in st}
-                if (kv.get('purchase_logs_enabled') or '0') == '1':
-                    raw = (kv.get('purchase_logs_chat_id') or '').strip()
-                    log_chat = raw if raw.startswith('@') else (int(raw) if (raw and raw.lstrip('-').isdigit()) else 0)
-                    if log_chat:
+                import qrcode, io as _io
+                _b = _io.BytesIO(); qrcode.make(config_link).save(_b, format='PNG'); _b.seek(0)
+                await context.bot.send_photo(chat_id=order['user_id'], photo=_b, caption=("\U0001F517 لینک اشتراک شما:\n" + ltr_code(config_link)), parse_mode=ParseMode.HTML)
+                sent_qr = True
+            except Exception:
+                sent_qr = False
+        if not sent_qr:
+            await context.bot.send_message(order['user_id'], final_message, parse_mode=ParseMode.HTML)
+        # Purchase log to configured chat if enabled
+        try:
+            kv = settings_snapshot()
+            if (kv.get('purchase_logs_enabled') or '0') == '1':
+                raw = (kv.get('purchase_logs_chat_id') or '').strip()
+                log_chat = raw if raw.startswith('@') else (int(raw) if (raw and raw.lstrip('-').isdigit()) else 0)
+                if log_chat:
+                    from datetime import datetime
+                    ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    amount = int(plan.get('price') or 0)
+                    dc = order.get('discount_code') or '-'
+                    text = (
+                        f"🧾 خرید سرویس\n"
+                        f"کاربر: `{order['user_id']}`\n"
+                        f"پلن: {plan['name']}\n"
+                        f"مبلغ: {amount:,} تومان\n"
+                        f"کد تخفیف: {dc}\n"
+                        f"زمان: `{ts}`"
+                    )
+                    try:
+                        await context.bot.send_message(chat_id=log_chat, text=text, parse_mode=ParseMode.MARKDOWN)
+                    except Exception as e:
+                        try:
+                            logger.warning(f"purchase log send failed to '{raw}' ({log_chat}): {e}")
+                        except Exception:
+                            pass
+                        # Fallback: DM to admins
+                        try:
+                            from ..helpers.tg import notify_admins as _notify
+                            await _notify(context.bot, text=("[Log delivery fallback]\n" + text), parse_mode=ParseMode.MARKDOWN)
+                        except Exception:
+                            pass
+                else:
+                    # No configured chat -> DM to admins
+                    try:
+                        from ..helpers.tg import notify_admins as _notify
                         from datetime import datetime
                         ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                         amount = int(plan.get('price') or 0)
@@ -656,182 +678,54 @@ async def admin_approve_on_panel(update: Update, context: ContextTypes.DEFAULT_T
                             f"کد تخفیف: {dc}\n"
                             f"زمان: `{ts}`"
                         )
-                        try:
-                            await context.bot.send_message(chat_id=log_chat, text=text, parse_mode=ParseMode.MARKDOWN)
-                        except Exception as e:
-                            try:
-                                logger.warning(f"purchase log send failed to '{raw}' ({log_chat}): {e}")
-                            except Exception:
-                                pass
-                            # Fallback: DM to admins
-                            try:
-                                from ..helpers.tg import notify_admins as _notify
-                                await _notify(context.bot, text=("[Log delivery fallback]\n" + text), parse_mode=ParseMode.MARKDOWN)
-                            except Exception:
-                                pass
-                    else:
-                        # No configured chat -> DM to admins
-                        try:
-                            from ..helpers.tg import notify_admins as _notify
-                            from datetime import datetime
-                            ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            amount = int(plan.get('price') or 0)
-                            dc = order.get('discount_code') or '-'
-                            text = (
-                                f"🧾 خرید سرویس\n"
-                                f"کاربر: `{order['user_id']}`\n"
-                                f"پلن: {plan['name']}\n"
-                                f"مبلغ: {amount:,} تومان\n"
-                                f"کد تخفیف: {dc}\n"
-                                f"زمان: `{ts}`"
-                            )
-                            await _notify(context.bot, text=("[Log delivery fallback]\n" + text), parse_mode=ParseMode.MARKDOWN)
-                        except Exception:
-                            pass
-            except Exception:
-                pass
-            # Send interactive menu and return to main menu automatically
-            try:
-                # First send the congratulations message with quick actions
-                keyboard = [
-                    [InlineKeyboardButton("📱 سرویس‌های من", callback_data='my_services')],
-                    [InlineKeyboardButton("📖 آموزش اتصال", callback_data='tutorials_menu'), InlineKeyboardButton("💬 پشتیبانی", callback_data='support_menu')],
-                    [InlineKeyboardButton("🏠 منوی اصلی", callback_data='start_main')]
-                ]
-                await context.bot.send_message(
-                    chat_id=order['user_id'],
-                    text=(
-                        "🎉 <b>تبریک! سرویس شما آماده است</b>\n\n"
-                        "✨ لینک اشتراک و QR Code شما ارسال شد\n"
-                        "📚 برای اتصال، دکمه «آموزش اتصال» را بزنید\n"
-                        "🔄 می‌توانید از منوی «سرویس‌های من» وضعیت سرویس را مشاهده کنید\n\n"
-                        "❓ سوالی دارید؟ از پشتیبانی کمک بگیرید"
-                    ),
-                    reply_markup=InlineKeyboardMarkup(keyboard),
-                    parse_mode=ParseMode.HTML
-                )
-                
-                # Send main menu automatically after 2 seconds
-                import asyncio
-                await asyncio.sleep(2)
-                
-                # Import and call start_command to show main menu
-                from .common import start_command
-                from telegram import Update
-                # Create a fake update object to trigger start_command
-                class FakeUser:
-                    def __init__(self, user_id, first_name=""):
-                        self.id = user_id
-                        self.first_name = first_name
-                        self.username = None
-                        self.is_bot = False
-                
-                class FakeMessage:
-                    def __init__(self, chat_id, user):
-                        self.chat_id = chat_id
-                        self.from_user = user
-                        self.text = "/start"
-                        
-                    async def reply_text(self, text, **kwargs):
-                        await context.bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
-                
-                fake_user = FakeUser(order['user_id'])
-                fake_message = FakeMessage(order['user_id'], fake_user)
-                
-                fake_update = type('obj', (object,), {
-                    'effective_user': fake_user,
-                    'message': fake_message,
-                    'callback_query': None
-                })()
-                
-                await start_command(fake_update, context)
-                
-            except Exception as e:
-                try:
-                    logger.error(f"Error sending post-purchase menu: {e}")
-                except:
-                    pass
-            done_text = base_text + f"\n\n\u2705 **ارسال خودکار موفق بود.**"
-            if is_media:
-                await _safe_edit_caption(query.message, done_text, parse_mode=ParseMode.HTML, reply_markup=None)
-            else:
-                await _safe_edit_text(query.message, done_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        except TelegramError as e:
-            err_text = base_text + f"\n\n\u26A0\uFE0F **خطا:** ارسال به کاربر ناموفق بود. {e}\nکانفیگ: <code>{config_link}</code>"
-            if is_media:
-                await _safe_edit_caption(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-            else:
-                await _safe_edit_text(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-    else:
-        fail_text = base_text + f"\n\n\u274C **خطای پنل:** `{message}`"
-        if is_media:
-            await _safe_edit_caption(query.message, fail_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        else:
-            await _safe_edit_text(query.message, fail_text, parse_mode=ParseMode.HTML, reply_markup=None)
+                        await _notify(context.bot, text=("[Log delivery fallback]\n" + text), parse_mode=ParseMode.MARKDOWN)
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+        # Menu follow-up runs on its own task so it does not hold an approval worker
+        context.application.create_task(_send_post_purchase_menu(context, order['user_id']))
+    except TelegramError as e:
+        return f"\u26A0\uFE0F **خطا:** ارسال به کاربر ناموفق بود. {e}\nکانفیگ: <code>{config_link}</code>"
+    return "\u2705 **ارسال خودکار موفق بود.**"
 
 
 async def admin_xui_choose_inbound(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer("در حال ساخت کلاینت روی اینباند انتخابی...")
     _, _, order_id, panel_id, inbound_id = query.data.split('_', 4)
     order_id, panel_id = int(order_id), int(panel_id)
-    # Capture current message meta for later edits
     is_media = bool(query.message.photo or query.message.video or query.message.document)
     base_text = query.message.caption_html if is_media else (query.message.text_html or query.message.text or '')
+    if await _submit_approval(query, context, order_id, panel_id, int(inbound_id), base_text, is_media):
+        # Exit selection mode
+        context.user_data.pop('pending_xui', None)
 
-    order = query_db("SELECT * FROM orders WHERE id = ?", (order_id,), one=True)
-    if not order:
-        err_text = base_text + "\n\n\u274C سفارش یافت نشد."
-        if is_media:
-            await _safe_edit_caption(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        else:
-            await _safe_edit_text(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        try:
-            await query.message.edit_reply_markup(reply_markup=None)
-        except Exception:
-            pass
-        return
-    plan = query_db("SELECT * FROM plans WHERE id = ?", (order['plan_id'],), one=True)
 
+async def _provision_inbound_order(job: ApprovalJob, context: ContextTypes.DEFAULT_TYPE):
+    """Approval job for X-UI style panels: create the client on the chosen inbound and send its config"""
+    order, plan, panel_row = _load_approval_order(job)
+    order_id, panel_id, inbound_id = job.order_id, job.panel_id, job.inbound_id
     api = VpnPanelAPI(panel_id=panel_id)
     if not hasattr(api, 'create_user_on_inbound'):
-        err_text = base_text + "\n\n\u274C این نوع پنل از ساخت بر اساس اینباند پشتیبانی نمی‌کند."
-        if is_media:
-            await _safe_edit_caption(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        else:
-            await _safe_edit_text(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        try:
-            await query.message.edit_reply_markup(reply_markup=None)
-        except Exception:
-            pass
-        return
-
-    username, sub_link, msg = None, None, None
+        raise ValueError("این نوع پنل از ساخت بر اساس اینباند پشتیبانی نمی‌کند.")
+    await ensure_panel_ready(panel_id, api)
+    await job.report("ساخت کلاینت روی اینباند")
     try:
-        username, sub_link, msg = api.create_user_on_inbound(inbound_id, order['user_id'], plan)
+        username, sub_link, msg = await run_panel_call(api.create_user_on_inbound, inbound_id, order['user_id'], plan)
     except Exception as e:
-        username, sub_link, msg = None, None, str(e)
-    
+        # Past this point the panel may already have created the client: no automatic retry
+        if is_pre_send_failure(e):
+            raise RetryableError(str(e))
+        raise
     if not sub_link or not username:
-        safe = html_escape(str(msg))
-        err_text = base_text + f"\n\n<b>خطای پنل:</b>\n<code>{safe}</code>"
-        if is_media:
-            await _safe_edit_caption(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        else:
-            await _safe_edit_text(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        try:
-            await query.message.edit_reply_markup(reply_markup=None)
-        except Exception:
-            pass
-        return
+        raise ValueError(str(msg or "ساخت کلاینت ناموفق بود"))
 
     # Build direct configs from inbound where possible; fallback to fetching sub content
-    panel_row = query_db("SELECT * FROM panels WHERE id = ?", (panel_id,), one=True)
     execute_db("UPDATE orders SET status = 'approved', marzban_username = ?, panel_id = ?, panel_type = ?, xui_inbound_id = ? WHERE id = ?", (username, panel_id, (panel_row.get('panel_type') or 'marzban').lower(), int(inbound_id), order_id))
     if order.get('discount_code'):
         execute_db("UPDATE discount_codes SET times_used = times_used + 1 WHERE code = ?", (order['discount_code'],))
 
-    inbound_detail = getattr(api, '_fetch_inbound_detail', lambda _id: None)(int(inbound_id))
+    inbound_detail = await asyncio.to_thread(getattr(api, '_fetch_inbound_detail', lambda _id: None), int(inbound_id))
     built_confs = []
     if inbound_detail:
         try:
@@ -840,17 +734,17 @@ async def admin_xui_choose_inbound(update: Update, context: ContextTypes.DEFAULT
             built_confs = []
     # If none, try decoding subscription
     if not built_confs:
-        built_confs = _fetch_subscription_configs(sub_link)
+        built_confs = await fetch_subscription_configs(sub_link)
     # As an extra attempt (but still ensure single output), try API helper only if still empty
     api_confs = []
     if not built_confs and hasattr(api, 'get_configs_for_user_on_inbound'):
         try:
-            api_confs = api.get_configs_for_user_on_inbound(int(inbound_id), username) or []
+            api_confs = await fetch_user_configs(api, int(inbound_id), username) or []
         except Exception:
             api_confs = []
     display_confs = built_confs or api_confs
 
-    footer = ((query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True) or {}).get('value') or '')
+    footer = (get_setting('config_footer_text') or '')
     ptype_lower = (panel_row.get('panel_type') or '').lower()
     if display_confs:
         preview = display_confs[:1]  # send only the first config
@@ -884,6 +778,7 @@ async def admin_xui_choose_inbound(update: Update, context: ContextTypes.DEFAULT
                 f"<b>پلن:</b> {plan['name']}\n"
                 f"<b>لینک اشتراک:</b>\n<code>{sub_link}</code>\n\n" + footer
             )
+    await job.report("ارسال به کاربر")
     try:
         # Try to send QR first (for first config or subscription link), then fallback to text
         sent_qr = False
@@ -930,27 +825,9 @@ async def admin_xui_choose_inbound(update: Update, context: ContextTypes.DEFAULT
         except Exception:
             pass
 
-        # Exit selection mode: clear pending and collapse keyboard
-        context.user_data.pop('pending_xui', None)
-        ok_text = base_text + f"\n\n\u2705 **ارسال با موفقیت انجام شد.**"
-        if is_media:
-            await _safe_edit_caption(query.message, ok_text, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\U0001F519 بازگشت", callback_data='admin_main')]]))
-        else:
-            await _safe_edit_text(query.message, ok_text, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\U0001F519 بازگشت", callback_data='admin_main')]]))
-        try:
-            await query.message.edit_reply_markup(reply_markup=None)
-        except Exception:
-            pass
     except TelegramError as e:
-        err_text = base_text + f"\n\n\u26A0\uFE0F **خطا در ارسال به کاربر:** {e}"
-        if is_media:
-            await _safe_edit_caption(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        else:
-            await _safe_edit_text(query.message, err_text, parse_mode=ParseMode.HTML, reply_markup=None)
-        try:
-            await query.message.edit_reply_markup(reply_markup=None)
-        except Exception:
-            pass
+        return f"\u26A0\uFE0F **خطا در ارسال به کاربر:** {e}"
+    return "\u2705 **ارسال با موفقیت انجام شد.**"
 
 
 async def admin_review_order_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1350,7 +1227,7 @@ async def process_manual_order_message(update: Update, context: ContextTypes.DEF
                             confs = []
                             if ib_id is not None:
                                 try:
-                                    confs = api.get_configs_for_user_on_inbound(int(ib_id), ord_row['marzban_username']) or []
+                                    confs = await fetch_user_configs(api, int(ib_id), ord_row['marzban_username']) or []
                                 except Exception:
                                     confs = []
                             if confs:
@@ -1618,7 +1495,7 @@ async def admin_plan_edit_save(update: Update, context: ContextTypes.DEFAULT_TYP
 async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await answer_safely(query)
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     trial_status = settings.get('free_trial_status', '0')
     trial_button_text = "\u274C غیرفعال کردن تست" if trial_status == '1' else "\u2705 فعال کردن تست"
     trial_button_callback = "set_trial_status_0" if trial_status == '1' else "set_trial_status_1"
@@ -1682,7 +1559,7 @@ async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TY
 async def admin_toggle_trial_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     new_status = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_status'", (new_status,))
+    set_setting('free_trial_status', new_status)
     await query.answer(f"وضعیت تست رایگان {'فعال' if new_status == '1' else 'غیرفعال'} شد.", show_alert=True)
     return await admin_settings_manage(update, context)
 
@@ -1691,7 +1568,7 @@ async def admin_toggle_trial_status(update: Update, context: ContextTypes.DEFAUL
 async def admin_reseller_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     enabled = settings.get('reseller_enabled', '1') == '1'
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     percent = int((settings.get('reseller_discount_percent') or '50') or 50)
@@ -1720,7 +1597,7 @@ async def admin_toggle_reseller(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     val = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('reseller_enabled', ?)", (val,))
+    set_setting('reseller_enabled', val)
     return await admin_reseller_menu(update, context)
 
 
@@ -1763,7 +1640,7 @@ async def admin_reseller_set_value_save(update: Update, context: ContextTypes.DE
         await update.message.reply_text("جلسه منقضی شده است.")
         return await admin_reseller_menu(update, context)
     val = _normalize_digits(update.message.text.strip())
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, val))
+    set_setting(key, val)
     context.user_data.pop('reseller_edit_key', None)
     await update.message.reply_text("ذخیره شد.")
     # Return to reseller menu
@@ -1830,7 +1707,7 @@ async def admin_reseller_approve(update: Update, context: ContextTypes.DEFAULT_T
         await query.answer("این درخواست قبلا بررسی شده است.", show_alert=True)
         return SETTINGS_MENU
     # Activate reseller for user
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     percent = int((settings.get('reseller_discount_percent') or '50') or 50)
     days = int((settings.get('reseller_duration_days') or '30') or 30)
     cap = int((settings.get('reseller_max_purchases') or '10') or 10)
@@ -1869,7 +1746,8 @@ async def admin_toggle_usd_mode(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'usd_irt_mode'", (target,))
+    set_setting('usd_irt_mode', target)
+    get_rate_service().invalidate()
     return await admin_settings_manage(update, context)
 
 
@@ -2019,8 +1897,8 @@ async def admin_settings_ask(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def admin_settings_save_trial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         days, gb = update.message.text.split('-')
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_days'", (days.strip(),))
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_gb'", (gb.strip(),))
+        set_setting('free_trial_days', days.strip())
+        set_setting('free_trial_gb', gb.strip())
         await update.message.reply_text("\u2705 تنظیمات تست رایگان با موفقیت ذخیره شد.")
     except Exception:
         await update.message.reply_text("فرمت نامعتبر است. لطفا با فرمت `روز-حجم` وارد کنید.")
@@ -2957,16 +2835,25 @@ async def admin_orders_pending(update: Update, context: ContextTypes.DEFAULT_TYP
     
     text = f"⏳ <b>سفارشات در انتظار ({len(pending)} عدد)</b>\n\n"
     keyboard = []
+    pending_ids = {int(o['id']) for o in pending}
+    # Drop selections of orders that are no longer pending
+    selected = context.user_data['bulk_approve'] = set(context.user_data.get('bulk_approve') or ()) & pending_ids
     
     for order in pending:
         plan = order.get('plan_name', 'نامشخص')
         price = order.get('price', 0)
         text += f"🆔 #{order['id']} | کاربر {order['user_id']}\n📦 {plan} | 💰 {int(price):,}ت\n\n"
+        mark = "☑️" if int(order['id']) in selected else "⬜"
         keyboard.append([
+            InlineKeyboardButton(mark, callback_data=f"bulk_approve_toggle_{order['id']}"),
             InlineKeyboardButton(f"✅ تأیید #{order['id']}", callback_data=f"approve_auto_{order['id']}"),
             InlineKeyboardButton(f"❌ رد #{order['id']}", callback_data=f"reject_order_{order['id']}")
         ])
     
+    keyboard.append([
+        InlineKeyboardButton(f"✅ تأیید انتخاب‌شده‌ها ({len(selected)})", callback_data='bulk_approve_go'),
+        InlineKeyboardButton("☑️ انتخاب همه", callback_data='bulk_approve_all'),
+    ])
     keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='admin_orders_menu')])
     
     await query.message.edit_text(
@@ -2977,6 +2864,95 @@ async def admin_orders_pending(update: Update, context: ContextTypes.DEFAULT_TYP
     return ADMIN_MAIN_MENU
 
 
+_XUI_PANEL_TYPES = ('xui', 'x-ui', 'sanaei', 'alireza', '3xui', '3x-ui', 'txui', 'tx-ui', 'sui', 's-ui')
+
+
+async def admin_bulk_approve(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Multi-select approval of pending orders: toggle/select all, then queue a job per order on its plan's panel"""
+    query = update.callback_query
+    action = query.data[len('bulk_approve_'):]
+    selected = set(context.user_data.get('bulk_approve') or ())
+    if action.startswith('toggle_'):
+        oid = int(action.split('_')[-1])
+        selected.symmetric_difference_update({oid})
+        context.user_data['bulk_approve'] = selected
+        return await admin_orders_pending(update, context)
+    if action == 'all':
+        rows = query_db("SELECT id FROM orders WHERE status = 'pending' ORDER BY timestamp DESC LIMIT 20") or []
+        context.user_data['bulk_approve'] = {int(r['id']) for r in rows}
+        return await admin_orders_pending(update, context)
+    if not selected:
+        await answer_safely(query, "هیچ سفارشی انتخاب نشده است.", show_alert=True)
+        return ADMIN_MAIN_MENU
+    await answer_safely(query, "در حال افزودن به صف ساخت...")
+    context.user_data['bulk_approve'] = set()
+
+    queue = get_approval_queue()
+    jobs, manual, skipped = [], [], []
+    for oid in sorted(selected):
+        row = query_db(
+            "SELECT o.status, p.panel_id, p.xui_inbound_id, pn.panel_type FROM orders o "
+            "LEFT JOIN plans p ON p.id = o.plan_id LEFT JOIN panels pn ON pn.id = p.panel_id WHERE o.id = ?",
+            (oid,), one=True,
+        )
+        if not row or row.get('status') != 'pending':
+            skipped.append(oid)
+            continue
+        panel_id = row.get('panel_id')
+        ptype = (row.get('panel_type') or 'marzban').lower()
+        inbound_id = row.get('xui_inbound_id') if ptype in _XUI_PANEL_TYPES else None
+        # Without a plan binding the admin has to pick the panel/inbound per order
+        if not panel_id or (ptype in _XUI_PANEL_TYPES and not inbound_id):
+            manual.append(oid)
+            continue
+        runner = _provision_inbound_order if inbound_id else _provision_panel_order
+        job = ApprovalJob(oid, panel_id, run=lambda j, r=runner: r(j, context), inbound_id=inbound_id)
+        if queue.submit(job) == JOB_QUEUED:
+            jobs.append(job)
+        else:
+            skipped.append(oid)
+
+    message = query.message
+    lock = asyncio.Lock()
+    last_edit = [0.0]
+
+    def summary() -> str:
+        counts = {}
+        for j in jobs:
+            counts[j.state] = counts.get(j.state, 0) + 1
+        text = (
+            f"📦 <b>تأیید گروهی ({len(jobs)} سفارش در صف)</b>\n\n"
+            f"⏳ در صف: {counts.get(JOB_QUEUED, 0)} | ⚙️ در حال انجام: {counts.get(JOB_RUNNING, 0) + counts.get(JOB_RETRY, 0)}\n"
+            f"✅ موفق: {counts.get(JOB_DONE, 0)} | ❌ ناموفق: {counts.get(JOB_FAILED, 0)}\n"
+        )
+        failed = [j for j in jobs if j.state == JOB_FAILED]
+        for j in failed[:10]:
+            text += f"\n#{j.order_id}: <code>{html_escape(str(j.error or ''))}</code>"
+        if manual:
+            text += "\n\nنیاز به انتخاب دستی پنل: " + ", ".join(f"#{o}" for o in manual)
+        if skipped:
+            text += "\n\nرد شده (بررسی‌شده یا در حال پردازش): " + ", ".join(f"#{o}" for o in skipped)
+        return text
+
+    async def progress(job: ApprovalJob):
+        done = all(j.finished for j in jobs)
+        # One message for the whole batch; edit at most once a second until everything finished
+        if not done and time.monotonic() - last_edit[0] < 1.0:
+            return
+        async with lock:
+            last_edit[0] = time.monotonic()
+            markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data='admin_orders_pending')]])
+            await _safe_edit_text(message, summary(), parse_mode=ParseMode.HTML, reply_markup=markup)
+
+    for j in jobs:
+        j.progress = progress
+    last_edit[0] = 0.0
+    async with lock:
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data='admin_orders_pending')]])
+        await _safe_edit_text(message, summary(), parse_mode=ParseMode.HTML, reply_markup=markup)
+    return ADMIN_MAIN_MENU
+
+
 async def admin_user_management(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show user management menu"""
     query = update.callback_query
@@ -3466,13 +3442,15 @@ async def admin_set_usd_rate_save(update: Update, context: ContextTypes.DEFAULT_
         else:
             val = update.message.text.strip()
         if val == '-' or val == '' or val.lower() == 'clear':
-            execute_db("UPDATE settings SET value = NULL WHERE key = 'usd_irt_manual'", ())
+            set_setting('usd_irt_manual', None)
+            get_rate_service().invalidate()
             await update.message.reply_text("نرخ دلار پاک شد؛ از نرخ API استفاده خواهد شد.")
         else:
             rate = int(float(val))
             if rate <= 0:
                 raise ValueError()
-            execute_db("UPDATE settings SET value = ? WHERE key = 'usd_irt_manual'", (str(rate),))
+            set_setting('usd_irt_manual', str(rate))
+            get_rate_service().invalidate()
             await update.message.reply_text("نرخ دلار ذخیره شد.")
     except Exception:
         await update.message.reply_text("ورودی نامعتبر است. یک عدد صحیح تومان وارد کنید یا '-' برای پاک کردن.")
@@ -3496,7 +3474,8 @@ async def admin_set_usd_rate_save(update: Update, context: ContextTypes.DEFAULT_
 
 async def admin_clear_usd_cache(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    execute_db("UPDATE settings SET value = '' WHERE key IN ('usd_irt_cached','usd_irt_cached_ts')")
+    set_settings({'usd_irt_cached': '', 'usd_irt_cached_ts': ''})
+    get_rate_service().invalidate(clear_quote=True)
     await query.answer("کش دلار پاک شد.", show_alert=True)
     return await admin_settings_manage(update, context)
 
@@ -3504,35 +3483,35 @@ async def admin_clear_usd_cache(update: Update, context: ContextTypes.DEFAULT_TY
 async def admin_toggle_pay_card(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'pay_card_enabled'", (val,))
+    set_setting('pay_card_enabled', val)
     return await admin_settings_manage(update, context)
 
 
 async def admin_toggle_pay_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'pay_crypto_enabled'", (val,))
+    set_setting('pay_crypto_enabled', val)
     return await admin_settings_manage(update, context)
 
 
 async def admin_toggle_pay_gateway(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'pay_gateway_enabled'", (val,))
+    set_setting('pay_gateway_enabled', val)
     return await admin_settings_manage(update, context)
 
 
 async def admin_toggle_gateway_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     t = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'gateway_type'", (t,))
+    set_setting('gateway_type', t)
     return await admin_settings_manage(update, context)
 
 
 async def admin_set_gateway_api_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     context.user_data['gateway_setup'] = {'step': 1, 'type': gateway_type}
     if gateway_type == 'zarinpal':
@@ -3553,7 +3532,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
             if len(txt) < 5:
                 await update.message.reply_text("MerchantID نامعتبر است. دوباره وارد کنید:")
                 return SETTINGS_AWAIT_GATEWAY_API
-            execute_db("UPDATE settings SET value = ? WHERE key = 'zarinpal_merchant_id'", (txt,))
+            set_setting('zarinpal_merchant_id', txt)
             context.user_data['gateway_setup']['step'] = 2
             await update.message.reply_text("مرحله 2/2: Callback URL را وارد کنید (مثال: https://site.com/pay/callback):")
             return SETTINGS_AWAIT_GATEWAY_API
@@ -3561,7 +3540,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
             if not (txt.startswith('http://') or txt.startswith('https://')):
                 await update.message.reply_text("Callback URL نامعتبر است. با http(s) شروع شود:")
                 return SETTINGS_AWAIT_GATEWAY_API
-            execute_db("UPDATE settings SET value = ? WHERE key = 'gateway_callback_url'", (txt,))
+            set_setting('gateway_callback_url', txt)
             await update.message.reply_text("اطلاعات زرین‌پال ذخیره شد.")
             context.user_data.pop('gateway_setup', None)
             return await admin_settings_manage(update, context)
@@ -3570,7 +3549,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
             if len(txt) < 4:
                 await update.message.reply_text("PIN نامعتبر است. دوباره وارد کنید:")
                 return SETTINGS_AWAIT_GATEWAY_API
-            execute_db("UPDATE settings SET value = ? WHERE key = 'aghapay_pin'", (txt,))
+            set_setting('aghapay_pin', txt)
             context.user_data['gateway_setup']['step'] = 2
             await update.message.reply_text("مرحله 2/2: Callback URL را وارد کنید (اختیاری، برای رد این مرحله '-' بزنید):")
             return SETTINGS_AWAIT_GATEWAY_API
@@ -3579,7 +3558,7 @@ async def admin_set_gateway_api_save(update: Update, context: ContextTypes.DEFAU
                 if not (txt.startswith('http://') or txt.startswith('https://')):
                     await update.message.reply_text("Callback URL نامعتبر است. با http(s) شروع شود یا '-' برای رد:")
                     return SETTINGS_AWAIT_GATEWAY_API
-                execute_db("UPDATE settings SET value = ? WHERE key = 'gateway_callback_url'", (txt,))
+                set_setting('gateway_callback_url', txt)
             await update.message.reply_text("اطلاعات آقای پرداخت ذخیره شد.")
             context.user_data.pop('gateway_setup', None)
             return await admin_settings_manage(update, context)
@@ -4138,7 +4117,7 @@ async def admin_tutorial_view(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def admin_toggle_signup_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     val = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'signup_bonus_enabled'", (val,))
+    set_setting('signup_bonus_enabled', val)
     await query.answer("ذخیره شد.", show_alert=False)
     return await admin_settings_manage(update, context)
 
@@ -4159,7 +4138,7 @@ async def admin_set_signup_bonus_amount_save(update: Update, context: ContextTyp
     except Exception:
         await update.message.reply_text("مبلغ نامعتبر است. یک عدد صحیح وارد کنید:")
         return SETTINGS_AWAIT_SIGNUP_BONUS
-    execute_db("UPDATE settings SET value = ? WHERE key = 'signup_bonus_amount'", (str(amount),))
+    set_setting('signup_bonus_amount', str(amount))
     await update.message.reply_text("ذخیره شد.")
     fake_query = type('obj', (object,), {
         'data': 'admin_settings_manage',
@@ -4192,7 +4171,7 @@ async def _apply_referral_bonus(order_id: int, context: ContextTypes.DEFAULT_TYP
             base_price = 0
         if base_price <= 0:
             return
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = settings_snapshot()
         pct = 10
         try:
             pct = int((settings.get('referral_commission_percent') or '10').strip())
@@ -4297,7 +4276,7 @@ async def admin_setms_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     txt = (update.message.text or '').strip()
     arg = txt[len('/setms'):].strip() if txt.startswith('/setms') else ''
     if arg:
-        execute_db("UPDATE settings SET value = ? WHERE key = 'config_footer_text'", (arg,))
+        set_setting('config_footer_text', arg)
         await update.message.reply_text("✅ متن زیر کانفیگ بروزرسانی شد.")
         return
     context.user_data['awaiting_admin'] = 'set_config_footer'
@@ -4340,7 +4319,7 @@ async def admin_set_config_footer_save(update: Update, context: ContextTypes.DEF
     if context.user_data.get('awaiting_admin') != 'set_config_footer':
         return ConversationHandler.END
     new_text = (update.message.text or '').strip()
-    execute_db("UPDATE settings SET value = ? WHERE key = 'config_footer_text'", (new_text,))
+    set_setting('config_footer_text', new_text)
     context.user_data.pop('awaiting_admin', None)
     await update.message.reply_text("✅ متن زیر کانفیگ ذخیره شد.")
     # Refresh settings view
@@ -4374,7 +4353,7 @@ async def admin_set_ref_percent_save(update: Update, context: ContextTypes.DEFAU
         percent = int(float(txt))
         if percent < 0 or percent > 100:
             raise ValueError()
-        execute_db("UPDATE settings SET value = ? WHERE key = 'referral_commission_percent'", (str(percent),))
+        set_setting('referral_commission_percent', str(percent))
         await update.message.reply_text("✅ درصد کمیسیون ذخیره شد.")
         context.user_data.pop('awaiting_admin', None)
     except Exception:
@@ -4416,7 +4395,7 @@ async def admin_set_trial_panel_choose(update: Update, context: ContextTypes.DEF
     await query.answer()
     panel_id = query.data.split('_')[-1]
     value = '' if panel_id == '0' else panel_id
-    execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_panel_id'", (value,))
+    set_setting('free_trial_panel_id', value)
     await query.answer("ذخیره شد", show_alert=True)
     return await admin_settings_manage(update, context)
 
@@ -4501,11 +4480,11 @@ async def auto_approve_wallet_order(order_id: int, context: ContextTypes.DEFAULT
                 except Exception:
                     built_confs = []
             if not built_confs:
-                built_confs = _fetch_subscription_configs(sub_link)
+                built_confs = await fetch_subscription_configs(sub_link)
             api_confs = []
             if not built_confs and hasattr(api, 'get_configs_for_user_on_inbound'):
                 try:
-                    api_confs = api.get_configs_for_user_on_inbound(int(inbound_id), username_created) or []
+                    api_confs = await fetch_user_configs(api, int(inbound_id), username_created) or []
                 except Exception:
                     api_confs = []
             display_confs = built_confs or api_confs
@@ -4524,8 +4503,7 @@ async def auto_approve_wallet_order(order_id: int, context: ContextTypes.DEFAULT
                     display_confs = [ _with_name_fragment(c, username_created) for c in display_confs ]
             except Exception:
                 pass
-            footer_row = query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True)
-            footer_text = (footer_row.get('value') if footer_row else '') or ''
+            footer_text = get_setting('config_footer_text') or ''
             sub_abs = sub_link
             try:
                 if sub_abs and not sub_abs.startswith('http'):
@@ -4647,19 +4625,18 @@ async def auto_approve_wallet_order(order_id: int, context: ContextTypes.DEFAULT
                 built_confs = []
         # If none, try decoding subscription content
         if not built_confs:
-            built_confs = _fetch_subscription_configs(sub_link)
+            built_confs = await fetch_subscription_configs(sub_link)
         # As extra attempt: use API helper if available
         api_confs = []
         if not built_confs and hasattr(api, 'get_configs_for_user_on_inbound'):
             try:
-                api_confs = api.get_configs_for_user_on_inbound(int(inbound_id), username_created) or []
+                api_confs = await fetch_user_configs(api, int(inbound_id), username_created) or []
             except Exception:
                 api_confs = []
         display_confs = built_confs or api_confs
 
         # Footer and message composition
-        footer_row = query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True)
-        footer_text = (footer_row.get('value') if footer_row else '') or ''
+        footer_text = get_setting('config_footer_text') or ''
         sub_abs = sub_link
         try:
             if sub_abs and not sub_abs.startswith('http'):
@@ -4691,7 +4668,7 @@ async def auto_approve_wallet_order(order_id: int, context: ContextTypes.DEFAULT
 async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     trial_status = settings.get('free_trial_status', '0')
     trial_button_text = "\u274C غیرفعال کردن تست" if trial_status == '1' else "\u2705 فعال کردن تست"
     trial_button_callback = "set_trial_status_0" if trial_status == '1' else "set_trial_status_1"
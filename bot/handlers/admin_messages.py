@@ -3,6 +3,7 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
 from ..db import query_db, execute_db, get_message_text
+from ..settings_store import get_setting
 from ..states import (
     ADMIN_MESSAGES_MENU,
     ADMIN_MESSAGES_SELECT,
@@ -449,8 +450,7 @@ async def admin_buttons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         # Desired layout: row1: [buy_config_main, get_free_config]; row2: [my_services, ...]
         buy_info = next(({'row': r['row'], 'col': r['col']} for r in existing_rows if r['target'] == 'buy_config_main'), None)
-        trial_status = query_db("SELECT value FROM settings WHERE key = 'free_trial_status'", one=True)
-        trial_enabled = bool(trial_status and (trial_status.get('value') == '1'))
+        trial_enabled = get_setting('free_trial_status') == '1'
 
         # Ensure buy button
         if 'buy_config_main' not in existing_targets:
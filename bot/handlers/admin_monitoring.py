@@ -2,10 +2,15 @@
 Admin Monitoring Handlers
 System health and performance monitoring for admins
 """
+import html
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 from ..monitoring import get_monitor
+from ..metrics import get_metrics
+from ..write_queue import get_write_queues
+from .. import query_profiler
 from ..config import logger
 from ..helpers.back_buttons import BackButtons
 
@@ -69,6 +74,9 @@ async def admin_monitoring_menu(update: Update, context: ContextTypes.DEFAULT_TY
             InlineKeyboardButton("🔌 بررسی پنل‌ها", callback_data='admin_check_panels'),
             InlineKeyboardButton("💾 وضعیت Cache", callback_data='admin_cache_stats')
         ],
+        [
+            InlineKeyboardButton("🧮 کوئری به‌ازای هر آپدیت", callback_data='admin_query_profile'),
+        ],
         [
             InlineKeyboardButton("⚡ مانیتور لحظه‌ای", callback_data='real_time_monitor'),
             InlineKeyboardButton("🌐 IoT دستگاه‌ها", callback_data='iot_management')
@@ -90,6 +98,10 @@ async def admin_monitoring_menu(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
 
+def _fmt_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds < 10 else f"{seconds:.0f}s"
+
+
 async def admin_perf_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show detailed performance stats"""
     query = update.callback_query
@@ -110,11 +122,45 @@ async def admin_perf_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
     message += f"   • کل: <code>{perf['total_errors']:,}</code>\n"
     message += f"   • نرخ: <code>{perf['error_rate']:.2f}%</code>\n\n"
     
+    # Tail latency per handler / panel endpoint / DB statement (p50 · p95 · p99, slowest p95 first)
+    metrics = get_metrics()
+    sections = (
+        ("🎯 <b>هندلرها</b>", 'bot_request_duration_seconds', 'handler', 6),
+        ("🔌 <b>API پنل‌ها</b>", 'panel_request_duration_seconds', 'endpoint', 5),
+        ("🗄 <b>کوئری‌های دیتابیس</b>", 'db_statement_duration_seconds', 'stmt', 5),
+    )
+    for title, name, label, limit in sections:
+        rows = metrics.top_quantiles(name, label, limit=limit)
+        if not rows:
+            continue
+        message += f"{title} (p50 · p95 · p99):\n"
+        for r in rows:
+            tag = r[label]
+            if label == 'endpoint':
+                tag = f"#{r['labels'].get('panel', '?')} {tag}"
+            message += (
+                f"   • <code>{html.escape(tag[:48])}</code> ×{r['count']}\n"
+                f"     <code>{_fmt_ms(r['p50'])} · {_fmt_ms(r['p95'])} · {_fmt_ms(r['p99'])}</code>\n"
+            )
+        message += "\n"
+    
+    # Background write queues (depth / capacity, drops under overload)
+    queues = [q.stats() for q in get_write_queues()]
+    if queues:
+        message += "📥 <b>صف‌های نوشتن پس‌زمینه:</b>\n"
+        for q in queues:
+            message += (
+                f"   • {html.escape(q['name'])}: <code>{q['depth']}/{q['maxsize']}</code>"
+                f" | نوشته‌شده <code>{q['written']:,}</code>"
+                f" | حذف <code>{q['dropped']:,}</code> | نمونه‌برداری <code>{q['sampled_out']:,}</code>\n"
+            )
+        message += "\n"
+    
     # Show slow requests
     if monitor.slow_requests:
         message += "🐌 <b>آخرین درخواست‌های کند:</b>\n"
         for req in monitor.slow_requests[-5:]:
-            message += f"   • {req['handler']}: <code>{req['duration']:.2f}s</code>\n"
+            message += f"   • {html.escape(req['handler'])}: <code>{req['duration']:.2f}s</code>\n"
     
     message += "\n━━━━━━━━━━━━━━━━━━━━━━━━"
     
@@ -127,6 +173,50 @@ async def admin_perf_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+async def admin_query_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Per-update query counts and N+1 suspects from the query profiler"""
+    query = update.callback_query
+    action = (query.data or '').rsplit('_', 1)[-1]
+    if action == 'on':
+        query_profiler.set_enabled(True)
+    elif action == 'off':
+        query_profiler.set_enabled(False)
+    elif action == 'reset':
+        query_profiler.reset()
+    await query.answer()
+
+    enabled = query_profiler.is_enabled()
+    message = "🧮 <b>کوئری‌های دیتابیس به‌ازای هر آپدیت</b>\n\n"
+    message += f"وضعیت پروفایلر: <code>{'روشن' if enabled else 'خاموش'}</code>\n"
+    message += f"آستانه N+1: <code>{query_profiler.QUERY_N_PLUS_ONE}</code> تکرار یک کوئری در یک آپدیت\n\n"
+    offenders = query_profiler.top_offenders(8)
+    if not offenders:
+        message += "هنوز داده‌ای ثبت نشده است.\n"
+    for s in offenders:
+        message += (
+            f"• <code>{html.escape(s.handler[:48])}</code>\n"
+            f"   آپدیت <code>{s.updates:,}</code> | میانگین <code>{s.avg_queries:.1f}</code>"
+            f" | بیشینه <code>{s.max_queries}</code> | DB <code>{_fmt_ms(s.seconds / max(1, s.updates))}</code>\n"
+        )
+        for stmt, count in sorted(s.repeated.items(), key=lambda kv: kv[1], reverse=True)[:2]:
+            message += f"   ⚠️ N+1 ×{count}: <code>{html.escape(stmt[:60])}</code>\n"
+    message += "\n━━━━━━━━━━━━━━━━━━━━━━━━"
+
+    keyboard = [
+        [
+            InlineKeyboardButton("⏸ خاموش" if enabled else "▶️ روشن",
+                                 callback_data='admin_query_profile_off' if enabled else 'admin_query_profile_on'),
+            InlineKeyboardButton("🗑 ریست", callback_data='admin_query_profile_reset'),
+        ],
+        [BackButtons.refresh('admin_query_profile'), BackButtons.to_monitoring()],
+    ]
+    await query.message.edit_text(
+        message,
+        parse_mode=ParseMode.HTML,
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
 async def admin_error_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show recent error logs"""
     query = update.callback_query
@@ -3,9 +3,11 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, ConversationHandler
 
 from ..db import query_db, execute_db
+from ..settings_store import get_setting, set_setting, settings_snapshot
 from ..states import SETTINGS_MENU, SETTINGS_AWAIT_TRIAL_DAYS, SETTINGS_AWAIT_PAYMENT_TEXT, SETTINGS_AWAIT_USD_RATE, SETTINGS_AWAIT_GATEWAY_API, SETTINGS_AWAIT_SIGNUP_BONUS, SETTINGS_AWAIT_TRAFFIC_ALERT_VALUE
 from ..helpers.tg import notify_admins, append_footer_buttons as _footer, answer_safely as _ans, safe_edit_text as _safe_edit_text
 from ..config import ADMIN_ID, logger
+from ..exchange_rate import get_rate_service
 <<<<<<< HEAD
 from ..helpers.back_buttons import BackButtons
 =======
@@ -33,7 +35,7 @@ async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TY
         await query.answer()
     except Exception:
         pass  # Ignore expired callback queries
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     trial_status = settings.get('free_trial_status', '0')
     trial_button_text = "\u274C غیرفعال کردن تست" if trial_status == '1' else "\u2705 فعال کردن تست"
     trial_button_callback = "set_trial_status_0" if trial_status == '1' else "set_trial_status_1"
@@ -169,7 +171,7 @@ async def admin_settings_manage(update: Update, context: ContextTypes.DEFAULT_TY
 async def admin_toggle_trial_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     new_status = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_status'", (new_status,))
+    set_setting('free_trial_status', new_status)
     await query.answer(f"وضعیت تست رایگان {'فعال' if new_status == '1' else 'غیرفعال'} شد.", show_alert=True)
     return await admin_settings_manage(update, context)
 
@@ -190,7 +192,7 @@ async def admin_toggle_join_logs(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('join_logs_enabled', ?)", (target,))
+    set_setting('join_logs_enabled', target)
     return await admin_settings_manage(update, context)
 
 
@@ -198,7 +200,7 @@ async def admin_toggle_purchase_logs(update: Update, context: ContextTypes.DEFAU
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('purchase_logs_enabled', ?)", (target,))
+    set_setting('purchase_logs_enabled', target)
     return await admin_settings_manage(update, context)
 
 
@@ -227,7 +229,7 @@ async def admin_settings_save_log_chat(update: Update, context: ContextTypes.DEF
         await update.message.reply_text("ورودی نامعتبر است.")
         return ConversationHandler.END
     key = 'join_logs_chat_id' if mode == 'set_join_logs_chat' else 'purchase_logs_chat_id'
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, txt))
+    set_setting(key, txt)
     context.user_data.pop('awaiting_admin', None)
     await update.message.reply_text("ذخیره شد.")
     fake_query = type('obj', (object,), {
@@ -240,7 +242,7 @@ async def admin_settings_save_log_chat(update: Update, context: ContextTypes.DEF
 async def admin_settings_send_test_join_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    st = {r['key']: r['value'] for r in query_db("SELECT key,value FROM settings WHERE key IN ('join_logs_enabled','join_logs_chat_id')")}
+    st = settings_snapshot()
     if (st.get('join_logs_enabled') or '0') != '1':
         await _ans(query, "لاگ ورود غیرفعال است.", show_alert=True)
         return await admin_settings_manage(update, context)
@@ -262,7 +264,7 @@ async def admin_settings_send_test_join_log(update: Update, context: ContextType
 async def admin_settings_send_test_purchase_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    st = {r['key']: r['value'] for r in query_db("SELECT key,value FROM settings WHERE key IN ('purchase_logs_enabled','purchase_logs_chat_id')")}
+    st = settings_snapshot()
     if (st.get('purchase_logs_enabled') or '0') != '1':
         await _ans(query, "لاگ خرید غیرفعال است.", show_alert=True)
         return await admin_settings_manage(update, context)
@@ -302,7 +304,8 @@ async def admin_toggle_usd_mode(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("UPDATE settings SET value = ? WHERE key = 'usd_irt_mode'", (target,))
+    set_setting('usd_irt_mode', target)
+    get_rate_service().invalidate()
     return await admin_settings_manage(update, context)
 
 
@@ -324,8 +327,8 @@ async def admin_settings_ask(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def admin_settings_save_trial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         days, gb = update.message.text.split('-')
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_days'", (days.strip(),))
-        execute_db("UPDATE settings SET value = ? WHERE key = 'free_trial_gb'", (gb.strip(),))
+        set_setting('free_trial_days', days.strip())
+        set_setting('free_trial_gb', gb.strip())
         await update.message.reply_text("\u2705 تنظیمات تست رایگان با موفقیت ذخیره شد.")
     except Exception:
         await update.message.reply_text("فرمت نامعتبر است. لطفا با فرمت `روز-حجم` وارد کنید.")
@@ -376,7 +379,7 @@ async def admin_toggle_user_quota(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('user_show_quota_enabled', ?)", (target,))
+    set_setting('user_show_quota_enabled', target)
     return await admin_settings_manage(update, context)
 
 
@@ -384,7 +387,7 @@ async def admin_toggle_talert(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('traffic_alert_enabled', ?)", (target,))
+    set_setting('traffic_alert_enabled', target)
     return await admin_settings_manage(update, context)
 
 
@@ -428,7 +431,7 @@ async def admin_set_talert_value_save(update: Update, context: ContextTypes.DEFA
         except Exception:
             await update.message.reply_text("❌ عدد نامعتبر است. لطفاً دوباره تلاش کنید:")
             return SETTINGS_AWAIT_TRAFFIC_ALERT_VALUE
-        execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('traffic_alert_value_gb', ?)", (str(val),))
+        set_setting('traffic_alert_value_gb', str(val))
         await update.message.reply_text(f"✅ مقدار هشدار حجم به {val} GB تنظیم شد.\n\n🔄 بازگشت به منوی تنظیمات...")
     elif mode == 'set_time_alert_days':
         try:
@@ -436,7 +439,7 @@ async def admin_set_talert_value_save(update: Update, context: ContextTypes.DEFA
         except Exception:
             await update.message.reply_text("❌ عدد صحیح نامعتبر است. لطفاً دوباره تلاش کنید:")
             return SETTINGS_AWAIT_TRAFFIC_ALERT_VALUE
-        execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('time_alert_days', ?)", (str(ival),))
+        set_setting('time_alert_days', str(ival))
         await update.message.reply_text(f"✅ روزهای هشدار زمان به {ival} روز تنظیم شد.\n\n🔄 بازگشت به منوی تنظیمات...")
     elif mode == 'set_auto_backup_hours':
         try:
@@ -446,7 +449,7 @@ async def admin_set_talert_value_save(update: Update, context: ContextTypes.DEFA
         except Exception:
             await update.message.reply_text("❌ عدد صحیح نامعتبر است. لطفاً دوباره تلاش کنید:")
             return SETTINGS_AWAIT_TRAFFIC_ALERT_VALUE
-        execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('auto_backup_hours', ?)", (str(hours),))
+        set_setting('auto_backup_hours', str(hours))
         # Reschedule the backup job with new interval
         try:
             jq = context.application.job_queue
@@ -454,7 +457,7 @@ async def admin_set_talert_value_save(update: Update, context: ContextTypes.DEFA
             for j in jq.get_jobs_by_name("auto_backup_send"):
                 j.schedule_removal()
             # Check if auto-backup is enabled
-            ab_enabled = (query_db("SELECT value FROM settings WHERE key='auto_backup_enabled'", one=True) or {}).get('value') == '1'
+            ab_enabled = get_setting('auto_backup_enabled') == '1'
             if ab_enabled:
                 from ..jobs import backup_and_send_to_admins
                 from ..config import logger
@@ -504,7 +507,7 @@ async def admin_toggle_time_alert(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('time_alert_enabled', ?)", (target,))
+    set_setting('time_alert_enabled', target)
     return await admin_settings_manage(update, context)
 
 
@@ -512,7 +515,7 @@ async def admin_toggle_auto_backup(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
     target = query.data.split('_')[-1]
-    execute_db("INSERT OR REPLACE INTO settings (key, value) VALUES ('auto_backup_enabled', ?)", (target,))
+    set_setting('auto_backup_enabled', target)
     # Reschedule job immediately
     try:
         # Cancel existing
@@ -521,9 +524,8 @@ async def admin_toggle_auto_backup(update: Update, context: ContextTypes.DEFAULT
             j.schedule_removal()
         # If enabling, schedule with current hours
         if target == '1':
-            from ..db import query_db as _q
             try:
-                hours = int((_q("SELECT value FROM settings WHERE key='auto_backup_hours'", one=True) or {}).get('value') or '12')
+                hours = int(get_setting('auto_backup_hours') or '12')
             except Exception:
                 hours = 12
             if hours > 0:
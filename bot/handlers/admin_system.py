@@ -192,7 +192,8 @@ async def admin_clear_notifications(update: Update, context: ContextTypes.DEFAUL
             SET notified_traffic_80 = 0,
                 notified_traffic_95 = 0,
                 notified_expiry_3d = 0,
-                notified_expiry_1d = 0
+                notified_expiry_1d = 0,
+                notified_low_traffic = 0
             WHERE status = 'approved'
         """)
         
@@ -4,15 +4,17 @@ from telegram.ext import ContextTypes
 import io
 import csv
 
-from ..db import query_db, execute_db
+from ..db import query_db, execute_db, fetch_user_orders_page, get_user_order_counts
 from ..states import ADMIN_USERS_MENU, ADMIN_USERS_AWAIT_SEARCH
 from ..helpers.tg import safe_edit_text as _safe_edit_text
+from ..helpers.paging import parse_cursor_callback, cursor_nav_row
 <<<<<<< HEAD
 from ..helpers.back_buttons import BackButtons
 =======
 >>>>>>> origin/master
 
 PAGE_SIZE = 10
+SERVICES_PAGE_SIZE = 5
 
 def _build_users_query(search: str | None):
     base = "SELECT user_id, first_name, COALESCE(banned,0) AS banned, join_date FROM users"
@@ -143,8 +145,9 @@ async def admin_users_view_by_id_show(update: Update, context: ContextTypes.DEFA
         return ADMIN_USERS_MENU
     banned = int(u.get('banned') or 0) == 1
     # Aggregates
-    orders_total = (query_db("SELECT COUNT(*) AS c FROM orders WHERE user_id = ?", (uid,), one=True) or {}).get('c', 0)
-    orders_active = (query_db("SELECT COUNT(*) AS c FROM orders WHERE user_id = ? AND status='approved'", (uid,), one=True) or {}).get('c', 0)
+    order_counts = get_user_order_counts(uid)
+    orders_total = sum(order_counts.values())
+    orders_active = order_counts.get('approved', 0)
     last_order = (query_db("SELECT MAX(timestamp) AS ts FROM orders WHERE user_id = ?", (uid,), one=True) or {}).get('ts', '-')
     wallet = (query_db("SELECT balance FROM user_wallets WHERE user_id = ?", (uid,), one=True) or {}).get('balance', 0)
     tickets_open = (query_db("SELECT COUNT(*) AS c FROM tickets WHERE user_id = ? AND status='pending'", (uid,), one=True) or {}).get('c', 0)
@@ -219,26 +222,33 @@ def _paginate(items, page: int, size: int):
 async def admin_users_show_services(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    parts = query.data.split('_')
-    uid = int(parts[-1]) if parts[-2] != 'page' else int(parts[-3])
-    page = int(parts[-1]) if parts[-2] == 'page' else 1
+    uid = int(query.data[len('admin_user_services_'):].split('_', 1)[0])
+    page, before_id, after_id = parse_cursor_callback(query.data)
     
     # Debug logging
     from ..config import logger
     logger.info(f"[admin_users_show_services] callback_data={query.data}, parsed uid={uid}, page={page}")
     
-    rows = query_db(
-        """SELECT o.id, o.plan_id, o.status, o.marzban_username, o.panel_type, o.timestamp,
-           p.name as plan_name, p.price, p.duration_days, p.traffic_gb
-           FROM orders o
-           LEFT JOIN plans p ON p.id = o.plan_id
-           WHERE o.user_id = ?
-           ORDER BY o.id DESC""",
-        (uid,)
-    ) or []
+    # Keyset page served from idx_orders_user_id_desc; plan details only for the visible rows
+    rows, has_prev, has_next = fetch_user_orders_page(
+        uid, limit=SERVICES_PAGE_SIZE, before_id=before_id, after_id=after_id,
+        offset=(page - 1) * SERVICES_PAGE_SIZE if before_id is None and after_id is None else 0,
+    )
+    plan_ids = sorted({r['plan_id'] for r in rows if r.get('plan_id') is not None})
+    plans = {}
+    if plan_ids:
+        plans = {
+            p['id']: p for p in (query_db(
+                f"SELECT id, name AS plan_name, price, duration_days, traffic_gb FROM plans WHERE id IN ({','.join('?' * len(plan_ids))})",
+                tuple(plan_ids),
+            ) or [])
+        }
+    for r in rows:
+        p = plans.get(r.get('plan_id')) or {}
+        r.update(plan_name=p.get('plan_name'), price=p.get('price'), duration_days=p.get('duration_days'), traffic_gb=p.get('traffic_gb'))
     
-    logger.info(f"[admin_users_show_services] Found {len(rows)} orders for user {uid}")
-    if not rows:
+    logger.info(f"[admin_users_show_services] Found {len(rows)} orders for user {uid} (page {page})")
+    if not rows and page == 1:
         # Store user_id for re-displaying user details on back
         context.user_data['viewing_user_id'] = uid
         kb = [
@@ -260,7 +270,8 @@ async def admin_users_show_services(update: Update, context: ContextTypes.DEFAUL
         )
         return ADMIN_USERS_MENU
     
-    page_rows, total = _paginate(rows, page, 5)
+    page_rows = rows
+    total = sum(get_user_order_counts(uid).values())
     text = f"📦 <b>سرویس‌های کاربر {uid}</b>\n\n"
     
     kb = []
@@ -304,14 +315,9 @@ async def admin_users_show_services(update: Update, context: ContextTypes.DEFAUL
         kb.append(service_row)
     
     # Pagination
-    nav = []
-    total_pages = max(1, (total + 5 - 1) // 5)
-    if total_pages > 1:
-        if page > 1:
-            nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"admin_user_services_{uid}_page_{page-1}"))
-        nav.append(InlineKeyboardButton(f"📄 {page}/{total_pages}", callback_data='noop'))
-        if page < total_pages:
-            nav.append(InlineKeyboardButton("▶️ بعدی", callback_data=f"admin_user_services_{uid}_page_{page+1}"))
+    total_pages = max(1, (total + SERVICES_PAGE_SIZE - 1) // SERVICES_PAGE_SIZE)
+    nav = cursor_nav_row(f"admin_user_services_{uid}", page, total_pages, page_rows, has_prev, has_next)
+    if nav:
         kb.append(nav)
     
     kb.append([InlineKeyboardButton("🔙 بازگشت به کاربر", callback_data=f"admin_user_view_{uid}")])
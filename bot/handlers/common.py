@@ -5,9 +5,11 @@ from telegram.ext import ContextTypes, ApplicationHandlerStop
 
 from ..config import ADMIN_ID, CHANNEL_ID, CHANNEL_USERNAME, logger
 from ..db import query_db
+from ..settings_store import get_setting, settings_snapshot
 from ..utils import register_new_user
 from ..helpers.flow import get_flow
 from ..helpers.keyboards import build_start_menu_keyboard
+from ..helpers.menu_cache import get_dynamic_message, get_menu_buttons, get_menu_setting
 from ..helpers.tg import safe_edit_message, answer_safely
 
 
@@ -21,8 +23,7 @@ async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE)
 		return
 	# Gate: if bot is OFF, block non-admins globally with a maintenance message
 	try:
-		active_row = query_db("SELECT value FROM settings WHERE key='bot_active'", one=True)
-		bot_on = (active_row and str(active_row.get('value') or '1') == '1')
+		bot_on = str(get_setting('bot_active') or '1') == '1'
 	except Exception:
 		bot_on = True
 	if not bot_on:
@@ -36,8 +37,7 @@ async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE)
 			pass
 		# For normal users, show maintenance and stop
 		try:
-			mm = query_db("SELECT value FROM settings WHERE key='maintenance_message'", one=True)
-			text = (mm.get('value') if mm else None) or (
+			text = get_setting('maintenance_message') or (
                 "🔧 <b>ربات در حال نگهداری است</b>\n\n"
                 "━━━━━━━━━━━━━━━━━━━━━━━━\n"
                 "⚠️ ربات به‌طور موقت برای نگهداری و بهبود خاموش شده است.\n\n"
@@ -135,7 +135,7 @@ async def force_join_checker(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYPE, message_name: str, back_to: str = 'start_main'):
 	query = update.callback_query
 
-	message_data = query_db("SELECT text, file_id, file_type FROM messages WHERE message_name = ?", (message_name,), one=True)
+	message_data = get_dynamic_message(message_name)
 	if not message_data:
 		await answer_safely(query, f"محتوای '{message_name}' یافت نشد!", show_alert=True)
 		return
@@ -147,14 +147,10 @@ async def send_dynamic_message(update: Update, context: ContextTypes.DEFAULT_TYP
 	file_id = message_data.get('file_id')
 	file_type = message_data.get('file_type')
 
-	buttons_data = query_db(
-		"SELECT text, target, is_url, row, col FROM buttons WHERE menu_name = ? ORDER BY row, col",
-		(message_name,),
-	)
+	buttons_data = get_menu_buttons(message_name)
 
 	if message_name == 'start_main':
-		trial_status = query_db("SELECT value FROM settings WHERE key = 'free_trial_status'", one=True)
-		if not trial_status or trial_status.get('value') != '1':
+		if get_menu_setting('free_trial_status') != '1':
 			buttons_data = [b for b in buttons_data if b.get('target') != 'get_free_config']
 
 	keyboard = []
@@ -257,8 +253,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Optional: send join/start logs to admin-defined chat (skip if suppressed by flow OR user already existed)
     try:
         if not context.user_data.pop('suppress_join_log', False) and not user_existed:
-            st = query_db("SELECT key, value FROM settings WHERE key IN ('join_logs_enabled','join_logs_chat_id')") or []
-            kv = {r['key']: r['value'] for r in st}
+            kv = settings_snapshot()
             if (kv.get('join_logs_enabled') or '0') == '1':
                 raw = (kv.get('join_logs_chat_id') or '').strip()
                 chat_ident = raw if raw.startswith('@') else (int(raw) if (raw and raw.lstrip('-').isdigit()) else 0)
@@ -304,7 +299,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not sender:
         pass
 
-    message_data = query_db("SELECT text FROM messages WHERE message_name = 'start_main'", one=True)
+    message_data = get_dynamic_message('start_main')
     text = message_data.get('text') if message_data else "خوش آمدید!"
 
     reply_markup = build_start_menu_keyboard()
@@ -343,7 +338,7 @@ async def dynamic_button_handler(update: Update, context: ContextTypes.DEFAULT_T
 >>>>>>> origin/master
 	# First, check if the callback data corresponds to a dynamic message.
 	# This is safer than a blacklist of prefixes.
-	if query_db("SELECT 1 FROM messages WHERE message_name = ?", (message_name,), one=True):
+	if get_dynamic_message(message_name) is not None:
 		await send_dynamic_message(update, context, message_name=message_name, back_to='start_main')
 		# Stop further handlers from processing this update
 		raise ApplicationHandlerStop
@@ -5,11 +5,14 @@ from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import BadRequest
 
 from ..db import query_db, execute_db
+from ..settings_store import settings_snapshot
 from ..handlers.common import start_command
 from ..states import SELECT_PLAN, AWAIT_DISCOUNT_CODE, AWAIT_PAYMENT_SCREENSHOT, RENEW_AWAIT_PAYMENT, SELECT_PAYMENT_METHOD, AWAIT_CUSTOM_USERNAME
-from ..config import NOBITEX_TOKEN, logger, ADMIN_ID
+from ..config import logger, ADMIN_ID
+from ..exchange_rate import get_usdt_irt_price
 from ..helpers.tg import safe_edit_text as _safe_edit, ltr_code, notify_admins
 from ..helpers.flow import set_flow, clear_flow
+from ..helpers.menu_cache import get_dynamic_message, get_plans_list
 from .admin import auto_approve_wallet_order
 
 
@@ -87,7 +90,7 @@ async def start_purchase_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
                 r_percent = int((reseller.get('discount_percent') or 0) or 0)
     except Exception:
         r_percent = 0
-    plans = query_db("SELECT id, name, price FROM plans ORDER BY price")
+    plans = get_plans_list()
     if not plans:
         await _safe_edit(
             query.message,
@@ -109,7 +112,7 @@ async def start_purchase_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
         keyboard.append([InlineKeyboardButton(f"{plan['name']} - {label_price}", callback_data=f"select_plan_{plan['id']}")])
     keyboard.append([InlineKeyboardButton("\U0001F519 بازگشت", callback_data='start_main')])
 
-    message_data = query_db("SELECT text FROM messages WHERE message_name = 'buy_config_main'", one=True)
+    message_data = get_dynamic_message('buy_config_main')
     text = message_data.get('text') if message_data else "پلن موردنظر خود را انتخاب کنید:"
 
     await _safe_edit(query.message, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
@@ -224,160 +227,6 @@ async def receive_and_validate_discount_code(update: Update, context: ContextTyp
     return await show_payment_info(update, context)
 
 
-def _best_mid_from_orderbook(bids, asks) -> float:
-    try:
-        best_bid = float(bids[0][0]) if bids and bids[0] else 0.0
-        best_ask = float(asks[0][0]) if asks and asks[0] else 0.0
-        if best_bid > 0 and best_ask > 0:
-            return (best_bid + best_ask) / 2.0
-        return best_ask or best_bid or 0.0
-    except Exception:
-        return 0.0
-
-
-def _fetch_from_wallex() -> float:
-    headers = {
-        'Accept': 'application/json, text/plain, */*',
-        'User-Agent': 'Mozilla/5.0',
-    }
-    endpoints = [
-        ('GET', 'https://api.wallex.ir/v1/markets/orderbook', {'symbol': 'usdt-irt'}),
-        ('GET', 'https://api.wallex.ir/v1/depth', {'symbol': 'usdt-irt'}),
-    ]
-    for method, url, params in endpoints:
-        try:
-            r = requests.request(method, url, headers=headers, params=params, timeout=10)
-            if not r.ok:
-                continue
-            data = r.json() or {}
-            # common shapes: {'result': {'orderbook': {'bids': [...], 'asks': [...]}}}
-            res = data.get('result') or data
-            ob = res.get('orderbook') or res.get('depth') or res
-            bids = ob.get('bids') or []
-            asks = ob.get('asks') or []
-            price = _best_mid_from_orderbook(bids, asks)
-            if price > 0:
-                return price
-        except Exception:
-            continue
-    return 0.0
-
-
-def _fetch_from_bitpin() -> float:
-    headers = {
-        'Accept': 'application/json, text/plain, */*',
-        'User-Agent': 'Mozilla/5.0',
-    }
-    endpoints = [
-        ('GET', 'https://api.bitpin.ir/v1/mth/orderbook/USDTIRT', None),
-        ('GET', 'https://api.bitpin.ir/v1/orderbook/USDTIRT', None),
-        ('GET', 'https://api.bitpin.ir/v2/orderbook/USDTIRT', None),
-    ]
-    for method, url, params in endpoints:
-        try:
-            r = requests.request(method, url, headers=headers, params=params, timeout=10)
-            if not r.ok:
-                continue
-            data = r.json() or {}
-            # common shapes: {'result': {'bids': [...], 'asks': [...]}} or flat
-            res = data.get('result') or data
-            bids = res.get('bids') or []
-            asks = res.get('asks') or []
-            price = _best_mid_from_orderbook(bids, asks)
-            if price > 0:
-                return price
-        except Exception:
-            continue
-    return 0.0
-
-
-def _fetch_nobitex_usd_irt() -> float:
-    try:
-        headers = {
-            'Accept': 'application/json, text/plain, */*',
-            'User-Agent': 'Mozilla/5.0',
-        }
-        if NOBITEX_TOKEN:
-            headers['Authorization'] = f"Token {NOBITEX_TOKEN}"
-        # Try orderbook variants (prices in Toman)
-        endpoints = [
-            ('GET', 'https://api.nobitex.ir/v2/orderbook/USDTIRT', None),
-            ('GET', 'https://api.nobitex.ir/v2/orderbook/USDT-IRT', None),
-            ('GET', 'https://api.nobitex.ir/v2/orderbook/USDT_IRT', None),
-            ('GET', 'https://api.nobitex.ir/v2/orderbook', {'symbol': 'USDTIRT'}),
-        ]
-        for method, url, params in endpoints:
-            try:
-                r = requests.request(method, url, headers=headers, params=params, timeout=10)
-                if not r.ok:
-                    continue
-                data = r.json() or {}
-                ob = data.get('orderbook') if isinstance(data, dict) else None
-                bids = (ob or data).get('bids') or []
-                asks = (ob or data).get('asks') or []
-                best_bid = float(bids[0][0]) if bids and bids[0] else 0.0
-                best_ask = float(asks[0][0]) if asks and asks[0] else 0.0
-                if best_bid > 0 and best_ask > 0:
-                    return (best_bid + best_ask) / 2.0
-                if best_ask > 0 or best_bid > 0:
-                    return best_ask or best_bid
-            except Exception:
-                continue
-        # Fallback to stats (Toman)
-        rs = requests.get('https://api.nobitex.ir/v2/stats', headers=headers, timeout=10)
-        if rs.ok:
-            d = rs.json() or {}
-            stats = d.get('stats') or {}
-            pair = stats.get('USDTIRT') or stats.get('USDT-IRT') or {}
-            p = pair.get('latest') or pair.get('bestSell') or pair.get('average')
-            if p:
-                return float(p)
-        # Legacy market/stats (Rial)
-        rl = requests.post('https://api.nobitex.ir/market/stats', json={'srcCurrency': 'usdt', 'dstCurrency': 'rls'}, headers={'Content-Type': 'application/json', **({'Authorization': f'Token {NOBITEX_TOKEN}'} if NOBITEX_TOKEN else {})}, timeout=10)
-        if rl.ok:
-            d2 = rl.json() or {}
-            s2 = d2.get('stats') or {}
-            usdt = s2.get('usdt-rls') or s2.get('USDT-IRT') or {}
-            p2 = usdt.get('latest') or usdt.get('bestSell') or usdt.get('average')
-            if p2:
-                return float(p2) / 10.0
-    except Exception as e:
-        logger.error(f"Nobitex fetch error: {e}")
-    return 0.0
-
-
-def _fetch_usdt_irt_price() -> float:
-    # Priority based on mode: manual or api; then cached
-    from ..db import query_db as _q, execute_db as _x
-    mode = ((_q("SELECT value FROM settings WHERE key = 'usd_irt_mode'", one=True) or {}).get('value') or 'manual').lower()
-    if mode == 'manual':
-        manual = (_q("SELECT value FROM settings WHERE key = 'usd_irt_manual'", one=True) or {}).get('value') or ''
-        try:
-            rate = float(manual.strip()) if manual.strip() else 0.0
-            if rate > 0:
-                return rate
-        except Exception:
-            pass
-    else:
-        price = _fetch_nobitex_usd_irt()
-        if price > 0:
-            try:
-                _x("UPDATE settings SET value = ? WHERE key = 'usd_irt_cached'", (str(int(price)),))
-                _x("UPDATE settings SET value = ? WHERE key = 'usd_irt_cached_ts'", (datetime.now().isoformat(timespec='seconds'),))
-            except Exception:
-                pass
-            return price
-    # Cached fallback
-    cached = (_q("SELECT value FROM settings WHERE key = 'usd_irt_cached'", one=True) or {}).get('value') or ''
-    try:
-        c = float(cached.strip()) if cached.strip() else 0.0
-        if c > 0:
-            return c
-    except Exception:
-        pass
-    return 0.0
-
-
 async def show_payment_method_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     if query:
@@ -394,7 +243,7 @@ async def show_payment_method_selection(update: Update, context: ContextTypes.DE
         await update.effective_message.reply_text("⚠️ خطا! مبلغ نهایی مشخص نیست. لطفاً از ابتدا شروع کنید.")
         return await cancel_flow(update, context)
 
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     pay_card = settings.get('pay_card_enabled', '1') == '1'
     pay_crypto = settings.get('pay_crypto_enabled', '1') == '1'
     pay_gateway = settings.get('pay_gateway_enabled', '0') == '1'
@@ -869,7 +718,8 @@ async def show_payment_info_crypto(update: Update, context: ContextTypes.DEFAULT
             await update.message.reply_text(text_to_send, reply_markup=InlineKeyboardMarkup(kb))
         return SELECT_PAYMENT_METHOD
 
-    usdt_irt = _fetch_usdt_irt_price()
+    # Served from memory; refreshed in the background by refresh_usd_rate_job
+    usdt_irt = get_usdt_irt_price()
     usd_amount = (final_price / usdt_irt) if usdt_irt > 0 else 0
 
     is_renewal = context.user_data.get('renewing_order_id')
@@ -923,7 +773,7 @@ async def show_payment_info_gateway(update: Update, context: ContextTypes.DEFAUL
         await update.effective_message.reply_text("خطا! قیمت نهایی مشخص نیست. لطفا از ابتدا شروع کنید.")
         return await cancel_flow(update, context)
 
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     callback_url = (settings.get('gateway_callback_url') or '').strip()
 
@@ -1174,14 +1024,14 @@ async def gateway_verify_purchase(update: Update, context: ContextTypes.DEFAULT_
         await query.message.edit_text("خطا: اطلاعات پرداخت یافت نشد.")
         return SELECT_PAYMENT_METHOD
     if gw.get('type') == 'zarinpal':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = settings_snapshot()
         merchant_id = settings.get('zarinpal_merchant_id') or ''
         ok, ref_id = _zarinpal_verify(merchant_id, gw.get('amount_rial', 0), gw.get('authority', ''))
         if not ok:
             await query.message.edit_text("پرداخت تایید نشد. اگر پرداخت کرده‌اید چند لحظه دیگر دوباره بررسی کنید یا از روش‌های دیگر استفاده کنید.")
             return SELECT_PAYMENT_METHOD
     elif gw.get('type') == 'aghapay':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = settings_snapshot()
         pin = settings.get('aghapay_pin') or ''
         ok = _aghapay_verify(pin, int(context.user_data.get('final_price', 0)), gw.get('transid', ''))
         if not ok:
@@ -1241,14 +1091,14 @@ async def gateway_verify_renewal(update: Update, context: ContextTypes.DEFAULT_T
         await query.message.edit_text("خطا: اطلاعات پرداخت یافت نشد.")
         return RENEW_AWAIT_PAYMENT
     if gw.get('type') == 'zarinpal':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = settings_snapshot()
         merchant_id = settings.get('zarinpal_merchant_id') or ''
         ok, ref_id = _zarinpal_verify(merchant_id, gw.get('amount_rial', 0), gw.get('authority', ''))
         if not ok:
             await query.message.edit_text("پرداخت تایید نشد. اگر پرداخت کرده‌اید کمی بعد دوباره بررسی کنید.")
             return RENEW_AWAIT_PAYMENT
     elif gw.get('type') == 'aghapay':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = settings_snapshot()
         pin = settings.get('aghapay_pin') or ''
         ok = _aghapay_verify(pin, int(context.user_data.get('final_price', 0)), gw.get('transid', ''))
         if not ok:
@@ -10,7 +10,6 @@ def _with_name_fragment(uri: str, name: str) -> str:
             return uri.split('#', 1)[0] + f"#{name}"
         return uri
 from datetime import datetime
-import requests, base64
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.error import TelegramError, BadRequest
@@ -24,7 +23,12 @@ from ..db import query_db, execute_db
 from ..utils import register_new_user
 from ..helpers.flow import set_flow, clear_flow
 from ..helpers.keyboards import build_start_menu_keyboard
-from ..panel import VpnPanelAPI
+from ..helpers.menu_cache import get_tutorials_list
+from ..settings_store import get_setting, settings_snapshot
+from ..helpers.paging import parse_cursor_callback, cursor_nav_row
+from ..db import fetch_user_orders_page, get_user_order_counts
+from ..panel import VpnPanelAPI, fetch_user_configs, lookup_panel_users, get_user_usage
+from ..subscription_fetcher import fetch_subscription_configs
 from ..utils import bytes_to_gb
 from ..states import (
     WALLET_AWAIT_AMOUNT_CARD,
@@ -62,33 +66,6 @@ def _normalize_amount_text(text: str) -> str:
     return t
 
 
-def _fetch_subscription_configs(sub_url: str, timeout_seconds: int = 15) -> list[str]:
-    try:
-        headers = {
-            'Accept': 'text/plain, application/octet-stream, */*',
-            'User-Agent': 'Mozilla/5.0',
-        }
-        r = requests.get(sub_url, headers=headers, timeout=timeout_seconds)
-        r.raise_for_status()
-        raw = (r.text or '').strip()
-        if any(proto in raw for proto in ("vmess://","vless://","trojan://","ss://","hy2://")):
-            text = raw
-        else:
-            compact = "".join(raw.split())
-            pad = len(compact) % 4
-            if pad:
-                compact += "=" * (4 - pad)
-            try:
-                decoded = base64.b64decode(compact, validate=False)
-                text = decoded.decode('utf-8', errors='ignore')
-            except Exception:
-                text = raw
-        lines = [ln.strip() for ln in (text or '').splitlines()]
-        return [ln for ln in lines if ln and (ln.startswith('vmess://') or ln.startswith('vless://') or ln.startswith('trojan://') or ln.startswith('ss://') or ln.startswith('hy2://'))]
-    except Exception:
-        return []
-
-
 async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -112,8 +89,7 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
         return
 
     # Use admin-selected panel for free trials if set; fallback to first
-    cfg = query_db("SELECT value FROM settings WHERE key = 'free_trial_panel_id'", one=True)
-    sel_id = (cfg.get('value') if cfg else '') or ''
+    sel_id = str(get_setting('free_trial_panel_id') or '')
     first_panel = None
     if sel_id.isdigit():
         first_panel = query_db("SELECT id FROM panels WHERE id = ?", (int(sel_id),), one=True)
@@ -131,7 +107,7 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
     except Exception:
         pass
 
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings WHERE key LIKE 'free_trial_%'")}
+    settings = settings_snapshot()
     trial_plan = {'traffic_gb': settings.get('free_trial_gb', '0.2'), 'duration_days': settings.get('free_trial_days', '1')}
 
     panel_api = VpnPanelAPI(panel_id=first_panel['id'])
@@ -153,8 +129,8 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
         # For XUI-like panels, if a trial inbound is set, create on that inbound directly
         prow = query_db("SELECT panel_type FROM panels WHERE id = ?", (first_panel['id'],), one=True) or {}
         ptype = (prow.get('panel_type') or '').lower()
-        trial_inb_row = query_db("SELECT value FROM settings WHERE key='free_trial_inbound_id'", one=True)
-        trial_inb = int(trial_inb_row.get('value')) if (trial_inb_row and str(trial_inb_row.get('value') or '').isdigit()) else None
+        trial_inb_val = str(get_setting('free_trial_inbound_id') or '')
+        trial_inb = int(trial_inb_val) if trial_inb_val.isdigit() else None
         
         # Delete existing user from panel first to prevent duplicate email error
         import re as _re
@@ -202,9 +178,9 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
             prow = query_db("SELECT panel_type FROM panels WHERE id = ?", (first_panel['id'],), one=True) or {}
             ptype = (prow.get('panel_type') or '').lower()
             if ptype in ('xui','x-ui','3xui','3x-ui','alireza','txui','tx-ui','tx ui'):
-                trial_inb_row = query_db("SELECT value FROM settings WHERE key='free_trial_inbound_id'", one=True)
-                if trial_inb_row and str(trial_inb_row.get('value') or '').isdigit():
-                    xui_inb = int(trial_inb_row.get('value'))
+                trial_inb_val = str(get_setting('free_trial_inbound_id') or '')
+                if trial_inb_val.isdigit():
+                    xui_inb = int(trial_inb_val)
         except Exception:
             xui_inb = None
         if xui_inb is not None:
@@ -241,13 +217,13 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
                     ib_id = None
             if ib_id is not None and hasattr(panel_api, 'get_configs_for_user_on_inbound'):
                 try:
-                    confs = panel_api.get_configs_for_user_on_inbound(int(ib_id), marzban_username) or []
+                    confs = await fetch_user_configs(panel_api, int(ib_id), marzban_username) or []
                 except Exception:
                     confs = []
             if not confs and isinstance(config_link, str) and config_link.startswith('http'):
                 # Decode subscription content as a fallback
                 try:
-                    confs = _fetch_subscription_configs(config_link)
+                    confs = await fetch_subscription_configs(config_link)
                 except Exception:
                     confs = []
             if confs:
@@ -258,7 +234,7 @@ async def get_free_config_handler(update: Update, context: ContextTypes.DEFAULT_
                 except Exception:
                     confs_named = confs
                 cfg_text = "\n".join(f"<code>{c}</code>" for c in confs_named)
-                footer = ((query_db("SELECT value FROM settings WHERE key = 'config_footer_text'", one=True) or {}).get('value') or '')
+                footer = (get_setting('config_footer_text') or '')
                 text = (
                     f"✅ کانفیگ تست رایگان شما با موفقیت ساخته شد!\n\n"
                     f"<b>حجم:</b> {trial_plan['traffic_gb']} گیگابایت\n"
@@ -313,18 +289,18 @@ async def my_services_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
     user_id = query.from_user.id
     
-    # Get page number from callback data (default: page 1)
-    page = 1
-    if '_page_' in query.data:
-        try:
-            page = int(query.data.split('_page_')[1])
-        except Exception:
-            page = 1
-    
-    orders = query_db(
-        "SELECT * FROM orders WHERE user_id = ? AND status NOT IN ('deleted', 'canceled') ORDER BY timestamp DESC",
-        (user_id,)
+    # Keyset paging over idx_orders_user_id_desc; summary counts come from the per-user cache
+    per_page = 10
+    page, before_id, after_id = parse_cursor_callback(query.data)
+    orders, has_prev, has_next = fetch_user_orders_page(
+        user_id, limit=per_page, before_id=before_id, after_id=after_id,
+        offset=(page - 1) * per_page if before_id is None and after_id is None else 0,
+        exclude_statuses=('deleted', 'canceled'),
     )
+    if not orders and page > 1:
+        # Stale cursor (orders removed meanwhile): restart from the first page
+        page = 1
+        orders, has_prev, has_next = fetch_user_orders_page(user_id, limit=per_page, exclude_statuses=('deleted', 'canceled'))
     
     if not orders:
         keyboard = [
@@ -352,46 +328,29 @@ async def my_services_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
     
-    # Pagination: 10 services per page
-    per_page = 10
-    total_pages = (len(orders) + per_page - 1) // per_page
-    page = max(1, min(page, total_pages))
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    page_orders = orders[start_idx:end_idx]
+    page_orders = orders
     
     # Build inline keyboard for orders on current page
     keyboard = []
-    active_count = sum(1 for o in orders if (o.get('status') or '').lower() in ('active', 'approved'))
-    pending_count = sum(1 for o in orders if (o.get('status') or '').lower() in ('pending', 'awaiting', 'processing'))
-    expired_count = len(orders) - active_count - pending_count
-    
-    # Pre-fetch user info grouped by panel to avoid multiple logins
-    panel_users_cache = {}
+    status_counts = {(k or '').lower(): v for k, v in get_user_order_counts(user_id).items()}
+    total_count = sum(v for k, v in status_counts.items() if k not in ('deleted', 'canceled'))
+    active_count = sum(status_counts.get(k, 0) for k in ('active', 'approved'))
+    pending_count = sum(status_counts.get(k, 0) for k in ('pending', 'awaiting', 'processing'))
+    expired_count = total_count - active_count - pending_count
+    total_pages = max(1, (total_count + per_page - 1) // per_page)
+    
+    # Usage of just this page's services, one batched lookup per panel (run concurrently)
+    usernames_by_panel = {}
     for order in page_orders:
         if (order.get('status') or '').lower() in ('active', 'approved') and order.get('panel_id') and order.get('marzban_username'):
-            panel_id = order['panel_id']
-            if panel_id not in panel_users_cache:
-                panel_users_cache[panel_id] = {}
-    
-    # Fetch all users for each panel once
-    import asyncio
-    for panel_id in panel_users_cache.keys():
-        try:
-            panel_api = VpnPanelAPI(panel_id=panel_id)
-            # Get all users from this panel with timeout
-            users_list, _ = await asyncio.wait_for(
-                panel_api.get_all_users(limit=1000),
-                timeout=5.0
-            )
-            if users_list:
-                # Index by username for quick lookup
-                for user_info in users_list:
-                    username = user_info.get('username')
-                    if username:
-                        panel_users_cache[panel_id][username] = user_info
-        except Exception:
-            pass  # Silently fail - panel might be down
+            usernames_by_panel.setdefault(order['panel_id'], []).append(order['marzban_username'])
+    panel_users_cache = {}
+    if usernames_by_panel:
+        import asyncio
+        results = await asyncio.gather(*(
+            lookup_panel_users(panel_id, names, timeout=5.0) for panel_id, names in usernames_by_panel.items()
+        ))
+        panel_users_cache = dict(zip(usernames_by_panel.keys(), results))
     
     for order in page_orders:
         # Show custom service name if user set one, otherwise show plan name
@@ -427,13 +386,8 @@ async def my_services_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         keyboard.append([InlineKeyboardButton(label, callback_data=f"view_service_{order['id']}")])    
     
     # Pagination buttons
-    if total_pages > 1:
-        nav_row = []
-        if page > 1:
-            nav_row.append(InlineKeyboardButton("◀️ قبلی", callback_data=f'my_services_page_{page-1}'))
-        nav_row.append(InlineKeyboardButton(f"📄 {page}/{total_pages}", callback_data='noop'))
-        if page < total_pages:
-            nav_row.append(InlineKeyboardButton("بعدی ▶️", callback_data=f'my_services_page_{page+1}'))
+    nav_row = cursor_nav_row('my_services', page, total_pages, page_orders, has_prev, has_next, next_label="بعدی ▶️")
+    if nav_row:
         keyboard.append(nav_row)
     
     # Quick actions
@@ -459,7 +413,7 @@ async def my_services_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"{active_emoji} <b>فعال:</b> {active_count} عدد\n"
         f"{pending_emoji} <b>در انتظار:</b> {pending_count} عدد\n"
         f"{expired_emoji} <b>منقضی شده:</b> {expired_count} عدد\n"
-        f"📦 <b>کل سرویس‌ها:</b> {len(orders)} عدد\n\n"
+        f"📦 <b>کل سرویس‌ها:</b> {total_count} عدد\n\n"
         f"━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
     )
     
@@ -476,7 +430,7 @@ async def my_services_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"   ✅ فعال: <b>{active_count}</b> سرویس\n"
         f"   ⏳ در انتظار: <b>{pending_count}</b> سرویس\n"
         f"   ❌ منقضی: <b>{expired_count}</b> سرویس\n"
-        f"   📦 مجموع: <b>{len(orders)}</b> سرویس\n\n"
+        f"   📦 مجموع: <b>{total_count}</b> سرویس\n\n"
         f"━━━━━━━━━━━━━━━━━━━━━━━━\n"
         f"💡 <i>برای مشاهده جزئیات، روی هر سرویس کلیک کنید.</i>"
     )
@@ -552,10 +506,7 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
     try:
         import asyncio
         logger.info(f"[view_service] Calling get_user for {marzban_username}")
-        user_info, message = await asyncio.wait_for(
-            panel_api.get_user(marzban_username),
-            timeout=15.0
-        )
+        user_info, message, cached_at = await get_user_usage(panel_api, marzban_username, timeout=15.0)
         logger.info(f"[view_service] get_user returned: user_info={'OK' if user_info else 'None'}, message={message}")
     except asyncio.TimeoutError:
         logger.error(f"[view_service] Timeout getting user {marzban_username} from panel {panel_id}")
@@ -605,6 +556,12 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
         else user_info.get('subscription_url', 'لینک یافت نشد')
     )
 
+    # Panel unavailable: usage comes from the last successful read
+    stale_note = ""
+    if cached_at:
+        mins = max(1, int((time.time() - cached_at) / 60))
+        stale_note = f"\n⚠️ <i>پنل در دسترس نیست؛ اطلاعات {mins} دقیقه پیش نمایش داده می‌شود.</i>\n"
+
     # For 3x-UI/X-UI panels, try to show direct configs instead of sub link
     panel_type = (order.get('panel_type') or '').lower()
     if not panel_type and order.get('panel_id'):
@@ -627,9 +584,9 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
                     if inbounds:
                         ib_id = inbounds[0].get('id')
                 if ib_id is not None:
-                    confs = panel_api.get_configs_for_user_on_inbound(ib_id, marzban_username) or []
+                    confs = await fetch_user_configs(panel_api, ib_id, marzban_username) or []
             if not confs and sub_link and isinstance(sub_link, str) and sub_link.startswith('http'):
-                confs = _fetch_subscription_configs(sub_link)
+                confs = await fetch_subscription_configs(sub_link)
             if confs:
                 cfgs = "\n".join(f"<code>{c}</code>" for c in confs[:1])
                 # Try to also show subscription link under configs
@@ -649,7 +606,7 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
 
     # Respect setting: user_show_quota_enabled
     try:
-        show_quota = (query_db("SELECT value FROM settings WHERE key='user_show_quota_enabled'", one=True) or {}).get('value')
+        show_quota = get_setting('user_show_quota_enabled')
         show_quota = (show_quota or '1') == '1'
     except Exception:
         show_quota = True
@@ -661,7 +618,7 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
             f"━━━━━━━━━━━━━━━━━━━━━━━━\n"
             f"📊 <b>حجم کل:</b> {data_limit_gb}\n"
             f"📈 <b>حجم مصرفی:</b> {data_used_gb} گیگابایت\n"
-            f"📅 <b>تاریخ انقضا:</b> {expire_display}\n\n"
+            f"📅 <b>تاریخ انقضا:</b> {expire_display}\n{stale_note}\n"
             f"━━━━━━━━━━━━━━━━━━━━━━━━\n"
             f"<b>{link_label}</b>\n{link_value}"
         )
@@ -670,7 +627,7 @@ async def show_specific_service_details(update: Update, context: ContextTypes.DE
             f"📦 <b>مشخصات سرویس</b>\n"
             f"<code>{marzban_username}</code>\n\n"
             f"━━━━━━━━━━━━━━━━━━━━━━━━\n"
-            f"📅 <b>تاریخ انقضا:</b> {expire_display}\n\n"
+            f"📅 <b>تاریخ انقضا:</b> {expire_display}\n{stale_note}\n"
             f"━━━━━━━━━━━━━━━━━━━━━━━━\n"
             f"<b>{link_label}</b>\n{link_value}"
         )
@@ -751,7 +708,7 @@ async def view_service_qr(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             confs = []
             if ib_id is not None and hasattr(panel_api, 'get_configs_for_user_on_inbound'):
                 try:
-                    confs = panel_api.get_configs_for_user_on_inbound(ib_id, order['marzban_username']) or []
+                    confs = await fetch_user_configs(panel_api, ib_id, order['marzban_username']) or []
                 except Exception:
                     confs = []
             if confs:
@@ -1044,12 +1001,8 @@ async def refresh_service_link(update: Update, context: ContextTypes.DEFAULT_TYP
             # try multiple times to account for propagation
             confs = []
             if hasattr(panel_api, 'get_configs_for_user_on_inbound'):
-                for _ in range(4):
-                    pref_id = (order.get('xui_client_id') or None)
-                    confs = panel_api.get_configs_for_user_on_inbound(ib_id, order['marzban_username'], preferred_id=pref_id) or []
-                    if confs:
-                        break
-                    time.sleep(1.0)
+                pref_id = (order.get('xui_client_id') or None)
+                confs = await fetch_user_configs(panel_api, ib_id, order['marzban_username'], preferred_id=pref_id)
             if not confs:
                 # decode subscription as fallback for display
                 user_info, message = await panel_api.get_user(order['marzban_username'])
@@ -1058,7 +1011,8 @@ async def refresh_service_link(update: Update, context: ContextTypes.DEFAULT_TYP
                         f"{panel_api.base_url}{user_info['subscription_url']}" if user_info.get('subscription_url') and not user_info['subscription_url'].startswith('http') else user_info.get('subscription_url', '')
                     )
                     if sub:
-                        confs = _fetch_subscription_configs(sub)
+                        # Explicit refresh: revalidate instead of serving the cached copy
+                        confs = await fetch_subscription_configs(sub, max_age=0)
             if not confs:
                 try:
                     await context.bot.send_message(chat_id=query.message.chat_id, text="ساخت کانفیگ ناموفق بود - کمی بعد دوباره تلاش کنید.")
@@ -1236,7 +1190,7 @@ async def revoke_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             try:
                 # Try to reuse X-UI/3x-UI config builder with preferred new id
                 if hasattr(panel_api, 'get_configs_for_user_on_inbound'):
-                    confs = panel_api.get_configs_for_user_on_inbound(ib_id, order['marzban_username'], preferred_id=(new_client.get('id') or new_client.get('uuid'))) or []
+                    confs = await fetch_user_configs(panel_api, ib_id, order['marzban_username'], preferred_id=(new_client.get('id') or new_client.get('uuid'))) or []
                 if confs:
                     try:
                         disp_name = (order.get('marzban_username') or '')
@@ -1461,7 +1415,7 @@ async def _wallet_show_gateway_message(update: Update, context: ContextTypes.DEF
     if not amount:
         await update.message.reply_text("خطا: مبلغ یافت نشد.")
         return ConversationHandler.END
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     callback_url = (settings.get('gateway_callback_url') or '').strip()
     amount_rial = int(amount) * 10
@@ -1519,7 +1473,7 @@ async def wallet_verify_gateway(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.edit_text("اطلاعات پرداخت یافت نشد.")
         return ConversationHandler.END
     ok = False
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+    settings = settings_snapshot()
     if gw.get('type') == 'zarinpal':
         from .purchase import _zarinpal_verify
         ok, _ = _zarinpal_verify(settings.get('zarinpal_merchant_id') or '', gw.get('amount_rial', 0), gw.get('authority',''))
@@ -1820,7 +1774,7 @@ async def ticket_receive_message(update: Update, context: ContextTypes.DEFAULT_T
 async def tutorials_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    rows = query_db("SELECT id, title FROM tutorials ORDER BY sort_order, id DESC")
+    rows = get_tutorials_list()
     
     if not rows:
         text = (
@@ -1904,8 +1858,7 @@ async def referral_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     link = f"https://t.me/{(await context.bot.get_me()).username}?start={uid}"
     total = query_db("SELECT COUNT(*) AS c FROM referrals WHERE referrer_id = ?", (uid,), one=True) or {'c': 0}
     buyers = query_db("SELECT COUNT(DISTINCT o.user_id) AS c FROM orders o JOIN referrals r ON r.referee_id = o.user_id WHERE r.referrer_id = ? AND o.status='approved'", (uid,), one=True) or {'c': 0}
-    cfg = query_db("SELECT value FROM settings WHERE key = 'referral_commission_percent'", one=True)
-    percent = int((cfg.get('value') if cfg else '10') or 10)
+    percent = int(get_setting('referral_commission_percent', '10') or 10)
     text = (
         "معرفی به دوستان\n\n"
         f"لینک اختصاصی شما:\n{link}\n\n"
@@ -1922,7 +1875,7 @@ async def reseller_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = query.from_user.id
     # Mark intent so direct uploads are accepted even if button wasn't pressed
     context.user_data['reseller_intent'] = True
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     if settings.get('reseller_enabled', '1') != '1':
         await query.message.edit_text("قابلیت نمایندگی موقتا غیرفعال است.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("\U0001F519 بازگشت", callback_data='start_main')]]))
         return ConversationHandler.END
@@ -1980,7 +1933,7 @@ async def reseller_pay_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     context.user_data['reseller_intent'] = True
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     text = (
         f"پرداخت هزینه نمایندگی ({fee:,} تومان)\n\nروش پرداخت خود را انتخاب کنید:"
@@ -1998,7 +1951,7 @@ async def reseller_pay_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def reseller_pay_card(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     cards = query_db("SELECT card_number, holder_name FROM cards") or []
     if not cards:
@@ -2017,7 +1970,7 @@ async def reseller_pay_card(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def reseller_pay_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     wallets = query_db("SELECT asset, chain, address, memo FROM wallets ORDER BY id DESC") or []
     if not wallets:
@@ -2037,7 +1990,7 @@ async def reseller_pay_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def reseller_pay_gateway(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     gateway_type = (settings.get('gateway_type') or 'zarinpal').lower()
     callback_url = (settings.get('gateway_callback_url') or '').strip()
@@ -2093,7 +2046,7 @@ async def reseller_verify_gateway(update: Update, context: ContextTypes.DEFAULT_
         await query.message.edit_text("اطلاعات پرداخت یافت نشد.")
         return ConversationHandler.END
     ok = False
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     if gw.get('type') == 'zarinpal':
         from .purchase import _zarinpal_verify
         ok, ref_id = _zarinpal_verify(settings.get('zarinpal_merchant_id') or '', gw.get('amount_rial', 0), gw.get('authority',''))
@@ -2108,7 +2061,7 @@ async def reseller_verify_gateway(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
     # Log request and notify admins
     user = query.from_user
-    settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+    settings = settings_snapshot()
     fee = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     rr_id = execute_db(
         "INSERT INTO reseller_requests (user_id, amount, method, status, created_at, reference) VALUES (?, ?, ?, 'pending', ?, ?)",
@@ -2148,7 +2101,7 @@ async def reseller_upload_router(update: Update, context: ContextTypes.DEFAULT_T
     method = pay.get('method') or 'card'
     amount = int(pay.get('amount') or 0)
     if amount <= 0:
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")} or {}
+        settings = settings_snapshot()
         amount = int((settings.get('reseller_fee_toman') or '200000') or 200000)
     file_id = None
     caption_extra = ''
@@ -2516,7 +2469,7 @@ async def purchase_method_selected(update: Update, context: ContextTypes.DEFAULT
         return ConversationHandler.END
 
     if payment_method == 'gateway':
-        settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+        settings = settings_snapshot()
         # ... existing code ...
 
 async def purchase_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
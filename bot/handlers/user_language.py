@@ -4,7 +4,7 @@ Language Selection and Preferences Handlers
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
-from ..i18n import get_i18n, t, TRANSLATIONS
+from ..i18n import get_i18n, t
 
 
 async def language_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -76,7 +76,7 @@ async def preferences_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     i18n = get_i18n()
     lang = i18n.get_user_lang(user_id)
     
-    text = t('preferences_title', user_id) if 'preferences_title' in TRANSLATIONS.get(lang, {}) else "⚙️ تنظیمات"
+    text = t('preferences_title', user_id) if i18n.has('preferences_title', lang) else "⚙️ تنظیمات"
     text += "\n\n━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
     text += f"🌍 زبان: <b>{i18n.get_available_languages()[lang]}</b>\n"
     text += "🔔 اعلان‌ها: <b>فعال</b>\n"
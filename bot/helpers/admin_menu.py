@@ -3,6 +3,7 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from ..db import query_db
+from ..settings_store import get_setting
 
 async def get_admin_stats():
     """Get quick stats for admin dashboard"""
@@ -38,7 +39,7 @@ def get_main_menu_keyboard():
     """Generate main admin menu keyboard"""
     # Get bot active status
     try:
-        active_val = (query_db("SELECT value FROM settings WHERE key='bot_active'", one=True) or {}).get('value') or '1'
+        active_val = get_setting('bot_active') or '1'
         bot_on = str(active_val) == '1'
     except Exception:
         bot_on = True
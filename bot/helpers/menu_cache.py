@@ -0,0 +1,83 @@
+"""Versioned cache for DB-driven menus
+
+Entries are keyed by ``(name, *args)`` and tagged with ``db.get_menu_version()``,
+which ``execute_db`` bumps on every write to buttons / messages / plans /
+tutorials / settings. A menu tap therefore costs no query until an admin edits
+something; ``MENU_CACHE_TTL`` only bounds staleness for writes made by another
+process (e.g. a manual sqlite session). A menu built while a query failed (and
+so came back empty) is returned but not cached; the previous entry, if any,
+is served instead.
+"""
+import os
+import time
+from typing import Callable, Dict, Tuple
+
+from ..db import get_menu_version, get_query_error_count, query_db
+from ..settings_store import get_setting
+
+MENU_CACHE_TTL = int(os.getenv('MENU_CACHE_TTL', '300'))
+
+_entries: Dict[Tuple, tuple] = {}
+
+
+def cached_menu(name: str, builder: Callable, *args):
+    """Return ``builder(*args)``, rebuilt only when the menu version changes"""
+    key = (name, *args)
+    version = get_menu_version()
+    now = time.monotonic()
+    hit = _entries.get(key)
+    if hit and hit[0] == version and now - hit[1] < MENU_CACHE_TTL:
+        return hit[2]
+    errors = get_query_error_count()
+    value = builder(*args)
+    if get_query_error_count() != errors:
+        # query_db answered [] / None for a failed query: don't keep that for MENU_CACHE_TTL
+        return hit[2] if hit else value
+    _entries[key] = (version, now, value)
+    return value
+
+
+def clear_menu_cache():
+    _entries.clear()
+
+
+def _load_messages() -> Dict[str, dict]:
+    rows = query_db("SELECT message_name, text, file_id, file_type FROM messages") or []
+    return {r['message_name']: r for r in rows}
+
+
+def get_dynamic_message(message_name: str):
+    """Row of ``messages`` for ``message_name`` (or None) from one cached table scan"""
+    return cached_menu('messages', _load_messages).get(message_name)
+
+
+def _load_menu_buttons(menu_name: str):
+    return query_db(
+        "SELECT text, target, is_url, row, col FROM buttons WHERE menu_name = ? ORDER BY row, col",
+        (menu_name,),
+    ) or []
+
+
+def get_menu_buttons(menu_name: str):
+    return cached_menu('buttons', _load_menu_buttons, menu_name)
+
+
+def get_menu_setting(key: str):
+    """Settings value used while rendering menus (e.g. ``free_trial_status``)"""
+    return get_setting(key)
+
+
+def _load_plans():
+    return query_db("SELECT id, name, price FROM plans ORDER BY price") or []
+
+
+def get_plans_list():
+    return cached_menu('plans', _load_plans)
+
+
+def _load_tutorials():
+    return query_db("SELECT id, title FROM tutorials ORDER BY sort_order, id DESC") or []
+
+
+def get_tutorials_list():
+    return cached_menu('tutorials', _load_tutorials)
@@ -0,0 +1,39 @@
+"""Cursor (keyset) paging helpers for order lists
+
+Callback data layout: ``<prefix>_page_<n>_<b|a><id>`` where ``b<id>`` means
+"rows older than id" (next page) and ``a<id>`` "rows newer than id"
+(previous page). ``<prefix>_page_<n>`` without a cursor is still accepted
+for buttons rendered before cursor paging existed.
+"""
+import re
+
+from telegram import InlineKeyboardButton
+
+_CURSOR_RE = re.compile(r"_page_(\d+)(?:_([ab])(\d+))?$")
+
+
+def parse_cursor_callback(data: str):
+    """Return ``(page, before_id, after_id)`` parsed from callback data"""
+    m = _CURSOR_RE.search(data or '')
+    if not m:
+        return 1, None, None
+    page = max(1, int(m.group(1)))
+    if m.group(2) == 'b':
+        return page, int(m.group(3)), None
+    if m.group(2) == 'a':
+        return page, None, int(m.group(3))
+    return page, None, None
+
+
+def cursor_nav_row(prefix: str, page: int, total_pages: int, rows, has_prev: bool, has_next: bool,
+                   prev_label: str = "◀️ قبلی", next_label: str = "▶️ بعدی"):
+    """Prev / page-counter / next buttons for a keyset-paged list (empty if single page)"""
+    if not rows or (not has_prev and not has_next):
+        return []
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(prev_label, callback_data=f"{prefix}_page_{max(1, page - 1)}_a{rows[0]['id']}"))
+    nav.append(InlineKeyboardButton(f"📄 {page}/{max(page, total_pages)}", callback_data='noop'))
+    if has_next:
+        nav.append(InlineKeyboardButton(next_label, callback_data=f"{prefix}_page_{page + 1}_b{rows[-1]['id']}"))
+    return nav
@@ -2,9 +2,12 @@
 Internationalization (i18n) System
 Multi-language support for the bot
 """
+import os
+import string
+import time
+from collections import OrderedDict
 from typing import Dict, Optional
 from .db import query_db, execute_db
-from .cache_manager import cached
 
 # Default translations
 TRANSLATIONS = {
@@ -136,30 +139,110 @@ TRANSLATIONS = {
 }
 
 
+LANG_CACHE_SIZE = int(os.getenv('I18N_LANG_CACHE_SIZE', '20000'))
+# How often (seconds) t() checks whether custom translations changed in the DB
+RELOAD_CHECK_SECONDS = float(os.getenv('I18N_RELOAD_CHECK_SECONDS', '30'))
+_VERSION_KEY = 'translations_version'
+_formatter = string.Formatter()
+
+
+class _Template:
+    """Pre-parsed translation text: plain literal, simple ``{name}`` joins, or full str.format"""
+
+    __slots__ = ('text', 'parts', 'simple')
+
+    def __init__(self, text: str):
+        self.text = text
+        try:
+            parsed = list(_formatter.parse(text))
+        except ValueError:
+            parsed = [(text, None, None, None)]
+        self.parts = [(lit, field) for lit, field, _, _ in parsed]
+        self.simple = all(
+            field is None or (field.isidentifier() and not spec and not conv)
+            for _, field, spec, conv in parsed
+        )
+        if all(field is None for _, field in self.parts):
+            # No placeholders: keep the literal (``{{`` already unescaped by the parser)
+            self.text = ''.join(lit for lit, _ in self.parts)
+            self.parts = None
+
+    def render(self, kwargs: Dict) -> str:
+        if self.parts is None:
+            return self.text
+        if self.simple:
+            out = []
+            for lit, field in self.parts:
+                out.append(lit)
+                if field is not None:
+                    out.append(str(kwargs[field]))
+            return ''.join(out)
+        return self.text.format(**kwargs)
+
+
 class I18n:
     """Internationalization manager"""
     
     def __init__(self, default_lang: str = 'fa'):
         self.default_lang = default_lang
+        self._custom: Dict[str, Dict[str, str]] = {}
+        self._templates: Dict[tuple, _Template] = {}
+        self._user_langs: "OrderedDict[int, str]" = OrderedDict()
+        self._version = None
+        self._next_check = 0.0
         self._load_custom_translations()
     
+    def _db_version(self):
+        row = query_db("SELECT value FROM settings WHERE key = ?", (_VERSION_KEY,), one=True)
+        return row.get('value') if row else None
+    
     def _load_custom_translations(self):
-        """Load custom translations from database"""
+        """Load custom translations from database (overlay on TRANSLATIONS)"""
+        custom: Dict[str, Dict[str, str]] = {}
         try:
-            custom = query_db("SELECT lang, key, value FROM translations")
-            for row in custom:
-                lang = row['lang']
-                key = row['key']
-                value = row['value']
-                
-                if lang not in TRANSLATIONS:
-                    TRANSLATIONS[lang] = {}
-                TRANSLATIONS[lang][key] = value
+            self._version = self._db_version()
+            for row in query_db("SELECT lang, key, value FROM translations") or []:
+                custom.setdefault(row['lang'], {})[row['key']] = row['value']
         except Exception:
             pass  # Table might not exist yet
+        self._custom = custom
+        self._templates = {}
+        self._next_check = time.monotonic() + RELOAD_CHECK_SECONDS
+    
+    def _maybe_reload(self):
+        """Hot-reload custom translations when the DB version moved (checked at most every RELOAD_CHECK_SECONDS)"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + RELOAD_CHECK_SECONDS
+        try:
+            if self._db_version() != self._version:
+                self._load_custom_translations()
+        except Exception:
+            pass
+    
+    def reload(self):
+        self._load_custom_translations()
+    
+    def set_custom_translation(self, lang: str, key: str, value: Optional[str]):
+        """Create/replace (or delete with ``value=None``) a custom translation and apply it now"""
+        if value is None:
+            execute_db("DELETE FROM translations WHERE lang = ? AND key = ?", (lang, key))
+        else:
+            execute_db(
+                "INSERT OR REPLACE INTO translations (lang, key, value) VALUES (?, ?, ?)",
+                (lang, key, value)
+            )
+        self._load_custom_translations()
     
     def get_user_lang(self, user_id: int) -> str:
-        """Get user's preferred language"""
+        """Get user's preferred language (bounded LRU in front of user_preferences)"""
+        cache = self._user_langs
+        lang = cache.get(user_id)
+        if lang is not None:
+            cache.move_to_end(user_id)
+            return lang
+        lang = self.default_lang
         try:
             result = query_db(
                 "SELECT language FROM user_preferences WHERE user_id = ?",
@@ -167,12 +250,20 @@ class I18n:
                 one=True
             )
             if result and isinstance(result, dict):
-                lang = result.get('language', self.default_lang)
+                value = result.get('language', self.default_lang)
                 # Ensure we return a string, not a dict
-                return lang if isinstance(lang, str) else self.default_lang
-            return self.default_lang
+                lang = value if isinstance(value, str) else self.default_lang
         except Exception:
             return self.default_lang
+        self._remember_lang(user_id, lang)
+        return lang
+    
+    def _remember_lang(self, user_id: int, lang: str):
+        cache = self._user_langs
+        cache[user_id] = lang
+        cache.move_to_end(user_id)
+        while len(cache) > LANG_CACHE_SIZE:
+            cache.popitem(last=False)
     
     def set_user_lang(self, user_id: int, lang: str):
         """Set user's preferred language"""
@@ -182,34 +273,45 @@ class I18n:
                    VALUES (?, ?)""",
                 (user_id, lang)
             )
-            # Clear cache
-            from .cache_manager import get_cache
-            get_cache().delete(f"i18n:get_user_lang:{user_id}")
+            self._remember_lang(user_id, lang)
         except Exception as e:
             from .config import logger
+            self._user_langs.pop(user_id, None)
             logger.error(f"Set user lang error: {e}")
     
+    def _lookup(self, key: str, lang: str) -> Optional[str]:
+        text = self._custom.get(lang, {}).get(key)
+        if text is None:
+            text = TRANSLATIONS.get(lang, {}).get(key)
+        return text
+    
+    def has(self, key: str, lang: str) -> bool:
+        return self._lookup(key, lang) is not None
+    
+    def _template(self, key: str, lang: str) -> _Template:
+        tpl = self._templates.get((lang, key))
+        if tpl is None:
+            text = self._lookup(key, lang)
+            # Fallback to default language
+            if text is None:
+                text = self._lookup(key, self.default_lang)
+            tpl = self._templates[(lang, key)] = _Template(key if text is None else text)
+        return tpl
+    
     def t(self, key: str, lang: Optional[str] = None, **kwargs) -> str:
         """Translate a key"""
-        if lang is None:
-            lang = self.default_lang
-        
         # Ensure lang is a string
         if not isinstance(lang, str):
             lang = self.default_lang
         
-        # Try to get translation for the language
-        text = TRANSLATIONS.get(lang, {}).get(key)
-        
-        # Fallback to default language
-        if text is None:
-            text = TRANSLATIONS.get(self.default_lang, {}).get(key, key)
+        self._maybe_reload()
+        tpl = self._template(key, lang)
         
         # Format with kwargs
         try:
-            return text.format(**kwargs)
+            return tpl.render(kwargs)
         except Exception:
-            return text
+            return tpl.text
     
     def get_available_languages(self) -> Dict[str, str]:
         """Get list of available languages"""
@@ -240,34 +342,6 @@ def t(key: str, user_id: Optional[int] = None, **kwargs) -> str:
 
 # Database migration for translations
 def setup_i18n_tables():
-    """Create i18n tables"""
-    try:
-        from .db import execute_db
-        
-        # User preferences table
-        execute_db("""
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                user_id INTEGER PRIMARY KEY,
-                language TEXT NOT NULL DEFAULT 'fa',
-                theme TEXT DEFAULT 'default',
-                notifications_enabled INTEGER DEFAULT 1
-            )
-        """)
-        
-        # Custom translations table
-        execute_db("""
-            CREATE TABLE IF NOT EXISTS translations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lang TEXT NOT NULL,
-                key TEXT NOT NULL,
-                value TEXT NOT NULL,
-                UNIQUE(lang, key)
-            )
-        """)
-        
-        from .config import logger
-        logger.info("✅ i18n tables created")
-        
-    except Exception as e:
-        from .config import logger
-        logger.error(f"i18n setup error: {e}")
+    """Create i18n tables (owned by bot.migrations)"""
+    from .migrations import ensure_schema
+    ensure_schema()
@@ -0,0 +1,237 @@
+"""
+Precompiled intent index for the AI assistant
+* Aho-Corasick automaton: every static intent pattern found as a substring in one pass
+* Char n-gram TF-IDF index: shortlists fuzzy candidates (cosine) over static and learned
+  patterns; only the shortlist is confirmed with SequenceMatcher, so the confidence rules
+  of the old per-pattern loop are kept
+
+Learned patterns are appended incrementally; document norms are recomputed only
+when the corpus has grown enough for IDF weights to drift.
+"""
+import heapq
+import math
+from collections import deque
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Tuple
+
+NGRAM = 3
+# SequenceMatcher ratios of the original matcher
+STATIC_FUZZY_THRESHOLD = 0.7
+LEARNED_FUZZY_THRESHOLD = 0.8
+# Cosine floor and size of the shortlist handed to SequenceMatcher
+CANDIDATE_MIN_SCORE = 0.3
+CANDIDATE_LIMIT = 8
+SUBSTRING_CONFIDENCE = 0.9
+FUZZY_CONFIDENCE = 0.7
+# Re-weight all documents once the corpus grows by this factor since the last full pass
+REWEIGHT_GROWTH = 1.2
+
+
+def normalize(text: str) -> str:
+    return ' '.join((text or '').lower().split())
+
+
+def char_ngrams(text: str, n: int = NGRAM) -> Dict[str, int]:
+    padded = f" {text} "
+    grams: Dict[str, int] = {}
+    if len(padded) < n:
+        grams[padded] = 1
+        return grams
+    for i in range(len(padded) - n + 1):
+        g = padded[i:i + n]
+        grams[g] = grams.get(g, 0) + 1
+    return grams
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher; ``find(text)`` yields payload ids of every pattern present"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        self._built = True
+
+    def add(self, pattern: str, payload: int):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(payload)
+        self._built = False
+
+    def build(self):
+        queue = deque()
+        for ch, nxt in self._goto[0].items():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def find(self, text: str) -> Iterable[int]:
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield from out[node]
+
+
+class NgramIndex:
+    """Inverted char-n-gram index with TF-IDF weights and cosine scoring"""
+
+    def __init__(self):
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._doc_grams: List[Dict[str, int]] = []
+        self._norms: List[float] = []
+        self._weighted_at = 0
+
+    def __len__(self):
+        return len(self._doc_grams)
+
+    def _idf(self, gram: str) -> float:
+        df = len(self._postings.get(gram, ()))
+        return math.log((1 + len(self._doc_grams)) / (1 + df)) + 1.0
+
+    def _norm(self, grams: Dict[str, int]) -> float:
+        return math.sqrt(sum((tf * self._idf(g)) ** 2 for g, tf in grams.items())) or 1.0
+
+    def add(self, text: str) -> int:
+        doc_id = len(self._doc_grams)
+        grams = char_ngrams(text)
+        self._doc_grams.append(grams)
+        for g, tf in grams.items():
+            self._postings.setdefault(g, []).append((doc_id, tf))
+        self._norms.append(self._norm(grams))
+        if len(self._doc_grams) >= max(16, self._weighted_at * REWEIGHT_GROWTH):
+            self.reweight()
+        return doc_id
+
+    def reweight(self):
+        self._norms = [self._norm(g) for g in self._doc_grams]
+        self._weighted_at = len(self._doc_grams)
+
+    def search(self, text: str, min_score: float) -> Dict[int, float]:
+        """Cosine similarity for every document scoring at least ``min_score``"""
+        q = char_ngrams(text)
+        n_docs = len(self._doc_grams)
+        if not n_docs:
+            return {}
+        scores: Dict[int, float] = {}
+        q_sq = 0.0
+        for g, qtf in q.items():
+            idf = self._idf(g)
+            qw = qtf * idf
+            q_sq += qw * qw
+            posting = self._postings.get(g)
+            if not posting:
+                continue
+            # Grams present in most documents carry almost no signal; skip their long postings
+            if n_docs > 100 and len(posting) > n_docs // 2:
+                continue
+            w = qw * idf
+            for doc_id, tf in posting:
+                scores[doc_id] = scores.get(doc_id, 0.0) + w * tf
+        q_norm = math.sqrt(q_sq) or 1.0
+        norms = self._norms
+        return {d: s / (q_norm * norms[d]) for d, s in scores.items() if s / (q_norm * norms[d]) >= min_score}
+
+
+class IntentIndex:
+    """Built once from the intents table (+ verified learned patterns), queried per message"""
+
+    def __init__(self):
+        self._ac = AhoCorasick()
+        self._fuzzy = NgramIndex()
+        # payload id -> (intent, learned, normalized pattern)
+        self._docs: List[Tuple[str, bool, str]] = []
+        self._priority: Dict[str, float] = {}
+        self._learned_conf: Dict[str, float] = {}
+        self._learned_seen = set()
+
+    @classmethod
+    def build(cls, intents: Dict[str, Dict], learned: Iterable[Dict] = ()) -> 'IntentIndex':
+        idx = cls()
+        for name, data in intents.items():
+            idx._priority[name] = data.get('priority') or 0
+            for pattern in data.get('patterns') or []:
+                p = normalize(pattern)
+                if not p:
+                    continue
+                doc = len(idx._docs)
+                idx._docs.append((name, False, p))
+                idx._ac.add(p, doc)
+                idx._fuzzy.add(p)
+        idx._ac.build()
+        for row in learned:
+            idx.add_learned(row['pattern'], row['intent'], row.get('confidence') or 0.0)
+        idx._fuzzy.reweight()
+        return idx
+
+    def set_priority(self, intent: str, priority: float):
+        self._priority[intent] = priority
+
+    def add_learned(self, pattern: str, intent: str, confidence: float):
+        """Incrementally index a verified learned pattern"""
+        p = normalize(pattern)
+        if not p:
+            return
+        if confidence > self._learned_conf.get(intent, 0.0):
+            self._learned_conf[intent] = confidence
+        if (p, intent) in self._learned_seen:
+            return
+        self._learned_seen.add((p, intent))
+        self._docs.append((intent, True, p))
+        self._fuzzy.add(p)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def match(self, message: str) -> Tuple[Optional[str], float]:
+        text = normalize(message)
+        best_intent, best = None, 0.0
+
+        def consider(intent: str, conf: float):
+            nonlocal best_intent, best
+            if conf > best:
+                best_intent, best = intent, conf
+
+        substring_hits = set()
+        for doc in self._ac.find(text):
+            intent = self._docs[doc][0]
+            if intent not in substring_hits:
+                substring_hits.add(intent)
+                consider(intent, SUBSTRING_CONFIDENCE + self._priority.get(intent, 0) * 0.1)
+
+        candidates = self._fuzzy.search(text, CANDIDATE_MIN_SCORE)
+        for doc in heapq.nlargest(CANDIDATE_LIMIT, candidates, key=candidates.get):
+            intent, learned, pattern = self._docs[doc]
+            if not learned and intent in substring_hits:
+                continue
+            ratio = SequenceMatcher(None, pattern, text).ratio()
+            if learned:
+                if ratio > LEARNED_FUZZY_THRESHOLD:
+                    consider(intent, self._learned_conf.get(intent, 0.0))
+            elif ratio > STATIC_FUZZY_THRESHOLD:
+                consider(intent, FUZZY_CONFIDENCE + self._priority.get(intent, 0) * 0.1)
+
+        return best_intent, min(best, 1.0)
@@ -6,6 +6,7 @@ from telegram.ext import ContextTypes
 
 from .config import logger
 from .db import query_db, execute_db
+from .settings_store import settings_snapshot
 from .panel import VpnPanelAPI
 from .utils import bytes_to_gb
 from .memory_optimizer import cleanup_memory, log_memory_stats, check_memory_threshold
@@ -15,7 +16,7 @@ async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
     logger.info("Running daily expiration check job...")
     log_memory_stats()  # Log initial memory state
     
-    st_global = {s['key']: s['value'] for s in (query_db("SELECT key, value FROM settings WHERE key IN ('reminder_job_enabled')") or [])}
+    st_global = settings_snapshot()
     if (st_global.get('reminder_job_enabled') or '1') != '1':
         logger.info("Reminder job disabled by settings. Skipping run.")
         return
@@ -66,7 +67,7 @@ async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Reseller expiry check failed: {e}")
 
     # Load alert settings once
-    st = {s['key']: s['value'] for s in (query_db("SELECT key, value FROM settings WHERE key IN ('traffic_alert_enabled','traffic_alert_value_gb','time_alert_enabled','time_alert_days')") or [])}
+    st = settings_snapshot()
     alert_enabled = (st.get('traffic_alert_enabled') or '0') == '1'
     try:
         alert_gb = float(st.get('traffic_alert_value_gb') or 5)
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta
 from telegram.constants import ParseMode
 from telegram.error import Forbidden, BadRequest
@@ -5,13 +6,15 @@ from telegram.ext import ContextTypes
 
 from ..config import logger
 from ..db import query_db, execute_db
+from ..settings_store import settings_snapshot
 from ..panel import VpnPanelAPI
+from ..usage_snapshot import UsageThresholds, get_usage_collector
 from ..utils import bytes_to_gb
 
 
 async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
     logger.info("Running daily expiration check job...")
-    st_global = {s['key']: s['value'] for s in (query_db("SELECT key, value FROM settings WHERE key IN ('reminder_job_enabled')") or [])}
+    st_global = settings_snapshot()
     if (st_global.get('reminder_job_enabled') or '1') != '1':
         logger.info("Reminder job disabled by settings. Skipping run.")
         return
@@ -48,7 +51,7 @@ async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Reseller expiry check failed: {e}")
 
     # Load alert settings once
-    st = {s['key']: s['value'] for s in (query_db("SELECT key, value FROM settings WHERE key IN ('traffic_alert_enabled','traffic_alert_value_gb','time_alert_enabled','time_alert_days')") or [])}
+    st = settings_snapshot()
     alert_enabled = (st.get('traffic_alert_enabled') or '0') == '1'
     try:
         alert_gb = float(st.get('traffic_alert_value_gb') or 5)
@@ -60,15 +63,20 @@ async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         time_alert_days = 3
 
+    # panel_id -> {username: orders}, flushed with one batched write per inbound
+    pending_deletes = {}
+
+    # Reminder days (each day left sends once) and the GB alert are thresholds of the
+    # usage snapshot; only users whose band moved since the last run are processed
+    thresholds = UsageThresholds(
+        remaining_bytes=(alert_gb * (1024**3),) if alert_enabled else (),
+        expiry_days=range(max(0, time_alert_days) + 1) if time_alert_on else (),
+    )
+    collector = get_usage_collector()
+
     all_panels = query_db("SELECT id, panel_type FROM panels WHERE COALESCE(enabled,1)=1")
     for panel_data in all_panels:
         try:
-            panel_api = VpnPanelAPI(panel_id=panel_data['id'])
-            all_users, msg = await panel_api.get_all_users()
-            
-            # For 3x-UI or panels that don't support bulk fetch, all_users will be None/empty
-            # and we'll use the fallback path below
-
             async def _process_user_record(username: str, m_user: dict):
                 if username not in orders_map:
                     return
@@ -110,6 +118,10 @@ async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
                     if target_order:
                         try:
                             p_api = VpnPanelAPI(panel_id=target_order['panel_id'])
+                            if hasattr(p_api, 'delete_users'):
+                                # X-UI style panels: deleted together per inbound after the scan
+                                pending_deletes.setdefault(target_order['panel_id'], {})[username] = user_orders
+                                return
                             ok = False
                             msg_d = None
                             if hasattr(p_api, 'delete_user'):
@@ -188,42 +200,39 @@ async def check_expirations(context: ContextTypes.DEFAULT_TYPE):
                                 except Exception as e:
                                     logger.error(f"Error sending traffic alert to {order['user_id']}: {e}")
 
-            if not all_users:
-                # Fallback path for panels that don't support get_all_users (e.g., 3x-UI)
-                logger.info(f"Panel ID {panel_data['id']} does not support get_all_users: {msg}. Falling back to per-order query.")
-                # For this panel, gather usernames from orders
-                panel_usernames = []
-                for uname, ords in orders_map.items():
-                    try:
-                        if any(int(o.get('panel_id') or 0) == int(panel_data['id']) for o in ords):
-                            panel_usernames.append(uname)
-                    except Exception:
-                        continue
-                # Query each username individually
-                for uname in panel_usernames:
-                    try:
-                        uinfo, _m = await panel_api.get_user(uname)
-                        if isinstance(uinfo, dict):
-                            # Normalize to expected keys
-                            m_user = {
-                                'username': uname,
-                                'expire': uinfo.get('expire') or 0,
-                                'data_limit': uinfo.get('data_limit') or 0,
-                                'used_traffic': uinfo.get('used_traffic') or 0,
-                            }
-                            await _process_user_record(uname, m_user)
-                    except Exception as e:
-                        logger.warning(f"Per-user fetch failed for {uname} on panel {panel_data['id']}: {e}")
+            panel_usernames = [
+                uname for uname, ords in orders_map.items()
+                if any(int(o.get('panel_id') or 0) == int(panel_data['id']) for o in ords)
+            ]
+            if not panel_usernames:
                 continue
-
-            for m_user in all_users:
-                username = m_user.get('username')
-                if not username:
-                    continue
-                await _process_user_record(username, m_user)
+            snap = await collector.collect(panel_data['id'], panel_usernames)
+            if snap is None:
+                logger.warning(f"No usage from panel ID {panel_data['id']}, skipping its reminders")
+                continue
+            diff = collector.diff('expirations', snap, thresholds)
+            # Expired services are re-checked every run until deleted (deletion may have failed before)
+            candidates = set(diff.crossed) | set(snap.expired_before(snap.taken_at))
+            for username in snap.usernames:
+                if username in candidates:
+                    await _process_user_record(username, snap.row(username))
         except Exception as e:
             logger.error(f"Failed to process reminders for panel ID {panel_data['id']}: {e}")
 
+    for panel_id, users in pending_deletes.items():
+        try:
+            results = await asyncio.to_thread(VpnPanelAPI(panel_id=panel_id).delete_users, list(users))
+        except Exception as e:
+            logger.error(f"Batched deletion failed on panel {panel_id}: {e}")
+            continue
+        for username, res in results.items():
+            if res.ok:
+                for o in users.get(username) or []:
+                    execute_db("UPDATE orders SET status='deleted' WHERE id = ?", (o['id'],))
+                logger.info(f"Deleted expired service {username} on panel {panel_id}")
+            else:
+                logger.warning(f"Panel delete failed for {username}: {res.message}")
+
 
 async def backup_and_send_to_admins(context: ContextTypes.DEFAULT_TYPE):
     """Create a backup archive and send it to admins periodically."""
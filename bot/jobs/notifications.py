@@ -1,270 +1,131 @@
 """User notification jobs for traffic and expiry warnings"""
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from ..db import query_db, execute_db
 from ..config import logger
-from ..panel import VpnPanelAPI
+from ..usage_snapshot import UsageThresholds, get_usage_collector
 import gc
 
 
-async def check_low_traffic_and_expiry(context):
-    """
-    Unified job: Check for low traffic AND time-based expiry alerts.
-    Grouped by panel to minimize API calls.
-    """
-    try:
-        await check_low_traffic(context)
-        await check_near_expiry(context)
-    except Exception as e:
-        logger.error(f"Error in check_low_traffic_and_expiry: {e}")
-    finally:
-        # Force garbage collection to free memory
-        gc.collect()
+# Usage warnings at 80% / 95%; expiry warnings under 3 days / under 1 day left (whole days: 2 / 0)
+TRAFFIC_WARNING_PERCENT = 80
+TRAFFIC_CRITICAL_PERCENT = 95
+EXPIRY_WARNING_DAYS = 2
+EXPIRY_CRITICAL_DAYS = 0
+NOTIFY_THRESHOLDS = UsageThresholds(
+    usage_percent=(TRAFFIC_WARNING_PERCENT, TRAFFIC_CRITICAL_PERCENT),
+    expiry_days=(EXPIRY_WARNING_DAYS, EXPIRY_CRITICAL_DAYS),
+)
 
 
-async def check_low_traffic(context):
+async def check_low_traffic_and_expiry(context):
     """
-    Check services with low traffic and notify users
-    Notification at 80% and 95% usage
-    Optimized: fetch all users per panel once, then lookup
+    Unified job: low traffic AND time-based expiry alerts.
+    One usage snapshot per panel (bot.usage_snapshot); only services whose usage or
+    days left crossed a threshold since the previous run are looked at.
     """
     try:
-        logger.info("[Notification Job] Starting traffic check...")
-        # Get active orders
         orders = query_db("""
             SELECT o.id, o.user_id, o.marzban_username, o.panel_id,
-                   p.name as plan_name, p.traffic_gb,
-                   o.notified_traffic_80, o.notified_traffic_95
+                   p.name as plan_name,
+                   o.notified_traffic_80, o.notified_traffic_95,
+                   o.notified_expiry_3d, o.notified_expiry_1d
             FROM orders o
             LEFT JOIN plans p ON o.plan_id = p.id
             WHERE o.status = 'approved'
             AND o.marzban_username IS NOT NULL
             AND o.panel_id IS NOT NULL
         """) or []
-        
         if not orders:
             logger.info("[Notification Job] No active orders to check")
             return
-        
-        # Group orders by panel_id to minimize API calls
+
         orders_by_panel = {}
         for order in orders:
-            panel_id = order['panel_id']
-            if panel_id not in orders_by_panel:
-                orders_by_panel[panel_id] = []
-            orders_by_panel[panel_id].append(order)
-        
-        # For each panel, fetch all users once (or individually for 3x-UI)
+            orders_by_panel.setdefault(order['panel_id'], []).append(order)
+
+        collector = get_usage_collector()
+        checked = 0
         for panel_id, panel_orders in orders_by_panel.items():
             try:
-                # Check panel type first
-                panel_info = query_db("SELECT panel_type FROM panels WHERE id = ?", (panel_id,), one=True)
-                panel_type = panel_info.get('panel_type') if panel_info else 'marzban'
-                
-                if panel_type == '3xui':
-                    # For 3x-UI, fetch each user individually (doesn't support bulk fetch)
-                    logger.info(f"[Notification Job] Processing panel {panel_id} (3x-UI) - fetching users individually...")
-                    api = VpnPanelAPI(panel_id=panel_id)
-                    
-                    for order in panel_orders:
-                        try:
-                            username = order['marzban_username']
-                            result = await api.get_user(username)
-                            
-                            # Handle both tuple (user_data, message) and dict returns
-                            if isinstance(result, tuple):
-                                user_data, _ = result
-                            else:
-                                user_data = result
-                            
-                            if not user_data or not isinstance(user_data, dict):
-                                continue
-                            
-                            # Calculate usage percentage
-                            used = user_data.get('used_traffic', 0) / (1024**3)  # Convert to GB
-                            total = float(order['traffic_gb'] or 0)
-                            
-                            if total == 0:  # Unlimited traffic
-                                continue
-                            
-                            usage_percent = (used / total) * 100
-                            
-                            # Check thresholds
-                            if usage_percent >= 80 and not order.get('notified_traffic_80'):
-                                await send_traffic_warning(
-                                    context.bot, order['user_id'], order['id'],
-                                    order['plan_name'], usage_percent, used, total, level='warning'
-                                )
-                                execute_db("UPDATE orders SET notified_traffic_80 = 1 WHERE id = ?", (order['id'],))
-                            elif usage_percent >= 95 and not order.get('notified_traffic_95'):
-                                await send_traffic_warning(
-                                    context.bot, order['user_id'], order['id'],
-                                    order['plan_name'], usage_percent, used, total, level='critical'
-                                )
-                                execute_db("UPDATE orders SET notified_traffic_95 = 1 WHERE id = ?", (order['id'],))
-                        except Exception as e:
-                            logger.error(f"Error checking traffic for 3x-UI order {order['id']}: {e}")
-                            continue
-                    
-                    continue  # Move to next panel
-                
-                # For Marzban/other panels: fetch all users at once
-                logger.info(f"[Notification Job] Fetching users from panel {panel_id} (using cache if available)...")
-                api = VpnPanelAPI(panel_id=panel_id)
-                all_users, msg = await api.get_all_users()
-                
-                if not all_users:
-                    logger.warning(f"[Notification Job] Could not fetch users from panel {panel_id}: {msg}")
+                snap = await collector.collect(panel_id, [o['marzban_username'] for o in panel_orders])
+                if snap is None:
+                    logger.warning(f"[Notification Job] No usage from panel {panel_id}, skipping")
                     continue
-                
-                # Build lookup dict by username
-                users_dict = {}
-                for u in all_users:
-                    username = u.get('username') or u.get('email')
-                    if username:
-                        users_dict[username] = u
-                
-                # Check each order against the fetched data
+                crossed = set(collector.diff('notifications', snap, NOTIFY_THRESHOLDS).crossed)
+                failed = []
                 for order in panel_orders:
+                    username = order['marzban_username']
+                    if username not in crossed:
+                        continue
+                    checked += 1
+                    row = snap.row(username)
                     try:
-                        username = order['marzban_username']
-                        user_data = users_dict.get(username)
-                        
-                        if not user_data:
-                            continue
-                        
-                        # Calculate usage percentage
-                        used = user_data.get('used_traffic', 0) / (1024**3)  # Convert to GB
-                        total = float(order['traffic_gb'] or 0)
-                        
-                        if total == 0:  # Unlimited traffic
-                            continue
-                        
-                        usage_percent = (used / total) * 100
-                        
-                        # Check 80% threshold
-                        if usage_percent >= 80 and not order.get('notified_traffic_80'):
-                            await send_traffic_warning(
-                                context.bot,
-                                order['user_id'],
-                                order['id'],
-                                order['plan_name'],
-                                usage_percent,
-                                used,
-                                total,
-                                level='warning'
-                            )
-                            execute_db("UPDATE orders SET notified_traffic_80 = 1 WHERE id = ?", (order['id'],))
-                        
-                        # Check 95% threshold
-                        elif usage_percent >= 95 and not order.get('notified_traffic_95'):
-                            await send_traffic_warning(
-                                context.bot,
-                                order['user_id'],
-                                order['id'],
-                                order['plan_name'],
-                                usage_percent,
-                                used,
-                                total,
-                                level='critical'
-                            )
-                            execute_db("UPDATE orders SET notified_traffic_95 = 1 WHERE id = ?", (order['id'],))
-                        
+                        await _check_order_traffic(context.bot, order, row)
+                        await _check_order_expiry(context.bot, order, row, snap.taken_at)
                     except Exception as e:
-                        logger.error(f"Error checking traffic for order {order['id']}: {e}")
-                        continue
-                
+                        logger.error(f"Error checking order {order['id']}: {e}")
+                        failed.append(username)
+                if failed:
+                    collector.retry_later('notifications', panel_id, failed)
             except Exception as e:
-                logger.error(f"Error processing panel {panel_id} in traffic check: {e}")
+                logger.error(f"Error processing panel {panel_id} in notification check: {e}")
                 continue
-        
-        logger.info(f"[Notification Job] Traffic check completed for {len(orders)} orders")
-        
+
+        logger.info(f"[Notification Job] {checked} of {len(orders)} orders crossed a threshold")
     except Exception as e:
-        logger.error(f"Error in check_low_traffic: {e}")
+        logger.error(f"Error in check_low_traffic_and_expiry: {e}")
+    finally:
+        # Force garbage collection to free memory
+        gc.collect()
 
 
-async def check_near_expiry(context):
-    """
-    Check services near expiry and notify users
-    Notification at 3 days and 1 day before expiry
-    """
-    try:
-        now = datetime.now()
-        three_days = now + timedelta(days=3)
-        one_day = now + timedelta(days=1)
-        
-        # Get orders expiring in 3 days
-        orders_3d = query_db("""
-            SELECT o.id, o.user_id, o.marzban_username,
-                   p.name as plan_name, o.timestamp, p.duration_days,
-                   o.notified_expiry_3d, o.notified_expiry_1d
-            FROM orders o
-            LEFT JOIN plans p ON o.plan_id = p.id
-            WHERE o.status = 'approved'
-            AND datetime(o.timestamp, '+' || p.duration_days || ' days') <= ?
-            AND datetime(o.timestamp, '+' || p.duration_days || ' days') > ?
-            AND o.notified_expiry_3d != 1
-        """, (three_days.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'))) or []
-        
-        for order in orders_3d:
-            try:
-                expiry = datetime.strptime(order['timestamp'], '%Y-%m-%d %H:%M:%S') + timedelta(days=order['duration_days'])
-                days_left = (expiry - now).days
-                
-                await send_expiry_warning(
-                    context.bot,
-                    order['user_id'],
-                    order['id'],
-                    order['plan_name'],
-                    days_left,
-                    expiry,
-                    level='warning'
-                )
-                execute_db("UPDATE orders SET notified_expiry_3d = 1 WHERE id = ?", (order['id'],))
-                
-            except Exception as e:
-                logger.error(f"Error sending 3-day expiry for order {order['id']}: {e}")
-        
-        # Get orders expiring in 1 day
-        orders_1d = query_db("""
-            SELECT o.id, o.user_id, o.marzban_username,
-                   p.name as plan_name, o.timestamp, p.duration_days,
-                   o.notified_expiry_1d
-            FROM orders o
-            LEFT JOIN plans p ON o.plan_id = p.id
-            WHERE o.status = 'approved'
-            AND datetime(o.timestamp, '+' || p.duration_days || ' days') <= ?
-            AND datetime(o.timestamp, '+' || p.duration_days || ' days') > ?
-            AND o.notified_expiry_1d != 1
-        """, (one_day.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'))) or []
-        
-        for order in orders_1d:
-            try:
-                expiry = datetime.strptime(order['timestamp'], '%Y-%m-%d %H:%M:%S') + timedelta(days=order['duration_days'])
-                hours_left = int((expiry - now).total_seconds() / 3600)
-                
-                await send_expiry_warning(
-                    context.bot,
-                    order['user_id'],
-                    order['id'],
-                    order['plan_name'],
-                    0,
-                    expiry,
-                    level='critical',
-                    hours=hours_left
-                )
-                execute_db("UPDATE orders SET notified_expiry_1d = 1 WHERE id = ?", (order['id'],))
-                
-            except Exception as e:
-                logger.error(f"Error sending 1-day expiry for order {order['id']}: {e}")
-        
-        logger.info(f"Expiry check completed: {len(orders_3d)} 3-day, {len(orders_1d)} 1-day")
-        
-    except Exception as e:
-        logger.error(f"Error in check_near_expiry: {e}")
+async def _check_order_traffic(bot, order, row):
+    """80% / 95% traffic warnings for one order, each sent once"""
+    total_bytes = row['data_limit']
+    if total_bytes <= 0:  # Unlimited traffic
+        return
+    used = row['used_traffic'] / (1024**3)
+    total = total_bytes / (1024**3)
+    usage_percent = (used / total) * 100
+    if usage_percent >= TRAFFIC_CRITICAL_PERCENT and not order.get('notified_traffic_95'):
+        await send_traffic_warning(
+            bot, order['user_id'], order['id'],
+            order['plan_name'], usage_percent, used, total, level='critical'
+        )
+        # The critical warning supersedes the earlier one
+        execute_db("UPDATE orders SET notified_traffic_80 = 1, notified_traffic_95 = 1 WHERE id = ?", (order['id'],))
+    elif usage_percent >= TRAFFIC_WARNING_PERCENT and not order.get('notified_traffic_80'):
+        await send_traffic_warning(
+            bot, order['user_id'], order['id'],
+            order['plan_name'], usage_percent, used, total, level='warning'
+        )
+        execute_db("UPDATE orders SET notified_traffic_80 = 1 WHERE id = ?", (order['id'],))
+
+
+async def _check_order_expiry(bot, order, row, now_ts):
+    """3-day / 1-day expiry warnings for one order, from the expiry on the panel"""
+    expire = row['expire']
+    if expire <= 0 or expire < now_ts:
+        return
+    expiry = datetime.fromtimestamp(expire)
+    now = datetime.fromtimestamp(now_ts)
+    days_left = (expiry - now).days
+    if days_left <= EXPIRY_CRITICAL_DAYS and order.get('notified_expiry_1d') != 1:
+        hours_left = int((expiry - now).total_seconds() / 3600)
+        await send_expiry_warning(
+            bot, order['user_id'], order['id'], order['plan_name'],
+            0, expiry, level='critical', hours=hours_left
+        )
+        execute_db("UPDATE orders SET notified_expiry_1d = 1, notified_expiry_3d = 1 WHERE id = ?", (order['id'],))
+    elif days_left <= EXPIRY_WARNING_DAYS and order.get('notified_expiry_3d') != 1:
+        await send_expiry_warning(
+            bot, order['user_id'], order['id'], order['plan_name'],
+            days_left, expiry, level='warning'
+        )
+        execute_db("UPDATE orders SET notified_expiry_3d = 1 WHERE id = ?", (order['id'],))
 
 
 async def send_traffic_warning(bot, user_id, order_id, plan_name, usage_percent, used_gb, total_gb, level='warning'):
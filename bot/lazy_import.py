@@ -0,0 +1,90 @@
+"""
+Lazy handler loading
+Rarely used admin subsystems are kept out of the boot path and imported in a
+worker thread: in the background shortly after startup (``preload_lazy_modules_job``)
+or, if a handler is called before that, on its first call. Either way the import
+never runs on the event loop.
+"""
+import asyncio
+import importlib
+import os
+import threading
+import time
+from typing import Dict
+
+from .config import logger
+
+# Seconds after startup before the background preload runs (0 = only import on first use)
+LAZY_PRELOAD_DELAY = float(os.getenv('LAZY_PRELOAD_DELAY', '15'))
+
+# module -> imported module object (None until loaded)
+_modules: Dict[str, object] = {}
+_import_lock = threading.Lock()
+
+
+def _import(module: str):
+    """Blocking import of a registered module, once (runs in a worker thread)"""
+    mod = _modules.get(module)
+    if mod is not None:
+        return mod
+    with _import_lock:
+        mod = _modules.get(module)
+        if mod is None:
+            t0 = time.perf_counter()
+            mod = importlib.import_module(module, package=__package__)
+            _modules[module] = mod
+            logger.info(f"lazy import {module} took {(time.perf_counter() - t0) * 1000:.1f} ms")
+    return mod
+
+
+def lazy_handler(module: str, name: str):
+    """Return an async handler that imports ``module`` and resolves ``name`` on first call
+
+    ``module`` is relative to the ``bot`` package, e.g. ``'.handlers.ai_analytics'``.
+    """
+    _modules.setdefault(module, None)
+    target = None
+
+    def _resolve():
+        nonlocal target
+        if target is None:
+            target = getattr(_import(module), name)
+        return target
+
+    async def _handler(update, context, *args, **kwargs):
+        fn = target if target is not None else await asyncio.to_thread(_resolve)
+        return await fn(update, context, *args, **kwargs)
+
+    _handler.__name__ = name
+    _handler.__qualname__ = name
+    _handler.__module__ = f"bot{module}" if module.startswith('.') else module
+    _handler.resolve = _resolve
+    return _handler
+
+
+def lazy_handlers(module: str, *names: str):
+    """``a, b = lazy_handlers('.handlers.x', 'a', 'b')``"""
+    return tuple(lazy_handler(module, n) for n in names)
+
+
+def pending_modules():
+    return [m for m, mod in _modules.items() if mod is None]
+
+
+async def preload_lazy_modules():
+    """Import every registered module that is not loaded yet, one by one in a worker thread"""
+    t0 = time.perf_counter()
+    loaded = 0
+    for module in pending_modules():
+        try:
+            await asyncio.to_thread(_import, module)
+            loaded += 1
+        except Exception as e:
+            # Left for the first call, which will surface the error to the handler
+            logger.warning(f"lazy preload of {module} failed: {e}")
+    if loaded:
+        logger.info(f"lazy preload: {loaded} modules in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+async def preload_lazy_modules_job(context):
+    await preload_lazy_modules()
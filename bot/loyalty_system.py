@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, List
 from .db import query_db, execute_db
 from .config import logger
+from .migrations import ensure_schema
 
 # سطوح کاربری
 LEVELS = {
@@ -34,35 +35,8 @@ class LoyaltySystem:
     
     @staticmethod
     def setup_tables():
-        """ساخت جداول مورد نیاز"""
-        # جدول امتیازات کاربر
-        execute_db("""
-            CREATE TABLE IF NOT EXISTS user_points (
-                user_id INTEGER PRIMARY KEY,
-                total_points INTEGER DEFAULT 0,
-                current_points INTEGER DEFAULT 0,
-                level TEXT DEFAULT 'bronze',
-                last_daily_login DATE,
-                birthday DATE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
-        
-        # جدول تاریخچه امتیازات
-        execute_db("""
-            CREATE TABLE IF NOT EXISTS points_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                points INTEGER,
-                action TEXT,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
-        
-        logger.info("✅ Loyalty system tables created")
+        """ساخت جداول مورد نیاز (از طریق bot.migrations)"""
+        ensure_schema()
     
     @staticmethod
     def get_user_points(user_id: int) -> Dict:
@@ -0,0 +1,435 @@
+"""
+In-memory metrics pipeline
+Counters, gauges and fixed-bucket histograms are aggregated in process memory
+(no I/O on the request path) and flushed once a minute as compact rollup rows.
+
+* ``get_metrics().inc / observe / set_gauge``  - hot path, a dict lookup under a lock
+* ``get_metrics().top_quantiles``  - p50/p95/p99 per series from log-linear sketches
+* ``flush_metrics_job``        - per-minute batched write into ``metrics_rollup``
+* ``metrics_retention_job``    - downsamples 1m rows into 1h rows and prunes old history
+* ``start_metrics_server``     - Prometheus text exposition on 127.0.0.1:METRICS_PORT
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from .config import DB_NAME, logger
+
+# Upper bounds in seconds; the last implicit bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+FLUSH_SECONDS = int(os.getenv('METRICS_FLUSH_SECONDS', '60'))
+RAW_RETENTION_HOURS = int(os.getenv('METRICS_RAW_RETENTION_HOURS', '48'))
+HOURLY_RETENTION_DAYS = int(os.getenv('METRICS_HOURLY_RETENTION_DAYS', '30'))
+# 0/empty disables the exposition endpoint
+METRICS_PORT = int(os.getenv('METRICS_PORT') or '0')
+METRICS_BIND = os.getenv('METRICS_BIND', '127.0.0.1')
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict) -> SeriesKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+class LogLinearSketch:
+    """Streaming quantiles over log-linear buckets (HDR-style)
+
+    Values are kept in microseconds; each power of two is split into
+    ``2**SUB_BITS`` linear sub-buckets, so the relative error is about 1/16
+    and at most a few hundred buckets exist for 1 µs .. hours. Recording is
+    O(1); buckets live in a sparse dict so memory stays fixed per series.
+    """
+
+    SUB_BITS = 4
+    SUB = 1 << SUB_BITS
+
+    __slots__ = ('buckets', 'count')
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+
+    @classmethod
+    def _index(cls, us: int) -> int:
+        if us < cls.SUB:
+            return us if us > 0 else 0
+        shift = us.bit_length() - cls.SUB_BITS - 1
+        return (shift + 1) * cls.SUB + ((us >> shift) - cls.SUB)
+
+    @classmethod
+    def _bounds(cls, idx: int) -> Tuple[int, int]:
+        if idx < cls.SUB:
+            return idx, idx + 1
+        shift = idx // cls.SUB - 1
+        sub = idx - shift * cls.SUB
+        return sub << shift, (sub + 1) << shift
+
+    def record(self, seconds: float):
+        idx = self._index(int(seconds * 1_000_000))
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+
+    def copy(self) -> 'LogLinearSketch':
+        out = LogLinearSketch()
+        out.buckets = dict(self.buckets)
+        out.count = self.count
+        return out
+
+    def merge(self, other: 'LogLinearSketch'):
+        for idx, c in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + c
+        self.count += other.count
+
+    def quantiles(self, *qs: float) -> List[float]:
+        """Values (seconds) at the requested quantiles, e.g. ``quantiles(0.5, 0.95, 0.99)``"""
+        if not self.count:
+            return [0.0 for _ in qs]
+        items = sorted(self.buckets.items())
+        out = []
+        for q in qs:
+            rank = max(1, int(q * self.count + 0.999999))
+            seen = 0
+            for idx, c in items:
+                seen += c
+                if seen >= rank:
+                    lo, hi = self._bounds(idx)
+                    out.append((lo + hi) / 2 / 1_000_000)
+                    break
+        return out
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``observe`` is a bisect plus three additions
+
+    With ``with_sketch`` a :class:`LogLinearSketch` is fed as well, for p50/p95/p99.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'min', 'max', 'sketch')
+
+    def __init__(self, bounds=LATENCY_BUCKETS, with_sketch: bool = False):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = LogLinearSketch() if with_sketch else None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        if self.sketch is not None:
+            self.sketch.record(value)
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+
+    def quantile(self, q: float) -> float:
+        """Quantile from the sketch when present, else the upper bound of the fixed bucket holding rank q"""
+        if self.sketch is not None:
+            return self.sketch.quantiles(q)[0]
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return self.bounds[i] if i < len(self.bounds) else (self.max or 0.0)
+        return self.max or 0.0
+
+
+class MetricsRegistry:
+    """Process-wide metric store.
+
+    Totals since start feed the Prometheus endpoint; a separate per-window copy
+    is swapped out by :meth:`drain` for the minute rollups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[SeriesKey, float] = {}
+        self._gauges: Dict[SeriesKey, float] = {}
+        self._histograms: Dict[SeriesKey, Histogram] = {}
+        self._window_counters: Dict[SeriesKey, float] = {}
+        self._window_histograms: Dict[SeriesKey, Histogram] = {}
+        self._window_start = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self._counters[k] = self._counters.get(k, 0) + value
+            self._window_counters[k] = self._window_counters.get(k, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            h = self._histograms.get(k)
+            if h is None:
+                h = self._histograms[k] = Histogram(with_sketch=True)
+            h.observe(value)
+            w = self._window_histograms.get(k)
+            if w is None:
+                w = self._window_histograms[k] = Histogram()
+            w.observe(value)
+
+    def drain(self):
+        """Swap out the current window: ``(window_start, counters, histograms)``"""
+        with self._lock:
+            out = (self._window_start, self._window_counters, self._window_histograms)
+            self._window_counters = {}
+            self._window_histograms = {}
+            self._window_start = time.time()
+        return out
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self._histograms.get(_key(name, labels))
+
+    def series(self, name: str) -> Dict[Tuple, Histogram]:
+        """All label sets recorded for histogram ``name``"""
+        with self._lock:
+            return {k[1]: h for k, h in self._histograms.items() if k[0] == name}
+
+    def top_quantiles(self, name: str, label: str, limit: int = 10, by: float = 0.95) -> List[Dict]:
+        """Series of histogram ``name`` sorted by quantile ``by`` (slowest first)
+
+        Each item: ``{label, labels, count, p50, p95, p99, max}`` (seconds).
+        """
+        # Copy the sketches under the lock (observe() mutates them), rank them outside it
+        with self._lock:
+            snap = [
+                (k[1], h.count, h.max, h.sketch.copy())
+                for k, h in self._histograms.items()
+                if k[0] == name and h.count and h.sketch is not None
+            ]
+        rows = []
+        for labels, count, hmax, sketch in snap:
+            p50, p95, p99, pby = sketch.quantiles(0.5, 0.95, 0.99, by)
+            rows.append({
+                label: dict(labels).get(label, ''),
+                'labels': dict(labels),
+                'count': count, 'p50': p50, 'p95': p95, 'p99': p99, 'max': hmax or 0.0, '_by': pby,
+            })
+        rows.sort(key=lambda r: r['_by'], reverse=True)
+        for r in rows:
+            r.pop('_by')
+        return rows[:limit]
+
+    def counter_value(self, name: str, **labels) -> float:
+        return self._counters.get(_key(name, labels), 0)
+
+    # ── exposition ────────────────────────────────────────────────────
+    def render_prometheus(self) -> str:
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            body = ','.join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                            for k, v in items)
+            return '{' + body + '}'
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            hists = sorted(((k, (list(h.counts), h.count, h.sum, h.bounds)) for k, h in self._histograms.items()),
+                           key=lambda kv: kv[0])
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), v in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{fmt_labels(labels)} {v}')
+        for (name, labels), v in gauges:
+            if name not in typed:
+                lines.append(f'# TYPE {name} gauge')
+                typed.add(name)
+            lines.append(f'{name}{fmt_labels(labels)} {v}')
+        for (name, labels), (counts, count, total, bounds) in hists:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cum = 0
+            for i, c in enumerate(counts):
+                cum += c
+                le = repr(bounds[i]) if i < len(bounds) else '+Inf'
+                lines.append(f'{name}_bucket{fmt_labels(labels, (("le", le),))} {cum}')
+            lines.append(f'{name}_sum{fmt_labels(labels)} {total}')
+            lines.append(f'{name}_count{fmt_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+_registry: Optional[MetricsRegistry] = None
+
+
+def get_metrics() -> MetricsRegistry:
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry()
+    return _registry
+
+
+# ── rollup persistence ────────────────────────────────────────────────
+def _period_start(ts: float, seconds: int) -> str:
+    return datetime.fromtimestamp(ts - ts % seconds).isoformat(timespec='seconds')
+
+
+def flush_rollups(registry: Optional[MetricsRegistry] = None, db_name: str = DB_NAME) -> int:
+    """Write the drained window as one row per series in a single transaction"""
+    registry = registry or get_metrics()
+    window_start, counters, histograms = registry.drain()
+    if not counters and not histograms:
+        return 0
+    period = _period_start(window_start, 60)
+    rows = []
+    for (name, labels), v in counters.items():
+        rows.append((period, '1m', name, json.dumps(dict(labels)), 'counter', v, v, None, None, None))
+    for (name, labels), h in histograms.items():
+        rows.append((period, '1m', name, json.dumps(dict(labels)), 'histogram', h.count, h.sum,
+                     h.min, h.max, ','.join(map(str, h.counts))))
+    conn = sqlite3.connect(db_name, timeout=10)
+    try:
+        with conn:
+            conn.executemany(
+                """INSERT INTO metrics_rollup
+                   (period_start, resolution, name, labels, kind, count, sum, min, max, buckets)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def downsample_and_prune(db_name: str = DB_NAME, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Fold 1m rollups older than the raw retention into 1h rows and drop expired history"""
+    now = now or datetime.now()
+    raw_cutoff = (now - timedelta(hours=RAW_RETENTION_HOURS)).replace(minute=0, second=0, microsecond=0)
+    hourly_cutoff = now - timedelta(days=HOURLY_RETENTION_DAYS)
+    raw_cutoff_s = raw_cutoff.isoformat(timespec='seconds')
+    conn = sqlite3.connect(db_name, timeout=10)
+    conn.row_factory = sqlite3.Row
+    result = {'folded': 0, 'hourly_written': 0, 'pruned': 0}
+    try:
+        with conn:
+            rows = conn.execute(
+                "SELECT period_start, name, labels, kind, count, sum, min, max, buckets "
+                "FROM metrics_rollup WHERE resolution = '1m' AND period_start < ?",
+                (raw_cutoff_s,),
+            ).fetchall()
+            hours: Dict[Tuple, list] = {}
+            for r in rows:
+                hour = r['period_start'][:13] + ':00:00'
+                k = (hour, r['name'], r['labels'], r['kind'])
+                acc = hours.get(k)
+                counts = [int(c) for c in r['buckets'].split(',')] if r['buckets'] else None
+                if acc is None:
+                    hours[k] = [r['count'] or 0, r['sum'] or 0, r['min'], r['max'], counts]
+                    continue
+                acc[0] += r['count'] or 0
+                acc[1] += r['sum'] or 0
+                if r['min'] is not None and (acc[2] is None or r['min'] < acc[2]):
+                    acc[2] = r['min']
+                if r['max'] is not None and (acc[3] is None or r['max'] > acc[3]):
+                    acc[3] = r['max']
+                if counts and acc[4] and len(counts) == len(acc[4]):
+                    acc[4] = [a + b for a, b in zip(acc[4], counts)]
+            conn.executemany(
+                """INSERT INTO metrics_rollup
+                   (period_start, resolution, name, labels, kind, count, sum, min, max, buckets)
+                   VALUES (?, '1h', ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(h, n, l, kind, a[0], a[1], a[2], a[3], ','.join(map(str, a[4])) if a[4] else None)
+                 for (h, n, l, kind), a in hours.items()],
+            )
+            conn.execute("DELETE FROM metrics_rollup WHERE resolution = '1m' AND period_start < ?", (raw_cutoff_s,))
+            cur = conn.execute("DELETE FROM metrics_rollup WHERE resolution = '1h' AND period_start < ?",
+                               (hourly_cutoff.isoformat(timespec='seconds'),))
+            pruned = cur.rowcount
+            # Legacy per-request tables: keep only the raw retention window
+            for table in ('performance_metrics', 'metrics_history'):
+                try:
+                    cur = conn.execute(f"DELETE FROM {table} WHERE timestamp < ?", (raw_cutoff_s,))
+                    pruned += cur.rowcount
+                except sqlite3.OperationalError:
+                    pass
+            result.update(folded=len(rows), hourly_written=len(hours), pruned=pruned)
+    finally:
+        conn.close()
+    return result
+
+
+async def flush_metrics_job(context):
+    try:
+        await asyncio.to_thread(flush_rollups)
+    except Exception as e:
+        logger.error(f"metrics flush failed: {e}")
+
+
+async def metrics_retention_job(context):
+    try:
+        res = await asyncio.to_thread(downsample_and_prune)
+        if res['folded'] or res['pruned']:
+            logger.info(f"metrics retention: {res}")
+    except Exception as e:
+        logger.error(f"metrics retention failed: {e}")
+
+
+# ── Prometheus endpoint ───────────────────────────────────────────────
+class _ExpositionHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = get_metrics().render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(port: int = METRICS_PORT, bind: str = METRICS_BIND) -> Optional[ThreadingHTTPServer]:
+    """Serve ``/metrics`` from a daemon thread (no-op when port is 0 or already running)"""
+    global _server
+    if _server is not None or not port:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((bind, port), _ExpositionHandler)
+    except OSError as e:
+        logger.error(f"metrics endpoint could not bind {bind}:{port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"metrics endpoint listening on http://{bind}:{port}/metrics")
+    return _server
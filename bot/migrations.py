@@ -0,0 +1,855 @@
+"""
+Versioned schema migrations keyed by ``PRAGMA user_version``
+Pending migrations are applied in one transaction; an up-to-date database
+costs a single version read at startup
+"""
+import sqlite3
+import time
+from typing import Callable, List, Tuple
+
+from .config import DB_NAME, logger
+from .startup_profiler import record_phase
+
+
+def _m001_core_schema(cursor: sqlite3.Cursor):
+    """Core tables; the column probes upgrade databases created before versioning"""
+    # --- Create Tables ---
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_name TEXT, join_date TEXT)"
+    )
+    cursor.execute("PRAGMA table_info(users)")
+    ucols_init = [col[1] for col in cursor.fetchall()]
+    if 'banned' not in ucols_init:
+        try:
+            cursor.execute("ALTER TABLE users ADD COLUMN banned INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.Error:
+            pass
+    # Referrals
+    cursor.execute("PRAGMA table_info(users)")
+    ucols = [col[1] for col in cursor.fetchall()]
+    if 'referrer_id' not in ucols:
+        try:
+            cursor.execute("ALTER TABLE users ADD COLUMN referrer_id INTEGER")
+        except sqlite3.Error:
+            pass
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            referrer_id INTEGER NOT NULL,
+            referee_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            UNIQUE(referrer_id, referee_id)
+        )
+        """
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS messages (message_name TEXT PRIMARY KEY, text TEXT, file_id TEXT, file_type TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS buttons (id INTEGER PRIMARY KEY AUTOINCREMENT, menu_name TEXT, text TEXT, target TEXT, is_url BOOLEAN DEFAULT 0, row INTEGER, col INTEGER)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS plans (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, price INTEGER NOT NULL, duration_days INTEGER NOT NULL, traffic_gb REAL NOT NULL)"
+    )
+    # Migrations for plans: add optional per-plan binding to panel/inbound
+    cursor.execute("PRAGMA table_info(plans)")
+    pcols = [col[1] for col in cursor.fetchall()]
+    if 'panel_id' not in pcols:
+        try:
+            cursor.execute("ALTER TABLE plans ADD COLUMN panel_id INTEGER")
+        except sqlite3.Error as e:
+            logger.error(f"Error adding panel_id to plans: {e}")
+    cursor.execute("PRAGMA table_info(plans)")
+    pcols = [col[1] for col in cursor.fetchall()]
+    if 'xui_inbound_id' not in pcols:
+        try:
+            cursor.execute("ALTER TABLE plans ADD COLUMN xui_inbound_id INTEGER")
+        except sqlite3.Error as e:
+            logger.error(f"Error adding xui_inbound_id to plans: {e}")
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS cards (id INTEGER PRIMARY KEY AUTOINCREMENT, card_number TEXT NOT NULL, holder_name TEXT NOT NULL)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS free_trials (user_id INTEGER PRIMARY KEY, timestamp TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS discount_codes (id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT UNIQUE NOT NULL, percentage INTEGER NOT NULL, usage_limit INTEGER NOT NULL, times_used INTEGER DEFAULT 0, expiry_date TEXT)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS panels (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, panel_type TEXT NOT NULL DEFAULT 'marzban', url TEXT NOT NULL, username TEXT NOT NULL, password TEXT NOT NULL, sub_base TEXT, token TEXT)"
+    )
+    # Migrations for existing tables
+    cursor.execute("PRAGMA table_info(panels)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'enabled' not in columns:
+        try:
+            cursor.execute("ALTER TABLE panels ADD COLUMN enabled INTEGER NOT NULL DEFAULT 1")
+        except sqlite3.Error as e:
+            logger.error(f"Error adding enabled to panels: {e}")
+    if 'panel_type' not in columns:
+        try:
+            cursor.execute("ALTER TABLE panels ADD COLUMN panel_type TEXT NOT NULL DEFAULT 'marzban'")
+            cursor.execute("UPDATE panels SET panel_type = 'marzban' WHERE panel_type IS NULL")
+        except sqlite3.Error as e:
+            logger.error(f"Error adding panel_type to panels: {e}")
+    cursor.execute("PRAGMA table_info(panels)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'sub_base' not in columns:
+        try:
+            cursor.execute("ALTER TABLE panels ADD COLUMN sub_base TEXT")
+        except sqlite3.Error as e:
+            logger.error(f"Error adding sub_base to panels: {e}")
+    cursor.execute("PRAGMA table_info(panels)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'token' not in columns:
+        try:
+            cursor.execute("ALTER TABLE panels ADD COLUMN token TEXT")
+        except sqlite3.Error as e:
+            logger.error(f"Error adding token to panels: {e}")
+    # Ensure panel_inbounds exists BEFORE running its migrations
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS panel_inbounds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            panel_id INTEGER NOT NULL,
+            protocol TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            inbound_id INTEGER,
+            UNIQUE(panel_id, tag),
+            FOREIGN KEY (panel_id) REFERENCES panels(id) ON DELETE CASCADE
+        )
+        """
+    )
+
+    # Migrations for panel_inbounds
+    cursor.execute("PRAGMA table_info(panel_inbounds)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'inbound_id' not in columns:
+        try:
+            cursor.execute("ALTER TABLE panel_inbounds ADD COLUMN inbound_id INTEGER")
+        except sqlite3.Error as e:
+            logger.error(f"Error adding inbound_id to panel_inbounds: {e}")
+
+    # Table for manually setting inbounds for each panel (already ensured above)
+
+    # Orders table with conditional add columns
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='orders'")
+    if cursor.fetchone():
+        cursor.execute("PRAGMA table_info(orders)")
+        columns = [col[1] for col in cursor.fetchall()]
+
+        if 'panel_id' not in columns:
+            cursor.execute("ALTER TABLE orders ADD COLUMN panel_id INTEGER")
+        if 'discount_code' not in columns:
+            cursor.execute("ALTER TABLE orders ADD COLUMN discount_code TEXT")
+        if 'final_price' not in columns:
+            cursor.execute("ALTER TABLE orders ADD COLUMN final_price INTEGER")
+        if 'last_reminder_date' not in columns:
+            cursor.execute("ALTER TABLE orders ADD COLUMN last_reminder_date TEXT")
+        if 'panel_type' not in columns:
+            cursor.execute("ALTER TABLE orders ADD COLUMN panel_type TEXT")
+        if 'last_link' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN last_link TEXT")
+            except sqlite3.Error:
+                pass
+        if 'last_traffic_alert_date' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN last_traffic_alert_date TEXT")
+            except sqlite3.Error:
+                pass
+        if 'desired_username' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN desired_username TEXT")
+            except sqlite3.Error:
+                pass
+
+        if 'xui_inbound_id' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN xui_inbound_id INTEGER")
+            except sqlite3.Error:
+                pass
+        if 'xui_client_id' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN xui_client_id TEXT")
+            except sqlite3.Error:
+                pass
+        if 'is_trial' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN is_trial INTEGER DEFAULT 0")
+            except sqlite3.Error:
+                pass
+        # Notification tracking columns
+        if 'notified_traffic_80' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN notified_traffic_80 INTEGER DEFAULT 0")
+            except sqlite3.Error:
+                pass
+        if 'notified_traffic_95' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN notified_traffic_95 INTEGER DEFAULT 0")
+            except sqlite3.Error:
+                pass
+        if 'notified_expiry_3d' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN notified_expiry_3d INTEGER DEFAULT 0")
+            except sqlite3.Error:
+                pass
+        if 'notified_expiry_1d' not in columns:
+            try:
+                cursor.execute("ALTER TABLE orders ADD COLUMN notified_expiry_1d INTEGER DEFAULT 0")
+            except sqlite3.Error:
+                pass
+    else:
+        cursor.execute(
+            """
+            CREATE TABLE orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, plan_id INTEGER NOT NULL,
+                status TEXT DEFAULT 'pending', marzban_username TEXT, screenshot_file_id TEXT, timestamp TEXT,
+                panel_id INTEGER, discount_code TEXT, final_price INTEGER, last_reminder_date TEXT, panel_type TEXT,
+                last_link TEXT, xui_inbound_id INTEGER, xui_client_id TEXT, reseller_applied INTEGER DEFAULT 0,
+                is_trial INTEGER DEFAULT 0, desired_username TEXT, last_traffic_alert_date TEXT,
+                notified_traffic_80 INTEGER DEFAULT 0,
+                notified_traffic_95 INTEGER DEFAULT 0,
+                notified_expiry_3d INTEGER DEFAULT 0,
+                notified_expiry_1d INTEGER DEFAULT 0
+            )
+            """
+        )
+    # NEW: wallets and wallet_transactions
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wallets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            asset TEXT NOT NULL,
+            chain TEXT NOT NULL,
+            address TEXT NOT NULL,
+            memo TEXT
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_wallets (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wallet_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            direction TEXT NOT NULL, -- credit/debit
+            method TEXT NOT NULL,    -- gateway/crypto/card/manual
+            status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
+            created_at TEXT NOT NULL,
+            screenshot_file_id TEXT,
+            reference TEXT,
+            meta TEXT
+        )
+        """
+    )
+    # Reseller tables
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS resellers (
+            user_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'active',
+            activated_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            discount_percent INTEGER NOT NULL,
+            max_purchases INTEGER NOT NULL,
+            used_purchases INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reseller_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            method TEXT NOT NULL, -- card/crypto/gateway
+            status TEXT NOT NULL DEFAULT 'pending', -- pending/approved/rejected
+            created_at TEXT NOT NULL,
+            screenshot_file_id TEXT,
+            reference TEXT,
+            meta TEXT
+        )
+        """
+    )
+    # Migration: add reseller_applied if missing
+    cursor.execute("PRAGMA table_info(orders)")
+    ocols = [col[1] for col in cursor.fetchall()]
+    if 'reseller_applied' not in ocols:
+        try:
+            cursor.execute("ALTER TABLE orders ADD COLUMN reseller_applied INTEGER DEFAULT 0")
+        except sqlite3.Error:
+            pass
+    # Tickets table
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            content_type TEXT,
+            text TEXT,
+            file_id TEXT,
+            created_at TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending'
+        )
+        """
+    )
+    # Threaded ticket messages (new)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ticket_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL,
+            sender TEXT NOT NULL, -- 'user' | 'admin'
+            content_type TEXT,
+            text TEXT,
+            file_id TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+        )
+        """
+    )
+    # Tutorials
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tutorials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            sort_order INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tutorial_media (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tutorial_id INTEGER NOT NULL,
+            content_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            caption TEXT,
+            sort_order INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (tutorial_id) REFERENCES tutorials(id) ON DELETE CASCADE
+        )
+        """
+    )
+    # Admins table (additional admins besides primary ADMIN_ID)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY
+        )
+        """
+    )
+
+    from .db import initialize_default_content
+    initialize_default_content(cursor)
+
+
+# Indexes for hot queries
+_CORE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_orders_status_date ON orders(status, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_user_id_desc ON orders(user_id, id DESC, status, plan_id, marzban_username, panel_id, panel_type, timestamp, desired_username)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_plan ON orders(plan_id)",
+    "CREATE INDEX IF NOT EXISTS idx_wallet_tx_user_status ON wallet_transactions(user_id, status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_panels_enabled ON panels(enabled)",
+    "CREATE INDEX IF NOT EXISTS idx_panel_inbounds_panel ON panel_inbounds(panel_id)",
+]
+
+
+def _m002_core_indexes(cursor: sqlite3.Cursor):
+    for ddl in _CORE_INDEXES:
+        cursor.execute(ddl)
+
+
+# Tables owned by feature modules (previously created in each module's constructor)
+FEATURE_TABLES = {
+    'rate_limiter': [
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit_violations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            violation_type TEXT,
+            endpoint TEXT,
+            severity TEXT,
+            action_taken TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS spam_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pattern TEXT NOT NULL,
+            pattern_type TEXT,
+            confidence REAL,
+            last_seen TEXT,
+            occurrences INTEGER DEFAULT 1
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit_config (
+            endpoint TEXT PRIMARY KEY,
+            requests_per_minute INTEGER DEFAULT 30,
+            burst_limit INTEGER DEFAULT 5,
+            cooldown_seconds INTEGER DEFAULT 60,
+            auto_ban_threshold INTEGER DEFAULT 3
+        )
+        """,
+    ],
+    'monitoring': [
+        """
+        CREATE TABLE IF NOT EXISTS performance_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            metric_name TEXT NOT NULL,
+            metric_value REAL NOT NULL,
+            metadata TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS error_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            error_type TEXT NOT NULL,
+            error_message TEXT NOT NULL,
+            stack_trace TEXT,
+            user_id INTEGER,
+            handler_name TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS health_checks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            component TEXT NOT NULL,
+            status TEXT NOT NULL,
+            response_time REAL,
+            details TEXT
+        )
+        """,
+    ],
+    'advanced_monitoring': [
+        """
+        CREATE TABLE IF NOT EXISTS metrics_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            metric_name TEXT NOT NULL,
+            metric_value REAL NOT NULL,
+            metric_type TEXT,
+            tags TEXT,
+            aggregation_period TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            alert_type TEXT NOT NULL,
+            severity TEXT NOT NULL,
+            message TEXT,
+            metric_name TEXT,
+            metric_value REAL,
+            threshold REAL,
+            resolved BOOLEAN DEFAULT 0,
+            resolved_at TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS performance_baselines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            metric_name TEXT NOT NULL,
+            hour_of_day INTEGER,
+            day_of_week INTEGER,
+            baseline_value REAL,
+            std_deviation REAL,
+            sample_count INTEGER,
+            last_updated TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_metrics_timestamp ON metrics_history(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_metrics_name ON metrics_history(metric_name)",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_resolved ON alerts(resolved)",
+    ],
+    'security_manager': [
+        """
+        CREATE TABLE IF NOT EXISTS security_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key_type TEXT NOT NULL,
+            key_value TEXT NOT NULL,
+            created_at TEXT,
+            expires_at TEXT,
+            is_active BOOLEAN DEFAULT 1
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS security_audit (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            event_type TEXT,
+            user_id INTEGER,
+            ip_address TEXT,
+            action TEXT,
+            result TEXT,
+            risk_level TEXT,
+            details TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS threat_detections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            threat_type TEXT,
+            severity TEXT,
+            source TEXT,
+            user_id INTEGER,
+            action_taken TEXT,
+            blocked BOOLEAN DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_hash TEXT UNIQUE NOT NULL,
+            user_id INTEGER,
+            name TEXT,
+            permissions TEXT,
+            created_at TEXT,
+            last_used TEXT,
+            expires_at TEXT,
+            is_active BOOLEAN DEFAULT 1
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ip_blacklist (
+            ip_address TEXT PRIMARY KEY,
+            reason TEXT,
+            added_at TEXT,
+            expires_at TEXT,
+            permanent BOOLEAN DEFAULT 0
+        )
+        """,
+    ],
+    'wallet_system': [
+        """
+        CREATE TABLE IF NOT EXISTS user_wallets (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER DEFAULT 0,
+            total_deposited INTEGER DEFAULT 0,
+            total_spent INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_wallet_balance ON user_wallets(balance)",
+        """
+        CREATE TABLE IF NOT EXISTS wallet_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            direction TEXT NOT NULL CHECK(direction IN ('credit', 'debit')),
+            method TEXT,
+            status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'approved', 'rejected', 'cancelled')),
+            reference TEXT,
+            description TEXT,
+            admin_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tx_user ON wallet_transactions(user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_tx_status ON wallet_transactions(status, created_at DESC)",
+    ],
+    'loyalty_system': [
+        """
+        CREATE TABLE IF NOT EXISTS user_points (
+            user_id INTEGER PRIMARY KEY,
+            total_points INTEGER DEFAULT 0,
+            current_points INTEGER DEFAULT 0,
+            level TEXT DEFAULT 'bronze',
+            last_daily_login DATE,
+            birthday DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS points_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            points INTEGER,
+            action TEXT,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """,
+    ],
+    'i18n': [
+        """
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            user_id INTEGER PRIMARY KEY,
+            language TEXT NOT NULL DEFAULT 'fa',
+            theme TEXT DEFAULT 'default',
+            notifications_enabled INTEGER DEFAULT 1
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS translations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lang TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            UNIQUE(lang, key)
+        )
+        """,
+    ],
+    'auto_backup': [
+        """
+        CREATE TABLE IF NOT EXISTS backup_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            backup_id TEXT UNIQUE NOT NULL,
+            timestamp TEXT NOT NULL,
+            backup_type TEXT,
+            size_bytes INTEGER,
+            file_count INTEGER,
+            compression_ratio REAL,
+            checksum TEXT,
+            location TEXT,
+            status TEXT,
+            restore_count INTEGER DEFAULT 0,
+            notes TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS backup_schedule (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            schedule_type TEXT NOT NULL,
+            frequency TEXT,
+            next_run TEXT,
+            last_run TEXT,
+            enabled BOOLEAN DEFAULT 1,
+            retention_days INTEGER DEFAULT 30
+        )
+        """,
+    ],
+}
+
+_RATE_LIMIT_DEFAULTS = [
+    ('start', 10, 3, 30, 5),
+    ('admin', 60, 10, 10, 10),
+    ('purchase', 5, 2, 120, 3),
+    ('wallet', 20, 5, 60, 5),
+    ('support', 10, 3, 60, 5),
+    ('default', 30, 5, 30, 5),
+]
+
+_BACKUP_SCHEDULE_DEFAULTS = [
+    ('database', 'daily', 30),
+    ('logs', 'weekly', 7),
+    ('full', 'weekly', 30),
+    ('config', 'on_change', 90),
+]
+
+
+def _m003_feature_tables(cursor: sqlite3.Cursor):
+    for statements in FEATURE_TABLES.values():
+        for ddl in statements:
+            cursor.execute(ddl)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO rate_limit_config "
+        "(endpoint, requests_per_minute, burst_limit, cooldown_seconds, auto_ban_threshold) VALUES (?, ?, ?, ?, ?)",
+        _RATE_LIMIT_DEFAULTS,
+    )
+    # backup_schedule has no unique key; seed only once
+    if cursor.execute("SELECT 1 FROM backup_schedule LIMIT 1").fetchone() is None:
+        cursor.executemany(
+            "INSERT INTO backup_schedule (schedule_type, frequency, retention_days) VALUES (?, ?, ?)",
+            _BACKUP_SCHEDULE_DEFAULTS,
+        )
+
+
+def _m004_metrics_rollup(cursor: sqlite3.Cursor):
+    """Per-minute / per-hour aggregates written by bot.metrics"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS metrics_rollup (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            name TEXT NOT NULL,
+            labels TEXT,
+            kind TEXT NOT NULL,
+            count REAL,
+            sum REAL,
+            min REAL,
+            max REAL,
+            buckets TEXT
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_metrics_rollup_period ON metrics_rollup(resolution, period_start)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_perf_metrics_ts ON performance_metrics(timestamp)")
+
+
+def _m005_translations_version(cursor: sqlite3.Cursor):
+    """Bump settings.translations_version on any translations edit so bot.i18n can hot-reload"""
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('translations_version', '0')")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_translations_version_{event.lower()}
+            AFTER {event} ON translations
+            BEGIN
+                UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'translations_version';
+            END
+        """)
+
+
+def _m006_error_events(cursor: sqlite3.Cursor):
+    """Error tables of bot.error_handler plus aggregation columns for deduplicated events"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS error_tracking (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            error_type TEXT NOT NULL,
+            error_message TEXT,
+            user_id INTEGER,
+            handler_name TEXT,
+            stack_trace TEXT,
+            resolved BOOLEAN DEFAULT 0,
+            resolution_notes TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS error_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pattern TEXT NOT NULL UNIQUE,
+            count INTEGER DEFAULT 1,
+            last_seen TEXT,
+            auto_response TEXT,
+            priority TEXT DEFAULT 'low'
+        )
+    """)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(error_tracking)").fetchall()}
+    # One error_tracking row now stands for every occurrence of a fingerprint within a flush window
+    if 'fingerprint' not in columns:
+        cursor.execute("ALTER TABLE error_tracking ADD COLUMN fingerprint TEXT")
+    if 'occurrences' not in columns:
+        cursor.execute("ALTER TABLE error_tracking ADD COLUMN occurrences INTEGER DEFAULT 1")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_error_tracking_ts ON error_tracking(timestamp)")
+
+
+def _m007_panel_endpoint_profile(cursor: sqlite3.Cursor):
+    """JSON endpoint-variant profile per panel (bot.panel_capabilities)"""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(panels)").fetchall()}
+    if 'endpoint_profile' not in columns:
+        cursor.execute("ALTER TABLE panels ADD COLUMN endpoint_profile TEXT")
+
+
+
+def _m008_approval_jobs(cursor: sqlite3.Cursor):
+    """Provisioning jobs of bot.approval_queue; the order id is the idempotency key"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS approval_jobs (
+            order_id INTEGER PRIMARY KEY,
+            panel_id INTEGER,
+            inbound_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_approval_jobs_status ON approval_jobs(status)")
+
+
+def _m009_notified_low_traffic(cursor: sqlite3.Cursor):
+    """Per-order flag of SmartNotification.check_low_traffic (one low-traffic alert per service)"""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(orders)").fetchall()}
+    if 'notified_low_traffic' not in columns:
+        cursor.execute("ALTER TABLE orders ADD COLUMN notified_low_traffic INTEGER DEFAULT 0")
+
+# (version, name, apply). Append new migrations here; never edit applied ones.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, 'core_schema', _m001_core_schema),
+    (2, 'core_indexes', _m002_core_indexes),
+    (3, 'feature_tables', _m003_feature_tables),
+    (4, 'metrics_rollup', _m004_metrics_rollup),
+    (5, 'translations_version', _m005_translations_version),
+    (6, 'error_events', _m006_error_events),
+    (7, 'panel_endpoint_profile', _m007_panel_endpoint_profile),
+    (8, 'approval_jobs', _m008_approval_jobs),
+    (9, 'notified_low_traffic', _m009_notified_low_traffic),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_schema_ready = False
+
+
+def run_migrations(db_name: str = DB_NAME) -> List[Tuple[int, str, float]]:
+    """Apply pending migrations atomically; returns ``[(version, name, seconds), ...]``"""
+    global _schema_ready
+    conn = sqlite3.connect(db_name, check_same_thread=False, isolation_level=None)
+    try:
+        version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+        if version >= LATEST_VERSION:
+            _schema_ready = True
+            return []
+        try:
+            # Persistent per database file; cannot be changed inside a transaction
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error:
+            pass
+        cursor = conn.cursor()
+        applied = []
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the write lock in case another process migrated meanwhile
+            version = int(cursor.execute("PRAGMA user_version").fetchone()[0])
+            for number, name, apply in MIGRATIONS:
+                if number <= version:
+                    continue
+                t0 = time.perf_counter()
+                apply(cursor)
+                applied.append((number, name, time.perf_counter() - t0))
+            cursor.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    _schema_ready = True
+    for number, name, secs in applied:
+        record_phase(f"migration {number:03d} {name}", secs)
+    if applied:
+        logger.info(f"Schema migrated from v{version} to v{LATEST_VERSION}: {', '.join(n for _, n, _ in applied)}")
+    return applied
+
+
+def ensure_schema():
+    """Cheap guard for feature modules: at most one version check per process"""
+    if _schema_ready:
+        return
+    try:
+        run_migrations()
+    except Exception as e:
+        logger.error(f"Schema migration failed: {e}")
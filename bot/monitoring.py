@@ -8,6 +8,8 @@ import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 from .db import query_db, execute_db
+from .migrations import ensure_schema
+from .metrics import get_metrics
 from .config import logger
 import traceback
 
@@ -23,46 +25,11 @@ class PerformanceMonitor:
         self._create_tables()
     
     def _create_tables(self):
-        """Create monitoring tables"""
-        try:
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS performance_metrics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    metric_name TEXT NOT NULL,
-                    metric_value REAL NOT NULL,
-                    metadata TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS error_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    error_type TEXT NOT NULL,
-                    error_message TEXT NOT NULL,
-                    stack_trace TEXT,
-                    user_id INTEGER,
-                    handler_name TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS health_checks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    component TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    response_time REAL,
-                    details TEXT
-                )
-            """)
-            
-        except Exception as e:
-            logger.error(f"Create monitoring tables error: {e}")
+        """Tables are owned by bot.migrations; this is a single version check"""
+        ensure_schema()
     
-    def log_request(self, duration: float, handler_name: str = ""):
-        """Log request performance"""
+    def log_request(self, duration: float, handler_name: str = "", success: bool = True):
+        """Log request performance (in-memory; rolled up by bot.metrics)"""
         self.request_count += 1
         
         # Track slow requests (>2 seconds)
@@ -77,15 +44,9 @@ class PerformanceMonitor:
             if len(self.slow_requests) > 100:
                 self.slow_requests = self.slow_requests[-100:]
         
-        # Log to database
-        try:
-            execute_db(
-                """INSERT INTO performance_metrics (timestamp, metric_name, metric_value, metadata)
-                   VALUES (?, 'request_duration', ?, ?)""",
-                (datetime.now().isoformat(), duration, handler_name)
-            )
-        except Exception:
-            pass
+        metrics = get_metrics()
+        metrics.observe('bot_request_duration_seconds', duration, handler=handler_name)
+        metrics.inc('bot_requests_total', handler=handler_name, status='ok' if success else 'error')
     
     def log_error(self, error: Exception, user_id: Optional[int] = None, handler_name: str = ""):
         """Log error"""
@@ -130,6 +91,16 @@ class PerformanceMonitor:
     async def check_panel_health(self, panel_id: int) -> Dict:
         """Check VPN panel connectivity"""
         start = time.time()
+        from .panel_health import get_panel_breaker
+        breaker = get_panel_breaker(panel_id)
+        if not breaker.available:
+            # Fast-failing anyway; the breaker's own half-open probe decides when it is back
+            return {
+                'status': 'unhealthy',
+                'response_time': 0.0,
+                'message': f'Circuit open, retry in {breaker.retry_in():.0f}s ({breaker.last_error})',
+                'breaker': breaker.state,
+            }
         try:
             from .panel import VpnPanelAPI
             panel_api = VpnPanelAPI(panel_id=panel_id)
@@ -1,3 +1,4 @@
+import asyncio
 import requests
 import json
 import uuid
@@ -6,9 +7,18 @@ from urllib.parse import urlsplit
 from datetime import datetime, timedelta
 import random
 import re
+import threading
 
 from .config import logger
 from .db import query_db
+from .metrics import get_metrics
+from .panel_capabilities import get_panel_capabilities
+from .panel_health import (
+    get_panel_breaker, last_known_usage, listing_requests, remember_usage, slow_request_seconds,
+)
+from .panel_batch import OP_DELETE, OP_RENEW, ClientMutation, MutationResult, apply_mutations
+from .config_links import link_host, link_template
+from .panel_inbound import parse_inbound
 
 
 def generate_username(user_id: int, desired_username: str = None) -> str:
@@ -35,6 +45,148 @@ _PANEL_API_CACHE: dict[tuple, tuple] = {}
 _PANEL_API_TTL_SECONDS = 14400  # 4 hours (tokens refresh automatically within instance)
 
 
+# Path segments that carry ids/usernames/emails collapse to ":id" so latency series stay bounded
+_ENDPOINT_ID_RE = re.compile(r"/(?=[^/]*[\d@.-])[^/]+|/[0-9a-fA-F]{24,}")
+_ENDPOINT_LABELS_PER_PANEL = 64
+
+
+class _TimedSession(requests.Session):
+    """requests.Session that records per-panel, per-endpoint latency into bot.metrics
+    and feeds the panel's circuit breaker (bot.panel_health)"""
+
+    def __init__(self, panel_id):
+        super().__init__()
+        self._panel_label = str(panel_id)
+        self._endpoints: set = set()
+        self._breaker = get_panel_breaker(panel_id)
+
+    def _endpoint(self, method: str, url: str) -> str:
+        label = f"{(method or '').upper()} {_ENDPOINT_ID_RE.sub('/:id', urlsplit(url).path or '/')}"
+        if label not in self._endpoints:
+            if len(self._endpoints) >= _ENDPOINT_LABELS_PER_PANEL:
+                return f"{(method or '').upper()} other"
+            self._endpoints.add(label)
+        return label
+
+    def request(self, method, url, *args, **kwargs):
+        probe = self._breaker.before_request()
+        t0 = _time.perf_counter()
+        failed, error = True, None
+        try:
+            resp = super().request(method, url, *args, **kwargs)
+            # 4xx means the panel is up and answering; only 5xx and slowness count against it
+            failed = resp.status_code >= 500 or _time.perf_counter() - t0 > slow_request_seconds()
+            error = f"HTTP {resp.status_code}" if resp.status_code >= 500 else ("slow response" if failed else None)
+            return resp
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._breaker.record(failed, error, probe=probe)
+            get_metrics().observe(
+                'panel_request_duration_seconds', _time.perf_counter() - t0,
+                panel=self._panel_label, endpoint=self._endpoint(method, url),
+            )
+
+
+# Batched username lookups (``lookup_users``): panels with a filtered endpoint are asked only
+# for the requested names; otherwise one full listing per panel is shared for a few seconds
+PANEL_USERS_SNAPSHOT_TTL = 30
+# Above this many names a single full listing is cheaper than per-name requests
+PANEL_LOOKUP_FILTERED_MAX = 20
+
+_USERS_SNAPSHOTS: dict[int, tuple] = {}
+_USERS_SNAPSHOT_LOCKS: dict[int, threading.Lock] = {}
+_USERS_SNAPSHOT_LOCKS_GUARD = threading.Lock()
+
+
+def _fresh_users_snapshot(panel_id) -> dict | None:
+    cached = _USERS_SNAPSHOTS.get(panel_id)
+    if cached and _time.monotonic() - cached[0] < PANEL_USERS_SNAPSHOT_TTL:
+        return cached[1]
+    return None
+
+
+def invalidate_users_snapshot(panel_id=None):
+    """Drop the shared listing of one panel (or all) after a write that changes usage/limits"""
+    if panel_id is None:
+        _USERS_SNAPSHOTS.clear()
+    else:
+        _USERS_SNAPSHOTS.pop(panel_id, None)
+
+
+# Serializes the bot's own batched writes to one inbound (bot.panel_batch)
+_INBOUND_WRITE_LOCKS: dict[tuple, threading.Lock] = {}
+_INBOUND_WRITE_LOCKS_GUARD = threading.Lock()
+
+
+def _inbound_write_lock(panel_id, inbound_id) -> threading.Lock:
+    with _INBOUND_WRITE_LOCKS_GUARD:
+        return _INBOUND_WRITE_LOCKS.setdefault((panel_id, int(inbound_id)), threading.Lock())
+
+
+def _inbound_update_payload(inbound_id: int, full: dict, settings_obj: dict) -> dict:
+    """Full-object body for ``inbounds/update/{id}`` with ``settings`` replaced"""
+    return {
+        "id": int(inbound_id),
+        "up": full.get('up', 0),
+        "down": full.get('down', 0),
+        "total": full.get('total', 0),
+        "remark": full.get('remark') or "",
+        "enable": bool(full.get('enable', True)),
+        "expiryTime": full.get('expiryTime', 0) or 0,
+        "listen": full.get('listen') or "",
+        "port": full.get('port') or 0,
+        "protocol": full.get('protocol') or full.get('type') or "vless",
+        "settings": json.dumps(settings_obj),
+        "streamSettings": full.get('streamSettings') or full.get('stream_settings') or "{}",
+        "sniffing": full.get('sniffing') or "{}",
+        "allocate": full.get('allocate') or "{}",
+    }
+
+
+def _client_has_limits(inbound: dict | None, username: str, total_bytes, expiry, tolerance: int = 0) -> bool:
+    """Whether ``inbound`` (read back after an update) holds ``username`` with these limits"""
+    c = parse_inbound(inbound).find(username) if inbound else None
+    return c is not None and c.total_bytes == int(total_bytes or 0) \
+        and abs(c.expiry_ms - int(expiry or 0)) <= tolerance
+
+
+def _usage_entry(username: str, data_limit, used_traffic, expire=0, enabled=True) -> dict:
+    """Common shape returned by ``lookup_users`` (same keys as ``get_user`` results)"""
+    try:
+        data_limit = int(data_limit or 0)
+    except (TypeError, ValueError):
+        data_limit = 0
+    try:
+        used_traffic = int(used_traffic or 0)
+    except (TypeError, ValueError):
+        used_traffic = 0
+    try:
+        expire = int(expire or 0)
+    except (TypeError, ValueError):
+        expire = 0
+    return {'username': username, 'data_limit': data_limit, 'used_traffic': used_traffic, 'expire': expire,
+            'enabled': enabled is not False}
+
+
+def _usage_from_client_traffic(obj: dict) -> dict | None:
+    """X-UI ``clientStats`` / ``getClientTraffics`` row -> usage entry"""
+    email = obj.get('email') or obj.get('name')
+    if not email:
+        return None
+    try:
+        used = int(obj.get('down') or obj.get('download') or 0) + int(obj.get('up') or obj.get('upload') or 0)
+    except (TypeError, ValueError):
+        used = 0
+    expiry_ms = obj.get('expiryTime') or 0
+    try:
+        expire = int(int(expiry_ms) / 1000) if int(expiry_ms) > 0 else 0
+    except (TypeError, ValueError):
+        expire = 0
+    return _usage_entry(email, obj.get('total') or obj.get('totalGB'), used, expire, obj.get('enable', True))
+
+
 class BasePanelAPI:
     async def get_all_users(self):
         raise NotImplementedError
@@ -48,6 +200,260 @@ class BasePanelAPI:
     async def create_user(self, user_id, plan, desired_username: str | None = None):
         raise NotImplementedError
 
+    @property
+    def caps(self):
+        """Remembered working endpoint variant per operation (bot.panel_capabilities)"""
+        return get_panel_capabilities(self.panel_id, self.base_url)
+
+    def _lookup_users_filtered(self, usernames: list) -> dict | None:
+        """{username: usage} from endpoints that return only the requested users; None if unsupported"""
+        return None
+
+    def _list_users_usage(self) -> list | None:
+        """Usage entries of every user on the panel, used for the shared snapshot; None if unsupported"""
+        return None
+
+    def _users_snapshot(self) -> dict:
+        panel_id = self.panel_id
+        with _USERS_SNAPSHOT_LOCKS_GUARD:
+            lock = _USERS_SNAPSHOT_LOCKS.setdefault(panel_id, threading.Lock())
+        # Concurrent renders for the same panel wait for one listing instead of each fetching it
+        with lock:
+            snap = _fresh_users_snapshot(panel_id)
+            if snap is not None:
+                return snap
+            try:
+                with listing_requests():
+                    entries = self._list_users_usage()
+            except Exception as e:
+                logger.warning(f"Users listing failed on panel {panel_id}: {e}")
+                entries = None
+            if entries is None:
+                return {}
+            snap = {e['username']: e for e in entries if e.get('username')}
+            _USERS_SNAPSHOTS[panel_id] = (_time.monotonic(), snap)
+            get_metrics().inc('panel_users_snapshot_total', panel=str(panel_id))
+            return snap
+
+    def lookup_users(self, usernames) -> dict:
+        """Blocking batched lookup: {username: {'data_limit', 'used_traffic', 'expire'}} for ``usernames``
+
+        Missing users are simply absent. Cost is one filtered request per name (or one
+        for all of them) where the panel supports it, else one shared listing per
+        ``PANEL_USERS_SNAPSHOT_TTL``. Run it via ``asyncio.to_thread``.
+        """
+        names = list(dict.fromkeys(u for u in usernames if u))
+        if not names:
+            return {}
+        snap = _fresh_users_snapshot(self.panel_id)
+        if snap is None and len(names) <= PANEL_LOOKUP_FILTERED_MAX:
+            try:
+                found = self._lookup_users_filtered(names)
+            except Exception as e:
+                logger.debug(f"Filtered user lookup failed on panel {self.panel_id}: {e}")
+                found = None
+            if found is not None:
+                return found
+        if snap is None:
+            if type(self)._list_users_usage is BasePanelAPI._list_users_usage:
+                # No full listing on this panel type: filtered requests in chunks instead
+                found = {}
+                for k in range(0, len(names), PANEL_LOOKUP_FILTERED_MAX):
+                    try:
+                        found.update(self._lookup_users_filtered(names[k:k + PANEL_LOOKUP_FILTERED_MAX]) or {})
+                    except Exception as e:
+                        logger.debug(f"Filtered user lookup failed on panel {self.panel_id}: {e}")
+                return found
+            snap = self._users_snapshot()
+        return {u: snap[u] for u in names if u in snap}
+
+
+class _ClientTrafficLookup:
+    """``lookup_users`` support for X-UI style panels (getClientTraffics / clientStats)"""
+
+    _INBOUND_LIST_PATHS = (
+        "/panel/api/inbounds/list",
+        "/xui/api/inbounds/list",
+        "/xui/API/inbounds/",
+        "/panel/API/inbounds/",
+    )
+
+    def _lookup_users_filtered(self, usernames: list) -> dict | None:
+        if not self.get_token():
+            return None
+        found = {}
+        for name in usernames:
+            obj = self._fetch_client_traffic_by_email(name)
+            entry = _usage_from_client_traffic(obj) if isinstance(obj, dict) else None
+            if entry:
+                found[name] = entry
+        return found
+
+    def _list_users_usage(self) -> list | None:
+        # One inbound listing carries clientStats for every client on the panel
+        if not self.get_token():
+            return None
+        headers = getattr(self, '_json_headers', None) or {'Accept': 'application/json'}
+        for path in self._INBOUND_LIST_PATHS:
+            try:
+                resp = self.session.get(f"{self.base_url}{path}", headers=headers, timeout=15)
+                if resp.status_code != 200:
+                    continue
+                data = resp.json()
+            except Exception:
+                continue
+            items = data.get('obj') if isinstance(data, dict) else data
+            if not isinstance(items, list):
+                continue
+            entries = []
+            for ib in items:
+                for st in (ib.get('clientStats') or []) if isinstance(ib, dict) else []:
+                    entry = _usage_from_client_traffic(st) if isinstance(st, dict) else None
+                    if entry:
+                        entries.append(entry)
+            return entries
+        return None
+
+
+class _InboundBatchMutations:
+    """Grouped client renew/delete for X-UI style panels: one inbound update per batch"""
+
+    _INBOUND_UPDATE_PATHS = (
+        "/panel/api/inbounds/update/{id}",
+        "/xui/api/inbounds/update/{id}",
+        "/panel/API/inbounds/update/{id}",
+        "/xui/API/inbounds/update/{id}",
+    )
+
+    def _post_inbound_update(self, inbound_id: int, full: dict, clients: list) -> bool | None:
+        """Write ``clients`` back with the full inbound; None when the panel has no update endpoint"""
+        settings_obj = dict(parse_inbound(full).settings)
+        settings_obj['clients'] = clients
+        payload = _inbound_update_payload(inbound_id, full, settings_obj)
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'}
+        paths = [p.format(id=int(inbound_id)) for p in self._INBOUND_UPDATE_PATHS]
+        probe = self.caps.probe('update_inbound', paths)
+        reachable = False
+        for p in probe:
+            try:
+                r = self.session.post(f"{self.base_url}{p}", headers=headers, json=payload, timeout=15)
+            except requests.RequestException:
+                reachable = True
+                probe.miss(0)
+                continue
+            if r.status_code in (404, 405):
+                probe.miss(r.status_code)
+                continue
+            reachable = True
+            if r.status_code not in (200, 201, 204):
+                probe.miss(r.status_code)
+                continue
+            probe.hit()
+            try:
+                body = r.json()
+            except ValueError:
+                body = None
+            if isinstance(body, dict) and body.get('success') is False:
+                logger.warning(f"panel {self.panel_id}: inbound {inbound_id} update refused: {body.get('msg')}")
+                return False
+            return True
+        return False if reachable else None
+
+    def _apply_client_mutations_singly(self, inbound_id: int, mutations: list, parsed, plan) -> list:
+        """Per-client endpoints, for panels without a full inbound update"""
+        out = []
+        for n, m in enumerate(mutations):
+            if n in plan.results:
+                out.append(plan.results[n])
+                continue
+            op, i = plan.targets[n]
+            raw = parsed.clients[i].raw
+            email = raw.get('email') or m.username
+            try:
+                if op == OP_DELETE:
+                    if hasattr(self, 'delete_user_on_inbound'):
+                        ok = bool(self.delete_user_on_inbound(inbound_id, email, client_id=raw.get('id') or raw.get('uuid')))
+                    else:
+                        ok = bool(self._delete_client_on_inbound(inbound_id, raw, email))
+                    out.append(MutationResult(ok, "Success" if ok else "کلاینت حذف نشد"))
+                elif op == OP_RENEW:
+                    updated, msg = self.renew_user_on_inbound(inbound_id, email, m.add_gb, m.add_days)
+                    out.append(MutationResult(updated is not None, msg, updated))
+                elif hasattr(self, '_update_client_by_uuid'):
+                    updated = m.updated(raw, int(datetime.now().timestamp() * 1000))
+                    ok = bool(self._update_client_by_uuid(inbound_id, raw.get('id') or raw.get('uuid'),
+                                                          int(updated.get('totalGB', 0) or 0),
+                                                          int(updated.get('expiryTime', 0) or 0), updated))
+                    out.append(MutationResult(ok, "Success" if ok else "به‌روزرسانی کلاینت ناموفق بود", updated if ok else None))
+                else:
+                    out.append(MutationResult(False, "این عملیات در این پنل پشتیبانی نمی‌شود"))
+            except Exception as e:
+                out.append(MutationResult(False, str(e)))
+        return out
+
+    def _apply_client_mutations(self, inbound_id: int, mutations: list) -> list:
+        return apply_mutations(
+            mutations,
+            fetch=lambda: self._fetch_inbound_detail(inbound_id),
+            write=lambda full, clients: self._post_inbound_update(inbound_id, full, clients),
+            apply_singly=lambda batch, parsed, plan: self._apply_client_mutations_singly(inbound_id, batch, parsed, plan),
+            panel_id=self.panel_id, inbound_id=inbound_id,
+        )
+
+    def apply_client_mutations(self, inbound_id: int, mutations) -> list:
+        """Apply ``ClientMutation``s to one inbound with a single update; one ``MutationResult`` per mutation, in order
+
+        Blocking; run it via ``asyncio.to_thread`` from handlers.
+        """
+        mutations = list(mutations)
+        if not mutations:
+            return []
+        if not self.get_token():
+            return [MutationResult(False, "خطا در ورود به پنل") for _ in mutations]
+        t0 = _time.perf_counter()
+        with _inbound_write_lock(self.panel_id, inbound_id):
+            results = self._apply_client_mutations(int(inbound_id), mutations)
+        invalidate_users_snapshot(self.panel_id)
+        m = get_metrics()
+        m.observe('panel_batch_seconds', _time.perf_counter() - t0, panel=str(self.panel_id))
+        ok = sum(1 for r in results if r.ok)
+        if ok:
+            m.inc('panel_batch_mutations_total', ok, panel=str(self.panel_id), result='ok')
+        if len(results) - ok:
+            m.inc('panel_batch_mutations_total', len(results) - ok, panel=str(self.panel_id), result='failed')
+        return results
+
+    def delete_users(self, usernames) -> dict:
+        """Delete clients by email across all inbounds, one batched update per inbound: {username: MutationResult}"""
+        names = list(dict.fromkeys(u for u in usernames if u))
+        if not names:
+            return {}
+        if not self.get_token():
+            return {u: MutationResult(False, "خطا در ورود به پنل") for u in names}
+        inbounds, msg = self.list_inbounds()
+        if not inbounds:
+            return {u: MutationResult(False, msg or "اینباندی یافت نشد") for u in names}
+        results = {}
+        for ib in inbounds:
+            inbound_id = ib.get('id') if isinstance(ib, dict) else None
+            if inbound_id is None:
+                continue
+            # Listings usually embed settings: only inbounds holding one of the names get a write
+            if ib.get('settings'):
+                listed = parse_inbound(ib)
+                present = [u for u in names if u in listed.by_email]
+            else:
+                present = names
+            if not present:
+                continue
+            mutations = [ClientMutation.delete(u) for u in present]
+            for mu, res in zip(mutations, self.apply_client_mutations(inbound_id, mutations)):
+                if res.ok or mu.username not in results:
+                    results[mu.username] = res
+        for u in names:
+            results.setdefault(u, MutationResult(False, "کلاینتی برای حذف یافت نشد"))
+        return results
+
 
 class MarzbanAPI(BasePanelAPI):
     def __init__(self, panel_row):
@@ -58,7 +464,7 @@ class MarzbanAPI(BasePanelAPI):
         self.base_url = _raw
         self.username = panel_row['username']
         self.password = panel_row['password']
-        self.session = requests.Session()
+        self.session = _TimedSession(self.panel_id)
         self.access_token = None
         self.token_expire_time = None
 
@@ -113,17 +519,11 @@ class MarzbanAPI(BasePanelAPI):
         inbound = self._fetch_inbound_detail(inbound_id)
         if not inbound:
             return False, "اینباند یافت نشد"
-        try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-        except Exception:
-            settings_obj = {}
-        clients = settings_obj.get('clients') or []
-        for c in list(clients):
-            if (c.get('email') == username) or (client_id and (c.get('id') == client_id or c.get('uuid') == client_id)):
-                ok = self._delete_client_on_inbound(int(inbound_id), c, username)
-                return (True, "Success") if ok else (False, "ناموفق در حذف کلاینت")
-        return False, "کلاینت موردنظر یافت نشد"
+        found = parse_inbound(inbound).find(username, client_id)
+        if found is None:
+            return False, "کلاینت موردنظر یافت نشد"
+        ok = self._delete_client_on_inbound(int(inbound_id), found.raw, username)
+        return (True, "Success") if ok else (False, "ناموفق در حذف کلاینت")
 
     def _fetch_inbound_detail(self, inbound_id: int):
         # Best-effort fetch inbound detail; try multiple endpoints
@@ -133,16 +533,21 @@ class MarzbanAPI(BasePanelAPI):
             f"{self.base_url}/xui/api/inbounds/get/{inbound_id}",
             f"{self.base_url}/panel/api/inbounds/get/{inbound_id}",
         ]
-        for ep in eps:
+        probe = self.caps.probe('inbound_detail', eps)
+        for ep in probe:
             try:
                 r = self.session.get(ep, headers={'Accept': 'application/json'}, timeout=12)
                 if r.status_code != 200:
+                    probe.miss(r.status_code)
                     continue
                 data = r.json()
+                probe.hit()
                 # Common shapes: {'obj': {...}} or flat
                 return data.get('obj') if isinstance(data, dict) and isinstance(data.get('obj'), dict) else data
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return None
 
     def _update_client_on_inbound(self, inbound_id: int, clients_payload_json: str):
@@ -156,14 +561,17 @@ class MarzbanAPI(BasePanelAPI):
             f"{self.base_url}/panel/api/inbound/updateClient",
         ]
         headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
-        for ep in endpoints:
+        probe = self.caps.probe('update_client', endpoints)
+        for ep in probe:
             try:
                 body = {"id": int(inbound_id), "settings": clients_payload_json}
                 r = self.session.post(ep, headers=headers, json=body, timeout=15)
                 if r.status_code in (200, 201, 202):
+                    probe.hit()
                     return True
+                probe.miss(r.status_code)
             except requests.RequestException:
-                continue
+                probe.miss(0)
         return False
 
     def renew_user_on_inbound(self, inbound_id: int, username: str, add_gb: float, add_days: int):
@@ -173,19 +581,12 @@ class MarzbanAPI(BasePanelAPI):
         inbound = self._fetch_inbound_detail(inbound_id)
         if not inbound:
             return None, "اینباند یافت نشد"
-        try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-        except Exception:
-            settings_obj = {}
-        clients = settings_obj.get('clients') or []
-        target = None
-        for c in clients:
-            if c.get('email') == username:
-                target = c
-                break
-        if target is None:
+        parsed = parse_inbound(inbound)
+        found = parsed.find(username)
+        if found is None:
             return None, "کلاینت یافت نشد"
+        clients = parsed.editable_clients()
+        target = clients[found.pos]
         try:
             cur_total = int(target.get('totalGB') or 0)
         except Exception:
@@ -217,18 +618,15 @@ class MarzbanAPI(BasePanelAPI):
         inbound = self._fetch_inbound_detail(inbound_id)
         if not inbound:
             return None
-        try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-        except Exception:
-            settings_obj = {}
-        clients = settings_obj.get('clients') or []
-        for c in clients:
-            if c.get('email') == username:
-                c['id'] = str(uuid.uuid4())
-                new_settings_json = json.dumps({"clients": clients})
-                ok = self._update_client_on_inbound(int(inbound_id), new_settings_json)
-                return c if ok else None
+        parsed = parse_inbound(inbound)
+        found = parsed.find(username)
+        if found is not None:
+            clients = parsed.editable_clients()
+            c = clients[found.pos]
+            c['id'] = str(uuid.uuid4())
+            new_settings_json = json.dumps({"clients": clients})
+            ok = self._update_client_on_inbound(int(inbound_id), new_settings_json)
+            return c if ok else None
         # Fallback: recreate
         created_user, sub_link, msg = self.create_user_on_inbound(inbound_id, 0, {'traffic_gb': 0, 'duration_days': 0}, desired_username=username)
         return {"email": username} if (created_user and sub_link) else None
@@ -242,7 +640,8 @@ class MarzbanAPI(BasePanelAPI):
             url = f"{self.base_url}/api/users"
             if limit:
                 url += f"?offset={offset}&limit={limit}"
-            r = self.session.get(url, headers=headers, timeout=20)
+            with listing_requests():
+                r = self.session.get(url, headers=headers, timeout=20)
             r.raise_for_status()
             users_data = r.json().get('users', [])
             # Clear large response object from memory immediately
@@ -252,6 +651,44 @@ class MarzbanAPI(BasePanelAPI):
             logger.error(f"Failed to get all users from {self.base_url}: {e}")
             return None, f"خطای پنل: {e}"
 
+    def _users_request(self, params=None, timeout=20):
+        """GET /api/users (optionally filtered), refreshing the token once on 401/403"""
+        if not self.access_token and not self.get_token():
+            return None
+        for _ in range(2):
+            headers = {'Authorization': f'Bearer {self.access_token}', 'accept': 'application/json'}
+            r = self.session.get(f"{self.base_url}/api/users", params=params, headers=headers, timeout=timeout)
+            if r.status_code in (401, 403) and self.get_token():
+                continue
+            r.raise_for_status()
+            return r.json().get('users', []) or []
+        return None
+
+    @staticmethod
+    def _usage_from_user(u: dict) -> dict:
+        used = u.get('used_traffic')
+        if not used:
+            used = int(u.get('download', 0) or u.get('downlink', 0) or 0) + int(u.get('upload', 0) or u.get('uplink', 0) or 0)
+        return _usage_entry(u.get('username'), u.get('data_limit'), used, u.get('expire'), u.get('status') != 'disabled')
+
+    def _lookup_users_filtered(self, usernames: list) -> dict | None:
+        # /api/users accepts repeated ?username= filters: one request for the whole batch
+        users = self._users_request(params=[('username', u) for u in usernames], timeout=10)
+        if users is None:
+            return None
+        wanted = set(usernames)
+        entries = [self._usage_from_user(u) for u in users if u.get('username')]
+        if len(entries) > len(wanted):
+            # Older panels ignore the filter and return everyone; keep it as the shared snapshot
+            _USERS_SNAPSHOTS[self.panel_id] = (_time.monotonic(), {e['username']: e for e in entries})
+        return {e['username']: e for e in entries if e['username'] in wanted}
+
+    def _list_users_usage(self) -> list | None:
+        users = self._users_request()
+        if users is None:
+            return None
+        return [self._usage_from_user(u) for u in users if u.get('username')]
+
     def list_inbounds(self):
         # Try to fetch inbounds from Marzban API; tries multiple endpoints for compatibility
         if not self.access_token and not self.get_token():
@@ -265,7 +702,8 @@ class MarzbanAPI(BasePanelAPI):
             f"{self.base_url}/api/config",
         ]
         last_error = None
-        for url in endpoints:
+        probe = self.caps.probe('inbound_list', endpoints)
+        for url in probe:
             try:
                 try:
                     logger.info(f"Marzban list_inbounds -> GET {url}")
@@ -277,6 +715,7 @@ class MarzbanAPI(BasePanelAPI):
                         logger.error(f"Marzban list_inbounds <- {r.status_code} @ {url} ct={r.headers.get('content-type','')} preview={(r.text or '')[:200]!r}")
                     except Exception:
                         pass
+                    probe.miss(r.status_code)
                     last_error = f"HTTP {r.status_code} @ {url}"
                     continue
                 try:
@@ -286,6 +725,7 @@ class MarzbanAPI(BasePanelAPI):
                         logger.error(f"Marzban list_inbounds JSON parse error @ {url} preview={(r.text or '')[:200]!r}")
                     except Exception:
                         pass
+                    probe.miss()
                     last_error = f"non-JSON response @ {url}"
                     continue
                 # Common shapes: {'inbounds': [...] } or list
@@ -317,6 +757,7 @@ class MarzbanAPI(BasePanelAPI):
                     if flat:
                         items = flat
                 if not isinstance(items, list):
+                    probe.miss()
                     last_error = "ساختار اینباندها قابل تشخیص نیست"
                     continue
                 inbounds = []
@@ -336,8 +777,10 @@ class MarzbanAPI(BasePanelAPI):
                     logger.info(f"Marzban list_inbounds <- OK {len(inbounds)} items from {url}")
                 except Exception:
                     pass
+                probe.hit()
                 return inbounds, "Success"
             except requests.RequestException as e:
+                probe.miss(0)
                 last_error = str(e)
                 continue
         return None, (last_error or "Unknown")
@@ -541,7 +984,7 @@ class MarzbanAPI(BasePanelAPI):
             return None, None, f"خطای پنل: {error_detail}"
 
 
-class XuiAPI(BasePanelAPI):
+class XuiAPI(_ClientTrafficLookup, _InboundBatchMutations, BasePanelAPI):
     """Alireza (X-UI) support using uppercase /xui/API endpoints as per provided method."""
 
     def __init__(self, panel_row):
@@ -556,7 +999,7 @@ class XuiAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self.session = _TimedSession(self.panel_id)
         self._json_headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json',
@@ -641,17 +1084,23 @@ class XuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/api/inbounds/getClientTraffics/{inbound_id}",
             f"{self.base_url}/panel/api/inbounds/getClientTraffics/{inbound_id}",
         ]
-        for url in endpoints:
+        probe = self.caps.probe('client_traffics', endpoints)
+        for url in probe:
             try:
                 resp = self.session.get(url, headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
+                    probe.miss(resp.status_code)
                     continue
                 data = resp.json()
                 items = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(items, list):
+                    probe.hit()
                     return items
+                probe.miss()
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return []
 
     def _fetch_client_traffic_by_email(self, email: str):
@@ -661,17 +1110,24 @@ class XuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/API/inbounds/getClientTraffics/{email}",
             f"{self.base_url}/panel/API/inbounds/getClientTraffics/{email}",
         ]
-        for url in endpoints:
+        probe = self.caps.probe('client_traffic_by_email', endpoints)
+        for url in probe:
             try:
                 resp = self.session.get(url, headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
+                    probe.miss(resp.status_code)
                     continue
                 data = resp.json()
                 obj = data.get('obj') if isinstance(data, dict) else data
-                if isinstance(obj, dict):
-                    return obj
+                if isinstance(obj, dict) or (isinstance(data, dict) and 'obj' in data):
+                    # {"obj": null} is this endpoint answering "no such client"
+                    probe.hit()
+                    return obj if isinstance(obj, dict) else None
+                probe.miss()
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return None
 
     def _delete_client_on_inbound(self, inbound_id: int, client: dict, username: str):
@@ -711,22 +1167,15 @@ class XuiAPI(BasePanelAPI):
         found_any = False
         for ib in inbounds:
             inbound_id = ib.get('id')
+            # Listings usually embed settings: skip the detail fetch for inbounds without the client
+            if ib.get('settings') and parse_inbound(ib).find(username) is None:
+                continue
             inbound = self._fetch_inbound_detail(inbound_id)
             if not inbound:
                 continue
-            settings_str = inbound.get('settings')
-            try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
-                continue
-            for c in list(clients):
-                if c.get('email') == username:
-                    ok = self._delete_client_on_inbound(inbound_id, c, username)
-                    if ok:
-                        found_any = True
+            found = parse_inbound(inbound).find(username)
+            if found is not None and self._delete_client_on_inbound(inbound_id, found.raw, username):
+                found_any = True
         return (True, "Success") if found_any else (False, "کلاینتی برای حذف یافت نشد")
 
     def list_inbounds(self):
@@ -742,24 +1191,29 @@ class XuiAPI(BasePanelAPI):
                 f"{self.base_url}/panel/api/inbounds",
             ]
             last_error = None
+            probe = self.caps.probe('inbound_list', endpoints)
             for attempt in range(2):
-                for url in endpoints:
+                for url in probe:
                     try:
                         resp = self.session.get(url, headers={'Accept': 'application/json'}, timeout=12)
                     except requests.RequestException as e:
+                        probe.miss(0)
                         last_error = str(e)
                         continue
                     if resp.status_code != 200:
+                        probe.miss(resp.status_code)
                         last_error = f"HTTP {resp.status_code} @ {url}"
                         continue
                     ctype = (resp.headers.get('content-type') or '').lower()
                     body = resp.text or ''
                     if ('application/json' not in ctype) and not (body.strip().startswith('{') or body.strip().startswith('[')):
+                        probe.miss()
                         last_error = f"پاسخ JSON معتبر نیست @ {url}"
                         continue
                     try:
                         data = resp.json()
                     except ValueError as ve:
+                        probe.miss()
                         last_error = f"JSON parse error @ {url}: {ve}"
                         continue
                     items = None
@@ -777,6 +1231,7 @@ class XuiAPI(BasePanelAPI):
                     elif isinstance(data, list):
                         items = data
                     if not isinstance(items, list):
+                        probe.miss()
                         last_error = f"ساختار JSON لیست اینباند قابل تشخیص نیست @ {url}"
                         continue
                     inbounds = []
@@ -789,6 +1244,7 @@ class XuiAPI(BasePanelAPI):
                             'protocol': it.get('protocol') or it.get('type') or 'unknown',
                             'port': it.get('port') or it.get('listen_port') or 0,
                         })
+                    probe.hit()
                     return inbounds, "Success"
                 # retry after re-login once
                 if attempt == 0:
@@ -844,33 +1300,38 @@ class XuiAPI(BasePanelAPI):
         ]
         headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
         last_error = None
+        # Up to 4 x 3 variants per round; the remembered (endpoint, payload) pair goes first
+        probe = self.caps.probe('add_client', [(ep, i) for ep in endpoints for i in range(len(payloads))])
         for attempt in range(2):
-            for ep in endpoints:
-                for body in payloads:
-                    try:
-                        resp = self.session.post(ep, headers=headers, json=body, timeout=15)
-                    except requests.RequestException as e:
-                        last_error = str(e)
-                        continue
-                    if resp.status_code in (200, 201):
-                        # Build subscription link
-                        if self.sub_base:
-                            origin = self.sub_base
-                        else:
-                            parts = urlsplit(self.base_url)
-                            host = parts.hostname or ''
-                            port = ''
-                            if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
-                                port = f":{parts.port}"
-                            origin = f"{parts.scheme}://{host}{port}"
-                        sub_link = f"{origin}/sub/{subid}?name={new_username}"
-                        return new_username, sub_link, "Success"
-                    # 401/403 → retry after login once
-                    if resp.status_code in (401, 403) and attempt == 0:
-                        self.get_token()
-                        continue
-                    # Save last error for reporting
-                    last_error = f"HTTP {resp.status_code} @ {ep}: {(resp.text or '')[:160]}"
+            for ep, variant in probe:
+                body = payloads[variant]
+                try:
+                    resp = self.session.post(ep, headers=headers, json=body, timeout=15)
+                except requests.RequestException as e:
+                    last_error = str(e)
+                    probe.miss(0)
+                    continue
+                if resp.status_code in (200, 201):
+                    probe.hit()
+                    # Build subscription link
+                    if self.sub_base:
+                        origin = self.sub_base
+                    else:
+                        parts = urlsplit(self.base_url)
+                        host = parts.hostname or ''
+                        port = ''
+                        if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+                            port = f":{parts.port}"
+                        origin = f"{parts.scheme}://{host}{port}"
+                    sub_link = f"{origin}/sub/{subid}?name={new_username}"
+                    return new_username, sub_link, "Success"
+                probe.miss(resp.status_code)
+                # 401/403 → retry after login once
+                if resp.status_code in (401, 403) and attempt == 0:
+                    self.get_token()
+                    continue
+                # Save last error for reporting
+                last_error = f"HTTP {resp.status_code} @ {ep}: {(resp.text or '')[:160]}"
             # After first round, try re-login once
             if attempt == 0:
                 self.get_token()
@@ -895,80 +1356,73 @@ class XuiAPI(BasePanelAPI):
             inbound = self._fetch_inbound_detail(inbound_id)
             if not inbound:
                 continue
-            settings_str = inbound.get('settings')
-            try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-            except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
-                continue
-            for c in clients:
-                if c.get('email') == username:
-                    total_bytes = int(c.get('totalGB', 0) or 0)
-                    # Try compute used traffic if present in client or stats
-                    used_bytes = 0
-                    try:
-                        down = int(c.get('downlink', 0) or 0)
-                    except Exception:
-                        down = 0
-                    try:
-                        up = int(c.get('uplink', 0) or 0)
-                    except Exception:
-                        up = 0
-                    try:
-                        used_bytes = int(c.get('total', 0) or 0)
-                    except Exception:
-                        used_bytes = down + up
+            found = parse_inbound(inbound).by_email.get(username)
+            if found is not None:
+                c = found.raw
+                total_bytes = int(c.get('totalGB', 0) or 0)
+                # Try compute used traffic if present in client or stats
+                used_bytes = 0
+                try:
+                    down = int(c.get('downlink', 0) or 0)
+                except Exception:
+                    down = 0
+                try:
+                    up = int(c.get('uplink', 0) or 0)
+                except Exception:
+                    up = 0
+                try:
+                    used_bytes = int(c.get('total', 0) or 0)
+                except Exception:
+                    used_bytes = down + up
+                if used_bytes == 0:
+                    # Fetch from getClientTraffics endpoint (by inbound)
+                    stats = self._fetch_client_traffics(inbound_id) or []
+                    for s in stats:
+                        if (s.get('email') or s.get('name')) == username:
+                            try:
+                                d = int(s.get('down') or s.get('download') or 0)
+                            except Exception:
+                                d = 0
+                            try:
+                                u = int(s.get('up') or s.get('upload') or 0)
+                            except Exception:
+                                u = 0
+                            used_bytes = d + u
+                            break
                     if used_bytes == 0:
-                        # Fetch from getClientTraffics endpoint (by inbound)
-                        stats = self._fetch_client_traffics(inbound_id) or []
-                        for s in stats:
-                            if (s.get('email') or s.get('name')) == username:
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                                break
-                        if used_bytes == 0:
-                            # Direct by email
-                            s = self._fetch_client_traffic_by_email(username)
-                            if isinstance(s, dict):
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                    expiry_ms = int(c.get('expiryTime', 0) or 0)
-                    expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
-                    subid = c.get('subId') or ''
-                    # Build subscription URL
-                    if self.sub_base:
-                        origin = self.sub_base
-                    else:
-                        parts = urlsplit(self.base_url)
-                        host = parts.hostname or ''
-                        port = ''
-                        if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
-                            port = f":{parts.port}"
-                        origin = f"{parts.scheme}://{host}{port}"
-                    # Use the user's email (username) as name param for readability
-                    sub_link = f"{origin}/sub/{subid}?name={username}" if subid else ''
-                    return {
-                        'data_limit': total_bytes,
-                        'used_traffic': used_bytes,
-                        'expire': expire,
-                        'subscription_url': sub_link,
-                    }, "Success"
+                        # Direct by email
+                        s = self._fetch_client_traffic_by_email(username)
+                        if isinstance(s, dict):
+                            try:
+                                d = int(s.get('down') or s.get('download') or 0)
+                            except Exception:
+                                d = 0
+                            try:
+                                u = int(s.get('up') or s.get('upload') or 0)
+                            except Exception:
+                                u = 0
+                            used_bytes = d + u
+                expiry_ms = int(c.get('expiryTime', 0) or 0)
+                expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
+                subid = c.get('subId') or ''
+                # Build subscription URL
+                if self.sub_base:
+                    origin = self.sub_base
+                else:
+                    parts = urlsplit(self.base_url)
+                    host = parts.hostname or ''
+                    port = ''
+                    if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+                        port = f":{parts.port}"
+                    origin = f"{parts.scheme}://{host}{port}"
+                # Use the user's email (username) as name param for readability
+                sub_link = f"{origin}/sub/{subid}?name={username}" if subid else ''
+                return {
+                    'data_limit': total_bytes,
+                    'used_traffic': used_bytes,
+                    'expire': expire,
+                    'subscription_url': sub_link,
+                }, "Success"
         return None, "کاربر یافت نشد"
 
     def _fetch_inbound_detail(self, inbound_id: int):
@@ -979,17 +1433,27 @@ class XuiAPI(BasePanelAPI):
             f"/xui/api/inbounds/get/{inbound_id}",
             f"/panel/api/inbounds/get/{inbound_id}",
         ]
-        for p in paths:
+        probe = self.caps.probe('inbound_detail', paths)
+        for p in probe:
             try:
                 resp = self.session.get(f"{self.base_url}{p}", headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
+                    probe.miss(resp.status_code)
                     continue
                 data = resp.json()
                 inbound = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(inbound, dict):
+                    probe.hit()
                     return inbound
+                if isinstance(data, dict) and 'obj' in data:
+                    # Right endpoint, unknown inbound
+                    probe.hit()
+                    return None
+                probe.miss()
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return None
 
     async def renew_user_in_panel(self, username, plan):
@@ -1016,93 +1480,63 @@ class XuiAPI(BasePanelAPI):
             inbound = self._fetch_inbound_detail(inbound_id)
             if not inbound:
                 continue
-            settings_str = inbound.get('settings')
-            clients = []
-            try:
-                if isinstance(settings_str, str):
-                    settings_obj = json.loads(settings_str)
-                    clients = settings_obj.get('clients', [])
-            except Exception:
-                clients = []
-            if not isinstance(clients, list):
+            parsed = parse_inbound(inbound)
+            found = parsed.find(username)
+            if found is None:
                 continue
-            for idx, c in enumerate(clients):
-                if c.get('email') == username:
-                    current_exp = int(c.get('expiryTime', 0) or 0)
-                    base = max(current_exp, now_ms)
-                    target_exp = base + (add_ms if add_ms > 0 else 0)
-                    new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
-                    updated = dict(c)
-                    updated['expiryTime'] = target_exp
-                    updated['totalGB'] = new_total
-                    # Endpoint variants (prioritize updateClient/{uuid})
-                    uuid_old = c.get('id') or c.get('uuid') or ''
-                    base_eps = [
-                        "/xui/API/inbounds/updateClient",
-                        "/panel/API/inbounds/updateClient",
-                        "/xui/api/inbounds/updateClient",
-                        "/panel/api/inbounds/updateClient",
-                    ]
-                    endpoints = ([f"{e}/{uuid_old}" for e in base_eps] + base_eps) if uuid_old else base_eps
-                    json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'}
-                    form_headers = {'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8', 'X-Requested-With': 'XMLHttpRequest'}
-                    last_err = None
-                    for up in endpoints:
-                        try:
-                            # A) settings with single updated client
-                            payload_settings_single = {"id": int(inbound_id), "settings": json.dumps({"clients": [updated]})}
-                            resp = self.session.post(f"{self.base_url}{up}", headers=json_headers, json=payload_settings_single, timeout=15)
-                            if resp.status_code in (200, 201):
-                                ref = self._fetch_inbound_detail(inbound_id)
-                                try:
-                                    robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                                except Exception:
-                                    robj = {}
-                                for c2 in (robj.get('clients') or []):
-                                    if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == target_exp and int(c2.get('totalGB', 0) or 0) == new_total:
-                                        return updated, "Success"
-                            # B) clients array JSON
-                            payload_clients = {"id": int(inbound_id), "clients": [updated]}
-                            resp = self.session.post(f"{self.base_url}{up}", headers=json_headers, json=payload_clients, timeout=15)
-                            if resp.status_code in (200, 201):
-                                ref = self._fetch_inbound_detail(inbound_id)
-                                try:
-                                    robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                                except Exception:
-                                    robj = {}
-                                for c2 in (robj.get('clients') or []):
-                                    if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == target_exp and int(c2.get('totalGB', 0) or 0) == new_total:
-                                        return updated, "Success"
-                            # C) form-urlencoded with settings (single)
-                            resp = self.session.post(f"{self.base_url}{up}", headers=form_headers, data={"id": str(int(inbound_id)), "settings": json.dumps({"clients": [updated]})}, timeout=15)
-                            if resp.status_code in (200, 201):
-                                ref = self._fetch_inbound_detail(inbound_id)
-                                try:
-                                    robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                                except Exception:
-                                    robj = {}
-                                for c2 in (robj.get('clients') or []):
-                                    if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == target_exp and int(c2.get('totalGB', 0) or 0) == new_total:
-                                        return updated, "Success"
-                            # D) settings with full clients
-                            full_clients = list(clients)
-                            full_clients[idx] = updated
-                            payload_settings_full = {"id": int(inbound_id), "settings": json.dumps({"clients": full_clients})}
-                            resp = self.session.post(f"{self.base_url}{up}", headers=json_headers, json=payload_settings_full, timeout=15)
-                            if resp.status_code in (200, 201):
-                                ref = self._fetch_inbound_detail(inbound_id)
-                                try:
-                                    robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                                except Exception:
-                                    robj = {}
-                                for c2 in (robj.get('clients') or []):
-                                    if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == target_exp and int(c2.get('totalGB', 0) or 0) == new_total:
-                                        return updated, "Success"
-                            last_err = f"HTTP {resp.status_code}: {(resp.text or '')[:160]}"
-                        except requests.RequestException as e:
-                            last_err = str(e)
-                            continue
-                    return None, (last_err or "به‌روزرسانی کلاینت ناموفق بود")
+            clients = parsed.client_dicts
+            idx, c = found.pos, found.raw
+            current_exp = int(c.get('expiryTime', 0) or 0)
+            base = max(current_exp, now_ms)
+            target_exp = base + (add_ms if add_ms > 0 else 0)
+            new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
+            updated = dict(c)
+            updated['expiryTime'] = target_exp
+            updated['totalGB'] = new_total
+            # Endpoint variants (prioritize updateClient/{uuid})
+            uuid_old = c.get('id') or c.get('uuid') or ''
+            base_eps = [
+                "/xui/API/inbounds/updateClient",
+                "/panel/API/inbounds/updateClient",
+                "/xui/api/inbounds/updateClient",
+                "/panel/api/inbounds/updateClient",
+            ]
+            endpoints = ([f"{e}/{uuid_old}" for e in base_eps] + base_eps) if uuid_old else base_eps
+            json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'}
+            form_headers = {'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8', 'X-Requested-With': 'XMLHttpRequest'}
+            last_err = None
+            for up in endpoints:
+                try:
+                    # A) settings with single updated client
+                    payload_settings_single = {"id": int(inbound_id), "settings": json.dumps({"clients": [updated]})}
+                    resp = self.session.post(f"{self.base_url}{up}", headers=json_headers, json=payload_settings_single, timeout=15)
+                    if resp.status_code in (200, 201):
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, new_total, target_exp):
+                            return updated, "Success"
+                    # B) clients array JSON
+                    payload_clients = {"id": int(inbound_id), "clients": [updated]}
+                    resp = self.session.post(f"{self.base_url}{up}", headers=json_headers, json=payload_clients, timeout=15)
+                    if resp.status_code in (200, 201):
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, new_total, target_exp):
+                            return updated, "Success"
+                    # C) form-urlencoded with settings (single)
+                    resp = self.session.post(f"{self.base_url}{up}", headers=form_headers, data={"id": str(int(inbound_id)), "settings": json.dumps({"clients": [updated]})}, timeout=15)
+                    if resp.status_code in (200, 201):
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, new_total, target_exp):
+                            return updated, "Success"
+                    # D) settings with full clients
+                    full_clients = list(clients)
+                    full_clients[idx] = updated
+                    payload_settings_full = {"id": int(inbound_id), "settings": json.dumps({"clients": full_clients})}
+                    resp = self.session.post(f"{self.base_url}{up}", headers=json_headers, json=payload_settings_full, timeout=15)
+                    if resp.status_code in (200, 201):
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, new_total, target_exp):
+                            return updated, "Success"
+                    last_err = f"HTTP {resp.status_code}: {(resp.text or '')[:160]}"
+                except requests.RequestException as e:
+                    last_err = str(e)
+                    continue
+            return None, (last_err or "به‌روزرسانی کلاینت ناموفق بود")
         return None, "کلاینت برای تمدید یافت نشد"
 
     async def create_user(self, user_id, plan, desired_username: str | None = None):
@@ -1117,37 +1551,30 @@ class XuiAPI(BasePanelAPI):
             return None, "اینباند یافت نشد"
         try:
             now_ms = int(datetime.now().timestamp() * 1000)
-            settings_str = inbound.get('settings')
-            clients = []
-            try:
-                if isinstance(settings_str, str):
-                    settings_obj = json.loads(settings_str)
-                    clients = settings_obj.get('clients', [])
-            except Exception:
-                clients = []
-            if not isinstance(clients, list):
+            parsed = parse_inbound(inbound)
+            if not isinstance(parsed.settings.get('clients', []), list):
                 return None, "ساختار کلاینت‌ها نامعتبر است"
             updated = None
             cur_total = 0
             cur_exp_raw = 0
-            for c in clients:
-                if c.get('email') == username:
-                    current_exp = int(c.get('expiryTime', 0) or 0)
-                    cur_exp_raw = current_exp
-                    add_bytes = int(float(add_gb) * (1024 ** 3)) if add_gb and add_gb > 0 else 0
-                    # detect seconds vs milliseconds based on current value magnitude
-                    is_ms = current_exp > 10**11
-                    now_unit = now_ms if is_ms else int(now_ms / 1000)
-                    add_unit = (int(add_days) * 86400 * (1000 if is_ms else 1)) if add_days and int(add_days) > 0 else 0
-                    base = max(current_exp, now_unit)
-                    target_exp = base + add_unit if add_unit > 0 else current_exp
-                    cur_total = int(c.get('totalGB', 0) or 0)
-                    new_total = cur_total + (add_bytes if add_bytes > 0 else 0)
-                    updated = dict(c)
-                    updated['expiryTime'] = target_exp
-                    updated['totalGB'] = new_total
-                    uuid_old = c.get('id') or c.get('uuid') or ''
-                    break
+            found = parsed.by_email.get(username)
+            if found is not None:
+                c = found.raw
+                current_exp = int(c.get('expiryTime', 0) or 0)
+                cur_exp_raw = current_exp
+                add_bytes = int(float(add_gb) * (1024 ** 3)) if add_gb and add_gb > 0 else 0
+                # detect seconds vs milliseconds based on current value magnitude
+                is_ms = current_exp > 10**11
+                now_unit = now_ms if is_ms else int(now_ms / 1000)
+                add_unit = (int(add_days) * 86400 * (1000 if is_ms else 1)) if add_days and int(add_days) > 0 else 0
+                base = max(current_exp, now_unit)
+                target_exp = base + add_unit if add_unit > 0 else current_exp
+                cur_total = int(c.get('totalGB', 0) or 0)
+                new_total = cur_total + (add_bytes if add_bytes > 0 else 0)
+                updated = dict(c)
+                updated['expiryTime'] = target_exp
+                updated['totalGB'] = new_total
+                uuid_old = c.get('id') or c.get('uuid') or ''
             if not updated:
                 return None, "کلاینت یافت نشد"
             # Build endpoints per Postman: prioritize updateClient/{uuid}
@@ -1174,70 +1601,35 @@ class XuiAPI(BasePanelAPI):
             payload_json = {"id": int(inbound_id), "settings": settings_payload}
             payload_form = {"id": str(int(inbound_id)), "settings": settings_payload}
             last_err = None; last_ep = None; last_code = None
+
+            def _renew_verified(variant):
+                # verify by refetching inbound; require growth when add requested
+                c2 = parse_inbound(self._fetch_inbound_detail(inbound_id) or {}).find(username)
+                if c2 is None:
+                    return False
+                new_exp, new_total_chk = c2.expiry_ms, c2.total_bytes
+                grew_total = (updated['totalGB'] > cur_total) if (updated['totalGB'] != cur_total) else (add_gb == 0)
+                grew_exp = (updated['expiryTime'] > cur_exp_raw) if (updated['expiryTime'] != cur_exp_raw) else (add_days == 0)
+                logger.info(f"X-UI renew verify {variant}: before_total={cur_total} after_total={new_total_chk} before_exp={cur_exp_raw} after_exp={new_exp}")
+                return new_total_chk == updated['totalGB'] and abs(new_exp - updated['expiryTime']) <= 5 and (grew_total or grew_exp)
+
             for ep in endpoints:
                 try:
                     # A) form-urlencoded (as in provided curl)
                     r = self.session.post(f"{self.base_url}{ep}", headers=form_headers, data=payload_form, timeout=15)
                     if r.status_code in (200, 201):
-                        # verify by refetching inbound
-                        ref = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                        except Exception:
-                            robj = {}
-                        for c2 in (robj.get('clients') or []):
-                            if c2.get('email') == username:
-                                new_exp = int(c2.get('expiryTime', 0) or 0)
-                                new_total_chk = int(c2.get('totalGB', 0) or 0)
-                                # require growth when add requested
-                                grew_total = (updated['totalGB'] > cur_total) if (updated['totalGB'] != cur_total) else (add_gb == 0)
-                                grew_exp = (updated['expiryTime'] > cur_exp_raw) if (updated['expiryTime'] != cur_exp_raw) else (add_days == 0)
-                                try:
-                                    logger.info(f"X-UI renew verify A: before_total={cur_total} after_total={new_total_chk} before_exp={cur_exp_raw} after_exp={new_exp}")
-                                except Exception:
-                                    pass
-                                if new_total_chk == updated['totalGB'] and (new_exp == updated['expiryTime'] or abs(new_exp - updated['expiryTime']) <= 5) and (grew_total or grew_exp):
-                                    return updated, "Success"
+                        if _renew_verified('A'):
+                            return updated, "Success"
                     # B) JSON body with settings string
                     r = self.session.post(f"{self.base_url}{ep}", headers=json_headers, json=payload_json, timeout=15)
                     if r.status_code in (200, 201):
-                        ref = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                        except Exception:
-                            robj = {}
-                        for c2 in (robj.get('clients') or []):
-                            if c2.get('email') == username:
-                                new_exp = int(c2.get('expiryTime', 0) or 0)
-                                new_total_chk = int(c2.get('totalGB', 0) or 0)
-                                try:
-                                    logger.info(f"X-UI renew verify B: before_total={cur_total} after_total={new_total_chk} before_exp={cur_exp_raw} after_exp={new_exp}")
-                                except Exception:
-                                    pass
-                                grew_total = (updated['totalGB'] > cur_total) if (updated['totalGB'] != cur_total) else (add_gb == 0)
-                                grew_exp = (updated['expiryTime'] > cur_exp_raw) if (updated['expiryTime'] != cur_exp_raw) else (add_days == 0)
-                                if new_total_chk == updated['totalGB'] and (new_exp == updated['expiryTime'] or abs(new_exp - updated['expiryTime']) <= 5) and (grew_total or grew_exp):
-                                    return updated, "Success"
+                        if _renew_verified('B'):
+                            return updated, "Success"
                     # C) JSON body with clients array
                     r = self.session.post(f"{self.base_url}{ep}", headers=json_headers, json={"id": int(inbound_id), "clients": [updated]}, timeout=15)
                     if r.status_code in (200, 201):
-                        ref = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                        except Exception:
-                            robj = {}
-                        for c2 in (robj.get('clients') or []):
-                            if c2.get('email') == username:
-                                new_exp = int(c2.get('expiryTime', 0) or 0)
-                                new_total_chk = int(c2.get('totalGB', 0) or 0)
-                                try:
-                                    logger.info(f"X-UI renew verify C: before_total={cur_total} after_total={new_total_chk} before_exp={cur_exp_raw} after_exp={new_exp}")
-                                except Exception:
-                                    pass
-                                grew_total = (updated['totalGB'] > cur_total) if (updated['totalGB'] != cur_total) else (add_gb == 0)
-                                grew_exp = (updated['expiryTime'] > cur_exp_raw) if (updated['expiryTime'] != cur_exp_raw) else (add_days == 0)
-                                if new_total_chk == updated['totalGB'] and (new_exp == updated['expiryTime'] or abs(new_exp - updated['expiryTime']) <= 5) and (grew_total or grew_exp):
-                                    return updated, "Success"
+                        if _renew_verified('C'):
+                            return updated, "Success"
                     last_ep = ep; last_code = r.status_code; last_err = f"HTTP {r.status_code}: {(r.text or '')[:160]}"
                 except requests.RequestException as e:
                     last_ep = ep; last_code = None; last_err = str(e)
@@ -1252,48 +1644,23 @@ class XuiAPI(BasePanelAPI):
                 ]
                 full = self._fetch_inbound_detail(inbound_id) or {}
                 # embed updated client back
-                try:
-                    cur_settings = json.loads(full.get('settings')) if isinstance(full.get('settings'), str) else (full.get('settings') or {})
-                except Exception:
-                    cur_settings = {}
-                cur_clients = list(cur_settings.get('clients') or [])
-                for i, cc in enumerate(cur_clients):
-                    if cc.get('email') == username:
-                        cur_clients[i] = updated
-                        break
+                parsed_full = parse_inbound(full)
+                cur_settings = dict(parsed_full.settings)
+                cur_clients = list(parsed_full.client_dicts)
+                found_full = parsed_full.find(username)
+                if found_full is not None:
+                    cur_clients[found_full.pos] = updated
                 else:
                     cur_clients.append(updated)
                 cur_settings['clients'] = cur_clients
-                settings_payload_str = json.dumps(cur_settings)
-                full_payload = {
-                    "id": int(inbound_id),
-                    "up": full.get('up', 0),
-                    "down": full.get('down', 0),
-                    "total": full.get('total', 0),
-                    "remark": full.get('remark') or "",
-                    "enable": bool(full.get('enable', True)),
-                    "expiryTime": full.get('expiryTime', 0) or 0,
-                    "listen": full.get('listen') or "",
-                    "port": full.get('port') or 0,
-                    "protocol": full.get('protocol') or full.get('type') or "vless",
-                    "settings": settings_payload_str,
-                    "streamSettings": full.get('streamSettings') or full.get('stream_settings') or "{}",
-                    "sniffing": full.get('sniffing') or "{}",
-                    "allocate": full.get('allocate') or "{}",
-                }
+                full_payload = _inbound_update_payload(inbound_id, full, cur_settings)
                 for p in up_paths:
                     try:
                         rr = self.session.post(f"{self.base_url}{p}", headers=json_headers, json=full_payload, timeout=15)
                         if rr.status_code in (200, 201):
                             # verify
-                            ref2 = self._fetch_inbound_detail(inbound_id)
-                            try:
-                                robj2 = json.loads(ref2.get('settings')) if isinstance(ref2.get('settings'), str) else (ref2.get('settings') or {})
-                            except Exception:
-                                robj2 = {}
-                            for c2 in (robj2.get('clients') or []):
-                                if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == updated['expiryTime'] and int(c2.get('totalGB', 0) or 0) == updated['totalGB']:
-                                    return updated, "Success"
+                            if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, updated['totalGB'], updated['expiryTime']):
+                                return updated, "Success"
                         else:
                             last_ep = p; last_code = rr.status_code; last_err = f"{p} -> HTTP {rr.status_code}: {(rr.text or '')[:160]}"
                     except requests.RequestException as e2:
@@ -1317,16 +1684,11 @@ class XuiAPI(BasePanelAPI):
         try:
             import json as _json, uuid as _uuid, random as _rand, string as _str
             now_ms = int(datetime.now().timestamp() * 1000)
-            settings_str = inbound.get('settings')
-            settings_obj = _json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
+            parsed = parse_inbound(inbound)
+            if not isinstance(parsed.settings.get('clients', []), list):
                 return None, "ساختار کلاینت‌ها نامعتبر است"
-            old = None
-            for c in clients:
-                if c.get('email') == username:
-                    old = c
-                    break
+            found = parsed.find(username)
+            old = found.raw if found is not None else None
             if not old:
                 return None, "کلاینت یافت نشد"
             current_exp = int(old.get('expiryTime', 0) or 0)
@@ -1378,178 +1740,39 @@ class XuiAPI(BasePanelAPI):
                 f"{self.base_url}/panel/API/inbounds/addClient",
                 f"{self.base_url}/xui/API/inbounds/addClient",
             ]
-            json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
-            form_headers = {'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
-            settings_payload = _json.dumps({"clients": [new_client]})
-            for ep in add_eps:
-                try:
-                    r1 = self.session.post(ep, headers=json_headers, json={"id": int(inbound_id), "clients": [new_client]}, timeout=15)
-                    if r1.status_code in (200, 201):
-                        return new_client, "Success"
-                    r2 = self.session.post(ep, headers=json_headers, json={"id": int(inbound_id), "settings": settings_payload}, timeout=15)
-                    if r2.status_code in (200, 201):
-                        return new_client, "Success"
-                    r3 = self.session.post(ep, headers=form_headers, data={"id": str(int(inbound_id)), "settings": settings_payload}, timeout=15)
-                    if r3.status_code in (200, 201):
-                        return new_client, "Success"
-                except requests.RequestException:
-                    continue
-            return None, "ساخت کلاینت جدید ناموفق بود"
-        except Exception as e:
-            return None, str(e)
-
-    def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None) -> list:
-        inbound = self._fetch_inbound_detail(inbound_id)
-        if not inbound:
-            return []
-        # helper to find client
-        def _find_client(inv):
-            s = inv.get('settings')
-            try:
-                obj = json.loads(s) if isinstance(s, str) else (s or {})
-            except Exception:
-                obj = {}
-            chosen = None
-            for c in (obj.get('clients') or []):
-                if preferred_id and (c.get('id') == preferred_id or c.get('uuid') == preferred_id):
-                    return c
-                if c.get('email') == username and chosen is None:
-                    chosen = c
-            return chosen
-        client = _find_client(inbound)
-        # small retry to allow propagation
-        retries = 2
-        while client is None and retries > 0:
-            _time.sleep(0.7)
-            inbound = self._fetch_inbound_detail(inbound_id)
-            if not inbound:
-                break
-            client = _find_client(inbound)
-            retries -= 1
-        if not client:
-            return []
-        try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            proto = (inbound.get('protocol') or '').lower()
-            port = inbound.get('port') or inbound.get('listen_port') or 0
-            stream_raw = inbound.get('streamSettings') or inbound.get('stream_settings')
-            stream = json.loads(stream_raw) if isinstance(stream_raw, str) else (stream_raw or {})
-            network = (stream.get('network') or '').lower() or 'tcp'
-            security = (stream.get('security') or '').lower() or ''
-            sni = ''
-            if security == 'tls':
-                tls = stream.get('tlsSettings') or {}
-                sni = tls.get('serverName') or ''
-            elif security == 'reality':
-                reality = stream.get('realitySettings') or {}
-                sni = (reality.get('serverNames') or [''])[0]
-            path = ''
-            host_header = ''
-            service_name = ''
-            header_type = ''
-            if network == 'ws':
-                ws = stream.get('wsSettings') or {}
-                path = ws.get('path') or '/'
-                headers = ws.get('headers') or {}
-                host_header = headers.get('Host') or headers.get('host') or ''
-            elif network == 'tcp':
-                tcp = stream.get('tcpSettings') or {}
-                header = tcp.get('header') or {}
-                if (header.get('type') or '').lower() == 'http':
-                    header_type = 'http'
-                    req = header.get('request') or {}
-                    rp = req.get('path')
-                    if isinstance(rp, list) and rp:
-                        path = rp[0] or '/'
-                    elif isinstance(rp, str) and rp:
-                        path = rp
-                    else:
-                        path = '/'
-                    h = req.get('headers') or {}
-                    hh = h.get('Host') or h.get('host') or ''
-                    if isinstance(hh, list) and hh:
-                        host_header = hh[0]
-                    elif isinstance(hh, str):
-                        host_header = hh
-            if network == 'grpc':
-                grpc = stream.get('grpcSettings') or {}
-                service_name = grpc.get('serviceName') or ''
-            # host
-            parts = urlsplit(self.base_url)
-            host = parts.hostname or ''
-            if not host:
-                host = host_header or sni or host
-            uuid_val = client.get('id') or client.get('uuid') or ''
-            passwd = client.get('password') or ''
-            name = username
-            configs = []
-            if proto == 'vless' and uuid_val:
-                qs = []
-                if network:
-                    qs.append(f'type={network}')
-                if network == 'ws':
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'tcp' and header_type == 'http':
-                    qs.append('headerType=http')
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'grpc' and service_name:
-                    qs.append(f'serviceName={service_name}')
-                if security:
-                    qs.append(f'security={security}')
-                    if sni:
-                        qs.append(f'sni={sni}')
-                else:
-                    qs.append('security=none')
-                flow = client.get('flow')
-                if flow:
-                    qs.append(f'flow={flow}')
-                query = '&'.join(qs)
-                uri = f"vless://{uuid_val}@{host}:{port}?{query}#{name}"
-                configs.append(uri)
-            elif proto == 'vmess' and uuid_val:
-                vm = {
-                    "v": "2",
-                    "ps": name,
-                    "add": host,
-                    "port": str(port),
-                    "id": uuid_val,
-                    "aid": "0",
-                    "net": network,
-                    "type": "none",
-                    "host": host_header or sni or host,
-                    "path": path or "/",
-                    "tls": "tls" if security in ("tls","reality") else "",
-                    "sni": sni or ""
-                }
-                import base64 as _b64
-                b = _b64.b64encode(json.dumps(vm, ensure_ascii=False).encode('utf-8')).decode('utf-8')
-                configs.append(f"vmess://{b}")
-            elif proto == 'trojan' and passwd:
-                qs = []
-                if network:
-                    qs.append(f'type={network}')
-                if network == 'ws':
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'grpc' and service_name:
-                    qs.append(f'serviceName={service_name}')
-                if security:
-                    qs.append(f'security={security}')
-                    if sni:
-                        qs.append(f'sni={sni}')
-                query = '&'.join(qs)
-                uri = f"trojan://{passwd}@{host}:{port}?{query}#{name}"
-                configs.append(uri)
-            return configs
+            json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+            form_headers = {'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
+            settings_payload = _json.dumps({"clients": [new_client]})
+            for ep in add_eps:
+                try:
+                    r1 = self.session.post(ep, headers=json_headers, json={"id": int(inbound_id), "clients": [new_client]}, timeout=15)
+                    if r1.status_code in (200, 201):
+                        return new_client, "Success"
+                    r2 = self.session.post(ep, headers=json_headers, json={"id": int(inbound_id), "settings": settings_payload}, timeout=15)
+                    if r2.status_code in (200, 201):
+                        return new_client, "Success"
+                    r3 = self.session.post(ep, headers=form_headers, data={"id": str(int(inbound_id)), "settings": settings_payload}, timeout=15)
+                    if r3.status_code in (200, 201):
+                        return new_client, "Success"
+                except requests.RequestException:
+                    continue
+            return None, "ساخت کلاینت جدید ناموفق بود"
+        except Exception as e:
+            return None, str(e)
+
+    def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None,
+                                        inbound: dict | None = None, client: dict | None = None) -> list:
+        """Config URIs of one client; pass ``inbound``/``client`` already at hand to skip the fetch.
+        Does not wait for a just-created client to appear: use ``fetch_user_configs`` for that."""
+        inbound = inbound or self._fetch_inbound_detail(inbound_id)
+        if not inbound:
+            return []
+        client = client or find_inbound_client(inbound, username, preferred_id)
+        if not client:
+            return []
+        try:
+            host = link_host(self.base_url)
+            return link_template(parse_inbound(inbound), host).render(client, username)
         except Exception:
             return []
 
@@ -1562,17 +1785,9 @@ class XuiAPI(BasePanelAPI):
             return None
         try:
             import random as _rand, string as _str
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
-                return None
             # locate old client
-            old_client = None
-            for c in clients:
-                if c.get('email') == username:
-                    old_client = c
-                    break
+            found = parse_inbound(inbound).find(username)
+            old_client = found.raw if found is not None else None
             if not old_client:
                 return None
             # prepare new client preserving quota and expiry
@@ -1658,7 +1873,7 @@ class XuiAPI(BasePanelAPI):
             return None
 
 
-class ThreeXuiAPI(BasePanelAPI):
+class ThreeXuiAPI(_ClientTrafficLookup, _InboundBatchMutations, BasePanelAPI):
     """3x-UI support using lowercase /xui/api endpoints."""
 
     def __init__(self, panel_row):
@@ -1673,7 +1888,7 @@ class ThreeXuiAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self.session = _TimedSession(self.panel_id)
         self._json_headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json',
@@ -1730,24 +1945,29 @@ class ThreeXuiAPI(BasePanelAPI):
                 f"{self.base_url}/panel/API/inbounds/",
             ]
             last_error = None
+            probe = self.caps.probe('inbound_list', endpoints)
             for attempt in range(2):
-                for url in endpoints:
+                for url in probe:
                     try:
                         resp = self.session.get(url, headers=self._json_headers, timeout=12)
                     except requests.RequestException as e:
+                        probe.miss(0)
                         last_error = str(e)
                         continue
                     if resp.status_code != 200:
+                        probe.miss(resp.status_code)
                         last_error = f"HTTP {resp.status_code} @ {url}"
                         continue
                     ctype = (resp.headers.get('content-type') or '').lower()
                     body = resp.text or ''
                     if ('application/json' not in ctype) and not (body.strip().startswith('{') or body.strip().startswith('[')):
+                        probe.miss()
                         last_error = f"پاسخ JSON معتبر نیست @ {url}"
                         continue
                     try:
                         data = resp.json()
                     except ValueError as ve:
+                        probe.miss()
                         last_error = f"JSON parse error @ {url}: {ve}"
                         continue
                     items = None
@@ -1761,6 +1981,7 @@ class ThreeXuiAPI(BasePanelAPI):
                     elif isinstance(data, list):
                         items = data
                     if not isinstance(items, list):
+                        probe.miss()
                         last_error = f"ساختار JSON لیست اینباند قابل تشخیص نیست @ {url}"
                         continue
                     inbounds = []
@@ -1773,6 +1994,7 @@ class ThreeXuiAPI(BasePanelAPI):
                             'protocol': it.get('protocol') or it.get('type') or 'unknown',
                             'port': it.get('port') or it.get('listen_port') or 0,
                         })
+                    probe.hit()
                     return inbounds, "Success"
                 if attempt == 0:
                     self.get_token()
@@ -1788,17 +2010,23 @@ class ThreeXuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/API/inbounds/getClientTraffics/{inbound_id}",
             f"{self.base_url}/panel/API/inbounds/getClientTraffics/{inbound_id}",
         ]
-        for url in endpoints:
+        probe = self.caps.probe('client_traffics', endpoints)
+        for url in probe:
             try:
                 resp = self.session.get(url, headers=self._json_headers, timeout=12)
                 if resp.status_code != 200:
+                    probe.miss(resp.status_code)
                     continue
                 data = resp.json()
                 items = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(items, list):
+                    probe.hit()
                     return items
+                probe.miss()
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return []
 
     def _fetch_client_traffic_by_email(self, email: str):
@@ -1808,17 +2036,24 @@ class ThreeXuiAPI(BasePanelAPI):
             f"{self.base_url}/xui/API/inbounds/getClientTraffics/{email}",
             f"{self.base_url}/panel/API/inbounds/getClientTraffics/{email}",
         ]
-        for url in endpoints:
+        probe = self.caps.probe('client_traffic_by_email', endpoints)
+        for url in probe:
             try:
                 resp = self.session.get(url, headers=self._json_headers, timeout=12)
                 if resp.status_code != 200:
+                    probe.miss(resp.status_code)
                     continue
                 data = resp.json()
                 obj = data.get('obj') if isinstance(data, dict) else data
-                if isinstance(obj, dict):
-                    return obj
+                if isinstance(obj, dict) or (isinstance(data, dict) and 'obj' in data):
+                    # {"obj": null} is this endpoint answering "no such client"
+                    probe.hit()
+                    return obj if isinstance(obj, dict) else None
+                probe.miss()
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return None
 
     def rotate_user_key_on_inbound(self, inbound_id: int, username: str):
@@ -1835,21 +2070,16 @@ class ThreeXuiAPI(BasePanelAPI):
             return None
             
         try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-            clients = settings_obj.get('clients') or []
+            parsed = parse_inbound(inbound)
             
             # Find the client
-            client_found = None
-            for c in clients:
-                if c.get('email') == username:
-                    client_found = c
-                    break
-                    
-            if not client_found:
+            found = parsed.find(username)
+            if found is None:
                 logger.error(f"[rotate_key] Client {username} not found")
                 return None
             
+            clients = parsed.editable_clients()
+            client_found = clients[found.pos]
             # Generate new UUID but keep all other settings
             old_uuid = client_found.get('id') or client_found.get('uuid')
             new_uuid = str(uuid.uuid4())
@@ -1938,56 +2168,39 @@ class ThreeXuiAPI(BasePanelAPI):
                 f"{self.base_url}/panel/api/inbounds/addClient",
             ]
 
-            # Try each endpoint with multiple payload formats
+            settings_obj = {"clients": [client_obj]}
+            form_headers = {
+                'Accept': 'application/json',
+                'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+                'X-Requested-With': 'XMLHttpRequest',
+            }
+
+            def _post(ep, form):
+                if form == 'clients':
+                    return self.session.post(ep, headers=self._json_headers, json={"id": int(inbound_id), "clients": [client_obj]}, timeout=15)
+                if form == 'settings':
+                    return self.session.post(ep, headers=self._json_headers, json={"id": int(inbound_id), "settings": json.dumps(settings_obj)}, timeout=15)
+                return self.session.post(ep, headers=form_headers, data={'id': str(int(inbound_id)), 'settings': json.dumps(settings_obj)}, timeout=15)
+
+            # Each endpoint with multiple payload formats; the remembered pair goes first
             last_preview = None
-            for ep in endpoints:
-                # 1) clients array JSON
-                payload1 = {"id": int(inbound_id), "clients": [client_obj]}
-                r1 = self.session.post(ep, headers=self._json_headers, json=payload1, timeout=15)
-                if r1.status_code in (200, 201):
-                    try:
-                        j1 = r1.json()
-                    except ValueError:
-                        j1 = {}
-                    if _is_success(j1):
-                        chosen_ep = ep
-                        break
-                    last_preview = f"endpoint={ep} form=clients preview={(r1.text or '')[:200]}"
-                else:
-                    last_preview = f"endpoint={ep} form=clients HTTP {r1.status_code}: {(r1.text or '')[:200]}"
-                # 2) settings JSON string
-                settings_obj = {"clients": [client_obj]}
-                payload2 = {"id": int(inbound_id), "settings": json.dumps(settings_obj)}
-                r2 = self.session.post(ep, headers=self._json_headers, json=payload2, timeout=15)
-                if r2.status_code in (200, 201):
-                    try:
-                        j2 = r2.json()
-                    except ValueError:
-                        j2 = {}
-                    if _is_success(j2):
-                        chosen_ep = ep
-                        break
-                    last_preview = f"endpoint={ep} form=settings preview={(r2.text or '')[:200]}"
-                else:
-                    last_preview = f"endpoint={ep} form=settings HTTP {r2.status_code}: {(r2.text or '')[:200]}"
-                # 3) form-urlencoded with settings
-                form_headers = {
-                    'Accept': 'application/json',
-                    'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                    'X-Requested-With': 'XMLHttpRequest',
-                }
-                r3 = self.session.post(ep, headers=form_headers, data={'id': str(int(inbound_id)), 'settings': json.dumps(settings_obj)}, timeout=15)
-                if r3.status_code in (200, 201):
+            probe = self.caps.probe('add_client', [(ep, form) for ep in endpoints for form in ('clients', 'settings', 'form')])
+            for ep, form in probe:
+                r = _post(ep, form)
+                if r.status_code in (200, 201):
                     try:
-                        j3 = r3.json()
+                        j = r.json()
                     except ValueError:
-                        j3 = {}
-                    if _is_success(j3):
+                        j = {}
+                    if _is_success(j):
+                        probe.hit()
                         chosen_ep = ep
                         break
-                    last_preview = f"endpoint={ep} form=form preview={(r3.text or '')[:200]}"
+                    probe.miss()
+                    last_preview = f"endpoint={ep} form={form} preview={(r.text or '')[:200]}"
                 else:
-                    last_preview = f"endpoint={ep} form=form HTTP {r3.status_code}: {(r3.text or '')[:200]}"
+                    probe.miss(r.status_code)
+                    last_preview = f"endpoint={ep} form={form} HTTP {r.status_code}: {(r.text or '')[:200]}"
             else:
                 # no break -> all failed
                 return None, None, f"API failure: {last_preview or 'unknown'}"
@@ -2023,81 +2236,74 @@ class ThreeXuiAPI(BasePanelAPI):
             inbound = self._fetch_inbound_detail(inbound_id)
             if not inbound:
                 continue
-            settings_str = inbound.get('settings')
-            try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-            except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
-                continue
-            for c in clients:
-                if c.get('email') == username:
-                    total_bytes = int(c.get('totalGB', 0) or 0)
-                    used_bytes = 0
-                    try:
-                        down = int(c.get('downlink', 0) or 0)
-                    except Exception:
-                        down = 0
-                    try:
-                        up = int(c.get('uplink', 0) or 0)
-                    except Exception:
-                        up = 0
+            found = parse_inbound(inbound).by_email.get(username)
+            if found is not None:
+                c = found.raw
+                total_bytes = int(c.get('totalGB', 0) or 0)
+                used_bytes = 0
+                try:
+                    down = int(c.get('downlink', 0) or 0)
+                except Exception:
+                    down = 0
+                try:
+                    up = int(c.get('uplink', 0) or 0)
+                except Exception:
+                    up = 0
+                try:
+                    used_bytes = int(c.get('total', 0) or 0)
+                except Exception:
+                    used_bytes = down + up
+                if used_bytes == 0:
+                    # try stats endpoint
+                    stats = []
                     try:
-                        used_bytes = int(c.get('total', 0) or 0)
+                        stats = self._fetch_client_traffics(inbound_id)
                     except Exception:
-                        used_bytes = down + up
-                    if used_bytes == 0:
-                        # try stats endpoint
                         stats = []
-                        try:
-                            stats = self._fetch_client_traffics(inbound_id)
-                        except Exception:
-                            stats = []
-                        for s in (stats or []):
-                            if (s.get('email') or s.get('name')) == username:
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                                break
-                        if used_bytes == 0:
-                            # direct by email
-                            s = self._fetch_client_traffic_by_email(username)
-                            if isinstance(s, dict):
-                                try:
-                                    d = int(s.get('down') or s.get('download') or 0)
-                                except Exception:
-                                    d = 0
-                                try:
-                                    u = int(s.get('up') or s.get('upload') or 0)
-                                except Exception:
-                                    u = 0
-                                used_bytes = d + u
-                    expiry_ms = int(c.get('expiryTime', 0) or 0)
-                    expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
-                    subid = c.get('subId') or ''
-                    if self.sub_base:
-                        origin = self.sub_base
-                    else:
-                        parts = urlsplit(self.base_url)
-                        host = parts.hostname or ''
-                        port = ''
-                        if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
-                            port = f":{parts.port}"
-                        origin = f"{parts.scheme}://{host}{port}"
-                    sub_link = f"{origin}/sub/{subid}" if subid else ''
-                    return {
-                        'data_limit': total_bytes,
-                        'used_traffic': used_bytes,
-                        'expire': expire,
-                        'subscription_url': sub_link,
-                    }, "Success"
+                    for s in (stats or []):
+                        if (s.get('email') or s.get('name')) == username:
+                            try:
+                                d = int(s.get('down') or s.get('download') or 0)
+                            except Exception:
+                                d = 0
+                            try:
+                                u = int(s.get('up') or s.get('upload') or 0)
+                            except Exception:
+                                u = 0
+                            used_bytes = d + u
+                            break
+                    if used_bytes == 0:
+                        # direct by email
+                        s = self._fetch_client_traffic_by_email(username)
+                        if isinstance(s, dict):
+                            try:
+                                d = int(s.get('down') or s.get('download') or 0)
+                            except Exception:
+                                d = 0
+                            try:
+                                u = int(s.get('up') or s.get('upload') or 0)
+                            except Exception:
+                                u = 0
+                            used_bytes = d + u
+                expiry_ms = int(c.get('expiryTime', 0) or 0)
+                expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
+                subid = c.get('subId') or ''
+                if self.sub_base:
+                    origin = self.sub_base
+                else:
+                    parts = urlsplit(self.base_url)
+                    host = parts.hostname or ''
+                    port = ''
+                    if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+                        port = f":{parts.port}"
+                    origin = f"{parts.scheme}://{host}{port}"
+                sub_link = f"{origin}/sub/{subid}" if subid else ''
+                return {
+                    'data_limit': total_bytes,
+                    'used_traffic': used_bytes,
+                    'expire': expire,
+                    'subscription_url': sub_link,
+                }, "Success"
         return None, "کاربر یافت نشد"
 
     def _fetch_inbound_detail(self, inbound_id: int):
@@ -2109,170 +2315,42 @@ class ThreeXuiAPI(BasePanelAPI):
             f"/xui/API/inbounds/get/{inbound_id}",
             f"/panel/API/inbounds/get/{inbound_id}",
         ]
-        for p in paths:
+        probe = self.caps.probe('inbound_detail', paths)
+        for p in probe:
             try:
                 resp = self.session.get(f"{self.base_url}{p}", headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
+                    probe.miss(resp.status_code)
                     continue
                 data = resp.json()
                 inbound = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(inbound, dict):
+                    probe.hit()
                     return inbound
+                if isinstance(data, dict) and 'obj' in data:
+                    # Right endpoint, unknown inbound
+                    probe.hit()
+                    return None
+                probe.miss()
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return None
 
-    def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None) -> list:
-        inbound = self._fetch_inbound_detail(inbound_id)
+    def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None,
+                                        inbound: dict | None = None, client: dict | None = None) -> list:
+        """Config URIs of one client; pass ``inbound``/``client`` already at hand to skip the fetch.
+        Does not wait for a just-created client to appear: use ``fetch_user_configs`` for that."""
+        inbound = inbound or self._fetch_inbound_detail(inbound_id)
         if not inbound:
             return []
-        # Retry a little to ensure client appears
-        def _find_client(inv):
-            s = inv.get('settings')
-            try:
-                obj = json.loads(s) if isinstance(s, str) else (s or {})
-            except Exception:
-                obj = {}
-            chosen = None
-            for c in (obj.get('clients') or []):
-                if preferred_id and (c.get('id') == preferred_id or c.get('uuid') == preferred_id):
-                    return c
-                if c.get('email') == username and chosen is None:
-                    chosen = c
-            return chosen
-        client = _find_client(inbound)
-        retries = 2
-        while client is None and retries > 0:
-            _time.sleep(0.7)
-            inbound = self._fetch_inbound_detail(inbound_id)
-            if not inbound:
-                break
-            client = _find_client(inbound)
-            retries -= 1
+        client = client or find_inbound_client(inbound, username, preferred_id)
         if not client:
             return []
         try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            proto = (inbound.get('protocol') or '').lower()
-            port = inbound.get('port') or inbound.get('listen_port') or 0
-            stream_raw = inbound.get('streamSettings') or inbound.get('stream_settings')
-            stream = json.loads(stream_raw) if isinstance(stream_raw, str) else (stream_raw or {})
-            network = (stream.get('network') or '').lower() or 'tcp'
-            security = (stream.get('security') or '').lower() or ''
-            sni = ''
-            if security == 'tls':
-                tls = stream.get('tlsSettings') or {}
-                sni = tls.get('serverName') or ''
-            elif security == 'reality':
-                reality = stream.get('realitySettings') or {}
-                sni = (reality.get('serverNames') or [''])[0]
-            path = ''
-            host_header = ''
-            service_name = ''
-            header_type = ''
-            if network == 'ws':
-                ws = stream.get('wsSettings') or {}
-                path = ws.get('path') or '/'
-                headers = ws.get('headers') or {}
-                host_header = headers.get('Host') or headers.get('host') or ''
-            elif network == 'tcp':
-                tcp = stream.get('tcpSettings') or {}
-                header = tcp.get('header') or {}
-                if (header.get('type') or '').lower() == 'http':
-                    header_type = 'http'
-                    req = header.get('request') or {}
-                    rp = req.get('path')
-                    if isinstance(rp, list) and rp:
-                        path = rp[0] or '/'
-                    elif isinstance(rp, str) and rp:
-                        path = rp
-                    else:
-                        path = '/'
-                    h = req.get('headers') or {}
-                    hh = h.get('Host') or h.get('host') or ''
-                    if isinstance(hh, list) and hh:
-                        host_header = hh[0]
-                    elif isinstance(hh, str):
-                        host_header = hh
-            if network == 'grpc':
-                grpc = stream.get('grpcSettings') or {}
-                service_name = grpc.get('serviceName') or ''
-            from urllib.parse import urlsplit as _us
-            parts = _us(getattr(self, 'sub_base', '') or self.base_url)
-            host = parts.hostname or ''
-            if not host:
-                host = host_header or sni or host
-            uuid = client.get('id') or client.get('uuid') or ''
-            passwd = client.get('password') or ''
-            name = username
-            configs = []
-            if proto == 'vless' and uuid:
-                qs = []
-                if network:
-                    qs.append(f'type={network}')
-                if network == 'ws':
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'tcp' and header_type == 'http':
-                    qs.append('headerType=http')
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'grpc' and service_name:
-                    qs.append(f'serviceName={service_name}')
-                if security:
-                    qs.append(f'security={security}')
-                    if sni:
-                        qs.append(f'sni={sni}')
-                else:
-                    qs.append('security=none')
-                flow = client.get('flow')
-                if flow:
-                    qs.append(f'flow={flow}')
-                query = '&'.join(qs)
-                uri = f"vless://{uuid}@{host}:{port}?{query}#{name}"
-                configs.append(uri)
-            elif proto == 'vmess' and uuid:
-                vm = {
-                    "v": "2",
-                    "ps": name,
-                    "add": host,
-                    "port": str(port),
-                    "id": uuid,
-                    "aid": "0",
-                    "net": network,
-                    "type": "none",
-                    "host": host_header or sni or host,
-                    "path": path or "/",
-                    "tls": "tls" if security in ("tls","reality") else "",
-                    "sni": sni or ""
-                }
-                import base64 as _b64
-                b = _b64.b64encode(json.dumps(vm, ensure_ascii=False).encode('utf-8')).decode('utf-8')
-                configs.append(f"vmess://{b}")
-            elif proto == 'trojan' and passwd:
-                qs = []
-                if network:
-                    qs.append(f'type={network}')
-                if network == 'ws':
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'grpc' and service_name:
-                    qs.append(f'serviceName={service_name}')
-                if security:
-                    qs.append(f'security={security}')
-                    if sni:
-                        qs.append(f'sni={sni}')
-                query = '&'.join(qs)
-                uri = f"trojan://{passwd}@{host}:{port}?{query}#{name}"
-                configs.append(uri)
-            return configs
+            host = link_host(getattr(self, 'sub_base', '') or self.base_url)
+            return link_template(parse_inbound(inbound), host).render(client, username)
         except Exception:
             return []
 
@@ -2286,16 +2364,11 @@ class ThreeXuiAPI(BasePanelAPI):
         try:
             import json as _json, uuid as _uuid, random as _rand, string as _str
             now_ms = int(datetime.now().timestamp() * 1000)
-            settings_str = inbound.get('settings')
-            settings_obj = _json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
+            parsed = parse_inbound(inbound)
+            if not isinstance(parsed.settings.get('clients', []), list):
                 return None, "ساختار کلاینت‌ها نامعتبر است"
-            old = None
-            for c in clients:
-                if c.get('email') == username:
-                    old = c
-                    break
+            found = parsed.find(username)
+            old = found.raw if found is not None else None
             if not old:
                 return None, "کلاینت یافت نشد"
             add_bytes = int(float(add_gb) * (1024 ** 3)) if add_gb and add_gb > 0 else 0
@@ -2386,21 +2459,13 @@ class ThreeXuiAPI(BasePanelAPI):
             if not added:
                 return None, (last_err or "ساخت کلاینت جدید ناموفق بود")
             # Verify by refetching inbound
-            ref = self._fetch_inbound_detail(inbound_id)
-            try:
-                robj = _json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-            except Exception:
-                robj = {}
-            for c2 in (robj.get('clients') or []):
-                if c2.get('email') == username:
-                    after_total = int(c2.get('totalGB', 0) or 0)
-                    after_exp = int(c2.get('expiryTime', 0) or 0)
-                    grew_total = after_total >= new_total
-                    grew_exp = after_exp >= target_exp
-                    if grew_total or grew_exp:
-                        return new_client, "Success"
+            c2 = parse_inbound(self._fetch_inbound_detail(inbound_id) or {}).find(username)
+            after_total = c2.total_bytes if c2 is not None else 'n/a'
+            after_exp = c2.expiry_ms if c2 is not None else 'n/a'
+            if c2 is not None and (after_total >= new_total or after_exp >= target_exp):
+                return new_client, "Success"
             try:
-                logger.error(f"X-UI/3x-UI recreate verify failed: inbound={inbound_id} before_total={cur_total} after_total={after_total if 'after_total' in locals() else 'n/a'} before_exp={current_exp} after_exp={after_exp if 'after_exp' in locals() else 'n/a'} last_ep={last_ep} err={last_err}")
+                logger.error(f"X-UI/3x-UI recreate verify failed: inbound={inbound_id} before_total={cur_total} after_total={after_total} before_exp={current_exp} after_exp={after_exp} last_ep={last_ep} err={last_err}")
             except Exception:
                 pass
             return None, "تایید افزایش حجم/زمان ناموفق بود"
@@ -2419,24 +2484,24 @@ class ThreeXuiAPI(BasePanelAPI):
         try:
             import json as _json
             now_ms = int(datetime.now().timestamp() * 1000)
-            settings_str = inbound.get('settings')
-            settings_obj = _json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
+            parsed = parse_inbound(inbound)
+            settings_obj = dict(parsed.settings)
+            clients = parsed.client_dicts
+            if not isinstance(parsed.settings.get('clients', []), list):
                 return None, "ساختار کلاینت‌ها نامعتبر است"
             updated = None; idx = -1; old_uuid = None
-            for i, c in enumerate(clients):
-                if c.get('email') == username:
-                    add_bytes = int(float(add_gb) * (1024 ** 3)) if add_gb and add_gb > 0 else 0
-                    add_ms = (int(add_days) * 86400 * 1000) if add_days and int(add_days) > 0 else 0
-                    current_exp = int(c.get('expiryTime', 0) or 0)
-                    base = max(current_exp, now_ms)
-                    target_exp = base + add_ms if add_ms > 0 else current_exp
-                    new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
-                    updated = dict(c); idx = i; old_uuid = c.get('id') or c.get('uuid') or None
-                    updated['expiryTime'] = target_exp
-                    updated['totalGB'] = new_total
-                    break
+            found = parsed.by_email.get(username)
+            if found is not None:
+                i, c = parsed.clients.index(found), found.raw
+                add_bytes = int(float(add_gb) * (1024 ** 3)) if add_gb and add_gb > 0 else 0
+                add_ms = (int(add_days) * 86400 * 1000) if add_days and int(add_days) > 0 else 0
+                current_exp = int(c.get('expiryTime', 0) or 0)
+                base = max(current_exp, now_ms)
+                target_exp = base + add_ms if add_ms > 0 else current_exp
+                new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
+                updated = dict(c); idx = i; old_uuid = c.get('id') or c.get('uuid') or None
+                updated['expiryTime'] = target_exp
+                updated['totalGB'] = new_total
             if not updated:
                 return None, "کلاینت یافت نشد"
             # Push full settings to ensure persistence
@@ -2479,14 +2544,9 @@ class ThreeXuiAPI(BasePanelAPI):
                                     return updated, "Success"
                         except Exception:
                             # many 3x-ui return empty body on success; verify by reading back
-                            new_ib = self._fetch_inbound_detail(inbound_id)
-                            try:
-                                ns = _json.loads(new_ib.get('settings')) if isinstance(new_ib.get('settings'), str) else (new_ib.get('settings') or {})
-                            except Exception:
-                                ns = {}
-                            for c2 in (ns.get('clients') or []):
-                                if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == updated['expiryTime'] and int(c2.get('totalGB', 0) or 0) == updated['totalGB']:
-                                    return updated, "Success"
+                            if _client_has_limits(self._fetch_inbound_detail(inbound_id), username,
+                                                  updated['totalGB'], updated['expiryTime']):
+                                return updated, "Success"
                     else:
                         last_preview = f"{ep} -> HTTP {r.status_code}: {(r.text or '')[:180]}"
                 except requests.RequestException:
@@ -2522,35 +2582,27 @@ class ThreeXuiAPI(BasePanelAPI):
             inbound = self._fetch_inbound_detail(inbound_id)
             if not inbound:
                 continue
-            settings_str = inbound.get('settings')
-            clients = []
-            try:
-                if isinstance(settings_str, str):
-                    settings_obj = json.loads(settings_str)
-                    clients = settings_obj.get('clients', [])
-            except Exception:
-                clients = []
-            if not isinstance(clients, list):
+            found = parse_inbound(inbound).find(username)
+            if found is None:
                 continue
-            for c in clients:
-                if c.get('email') == username:
-                    current_exp = int(c.get('expiryTime', 0) or 0)
-                    base = max(current_exp, now_ms)
-                    target_exp = base + (add_ms if add_ms > 0 else 0)
-                    new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
-                    updated = dict(c)
-                    updated['expiryTime'] = target_exp
-                    updated['totalGB'] = new_total
-                    settings_payload = json.dumps({"clients": [updated]})
-                    payload = {"id": int(inbound_id), "settings": settings_payload}
-                    for up in ["/xui/api/inbounds/updateClient", "/panel/api/inbounds/updateClient", "/xui/api/inbound/updateClient"]:
-                        try:
-                            resp = self.session.post(f"{self.base_url}{up}", headers={'Content-Type': 'application/json'}, json=payload, timeout=15)
-                            if resp.status_code in (200, 201):
-                                return updated, "Success"
-                        except requests.RequestException:
-                            continue
-                    return None, "به‌روزرسانی کلاینت ناموفق بود"
+            c = found.raw
+            current_exp = int(c.get('expiryTime', 0) or 0)
+            base = max(current_exp, now_ms)
+            target_exp = base + (add_ms if add_ms > 0 else 0)
+            new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
+            updated = dict(c)
+            updated['expiryTime'] = target_exp
+            updated['totalGB'] = new_total
+            settings_payload = json.dumps({"clients": [updated]})
+            payload = {"id": int(inbound_id), "settings": settings_payload}
+            for up in ["/xui/api/inbounds/updateClient", "/panel/api/inbounds/updateClient", "/xui/api/inbound/updateClient"]:
+                try:
+                    resp = self.session.post(f"{self.base_url}{up}", headers={'Content-Type': 'application/json'}, json=payload, timeout=15)
+                    if resp.status_code in (200, 201):
+                        return updated, "Success"
+                except requests.RequestException:
+                    continue
+            return None, "به‌روزرسانی کلاینت ناموفق بود"
         return None, "کلاینت برای تمدید یافت نشد"
 
     def _update_client_by_uuid(self, inbound_id: int, client_uuid: str, total_bytes: int, expiry_ms: int, updated_client: dict | None = None):
@@ -2614,15 +2666,9 @@ class ThreeXuiAPI(BasePanelAPI):
                 
             base_client = None
             if inbound:
-                try:
-                    settings_str = inbound.get('settings')
-                    settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-                except Exception:
-                    settings_obj = {}
-                for c in (settings_obj.get('clients') or []):
-                    if str(c.get('id') or c.get('uuid') or '') == str(client_uuid):
-                        base_client = dict(c)
-                        break
+                found = parse_inbound(inbound).by_uuid.get(str(client_uuid))
+                if found is not None:
+                    base_client = dict(found.raw)
                         
             if base_client is None and isinstance(updated_client, dict):
                 base_client = dict(updated_client)
@@ -2698,15 +2744,9 @@ class ThreeXuiAPI(BasePanelAPI):
         inbound = self._fetch_inbound_detail(inbound_id)
         updated_client = None
         if inbound:
-            try:
-                settings_str = inbound.get('settings')
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-                for c in (settings_obj.get('clients') or []):
-                    if str(c.get('id') or c.get('uuid') or '') == str(client_uuid):
-                        updated_client = c
-                        break
-            except Exception:
-                pass
+            found = parse_inbound(inbound).by_uuid.get(str(client_uuid))
+            if found is not None:
+                updated_client = found.raw
                 
         success = self._update_client_by_uuid(inbound_id, client_uuid, total_bytes, expiry_ms, updated_client)
         
@@ -2730,17 +2770,8 @@ class ThreeXuiAPI(BasePanelAPI):
             logger.error(f"[renew] Could not fetch inbound {inbound_id}")
             return None, "اینباند یافت نشد"
             
-        current_client = None
-        try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-            for c in (settings_obj.get('clients') or []):
-                if str(c.get('id') or c.get('uuid') or '') == str(client_uuid):
-                    current_client = c
-                    break
-        except Exception as e:
-            logger.error(f"[renew] Error parsing settings: {e}")
-            return None, "خطا در خواندن تنظیمات"
+        found = parse_inbound(inbound).by_uuid.get(str(client_uuid))
+        current_client = found.raw if found is not None else None
             
         if not current_client:
             logger.error(f"[renew] Client {client_uuid} not found in inbound {inbound_id}")
@@ -2786,17 +2817,8 @@ class ThreeXuiAPI(BasePanelAPI):
             logger.error(f"[renew] Could not fetch inbound {inbound_id}")
             return None, "اینباند یافت نشد"
             
-        client_uuid = None
-        try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-            for c in (settings_obj.get('clients') or []):
-                if c.get('email') == username:
-                    client_uuid = c.get('id') or c.get('uuid')
-                    break
-        except Exception as e:
-            logger.error(f"[renew] Error parsing settings: {e}")
-            return None, "خطا در خواندن تنظیمات"
+        found = parse_inbound(inbound).find(username)
+        client_uuid = found.uuid if found is not None else None
             
         if not client_uuid:
             logger.error(f"[renew] Client {username} not found in inbound {inbound_id}")
@@ -2822,16 +2844,9 @@ class ThreeXuiAPI(BasePanelAPI):
                 logger.error(f"[delete] Could not fetch inbound {inbound_id}")
                 return False
                 
-            try:
-                settings_str = inbound.get('settings')
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-                for c in (settings_obj.get('clients') or []):
-                    if c.get('email') == username:
-                        client_id = c.get('id') or c.get('uuid')
-                        break
-            except Exception as e:
-                logger.error(f"[delete] Error parsing settings: {e}")
-                return False
+            found = parse_inbound(inbound).find(username)
+            if found is not None:
+                client_id = found.uuid
                 
             if not client_id:
                 logger.error(f"[delete] Client {username} not found in inbound {inbound_id}")
@@ -2887,7 +2902,7 @@ class TxUiAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self.session = _TimedSession(self.panel_id)
         self._json_headers = {
             'Accept': 'application/json',
             'Content-Type': 'application/json',
@@ -2919,20 +2934,24 @@ class TxUiAPI(BasePanelAPI):
                 f"{self.base_url}/xui/api/inbounds",
             ]
             last_error = None
+            probe = self.caps.probe('inbound_list', endpoints)
             for attempt in range(2):
-                for url in endpoints:
+                for url in probe:
                     resp = self.session.get(url, headers=self._json_headers, timeout=12)
                     if resp.status_code != 200:
+                        probe.miss(resp.status_code)
                         last_error = f"HTTP {resp.status_code}"
                         continue
                     ctype = resp.headers.get('content-type', '').lower()
                     body = resp.text or ''
                     if ('application/json' not in ctype) and not (body.strip().startswith('{') or body.strip().startswith('[')):
+                        probe.miss()
                         last_error = "پاسخ JSON معتبر نیست"
                         continue
                     try:
                         data = resp.json()
                     except ValueError as ve:
+                        probe.miss()
                         last_error = f"JSON parse error: {ve}"
                         continue
                     items = None
@@ -2946,6 +2965,7 @@ class TxUiAPI(BasePanelAPI):
                                     items = v
                                     break
                     if not isinstance(items, list):
+                        probe.miss()
                         last_error = "ساختار JSON لیست اینباند قابل تشخیص نیست"
                         continue
                     inbounds = []
@@ -2958,6 +2978,7 @@ class TxUiAPI(BasePanelAPI):
                             'protocol': it.get('protocol') or it.get('type') or 'unknown',
                             'port': it.get('port') or it.get('listen_port') or 0,
                         })
+                    probe.hit()
                     return inbounds, "Success"
                 if attempt == 0:
                     self.get_token()
@@ -3020,52 +3041,38 @@ class TxUiAPI(BasePanelAPI):
                 f"{self.base_url}/panel/api/inbounds/addClient",
             ]
 
+            settings_obj = {"clients": [client_obj]}
+            form_headers = {
+                'Accept': 'application/json',
+                'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+                'X-Requested-With': 'XMLHttpRequest',
+            }
+
+            def _post(ep, form):
+                if form == 'clients':
+                    return self.session.post(ep, headers=self._json_headers, json={"id": int(inbound_id), "clients": [client_obj]}, timeout=15)
+                if form == 'settings':
+                    return self.session.post(ep, headers=self._json_headers, json={"id": int(inbound_id), "settings": json.dumps(settings_obj)}, timeout=15)
+                return self.session.post(ep, headers=form_headers, data={'id': str(int(inbound_id)), 'settings': json.dumps(settings_obj)}, timeout=15)
+
             last_preview = None
-            for ep in endpoints:
-                payload1 = {"id": int(inbound_id), "clients": [client_obj]}
-                r1 = self.session.post(ep, headers=self._json_headers, json=payload1, timeout=15)
-                if r1.status_code in (200, 201):
-                    try:
-                        j1 = r1.json()
-                    except ValueError:
-                        j1 = {}
-                    if _is_success(j1):
-                        chosen_ep = ep
-                        break
-                    last_preview = f"endpoint={ep} form=clients preview={(r1.text or '')[:200]}"
-                else:
-                    last_preview = f"endpoint={ep} form=clients HTTP {r1.status_code}: {(r1.text or '')[:200]}"
-                settings_obj = {"clients": [client_obj]}
-                payload2 = {"id": int(inbound_id), "settings": json.dumps(settings_obj)}
-                r2 = self.session.post(ep, headers=self._json_headers, json=payload2, timeout=15)
-                if r2.status_code in (200, 201):
-                    try:
-                        j2 = r2.json()
-                    except ValueError:
-                        j2 = {}
-                    if _is_success(j2):
-                        chosen_ep = ep
-                        break
-                    last_preview = f"endpoint={ep} form=settings preview={(r2.text or '')[:200]}"
-                else:
-                    last_preview = f"endpoint={ep} form=settings HTTP {r2.status_code}: {(r2.text or '')[:200]}"
-                form_headers = {
-                    'Accept': 'application/json',
-                    'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                    'X-Requested-With': 'XMLHttpRequest',
-                }
-                r3 = self.session.post(ep, headers=form_headers, data={'id': str(int(inbound_id)), 'settings': json.dumps(settings_obj)}, timeout=15)
-                if r3.status_code in (200, 201):
+            probe = self.caps.probe('add_client', [(ep, form) for ep in endpoints for form in ('clients', 'settings', 'form')])
+            for ep, form in probe:
+                r = _post(ep, form)
+                if r.status_code in (200, 201):
                     try:
-                        j3 = r3.json()
+                        j = r.json()
                     except ValueError:
-                        j3 = {}
-                    if _is_success(j3):
+                        j = {}
+                    if _is_success(j):
+                        probe.hit()
                         chosen_ep = ep
                         break
-                    last_preview = f"endpoint={ep} form=form preview={(r3.text or '')[:200]}"
+                    probe.miss()
+                    last_preview = f"endpoint={ep} form={form} preview={(r.text or '')[:200]}"
                 else:
-                    last_preview = f"endpoint={ep} form=form HTTP {r3.status_code}: {(r3.text or '')[:200]}"
+                    probe.miss(r.status_code)
+                    last_preview = f"endpoint={ep} form={form} HTTP {r.status_code}: {(r.text or '')[:200]}"
             else:
                 return None, None, f"API failure: {last_preview or 'unknown'}"
 
@@ -3088,6 +3095,22 @@ class TxUiAPI(BasePanelAPI):
     async def get_all_users(self):
         return None, "Not supported for TX-UI"
 
+    def _list_users_usage(self) -> list | None:
+        # TX-UI exposes no traffic endpoint: limits/expiry from inbound clients, usage unknown (0) as in get_user
+        if not self.get_token():
+            return None
+        inbounds, _ = self.list_inbounds()
+        if not inbounds:
+            return None
+        entries = []
+        for ib in inbounds:
+            inbound = self._fetch_inbound_detail(ib.get('id'))
+            if not inbound:
+                continue
+            for c in parse_inbound(inbound).by_email.values():
+                entries.append(_usage_entry(c.email, c.total_bytes, 0, c.expiry_ms // 1000 if c.expiry_ms > 0 else 0, c.enable))
+        return entries
+
     async def get_user(self, username):
         if not self.get_token():
             return None, "خطا در ورود به پنل TX-UI"
@@ -3099,36 +3122,29 @@ class TxUiAPI(BasePanelAPI):
             inbound = self._fetch_inbound_detail(inbound_id)
             if not inbound:
                 continue
-            settings_str = inbound.get('settings')
-            try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else {}
-            except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
-                continue
-            for c in clients:
-                if c.get('email') == username:
-                    total_bytes = int(c.get('totalGB', 0) or 0)
-                    expiry_ms = int(c.get('expiryTime', 0) or 0)
-                    expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
-                    subid = c.get('subId') or ''
-                    if self.sub_base:
-                        origin = self.sub_base
-                    else:
-                        parts = urlsplit(self.base_url)
-                        host = parts.hostname or ''
-                        port = ''
-                        if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
-                            port = f":{parts.port}"
-                        origin = f"{parts.scheme}://{host}{port}"
-                    sub_link = f"{origin}/sub/{subid}" if subid else ''
-                    return {
-                        'data_limit': total_bytes,
-                        'used_traffic': 0,
-                        'expire': expire,
-                        'subscription_url': sub_link,
-                    }, "Success"
+            found = parse_inbound(inbound).by_email.get(username)
+            if found is not None:
+                c = found.raw
+                total_bytes = int(c.get('totalGB', 0) or 0)
+                expiry_ms = int(c.get('expiryTime', 0) or 0)
+                expire = int(expiry_ms / 1000) if expiry_ms > 0 else 0
+                subid = c.get('subId') or ''
+                if self.sub_base:
+                    origin = self.sub_base
+                else:
+                    parts = urlsplit(self.base_url)
+                    host = parts.hostname or ''
+                    port = ''
+                    if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+                        port = f":{parts.port}"
+                    origin = f"{parts.scheme}://{host}{port}"
+                sub_link = f"{origin}/sub/{subid}" if subid else ''
+                return {
+                    'data_limit': total_bytes,
+                    'used_traffic': 0,
+                    'expire': expire,
+                    'subscription_url': sub_link,
+                }, "Success"
         return None, "کاربر یافت نشد"
 
     def _fetch_inbound_detail(self, inbound_id: int):
@@ -3137,170 +3153,42 @@ class TxUiAPI(BasePanelAPI):
             f"/xui/api/inbounds/get/{inbound_id}",
             f"/panel/api/inbounds/get/{inbound_id}",
         ]
-        for p in paths:
+        probe = self.caps.probe('inbound_detail', paths)
+        for p in probe:
             try:
                 resp = self.session.get(f"{self.base_url}{p}", headers={'Accept': 'application/json'}, timeout=12)
                 if resp.status_code != 200:
+                    probe.miss(resp.status_code)
                     continue
                 data = resp.json()
                 inbound = data.get('obj') if isinstance(data, dict) else data
                 if isinstance(inbound, dict):
+                    probe.hit()
                     return inbound
+                if isinstance(data, dict) and 'obj' in data:
+                    # Right endpoint, unknown inbound
+                    probe.hit()
+                    return None
+                probe.miss()
+            except requests.RequestException:
+                probe.miss(0)
             except Exception:
-                continue
+                probe.miss()
         return None
 
-    def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None) -> list:
-        inbound = self._fetch_inbound_detail(inbound_id)
+    def get_configs_for_user_on_inbound(self, inbound_id: int, username: str, preferred_id: str = None,
+                                        inbound: dict | None = None, client: dict | None = None) -> list:
+        """Config URIs of one client; pass ``inbound``/``client`` already at hand to skip the fetch.
+        Does not wait for a just-created client to appear: use ``fetch_user_configs`` for that."""
+        inbound = inbound or self._fetch_inbound_detail(inbound_id)
         if not inbound:
             return []
-        # helper to find client by preferred id or email
-        def _find_client(inv):
-            s = inv.get('settings')
-            try:
-                obj = json.loads(s) if isinstance(s, str) else (s or {})
-            except Exception:
-                obj = {}
-            chosen = None
-            for c in (obj.get('clients') or []):
-                if preferred_id and (c.get('id') == preferred_id or c.get('uuid') == preferred_id):
-                    return c
-                if c.get('email') == username and chosen is None:
-                    chosen = c
-            return chosen
-        client = _find_client(inbound)
-        retries = 2
-        while client is None and retries > 0:
-            _time.sleep(0.7)
-            inbound = self._fetch_inbound_detail(inbound_id)
-            if not inbound:
-                break
-            client = _find_client(inbound)
-            retries -= 1
+        client = client or find_inbound_client(inbound, username, preferred_id)
         if not client:
             return []
         try:
-            settings_str = inbound.get('settings')
-            settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            proto = (inbound.get('protocol') or '').lower()
-            port = inbound.get('port') or inbound.get('listen_port') or 0
-            stream_raw = inbound.get('streamSettings') or inbound.get('stream_settings')
-            stream = json.loads(stream_raw) if isinstance(stream_raw, str) else (stream_raw or {})
-            network = (stream.get('network') or '').lower() or 'tcp'
-            security = (stream.get('security') or '').lower() or ''
-            sni = ''
-            if security == 'tls':
-                tls = stream.get('tlsSettings') or {}
-                sni = tls.get('serverName') or ''
-            elif security == 'reality':
-                reality = stream.get('realitySettings') or {}
-                sni = (reality.get('serverNames') or [''])[0]
-            path = ''
-            host_header = ''
-            service_name = ''
-            header_type = ''
-            if network == 'ws':
-                ws = stream.get('wsSettings') or {}
-                path = ws.get('path') or '/'
-                headers = ws.get('headers') or {}
-                host_header = headers.get('Host') or headers.get('host') or ''
-            elif network == 'tcp':
-                tcp = stream.get('tcpSettings') or {}
-                header = tcp.get('header') or {}
-                if (header.get('type') or '').lower() == 'http':
-                    header_type = 'http'
-                    req = header.get('request') or {}
-                    rp = req.get('path')
-                    if isinstance(rp, list) and rp:
-                        path = rp[0] or '/'
-                    elif isinstance(rp, str) and rp:
-                        path = rp
-                    else:
-                        path = '/'
-                    h = req.get('headers') or {}
-                    hh = h.get('Host') or h.get('host') or ''
-                    if isinstance(hh, list) and hh:
-                        host_header = hh[0]
-                    elif isinstance(hh, str):
-                        host_header = hh
-            if network == 'grpc':
-                grpc = stream.get('grpcSettings') or {}
-                service_name = grpc.get('serviceName') or ''
-            from urllib.parse import urlsplit as _us
-            parts = _us(getattr(self, 'sub_base', '') or self.base_url)
-            host = parts.hostname or ''
-            if not host:
-                host = host_header or sni or host
-            uuid_val = client.get('id') or client.get('uuid') or ''
-            passwd = client.get('password') or ''
-            name = username
-            configs = []
-            if proto == 'vless' and uuid_val:
-                qs = []
-                if network:
-                    qs.append(f'type={network}')
-                if network == 'ws':
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'tcp' and header_type == 'http':
-                    qs.append('headerType=http')
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'grpc' and service_name:
-                    qs.append(f'serviceName={service_name}')
-                if security:
-                    qs.append(f'security={security}')
-                    if sni:
-                        qs.append(f'sni={sni}')
-                else:
-                    qs.append('security=none')
-                flow = client.get('flow')
-                if flow:
-                    qs.append(f'flow={flow}')
-                query = '&'.join(qs)
-                uri = f"vless://{uuid_val}@{host}:{port}?{query}#{name}"
-                configs.append(uri)
-            elif proto == 'vmess' and uuid_val:
-                vm = {
-                    "v": "2",
-                    "ps": name,
-                    "add": host,
-                    "port": str(port),
-                    "id": uuid_val,
-                    "aid": "0",
-                    "net": network,
-                    "type": "none",
-                    "host": host_header or sni or host,
-                    "path": path or "/",
-                    "tls": "tls" if security in ("tls","reality") else "",
-                    "sni": sni or ""
-                }
-                import base64 as _b64
-                b = _b64.b64encode(json.dumps(vm, ensure_ascii=False).encode('utf-8')).decode('utf-8')
-                configs.append(f"vmess://{b}")
-            elif proto == 'trojan' and passwd:
-                qs = []
-                if network:
-                    qs.append(f'type={network}')
-                if network == 'ws':
-                    if path:
-                        qs.append(f'path={path}')
-                    if host_header:
-                        qs.append(f'host={host_header}')
-                if network == 'grpc' and service_name:
-                    qs.append(f'serviceName={service_name}')
-                if security:
-                    qs.append(f'security={security}')
-                    if sni:
-                        qs.append(f'sni={sni}')
-                query = '&'.join(qs)
-                uri = f"trojan://{passwd}@{host}:{port}?{query}#{name}"
-                configs.append(uri)
-            return configs
+            host = link_host(getattr(self, 'sub_base', '') or self.base_url)
+            return link_template(parse_inbound(inbound), host).render(client, username)
         except Exception:
             return []
 
@@ -3325,35 +3213,27 @@ class TxUiAPI(BasePanelAPI):
             inbound = self._fetch_inbound_detail(inbound_id)
             if not inbound:
                 continue
-            settings_str = inbound.get('settings')
-            clients = []
-            try:
-                if isinstance(settings_str, str):
-                    settings_obj = json.loads(settings_str)
-                    clients = settings_obj.get('clients', [])
-            except Exception:
-                clients = []
-            if not isinstance(clients, list):
+            found = parse_inbound(inbound).find(username)
+            if found is None:
                 continue
-            for c in clients:
-                if c.get('email') == username:
-                    current_exp = int(c.get('expiryTime', 0) or 0)
-                    base = max(current_exp, now_ms)
-                    target_exp = base + (add_ms if add_ms > 0 else 0)
-                    new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
-                    updated = dict(c)
-                    updated['expiryTime'] = target_exp
-                    updated['totalGB'] = new_total
-                    settings_payload = json.dumps({"clients": [updated]})
-                    payload = {"id": int(inbound_id), "settings": settings_payload}
-                    for up in ["/tx/api/inbounds/updateClient", "/xui/api/inbounds/updateClient", "/panel/api/inbounds/updateClient"]:
-                        try:
-                            resp = self.session.post(f"{self.base_url}{up}", headers={'Content-Type': 'application/json'}, json=payload, timeout=15)
-                            if resp.status_code in (200, 201):
-                                return updated, "Success"
-                        except requests.RequestException:
-                            continue
-                    return None, "به‌روزرسانی کلاینت ناموفق بود"
+            c = found.raw
+            current_exp = int(c.get('expiryTime', 0) or 0)
+            base = max(current_exp, now_ms)
+            target_exp = base + (add_ms if add_ms > 0 else 0)
+            new_total = int(c.get('totalGB', 0) or 0) + (add_bytes if add_bytes > 0 else 0)
+            updated = dict(c)
+            updated['expiryTime'] = target_exp
+            updated['totalGB'] = new_total
+            settings_payload = json.dumps({"clients": [updated]})
+            payload = {"id": int(inbound_id), "settings": settings_payload}
+            for up in ["/tx/api/inbounds/updateClient", "/xui/api/inbounds/updateClient", "/panel/api/inbounds/updateClient"]:
+                try:
+                    resp = self.session.post(f"{self.base_url}{up}", headers={'Content-Type': 'application/json'}, json=payload, timeout=15)
+                    if resp.status_code in (200, 201):
+                        return updated, "Success"
+                except requests.RequestException:
+                    continue
+            return None, "به‌روزرسانی کلاینت ناموفق بود"
         return None, "کلاینت برای تمدید یافت نشد"
 
     def renew_by_recreate_on_inbound(self, inbound_id: int, username: str, add_gb: float, add_days: int):
@@ -3368,36 +3248,31 @@ class TxUiAPI(BasePanelAPI):
             return None, "اینباند یافت نشد"
         try:
             now_ms = int(datetime.now().timestamp() * 1000)
-            settings_str = inbound.get('settings')
-            try:
-                settings_obj = json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            except Exception:
-                settings_obj = {}
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
+            parsed = parse_inbound(inbound)
+            if not isinstance(parsed.settings.get('clients', []), list):
                 return None, "ساختار کلاینت‌ها نامعتبر است"
             updated = None
             cur_total = 0
             cur_exp_raw = 0
             uuid_old = ''
-            for c in clients:
-                if c.get('email') == username:
-                    current_exp = int(c.get('expiryTime', 0) or 0)
-                    cur_exp_raw = current_exp
-                    # TX-UI stores ms; detect if seconds
-                    is_ms = current_exp > 10**11
-                    now_unit = now_ms if is_ms else int(now_ms / 1000)
-                    add_unit = (int(add_days) * 86400 * (1000 if is_ms else 1)) if add_days and int(add_days) > 0 else 0
-                    base = max(current_exp, now_unit)
-                    target_exp = base + add_unit if add_unit > 0 else current_exp
-                    add_bytes = int(float(add_gb) * (1024 ** 3)) if add_gb and add_gb > 0 else 0
-                    cur_total = int(c.get('totalGB', 0) or 0)
-                    new_total = cur_total + (add_bytes if add_bytes > 0 else 0)
-                    updated = dict(c)
-                    updated['expiryTime'] = target_exp
-                    updated['totalGB'] = new_total
-                    uuid_old = c.get('id') or c.get('uuid') or ''
-                    break
+            found = parsed.by_email.get(username)
+            if found is not None:
+                c = found.raw
+                current_exp = int(c.get('expiryTime', 0) or 0)
+                cur_exp_raw = current_exp
+                # TX-UI stores ms; detect if seconds
+                is_ms = current_exp > 10**11
+                now_unit = now_ms if is_ms else int(now_ms / 1000)
+                add_unit = (int(add_days) * 86400 * (1000 if is_ms else 1)) if add_days and int(add_days) > 0 else 0
+                base = max(current_exp, now_unit)
+                target_exp = base + add_unit if add_unit > 0 else current_exp
+                add_bytes = int(float(add_gb) * (1024 ** 3)) if add_gb and add_gb > 0 else 0
+                cur_total = int(c.get('totalGB', 0) or 0)
+                new_total = cur_total + (add_bytes if add_bytes > 0 else 0)
+                updated = dict(c)
+                updated['expiryTime'] = target_exp
+                updated['totalGB'] = new_total
+                uuid_old = c.get('id') or c.get('uuid') or ''
             if not updated:
                 return None, "کلاینت یافت نشد"
             # Try update endpoints, including /updateClient/{uuid}
@@ -3417,50 +3292,29 @@ class TxUiAPI(BasePanelAPI):
                 try:
                     r = self.session.post(f"{self.base_url}{ep}", headers=form_headers, data=payload_form, timeout=15)
                     if r.status_code in (200, 201):
-                        ref = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                        except Exception:
-                            robj = {}
-                        for c2 in (robj.get('clients') or []):
-                            if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == updated['expiryTime'] and int(c2.get('totalGB', 0) or 0) == updated['totalGB']:
-                                return updated, "Success"
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, updated['totalGB'], updated['expiryTime']):
+                            return updated, "Success"
                     r = self.session.post(f"{self.base_url}{ep}", headers=json_headers, json=payload_json, timeout=15)
                     if r.status_code in (200, 201):
-                        ref = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                        except Exception:
-                            robj = {}
-                        for c2 in (robj.get('clients') or []):
-                            if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == updated['expiryTime'] and int(c2.get('totalGB', 0) or 0) == updated['totalGB']:
-                                return updated, "Success"
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, updated['totalGB'], updated['expiryTime']):
+                            return updated, "Success"
                     # Also try clients array
                     r = self.session.post(f"{self.base_url}{ep}", headers=json_headers, json={"id": int(inbound_id), "clients": [updated]}, timeout=15)
                     if r.status_code in (200, 201):
-                        ref = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            robj = json.loads(ref.get('settings')) if isinstance(ref.get('settings'), str) else (ref.get('settings') or {})
-                        except Exception:
-                            robj = {}
-                        for c2 in (robj.get('clients') or []):
-                            if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == updated['expiryTime'] and int(c2.get('totalGB', 0) or 0) == updated['totalGB']:
-                                return updated, "Success"
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, updated['totalGB'], updated['expiryTime']):
+                            return updated, "Success"
                     last_err = f"HTTP {r.status_code}: {(r.text or '')[:160]}"
                 except requests.RequestException as e:
                     last_err = str(e)
                     continue
             # Fallback: full inbound update (embed updated client)
             full = self._fetch_inbound_detail(inbound_id) or {}
-            try:
-                cur_settings = json.loads(full.get('settings')) if isinstance(full.get('settings'), str) else (full.get('settings') or {})
-            except Exception:
-                cur_settings = {}
-            cur_clients = list(cur_settings.get('clients') or [])
-            for i, cc in enumerate(cur_clients):
-                if cc.get('email') == username:
-                    cur_clients[i] = updated
-                    break
+            parsed_full = parse_inbound(full)
+            cur_settings = dict(parsed_full.settings)
+            cur_clients = list(parsed_full.client_dicts)
+            found_full = parsed_full.find(username)
+            if found_full is not None:
+                cur_clients[found_full.pos] = updated
             else:
                 cur_clients.append(updated)
             cur_settings['clients'] = cur_clients
@@ -3490,14 +3344,8 @@ class TxUiAPI(BasePanelAPI):
                 try:
                     rr = self.session.post(f"{self.base_url}{p}", headers=json_headers, json=full_payload, timeout=15)
                     if rr.status_code in (200, 201):
-                        ref2 = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            robj2 = json.loads(ref2.get('settings')) if isinstance(ref2.get('settings'), str) else (ref2.get('settings') or {})
-                        except Exception:
-                            robj2 = {}
-                        for c2 in (robj2.get('clients') or []):
-                            if c2.get('email') == username and int(c2.get('expiryTime', 0) or 0) == updated['expiryTime'] and int(c2.get('totalGB', 0) or 0) == updated['totalGB']:
-                                return updated, "Success"
+                        if _client_has_limits(self._fetch_inbound_detail(inbound_id), username, updated['totalGB'], updated['expiryTime']):
+                            return updated, "Success"
                 except requests.RequestException:
                     continue
             return None, (last_err or "به‌روزرسانی کلاینت ناموفق بود")
@@ -3528,7 +3376,7 @@ class MarzneshinAPI(BasePanelAPI):
         if _sb and '://' not in _sb:
             _sb = f"http://{_sb}"
         self.sub_base = _sb
-        self.session = requests.Session()
+        self.session = _TimedSession(self.panel_id)
         self._json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
         self._last_token_error = None
         
@@ -3892,6 +3740,33 @@ class MarzneshinAPI(BasePanelAPI):
         except requests.RequestException as e:
             return None, None, str(e)
 
+    @staticmethod
+    def _expire_ts(u: dict) -> int:
+        """Expiry as epoch seconds: ``expire`` if numeric, else the ISO ``expire_date``; 0 = none"""
+        if isinstance(u.get('expire'), (int, float)):
+            return int(u['expire'])
+        ed = u.get('expire_date') or u.get('expireDate')
+        if isinstance(ed, str) and ed:
+            try:
+                return int(datetime.fromisoformat(ed.replace('Z', '+00:00')).timestamp())
+            except ValueError:
+                return 0
+        return 0
+
+    def _lookup_users_filtered(self, usernames: list) -> dict | None:
+        if not self.token and not self._ensure_token():
+            return None
+        hdrs = {"Accept": "application/json", "Authorization": f"Bearer {self.token}"}
+        found = {}
+        for name in usernames:
+            ru = self.session.get(f"{self.base_url}/api/users/{name}", headers=hdrs, timeout=10)
+            if ru.status_code != 200:
+                continue
+            u = ru.json()
+            if isinstance(u, dict):
+                found[name] = _usage_entry(name, u.get('data_limit'), u.get('used_traffic'), self._expire_ts(u), u.get('enabled', True))
+        return found
+
     async def get_user(self, username):
         # Marzneshin: use /api/users/{username} for core info and /sub/{username}/{key}/info|usage for stats
         # 1) Ensure token and get user
@@ -3918,18 +3793,8 @@ class MarzneshinAPI(BasePanelAPI):
         except Exception:
             pass
         try:
-            # prefer epoch seconds if provided
-            if isinstance(u.get('expire'), (int, float)):
-                expire_ts = int(u['expire'])
-            else:
-                # ISO string in expire_date
-                ed = u.get('expire_date') or u.get('expireDate')
-                if isinstance(ed, str) and ed:
-                    from datetime import datetime
-                    try:
-                        expire_ts = int(datetime.fromisoformat(ed.replace('Z', '+00:00')).timestamp())
-                    except Exception:
-                        expire_ts = 0
+            # prefer epoch seconds if provided, else the ISO string in expire_date
+            expire_ts = self._expire_ts(u)
         except Exception:
             pass
 
@@ -4257,63 +4122,52 @@ class MarzneshinAPI(BasePanelAPI):
                 continue
             try:
                 import json as _json, uuid as _uuid, random as _rand, string as _str
-                settings_str = inbound.get('settings')
-                settings_obj = _json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-                clients = settings_obj.get('clients') or []
-                if not isinstance(clients, list):
-                    continue
+                found = parse_inbound(inbound).find(username)
                 proto = (inbound.get('protocol') or inbound.get('type') or '').lower()
-                for idx, c in enumerate(clients):
-                    if c.get('email') == username:
-                        updated = dict(c)
-                        old_uuid = c.get('id') or c.get('uuid') or None
-                        # Rotate identity based on protocol
-                        if proto in ('vless','vmess'):
-                            updated['id'] = str(_uuid.uuid4())
-                        elif proto == 'trojan':
-                            updated['password'] = ''.join(_rand.choices(_str.ascii_letters + _str.digits, k=16))
-                        # Always rotate subId when present
-                        if 'subId' in updated:
-                            updated['subId'] = ''.join(_rand.choices(_str.ascii_lowercase + _str.digits, k=12))
-                        # Push update via API
-                        settings_payload = _json.dumps({"clients": [updated]})
-                        payload = {"id": int(inbound_id), "settings": settings_payload}
-                        endpoints = [
-                            "/xui/api/inbounds/updateClient",
-                            "/panel/api/inbounds/updateClient",
-                            "/xui/api/inbound/updateClient",
-                        ]
-                        if old_uuid:
-                            endpoints = [f"{e}/{old_uuid}" for e in endpoints] + endpoints
-                        for ep in endpoints:
-                            try:
-                                resp = self.session.post(f"{self.base_url}{ep}", headers={'Content-Type': 'application/json'}, json=payload, timeout=15)
-                                if resp.status_code in (200, 201):
-                                    changed = True
-                                    break
-                            except requests.RequestException:
-                                continue
+                if found is not None:
+                    c = found.raw
+                    updated = dict(c)
+                    old_uuid = c.get('id') or c.get('uuid') or None
+                    # Rotate identity based on protocol
+                    if proto in ('vless','vmess'):
+                        updated['id'] = str(_uuid.uuid4())
+                    elif proto == 'trojan':
+                        updated['password'] = ''.join(_rand.choices(_str.ascii_letters + _str.digits, k=16))
+                    # Always rotate subId when present
+                    if 'subId' in updated:
+                        updated['subId'] = ''.join(_rand.choices(_str.ascii_lowercase + _str.digits, k=12))
+                    # Push update via API
+                    settings_payload = _json.dumps({"clients": [updated]})
+                    payload = {"id": int(inbound_id), "settings": settings_payload}
+                    endpoints = [
+                        "/xui/api/inbounds/updateClient",
+                        "/panel/api/inbounds/updateClient",
+                        "/xui/api/inbound/updateClient",
+                    ]
+                    if old_uuid:
+                        endpoints = [f"{e}/{old_uuid}" for e in endpoints] + endpoints
+                    for ep in endpoints:
+                        try:
+                            resp = self.session.post(f"{self.base_url}{ep}", headers={'Content-Type': 'application/json'}, json=payload, timeout=15)
+                            if resp.status_code in (200, 201):
+                                changed = True
+                                break
+                        except requests.RequestException:
+                            continue
                 # continue checking other inbounds
             except Exception:
                 continue
         return changed
         try:
-            import json as _json
-            settings_str = inbound.get('settings')
-            settings_obj = _json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            clients = settings_obj.get('clients') or []
-            client = None
-            for c in clients:
-                if c.get('email') == username:
-                    client = c
-                    break
-            if not client:
+            parsed = parse_inbound(inbound)
+            found = parsed.find(username)
+            if found is None:
                 return []
-            proto = (inbound.get('protocol') or '').lower()
-            port = inbound.get('port') or inbound.get('listen_port') or 0
+            client = found.raw
+            proto = parsed.protocol
+            port = parsed.port
             # stream settings
-            stream_raw = inbound.get('streamSettings') or inbound.get('stream_settings')
-            stream = _json.loads(stream_raw) if isinstance(stream_raw, str) else (stream_raw or {})
+            stream = parsed.stream
             network = (stream.get('network') or '').lower() or 'tcp'
             security = (stream.get('security') or '').lower() or ''
             # tls/sni
@@ -4453,33 +4307,39 @@ class MarzneshinAPI(BasePanelAPI):
             return None
         try:
             import json as _json, uuid as _uuid, random as _rand, string as _str
-            settings_str = inbound.get('settings')
-            settings_obj = _json.loads(settings_str) if isinstance(settings_str, str) else (settings_str or {})
-            clients = settings_obj.get('clients') or []
-            if not isinstance(clients, list):
+            parsed = parse_inbound(inbound)
+            if not isinstance(parsed.settings.get('clients', []), list):
                 return None
             proto = (inbound.get('protocol') or inbound.get('type') or '').lower()
-            updated = None; idx = -1; old_uuid = None
-            for i, c in enumerate(clients):
-                if c.get('email') == username:
-                    updated = dict(c); idx = i
-                    old_uuid = c.get('id') or c.get('uuid') or None
-                    if proto in ('vless','vmess'):
-                        updated['id'] = str(_uuid.uuid4())
-                    elif proto == 'trojan':
-                        updated['password'] = ''.join(_rand.choices(_str.ascii_letters + _str.digits, k=16))
-                    # Rotate subId if present
-                    if 'subId' in updated:
-                        updated['subId'] = ''.join(_rand.choices(_str.ascii_lowercase + _str.digits, k=12))
-                    break
-            if not updated:
+            found = parsed.find(username)
+            if found is None:
                 return None
+            c = found.raw
+            updated = dict(c)
+            old_uuid = c.get('id') or c.get('uuid') or None
+            if proto in ('vless','vmess'):
+                updated['id'] = str(_uuid.uuid4())
+            elif proto == 'trojan':
+                updated['password'] = ''.join(_rand.choices(_str.ascii_letters + _str.digits, k=16))
+            # Rotate subId if present
+            if 'subId' in updated:
+                updated['subId'] = ''.join(_rand.choices(_str.ascii_lowercase + _str.digits, k=12))
             # Replace in full settings and push update via multiple formats
-            full_settings = settings_obj
-            full_clients = list(clients)
-            if idx >= 0:
-                full_clients[idx] = updated
-                full_settings['clients'] = full_clients
+            full_settings = dict(parsed.settings)
+            full_clients = list(parsed.client_dicts)
+            full_clients[found.pos] = updated
+            full_settings['clients'] = full_clients
+
+            def _rotated():
+                c2 = parse_inbound(self._fetch_inbound_detail(inbound_id) or {}).find(username)
+                if c2 is None:
+                    return False
+                if proto in ('vless','vmess'):
+                    return c2.uuid == updated.get('id')
+                if proto == 'trojan':
+                    return c2.password == updated.get('password')
+                return False
+
             settings_payload = _json.dumps(full_settings)
             json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'}
             form_headers = {'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8', 'X-Requested-With': 'XMLHttpRequest'}
@@ -4504,19 +4364,8 @@ class MarzneshinAPI(BasePanelAPI):
                     payload_a = {"id": int(inbound_id), "settings": settings_payload}
                     resp = self.session.post(f"{self.base_url}{ep}", headers=json_headers, json=payload_a, timeout=15)
                     if resp.status_code in (200, 201):
-                        _new = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            _s = _json.loads(_new.get('settings')) if isinstance(_new.get('settings'), str) else (_new.get('settings') or {})
-                        except Exception:
-                            _s = {}
-                        for c2 in (_s.get('clients') or []):
-                            if c2.get('email') == username:
-                                if proto in ('vless','vmess'):
-                                    if c2.get('id') == updated.get('id'):
-                                        return updated
-                                elif proto == 'trojan':
-                                    if c2.get('password') == updated.get('password'):
-                                        return updated
+                        if _rotated():
+                            return updated
                     else:
                         last_preview = f"{ep} -> HTTP {resp.status_code}: {(resp.text or '')[:180]}"
                 except requests.RequestException as _e:
@@ -4526,19 +4375,8 @@ class MarzneshinAPI(BasePanelAPI):
                     payload_b = {"id": str(int(inbound_id)), "settings": settings_payload}
                     resp = self.session.post(f"{self.base_url}{ep}", headers=form_headers, data=payload_b, timeout=15)
                     if resp.status_code in (200, 201):
-                        _new = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            _s = _json.loads(_new.get('settings')) if isinstance(_new.get('settings'), str) else (_new.get('settings') or {})
-                        except Exception:
-                            _s = {}
-                        for c2 in (_s.get('clients') or []):
-                            if c2.get('email') == username:
-                                if proto in ('vless','vmess'):
-                                    if c2.get('id') == updated.get('id'):
-                                        return updated
-                                elif proto == 'trojan':
-                                    if c2.get('password') == updated.get('password'):
-                                        return updated
+                        if _rotated():
+                            return updated
                     else:
                         last_preview = f"{ep} -> HTTP {resp.status_code}: {(resp.text or '')[:180]}"
                 except requests.RequestException:
@@ -4548,19 +4386,8 @@ class MarzneshinAPI(BasePanelAPI):
                     payload_c = {"id": int(inbound_id), "clients": full_clients}
                     resp = self.session.post(f"{self.base_url}{ep}", headers=json_headers, json=payload_c, timeout=15)
                     if resp.status_code in (200, 201):
-                        _new = self._fetch_inbound_detail(inbound_id)
-                        try:
-                            _s = _json.loads(_new.get('settings')) if isinstance(_new.get('settings'), str) else (_new.get('settings') or {})
-                        except Exception:
-                            _s = {}
-                        for c2 in (_s.get('clients') or []):
-                            if c2.get('email') == username:
-                                if proto in ('vless','vmess'):
-                                    if c2.get('id') == updated.get('id'):
-                                        return updated
-                                elif proto == 'trojan':
-                                    if c2.get('password') == updated.get('password'):
-                                        return updated
+                        if _rotated():
+                            return updated
                     else:
                         last_preview = f"{ep} -> HTTP {resp.status_code}: {(resp.text or '')[:180]}"
                 except requests.RequestException:
@@ -4575,6 +4402,133 @@ class MarzneshinAPI(BasePanelAPI):
             return None
 
 
+# Waiting for a just-created/recreated client to show up on its inbound
+CLIENT_WAIT_DEADLINE = 4.0
+CLIENT_WAIT_INITIAL_DELAY = 0.25
+
+
+def find_inbound_client(inbound: dict, username: str, preferred_id: str | None = None) -> dict | None:
+    """Client of ``inbound`` with id ``preferred_id``, else the first one with email ``username``"""
+    c = parse_inbound(inbound).find(username, preferred_id)
+    return c.raw if c is not None else None
+
+
+async def wait_for_inbound_client(api, inbound_id: int, username: str, preferred_id: str | None = None,
+                                  inbound: dict | None = None, deadline: float = CLIENT_WAIT_DEADLINE):
+    """Poll until the client shows up on the inbound; returns ``(client, inbound)``
+
+    Starts from ``inbound`` when the caller already fetched it. While the client is
+    missing, panels with a per-client traffic endpoint are polled on that (a few
+    hundred bytes) and the full inbound detail is downloaded again only once the
+    client exists. Exponential backoff from ``CLIENT_WAIT_INITIAL_DELAY`` up to
+    ``deadline`` seconds in total; cancelling the awaiting task stops the polling.
+    ``client`` is None if it never appeared.
+    """
+    if inbound is None:
+        inbound = await asyncio.to_thread(api._fetch_inbound_detail, inbound_id)
+        if not inbound:
+            return None, None
+    client = find_inbound_client(inbound, username, preferred_id)
+    if client is not None:
+        return client, inbound
+    # A recreated client keeps its email, so only a fresh id needs the inbound itself
+    light = preferred_id is None and hasattr(api, '_fetch_client_traffic_by_email')
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + deadline
+    delay = CLIENT_WAIT_INITIAL_DELAY
+    polls = 0
+    while True:
+        remaining = stop_at - loop.time()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(delay, remaining))
+        delay *= 2
+        polls += 1
+        if light and not await asyncio.to_thread(api._fetch_client_traffic_by_email, username):
+            continue
+        fresh = await asyncio.to_thread(api._fetch_inbound_detail, inbound_id)
+        if not fresh:
+            continue
+        inbound = fresh
+        client = find_inbound_client(inbound, username, preferred_id)
+        if client is not None:
+            get_metrics().observe('panel_client_wait_polls', polls)
+            return client, inbound
+    logger.warning(f"Client {username} did not appear on inbound {inbound_id} within {deadline}s ({polls} polls)")
+    return None, inbound
+
+
+async def fetch_user_configs(api, inbound_id: int, username: str, preferred_id: str | None = None,
+                             inbound: dict | None = None, deadline: float = CLIENT_WAIT_DEADLINE) -> list:
+    """Async ``get_configs_for_user_on_inbound`` that tolerates propagation delay without blocking the loop"""
+    client, inbound = await wait_for_inbound_client(api, inbound_id, username, preferred_id, inbound, deadline)
+    if client is None:
+        return []
+    return api.get_configs_for_user_on_inbound(inbound_id, username, preferred_id, inbound=inbound, client=client) or []
+
+
+async def lookup_panel_users(panel_id: int, usernames, timeout: float = 5.0) -> dict:
+    """Usage of ``usernames`` on one panel without blocking the event loop; {} on error/timeout
+
+    The blocking lookup runs in a worker thread, so a timeout only stops waiting for it;
+    whatever it fetches still lands in the shared snapshot for the next render. While the
+    panel's circuit breaker is open, the last known usage is returned instead.
+    """
+    names = list(usernames)
+    found = {}
+    breaker = get_panel_breaker(panel_id)
+    t0 = _time.monotonic()
+    if breaker.available:
+        try:
+            api = VpnPanelAPI(panel_id)
+            found = await asyncio.wait_for(asyncio.to_thread(api.lookup_users, names), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"User lookup on panel {panel_id} timed out after {timeout}s")
+        except Exception as e:
+            logger.debug(f"User lookup on panel {panel_id} failed: {e}")
+    for u, entry in found.items():
+        remember_usage(panel_id, u, entry)
+    if len(found) < len(names) and (not breaker.available or breaker.last_failure >= t0):
+        # Panel unavailable or failing: last known usage for the rest
+        for u in names:
+            if u not in found:
+                cached = last_known_usage(panel_id, u)
+                if cached is not None:
+                    found[u] = cached[0]
+    return found
+
+
+async def get_user_usage(api, username: str, timeout: float = 15.0) -> tuple:
+    """``get_user`` for user screens: (info, message, cached_at)
+
+    ``cached_at`` is None for live data. While the panel's breaker is open, or when the
+    call fails or times out because of the panel, the last successfully read info is
+    returned with the wall time it was read at. Without such a copy, failures propagate
+    as from ``get_user`` (including ``asyncio.TimeoutError``).
+    """
+    breaker = get_panel_breaker(api.panel_id)
+    cached = last_known_usage(api.panel_id, username)
+    if cached is not None and not breaker.available:
+        get_metrics().inc('panel_usage_fallback_total', panel=str(api.panel_id))
+        return cached[0], "cached", cached[1]
+    t0 = _time.monotonic()
+    try:
+        info, message = await asyncio.wait_for(api.get_user(username), timeout=timeout)
+    except Exception:
+        if cached is None:
+            raise
+        get_metrics().inc('panel_usage_fallback_total', panel=str(api.panel_id))
+        return cached[0], "cached", cached[1]
+    if info:
+        remember_usage(api.panel_id, username, info)
+        return info, message, None
+    # get_user swallows transport errors; fall back only if the panel itself failed meanwhile
+    if cached is not None and breaker.last_failure >= t0:
+        get_metrics().inc('panel_usage_fallback_total', panel=str(api.panel_id))
+        return cached[0], "cached", cached[1]
+    return info, message, None
+
+
 def VpnPanelAPI(panel_id: int) -> BasePanelAPI:
     panel_row = query_db("SELECT * FROM panels WHERE id = ?", (panel_id,), one=True)
     if not panel_row:
@@ -0,0 +1,241 @@
+"""
+Batched client mutations for X-UI style inbounds
+Renewing or deleting a client used to be one full read-modify-write of the
+inbound per client. Here pending mutations for one inbound are applied to a
+single copy of ``settings.clients`` and written back with one update call.
+
+The panels have no conditional update, and writes from the bot itself are
+serialized per inbound, so a batch is planned on one read and checked on the
+read-back after the write (:func:`verify_plan`). Mutations whose client comes
+back exactly as it was planned from were lost to a concurrent writer
+(:func:`lost_mutations`); they are planned again on the read-back, up to
+``PANEL_BATCH_ATTEMPTS`` times. Every mutation gets its own :class:`MutationResult`.
+"""
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import logger
+from .metrics import get_metrics
+from .panel_inbound import ParsedInbound, parse_inbound
+
+PANEL_BATCH_ATTEMPTS = int(os.getenv('PANEL_BATCH_ATTEMPTS', '3'))
+
+OP_DELETE = 'delete'
+OP_RENEW = 'renew'
+OP_SET = 'set'
+
+
+class ClientMutation:
+    """One pending change to one client, addressed by email and/or UUID"""
+
+    __slots__ = ('op', 'username', 'client_id', 'add_gb', 'add_days', 'total_bytes', 'expiry_ms', 'enable')
+
+    def __init__(self, op: str, username: Optional[str] = None, client_id: Optional[str] = None,
+                 add_gb: float = 0, add_days: int = 0, total_bytes: Optional[int] = None,
+                 expiry_ms: Optional[int] = None, enable: Optional[bool] = None):
+        self.op = op
+        self.username = username
+        self.client_id = client_id
+        self.add_gb = add_gb
+        self.add_days = add_days
+        self.total_bytes = total_bytes
+        self.expiry_ms = expiry_ms
+        self.enable = enable
+
+    @classmethod
+    def delete(cls, username: Optional[str] = None, client_id: Optional[str] = None) -> 'ClientMutation':
+        return cls(OP_DELETE, username, client_id)
+
+    @classmethod
+    def renew(cls, username: str, add_gb: float, add_days: int, client_id: Optional[str] = None) -> 'ClientMutation':
+        return cls(OP_RENEW, username, client_id, add_gb=add_gb, add_days=add_days)
+
+    @classmethod
+    def set_limits(cls, username: Optional[str] = None, client_id: Optional[str] = None,
+                   total_bytes: Optional[int] = None, expiry_ms: Optional[int] = None,
+                   enable: Optional[bool] = None) -> 'ClientMutation':
+        return cls(OP_SET, username, client_id, total_bytes=total_bytes, expiry_ms=expiry_ms, enable=enable)
+
+    @property
+    def key(self) -> str:
+        """Result key: the username, or the UUID for mutations addressed by UUID only"""
+        return self.username or self.client_id or ''
+
+    def updated(self, client: dict, now_ms: int) -> dict:
+        """Copy of ``client`` with this renew/set applied"""
+        c = dict(client)
+        if self.op == OP_RENEW:
+            current_exp = int(c.get('expiryTime', 0) or 0)
+            # Older X-UI builds store seconds; detect by magnitude as the per-client renew does
+            is_ms = current_exp == 0 or current_exp > 10**11
+            now_unit = now_ms if is_ms else int(now_ms / 1000)
+            add_unit = int(self.add_days) * 86400 * (1000 if is_ms else 1) if self.add_days and int(self.add_days) > 0 else 0
+            if add_unit:
+                c['expiryTime'] = max(current_exp, now_unit) + add_unit
+            if self.add_gb and self.add_gb > 0:
+                c['totalGB'] = int(c.get('totalGB', 0) or 0) + int(float(self.add_gb) * (1024 ** 3))
+        else:
+            if self.total_bytes is not None:
+                c['totalGB'] = int(self.total_bytes)
+            if self.expiry_ms is not None:
+                c['expiryTime'] = int(self.expiry_ms)
+            if self.enable is not None:
+                c['enable'] = bool(self.enable)
+        return c
+
+    def __repr__(self):
+        return f"ClientMutation({self.op}, {self.key!r})"
+
+
+class MutationResult:
+    __slots__ = ('ok', 'message', 'client')
+
+    def __init__(self, ok: bool, message: str, client: Optional[dict] = None):
+        self.ok = ok
+        self.message = message
+        # Client dict as written (None for deletes and failures)
+        self.client = client
+
+    def __iter__(self):
+        # Unpacks like the per-client methods' (result, message) tuples
+        return iter((self.ok, self.message))
+
+    def __repr__(self):
+        return f"MutationResult({self.ok}, {self.message!r})"
+
+
+class BatchPlan:
+    """Mutations applied to one parsed inbound, ready to be written back"""
+
+    __slots__ = ('originals', 'slots', 'results', 'targets')
+
+    def __init__(self, originals: List[dict], slots: List[Optional[dict]], results: Dict[int, MutationResult],
+                 targets: Dict[int, Tuple[str, int]]):
+        # Clients as read when planning
+        self.originals = originals
+        # Clients in their original order; None where a client is deleted
+        self.slots = slots
+        # mutation index -> result (failures and, once written, successes)
+        self.results = results
+        # mutation index -> (op, slot) for mutations that will be written
+        self.targets = targets
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.targets)
+
+    @property
+    def clients(self) -> List[dict]:
+        return [c for c in self.slots if c is not None]
+
+
+def plan_mutations(parsed: ParsedInbound, mutations: List[ClientMutation], now_ms: Optional[int] = None) -> BatchPlan:
+    """Apply ``mutations`` in order to a copy of the inbound's clients"""
+    if now_ms is None:
+        now_ms = int(datetime.now().timestamp() * 1000)
+    originals = parsed.client_dicts
+    slots: List[Optional[dict]] = list(originals)
+    results: Dict[int, MutationResult] = {}
+    targets: Dict[int, Tuple[str, int]] = {}
+    for n, m in enumerate(mutations):
+        found = parsed.find(m.username, m.client_id)
+        i = found.pos if found is not None else None
+        if i is None or slots[i] is None:
+            results[n] = MutationResult(False, "کلاینت یافت نشد")
+            continue
+        targets[n] = (m.op, i)
+        slots[i] = None if m.op == OP_DELETE else m.updated(slots[i], now_ms)
+    return BatchPlan(originals, slots, results, targets)
+
+
+def verify_plan(parsed_after: ParsedInbound, plan: BatchPlan, mutations: List[ClientMutation]) -> Dict[int, MutationResult]:
+    """Per-mutation results from the inbound as read back after the write"""
+    out = dict(plan.results)
+    for n, (op, i) in plan.targets.items():
+        m = mutations[n]
+        expected = plan.slots[i]
+        after = parsed_after.find(m.username, m.client_id)
+        if expected is None:
+            # Deleted by this or a later mutation of the batch
+            out[n] = MutationResult(after is None, "Success" if after is None else "کلاینت حذف نشد")
+            continue
+        ok = after is not None \
+            and after.total_bytes == int(expected.get('totalGB', 0) or 0) \
+            and abs(after.expiry_ms - int(expected.get('expiryTime', 0) or 0)) <= 5
+        out[n] = MutationResult(ok, "Success" if ok else "به‌روزرسانی کلاینت ناموفق بود", expected if ok else None)
+    return out
+
+
+def lost_mutations(parsed_after: ParsedInbound, plan: BatchPlan, mutations: List[ClientMutation],
+                   results: Dict[int, MutationResult]) -> List[int]:
+    """Failed mutations whose client reads back untouched: the write was overwritten, safe to apply again
+
+    A client that changed some other way (e.g. the panel rounded the expiry) is not
+    retried, so a renew is never added twice.
+    """
+    lost = []
+    for n, (op, i) in plan.targets.items():
+        if results[n].ok:
+            continue
+        m = mutations[n]
+        after = parsed_after.find(m.username, m.client_id)
+        if after is None:
+            continue
+        before = plan.originals[i]
+        if op == OP_DELETE or (after.total_bytes == int(before.get('totalGB', 0) or 0)
+                               and after.expiry_ms == int(before.get('expiryTime', 0) or 0)
+                               and after.enable == before.get('enable', True)):
+            lost.append(n)
+    return lost
+
+
+def apply_mutations(mutations: List[ClientMutation],
+                    fetch: Callable[[], Optional[dict]],
+                    write: Callable[[dict, List[dict]], Optional[bool]],
+                    apply_singly: Callable[[List[ClientMutation], ParsedInbound, BatchPlan], list],
+                    panel_id=None, inbound_id=None) -> List[MutationResult]:
+    """Plan, write and verify ``mutations`` on one inbound, replanning lost writes
+
+    ``fetch()`` reads the inbound (None if missing), ``write(inbound, clients)`` stores
+    a clients list (None when the panel has no update call, then ``apply_singly`` runs
+    the batch per client). ``panel_id``/``inbound_id`` only label logs and metrics.
+    """
+    inbound = fetch()
+    results: Dict[int, MutationResult] = {}
+    pending = list(range(len(mutations)))
+    for attempt in range(PANEL_BATCH_ATTEMPTS):
+        if not inbound:
+            break
+        batch = [mutations[n] for n in pending]
+        parsed = parse_inbound(inbound)
+        plan = plan_mutations(parsed, batch)
+        if not plan.changed:
+            results.update((pending[k], r) for k, r in plan.results.items())
+            break
+        written = write(inbound, plan.clients)
+        if written is None:
+            done = apply_singly(batch, parsed, plan)
+            results.update(zip(pending, done))
+            break
+        # The read-back both verifies this write and is the base of a retry
+        inbound = fetch() if written else None
+        if not inbound:
+            results.update((pending[k], r) for k, r in plan.results.items())
+            break
+        after = parse_inbound(inbound)
+        verified = verify_plan(after, plan, batch)
+        lost = lost_mutations(after, plan, batch, verified)
+        results.update((pending[k], r) for k, r in verified.items())
+        if not lost:
+            break
+        get_metrics().inc('panel_batch_conflicts_total', panel=str(panel_id))
+        logger.info(f"panel {panel_id}: {len(lost)} writes on inbound {inbound_id} were overwritten, "
+                    f"replanning (attempt {attempt + 1})")
+        pending = [pending[k] for k in lost]
+    else:
+        for n in pending:
+            results[n] = MutationResult(False, "اینباند هم‌زمان در حال تغییر است؛ دوباره تلاش کنید")
+    if not inbound and not results:
+        return [MutationResult(False, "اینباند یافت نشد") for _ in mutations]
+    return [results.get(n) or MutationResult(False, "به‌روزرسانی اینباند ناموفق بود") for n in range(len(mutations))]
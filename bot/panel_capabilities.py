@@ -0,0 +1,170 @@
+"""
+Per-panel endpoint capability profile
+Panel forks expose the same operation under different prefixes (``/xui/API``,
+``/panel/api`` ...) and accept different payload shapes, so ``bot.panel`` keeps
+lists of candidates per operation. The profile remembers which candidate
+worked for each operation and serves it first; it is persisted as JSON in
+``panels.endpoint_profile`` so restarts do not probe again.
+
+Usage inside a panel method::
+
+    probe = self.caps.probe('inbound_list', endpoints)
+    for url in probe:
+        resp = ...
+        if ok:
+            probe.hit()
+            return ...
+        probe.miss(resp.status_code)
+
+Other candidates are only tried when the remembered one answers 404/405 or
+a body that cannot be parsed (``miss()`` without a status); any other failure
+(timeout, 5xx, auth) of a known-good endpoint ends the probe instead of
+sweeping every variant.
+"""
+import json
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from .config import logger
+from .db import execute_db, query_db
+from .metrics import get_metrics
+
+# Statuses that mean "wrong variant" rather than "panel unhappy"
+REDISCOVER_STATUSES = frozenset((404, 405))
+PROFILE_VERSION = 1
+
+
+class EndpointProbe:
+    """Iterates candidates of one operation, remembered variant first"""
+
+    __slots__ = ('_caps', '_op', '_candidates', '_known', '_current', '_stop', 'attempts')
+
+    def __init__(self, caps: 'PanelCapabilities', op: str, candidates: Sequence):
+        self._caps = caps
+        self._op = op
+        self._candidates = candidates
+        self._known = caps.known_index(op, len(candidates))
+        self._current: Optional[int] = None
+        self._stop = False
+        self.attempts = 0
+
+    def __iter__(self) -> Iterator:
+        self._stop = False
+        order = range(len(self._candidates))
+        if self._known is not None:
+            order = [self._known] + [i for i in order if i != self._known]
+        for i in order:
+            if self._stop:
+                return
+            self._current = i
+            self.attempts += 1
+            yield self._candidates[i]
+
+    def hit(self):
+        """The current candidate worked"""
+        if self._current is not None:
+            self._caps.remember(self._op, self._current, len(self._candidates))
+            self._known = self._current
+
+    def miss(self, status: Optional[int] = None):
+        """The current candidate failed; ``status`` None means unparseable response"""
+        if self._current is None or self._current != self._known:
+            return
+        if status is None or status in REDISCOVER_STATUSES:
+            logger.info(f"panel {self._caps.panel_id}: '{self._op}' variant stopped working (status={status}), rediscovering")
+            self._caps.forget(self._op)
+            self._known = None
+            get_metrics().inc('panel_endpoint_rediscover_total', panel=str(self._caps.panel_id), op=self._op)
+        else:
+            self._stop = True
+
+
+class PanelCapabilities:
+    """Remembered variant index per operation for one panel"""
+
+    def __init__(self, panel_id: int, base_url: str):
+        self.panel_id = panel_id
+        self.base_url = base_url
+        # op -> [candidate index, number of candidates when discovered]
+        self._ops: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        row = query_db("SELECT endpoint_profile FROM panels WHERE id = ?", (self.panel_id,), one=True)
+        raw = (row or {}).get('endpoint_profile')
+        if not raw:
+            return
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return
+        # A profile discovered against another URL (panel edited) is worthless
+        if data.get('v') != PROFILE_VERSION or data.get('base_url') != self.base_url:
+            return
+        self._ops = {k: list(v) for k, v in (data.get('ops') or {}).items() if isinstance(v, list) and len(v) == 2}
+
+    def _persist(self):
+        payload = json.dumps({
+            'v': PROFILE_VERSION,
+            'base_url': self.base_url,
+            'updated': int(time.time()),
+            'ops': self._ops,
+        }, separators=(',', ':'))
+        execute_db("UPDATE panels SET endpoint_profile = ? WHERE id = ?", (payload, self.panel_id))
+
+    def known_index(self, op: str, n_candidates: int) -> Optional[int]:
+        entry = self._ops.get(op)
+        # Candidate lists changed shape since discovery: probe again
+        if not entry or entry[1] != n_candidates or entry[0] >= n_candidates:
+            return None
+        return entry[0]
+
+    def remember(self, op: str, index: int, n_candidates: int):
+        with self._lock:
+            if self._ops.get(op) == [index, n_candidates]:
+                return
+            self._ops[op] = [index, n_candidates]
+            self._persist()
+        logger.debug(f"panel {self.panel_id}: '{op}' -> variant {index}/{n_candidates}")
+
+    def forget(self, op: str):
+        with self._lock:
+            if self._ops.pop(op, None) is not None:
+                self._persist()
+
+    def reset(self):
+        with self._lock:
+            self._ops.clear()
+            self._persist()
+
+    def probe(self, op: str, candidates: Sequence) -> EndpointProbe:
+        return EndpointProbe(self, op, candidates)
+
+    def as_dict(self) -> Dict[str, List[int]]:
+        return dict(self._ops)
+
+
+_capabilities: Dict[int, PanelCapabilities] = {}
+_capabilities_lock = threading.Lock()
+
+
+def get_panel_capabilities(panel_id: int, base_url: str) -> PanelCapabilities:
+    key = int(panel_id)
+    caps = _capabilities.get(key)
+    if caps is None or caps.base_url != base_url:
+        with _capabilities_lock:
+            caps = _capabilities.get(key)
+            if caps is None or caps.base_url != base_url:
+                caps = _capabilities[key] = PanelCapabilities(key, base_url)
+    return caps
+
+
+def reset_panel_capabilities(panel_id: int):
+    """Forget every remembered variant of a panel (e.g. after the panel was upgraded)"""
+    caps = _capabilities.pop(int(panel_id), None)
+    if caps is not None:
+        caps.reset()
+    else:
+        execute_db("UPDATE panels SET endpoint_profile = NULL WHERE id = ?", (int(panel_id),))
@@ -0,0 +1,219 @@
+"""
+Per-panel circuit breaker
+Every HTTP request a panel API makes goes through ``bot.panel._TimedSession``,
+which asks the panel's breaker first and reports the outcome afterwards:
+
+* closed: requests pass; transport errors, 5xx answers and requests slower than
+  ``PANEL_BREAKER_SLOW_SECONDS`` count as failures over the last
+  ``PANEL_BREAKER_WINDOW`` requests. Full user listings are expected to be slow
+  on large panels and get ``PANEL_BREAKER_LISTING_SLOW_SECONDS`` instead
+  (requests made inside :func:`listing_requests`)
+* open: entered after ``PANEL_BREAKER_CONSECUTIVE`` failures in a row, or a
+  failure ratio of ``PANEL_BREAKER_FAILURE_RATIO`` once the window holds
+  ``PANEL_BREAKER_MIN_CALLS`` requests; requests fail at once with
+  :class:`PanelUnavailable` instead of waiting out their timeout (and endpoint
+  variant loops give up at the first candidate)
+* half-open: after the cooldown a single request goes through as a probe while
+  the others keep failing fast; success closes the breaker, failure re-opens it
+  with a doubled cooldown (up to ``PANEL_BREAKER_MAX_COOLDOWN``). Only the probe
+  decides: :meth:`PanelBreaker.before_request` hands out a token that the
+  request passes back to :meth:`PanelBreaker.record`, so a request still in
+  flight from the closed state cannot close or re-open the breaker
+
+The module also keeps the last usage each user was successfully read with, so
+user screens can show it (marked as cached) while their panel is unavailable.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from .config import logger
+from .metrics import get_metrics
+
+PANEL_BREAKER_WINDOW = int(os.getenv('PANEL_BREAKER_WINDOW', '20'))
+PANEL_BREAKER_MIN_CALLS = int(os.getenv('PANEL_BREAKER_MIN_CALLS', '6'))
+PANEL_BREAKER_FAILURE_RATIO = float(os.getenv('PANEL_BREAKER_FAILURE_RATIO', '0.5'))
+PANEL_BREAKER_CONSECUTIVE = int(os.getenv('PANEL_BREAKER_CONSECUTIVE', '3'))
+PANEL_BREAKER_SLOW_SECONDS = float(os.getenv('PANEL_BREAKER_SLOW_SECONDS', '8'))
+PANEL_BREAKER_LISTING_SLOW_SECONDS = float(os.getenv('PANEL_BREAKER_LISTING_SLOW_SECONDS', '60'))
+PANEL_BREAKER_COOLDOWN = float(os.getenv('PANEL_BREAKER_COOLDOWN', '30'))
+PANEL_BREAKER_MAX_COOLDOWN = float(os.getenv('PANEL_BREAKER_MAX_COOLDOWN', '300'))
+PANEL_USAGE_CACHE_MAX = int(os.getenv('PANEL_USAGE_CACHE_MAX', '5000'))
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class PanelUnavailable(requests.ConnectionError):
+    """Raised instead of sending a request to a panel whose breaker is open"""
+
+
+# Slow threshold for requests made in the current context (None = PANEL_BREAKER_SLOW_SECONDS)
+_slow_seconds: ContextVar[Optional[float]] = ContextVar('panel_slow_seconds', default=None)
+
+
+@contextmanager
+def listing_requests():
+    """Requests made inside the block are full listings, judged against ``PANEL_BREAKER_LISTING_SLOW_SECONDS``"""
+    token = _slow_seconds.set(PANEL_BREAKER_LISTING_SLOW_SECONDS)
+    try:
+        yield
+    finally:
+        _slow_seconds.reset(token)
+
+
+def slow_request_seconds() -> float:
+    """Duration above which a successful request still counts as a failure"""
+    return _slow_seconds.get() or PANEL_BREAKER_SLOW_SECONDS
+
+
+class PanelBreaker:
+    def __init__(self, panel_id):
+        self.panel_id = panel_id
+        self.state = STATE_CLOSED
+        # True = failed, for the last PANEL_BREAKER_WINDOW requests
+        self._window: deque = deque(maxlen=max(1, PANEL_BREAKER_WINDOW))
+        self._consecutive = 0
+        self._cooldown = PANEL_BREAKER_COOLDOWN
+        self._opened_at = 0.0
+        self._probing = False
+        self.last_failure = 0.0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """False while requests would fail fast (open and cooling down, or a probe in flight)"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN:
+                return time.monotonic() - self._opened_at >= self._cooldown
+            return not self._probing
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets its probe through"""
+        if self.state != STATE_OPEN:
+            return 0.0
+        return max(0.0, self._cooldown - (time.monotonic() - self._opened_at))
+
+    def before_request(self) -> bool:
+        """Let the request through or raise :class:`PanelUnavailable`
+
+        Returns the probe token: True if this request is the half-open probe. Pass
+        it back to :meth:`record`.
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return False
+            if self.state == STATE_OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+                self._set_state(STATE_HALF_OPEN)
+            if self.state == STATE_HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        get_metrics().inc('panel_breaker_rejected_total', panel=str(self.panel_id))
+        raise PanelUnavailable(f"panel {self.panel_id} is unavailable ({self.last_error or 'circuit open'})")
+
+    def record(self, failed: bool, error: Optional[str] = None, probe: bool = False):
+        """Outcome of a request that :meth:`before_request` let through (``probe`` = its token)"""
+        with self._lock:
+            self._window.append(failed)
+            if failed:
+                self._consecutive += 1
+                self.last_failure = time.monotonic()
+                self.last_error = error
+            else:
+                self._consecutive = 0
+            if probe:
+                self._probing = False
+                if self.state == STATE_HALF_OPEN:
+                    if failed:
+                        self._cooldown = min(self._cooldown * 2, PANEL_BREAKER_MAX_COOLDOWN)
+                        self._open()
+                    else:
+                        self._cooldown = PANEL_BREAKER_COOLDOWN
+                        self._window.clear()
+                        self._set_state(STATE_CLOSED)
+                return
+            if self.state == STATE_CLOSED and failed and self._should_open():
+                self._open()
+
+    def _should_open(self) -> bool:
+        if self._consecutive >= PANEL_BREAKER_CONSECUTIVE:
+            return True
+        n = len(self._window)
+        return n >= PANEL_BREAKER_MIN_CALLS and sum(self._window) / n >= PANEL_BREAKER_FAILURE_RATIO
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set_state(STATE_OPEN)
+        logger.warning(f"panel {self.panel_id}: circuit open for {self._cooldown:.0f}s ({self.last_error})")
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            get_metrics().inc('panel_breaker_transitions_total', panel=str(self.panel_id), state=state)
+            if state == STATE_CLOSED:
+                logger.info(f"panel {self.panel_id}: circuit closed")
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            n = len(self._window)
+            return {
+                'state': self.state,
+                'failure_ratio': round(sum(self._window) / n, 2) if n else 0.0,
+                'consecutive_failures': self._consecutive,
+                'retry_in': round(self.retry_in(), 1),
+                'last_error': self.last_error,
+            }
+
+
+_breakers: Dict[str, PanelBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_panel_breaker(panel_id) -> PanelBreaker:
+    key = str(panel_id)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(key, PanelBreaker(panel_id))
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict]:
+    return {k: b.as_dict() for k, b in list(_breakers.items())}
+
+
+# (panel_id, username) -> (saved wall time, usage dict), most recently saved last
+_usage: "OrderedDict[Tuple[str, str], Tuple[float, dict]]" = OrderedDict()
+_usage_lock = threading.Lock()
+
+
+def remember_usage(panel_id, username: str, info: dict):
+    """Store a successfully read usage dict (``get_user`` result or ``lookup_users`` entry)"""
+    if not username or not isinstance(info, dict):
+        return
+    key = (str(panel_id), username)
+    with _usage_lock:
+        old = _usage.pop(key, None)
+        # A lookup entry carries fewer keys than get_user; keep the rest from before
+        merged = dict(old[1], **info) if old else dict(info)
+        _usage[key] = (time.time(), merged)
+        while len(_usage) > PANEL_USAGE_CACHE_MAX:
+            _usage.popitem(last=False)
+
+
+def last_known_usage(panel_id, username: str) -> Optional[Tuple[dict, float]]:
+    """(usage dict, saved wall time) of the last successful read, or None"""
+    hit = _usage.get((str(panel_id), username))
+    if hit is None:
+        return None
+    return dict(hit[1]), hit[0]
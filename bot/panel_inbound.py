@@ -0,0 +1,123 @@
+"""
+Parsed X-UI style inbound
+``inbound['settings']`` and ``inbound['streamSettings']`` arrive as JSON strings and
+every operation used to decode them again and scan ``clients`` linearly. A
+:class:`ParsedInbound` decodes both once per fetched inbound and indexes clients by
+email and UUID; :func:`parse_inbound` memoizes it per inbound dict, so all
+operations working on the same fetch share one parse.
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Inbound dicts kept alive alongside their parse; a handful of fetches in flight at once
+_PARSE_MEMO_SIZE = 64
+
+
+def _as_obj(value) -> dict:
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            obj = json.loads(value)
+        except ValueError:
+            return {}
+        return obj if isinstance(obj, dict) else {}
+    return {}
+
+
+def _as_int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class InboundClient:
+    """One entry of ``settings.clients``; ``raw`` is the panel's dict, for update payloads"""
+
+    __slots__ = ('email', 'uuid', 'password', 'sub_id', 'total_bytes', 'expiry_ms', 'enable', 'flow', 'raw', 'pos')
+
+    def __init__(self, raw: dict, pos: int = 0):
+        self.raw = raw
+        # Index in ParsedInbound.clients
+        self.pos = pos
+        self.email = raw.get('email') or ''
+        self.uuid = raw.get('id') or raw.get('uuid') or ''
+        self.password = raw.get('password') or ''
+        self.sub_id = raw.get('subId') or ''
+        self.total_bytes = _as_int(raw.get('totalGB'))
+        self.expiry_ms = _as_int(raw.get('expiryTime'))
+        self.enable = raw.get('enable', True)
+        self.flow = raw.get('flow') or ''
+
+
+class ParsedInbound:
+    __slots__ = ('id', 'protocol', 'port', 'remark', 'settings', 'stream', 'clients', 'by_email', 'by_uuid',
+                 'link_templates')
+
+    def __init__(self, detail: dict):
+        self.id = detail.get('id')
+        self.protocol = (detail.get('protocol') or '').lower()
+        self.port = detail.get('port') or detail.get('listen_port') or 0
+        self.remark = detail.get('remark') or detail.get('tag') or ''
+        self.settings = _as_obj(detail.get('settings'))
+        self.stream = _as_obj(detail.get('streamSettings') or detail.get('stream_settings'))
+        raw_clients = self.settings.get('clients') or []
+        if not isinstance(raw_clients, list):
+            raw_clients = []
+        self.clients: List[InboundClient] = [
+            InboundClient(c, i) for i, c in enumerate(c for c in raw_clients if isinstance(c, dict))
+        ]
+        self.by_email: Dict[str, InboundClient] = {}
+        self.by_uuid: Dict[str, InboundClient] = {}
+        for c in self.clients:
+            # First client wins, as the old linear scans returned the first match
+            if c.email and c.email not in self.by_email:
+                self.by_email[c.email] = c
+            if c.uuid and c.uuid not in self.by_uuid:
+                self.by_uuid[c.uuid] = c
+        # (dialect, host) -> compiled bot.config_links.LinkTemplate
+        self.link_templates: Dict[tuple, object] = {}
+
+    @property
+    def client_dicts(self) -> List[dict]:
+        return [c.raw for c in self.clients]
+
+    def editable_clients(self) -> List[dict]:
+        """Shallow copies of the client dicts, to modify for an update payload
+
+        The parse is shared by everyone holding the same fetch, so its dicts are never
+        modified in place; ``editable_clients()[client.pos]`` is the copy of ``client``.
+        """
+        return [dict(c.raw) for c in self.clients]
+
+    def find(self, username: Optional[str] = None, preferred_id: Optional[str] = None) -> Optional[InboundClient]:
+        """Client with UUID ``preferred_id`` if present, else the first with email ``username``"""
+        if preferred_id:
+            c = self.by_uuid.get(preferred_id)
+            if c is not None:
+                return c
+        return self.by_email.get(username) if username else None
+
+
+_memo: "OrderedDict[int, tuple]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def parse_inbound(detail: dict) -> ParsedInbound:
+    """ParsedInbound for an inbound detail dict, parsed once per dict object"""
+    key = id(detail)
+    with _memo_lock:
+        hit = _memo.get(key)
+        if hit is not None and hit[0] is detail:
+            _memo.move_to_end(key)
+            return hit[1]
+    parsed = ParsedInbound(detail)
+    with _memo_lock:
+        # Keep ``detail`` referenced so its id() cannot be reused while memoized
+        _memo[key] = (detail, parsed)
+        while len(_memo) > _PARSE_MEMO_SIZE:
+            _memo.popitem(last=False)
+    return parsed
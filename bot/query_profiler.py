@@ -0,0 +1,192 @@
+"""
+Request-scoped DB query profiler
+Opt-in (``QUERY_PROFILE=1`` or :func:`set_enabled`). Every ``query_db`` /
+``execute_db`` call made while an update is being processed is attributed to
+that update through a ContextVar; per update we keep the statement count, total
+DB time and how often each statement fingerprint repeated. A fingerprint seen
+``QUERY_N_PLUS_ONE`` or more times in one update is reported as an N+1 pattern.
+
+Nothing here imports ``bot.db`` so the DB layer can call :func:`record` cheaply.
+"""
+import os
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from .config import logger
+
+QUERY_N_PLUS_ONE = int(os.getenv('QUERY_N_PLUS_ONE', '5'))
+QUERY_PROFILE_LOG = os.getenv('QUERY_PROFILE_LOG', 'logs/query_profile.log')
+# Warn about the same (handler, statement) N+1 at most this often
+_N_PLUS_ONE_LOG_SECONDS = 600
+
+_enabled = os.getenv('QUERY_PROFILE', '0') == '1'
+_current: ContextVar[Optional['UpdateProfile']] = ContextVar('query_profile', default=None)
+
+
+class UpdateProfile:
+    """Queries issued while one update was processed"""
+
+    __slots__ = ('handler', 'started', 'count', 'seconds', 'statements')
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.count = 0
+        self.seconds = 0.0
+        # fingerprint -> [count, seconds]
+        self.statements: Dict[str, list] = {}
+
+    def add(self, stmt: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        s = self.statements.get(stmt)
+        if s is None:
+            self.statements[stmt] = [1, seconds]
+        else:
+            s[0] += 1
+            s[1] += seconds
+
+
+class HandlerQueryStats:
+    """Aggregate over every profiled update of one handler"""
+
+    __slots__ = ('handler', 'updates', 'queries', 'seconds', 'max_queries', 'n_plus_one', 'repeated')
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.updates = 0
+        self.queries = 0
+        self.seconds = 0.0
+        self.max_queries = 0
+        self.n_plus_one = 0
+        # fingerprint -> worst repeat count seen in a single update
+        self.repeated: Dict[str, int] = {}
+
+    @property
+    def avg_queries(self) -> float:
+        return self.queries / self.updates if self.updates else 0.0
+
+
+_stats: Dict[str, HandlerQueryStats] = {}
+_n_plus_one_logged: Dict[tuple, float] = {}
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = bool(enabled)
+    logger.info(f"query profiler {'enabled' if _enabled else 'disabled'}")
+
+
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def update_label(update) -> str:
+    """Initial name for an update until a handler claims it via :func:`set_handler`"""
+    cq = getattr(update, 'callback_query', None)
+    if cq is not None:
+        return 'callback:' + _DIGITS_RE.sub('#', cq.data or '')[:40]
+    msg = getattr(update, 'effective_message', None)
+    text = getattr(msg, 'text', None) or ''
+    if text.startswith('/'):
+        return text.split()[0].split('@')[0][:32]
+    return 'message' if msg is not None else 'update'
+
+
+def begin(handler: str):
+    """Start a profile for the current update; returns the token for :func:`finish`"""
+    return _current.set(UpdateProfile(handler))
+
+
+def set_handler(handler: str):
+    """Attribute the current update to ``handler`` once the dispatching handler is known"""
+    profile = _current.get()
+    if profile is not None:
+        profile.handler = handler
+
+
+def record(stmt: str, seconds: float):
+    """Called by the DB layer for every statement"""
+    profile = _current.get()
+    if profile is not None:
+        profile.add(stmt, seconds)
+
+
+def finish(token):
+    profile = _current.get()
+    _current.reset(token)
+    if profile is None or not profile.count:
+        return
+    stats = _stats.get(profile.handler)
+    if stats is None:
+        stats = _stats[profile.handler] = HandlerQueryStats(profile.handler)
+    stats.updates += 1
+    stats.queries += profile.count
+    stats.seconds += profile.seconds
+    stats.max_queries = max(stats.max_queries, profile.count)
+    try:
+        from .performance_optimizer import get_query_optimizer
+        optimizer = get_query_optimizer()
+    except Exception:
+        optimizer = None
+    now = time.monotonic()
+    for stmt, (count, seconds) in profile.statements.items():
+        if optimizer is not None:
+            optimizer.track_query(stmt, seconds / count)
+        if count < QUERY_N_PLUS_ONE:
+            continue
+        stats.n_plus_one += 1
+        if count > stats.repeated.get(stmt, 0):
+            stats.repeated[stmt] = count
+        key = (profile.handler, stmt)
+        if now - _n_plus_one_logged.get(key, -_N_PLUS_ONE_LOG_SECONDS) >= _N_PLUS_ONE_LOG_SECONDS:
+            _n_plus_one_logged[key] = now
+            logger.warning(f"N+1 suspect in {profile.handler}: {count}x {stmt}")
+
+
+def top_offenders(limit: int = 10) -> List[HandlerQueryStats]:
+    """Handlers ordered by N+1 occurrences, then by average queries per update"""
+    return sorted(_stats.values(), key=lambda s: (s.n_plus_one, s.avg_queries), reverse=True)[:limit]
+
+
+def reset():
+    _stats.clear()
+    _n_plus_one_logged.clear()
+
+
+def report_lines(limit: int = 10) -> List[str]:
+    lines = []
+    for s in top_offenders(limit):
+        lines.append(
+            f"{s.handler}: updates={s.updates} avg_queries={s.avg_queries:.1f} max={s.max_queries} "
+            f"db_ms={s.seconds * 1000:.0f} n_plus_one={s.n_plus_one}"
+        )
+        for stmt, count in sorted(s.repeated.items(), key=lambda kv: kv[1], reverse=True)[:3]:
+            lines.append(f"    {count}x {stmt}")
+    return lines
+
+
+def write_report(path: str = QUERY_PROFILE_LOG, limit: int = 25) -> int:
+    """Append the top-offenders report to ``path``; returns the number of handlers written"""
+    lines = report_lines(limit)
+    if not lines:
+        return 0
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write('\n'.join(lines) + '\n')
+    return min(limit, len(_stats))
+
+
+async def query_profile_report_job(context):
+    if not _enabled:
+        return
+    try:
+        write_report()
+    except Exception as e:
+        logger.error(f"query profile report failed: {e}")
@@ -11,6 +11,7 @@ from functools import wraps
 from telegram import Update
 from telegram.ext import ContextTypes
 from .db import execute_db, query_db
+from .migrations import ensure_schema
 from .advanced_logging import get_advanced_logger
 
 
@@ -27,64 +28,8 @@ class RateLimiter:
         self._load_banned_users()
     
     def _create_tables(self):
-        """Create rate limiting tables"""
-        try:
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS rate_limit_violations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    violation_type TEXT,
-                    endpoint TEXT,
-                    severity TEXT,
-                    action_taken TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS spam_patterns (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pattern TEXT NOT NULL,
-                    pattern_type TEXT,
-                    confidence REAL,
-                    last_seen TEXT,
-                    occurrences INTEGER DEFAULT 1
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS rate_limit_config (
-                    endpoint TEXT PRIMARY KEY,
-                    requests_per_minute INTEGER DEFAULT 30,
-                    burst_limit INTEGER DEFAULT 5,
-                    cooldown_seconds INTEGER DEFAULT 60,
-                    auto_ban_threshold INTEGER DEFAULT 3
-                )
-            """)
-            
-            # Default configurations
-            self._init_default_limits()
-            
-        except Exception as e:
-            self.logger.log_error(e, "rate_limiter_init")
-    
-    def _init_default_limits(self):
-        """Initialize default rate limits for different endpoints"""
-        defaults = [
-            ('start', 10, 3, 30, 5),
-            ('admin', 60, 10, 10, 10),
-            ('purchase', 5, 2, 120, 3),
-            ('wallet', 20, 5, 60, 5),
-            ('support', 10, 3, 60, 5),
-            ('default', 30, 5, 30, 5)
-        ]
-        
-        for endpoint, rpm, burst, cooldown, ban_threshold in defaults:
-            execute_db("""
-                INSERT OR IGNORE INTO rate_limit_config 
-                (endpoint, requests_per_minute, burst_limit, cooldown_seconds, auto_ban_threshold)
-                VALUES (?, ?, ?, ?, ?)
-            """, (endpoint, rpm, burst, cooldown, ban_threshold))
+        """Tables and default limits are owned by bot.migrations; this is a single version check"""
+        ensure_schema()
     
     def _load_banned_users(self):
         """Load banned users from database"""
@@ -14,6 +14,7 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2
 import jwt
 from .db import execute_db, query_db
+from .migrations import ensure_schema
 from .advanced_logging import get_advanced_logger
 from .config import logger
 
@@ -30,72 +31,8 @@ class SecurityManager:
         self.threat_patterns = self._load_threat_patterns()
     
     def _create_tables(self):
-        """Create security-related tables"""
-        try:
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS security_keys (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    key_type TEXT NOT NULL,
-                    key_value TEXT NOT NULL,
-                    created_at TEXT,
-                    expires_at TEXT,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS security_audit (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    event_type TEXT,
-                    user_id INTEGER,
-                    ip_address TEXT,
-                    action TEXT,
-                    result TEXT,
-                    risk_level TEXT,
-                    details TEXT
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS threat_detections (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    threat_type TEXT,
-                    severity TEXT,
-                    source TEXT,
-                    user_id INTEGER,
-                    action_taken TEXT,
-                    blocked BOOLEAN DEFAULT 0
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS api_tokens (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    token_hash TEXT UNIQUE NOT NULL,
-                    user_id INTEGER,
-                    name TEXT,
-                    permissions TEXT,
-                    created_at TEXT,
-                    last_used TEXT,
-                    expires_at TEXT,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            """)
-            
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS ip_blacklist (
-                    ip_address TEXT PRIMARY KEY,
-                    reason TEXT,
-                    added_at TEXT,
-                    expires_at TEXT,
-                    permanent BOOLEAN DEFAULT 0
-                )
-            """)
-            
-        except Exception as e:
-            logger.error(f"Failed to create security tables: {e}")
+        """Tables are owned by bot.migrations; this is a single version check"""
+        ensure_schema()
     
     def _get_or_create_key(self) -> bytes:
         """Get or create master encryption key"""
@@ -0,0 +1,148 @@
+"""
+Settings snapshot
+The whole ``settings`` table is held in memory as one dict that is swapped
+atomically; readers do a plain dict lookup instead of a query per key.
+
+Writes go through :func:`set_setting` / :func:`set_settings`, which persist and
+publish a new snapshot immediately. Writes that still use ``execute_db``
+directly bump ``db.get_settings_version()`` and trigger a reload on the next
+read; ``SETTINGS_SNAPSHOT_TTL`` bounds staleness for other processes.
+"""
+import os
+import sqlite3
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+
+from .config import logger
+from .db import execute_db, get_settings_version, query_db
+
+SETTINGS_SNAPSHOT_TTL = int(os.getenv('SETTINGS_SNAPSHOT_TTL', '300'))
+# After a failed reload, readers keep the previous snapshot this long before the next attempt
+SETTINGS_RETRY_SECONDS = 5.0
+
+_TRUE = frozenset(('1', 'true', 'yes', 'on'))
+
+
+class SettingsSnapshot:
+    """Read-mostly view of the settings table"""
+
+    def __init__(self):
+        self._data: Mapping[str, Optional[str]] = MappingProxyType({})
+        self._version = -1
+        self._loaded_at = 0.0
+        self._failed_at = 0.0
+        self._failed_version = -1
+        self._write_lock = threading.Lock()
+        self.loads = 0
+
+    def _load(self) -> bool:
+        version = get_settings_version()
+        try:
+            rows = query_db("SELECT key, value FROM settings", strict=True)
+        except sqlite3.Error as e:
+            # Keep serving the previous snapshot; an empty one would turn every toggle off
+            self._failed_at = time.monotonic()
+            self._failed_version = version
+            logger.warning(f"settings snapshot reload failed, keeping {len(self._data)} cached keys: {e}")
+            return False
+        self._data = MappingProxyType({r['key']: r['value'] for r in rows})
+        self._version = version
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        return True
+
+    def _current(self) -> Mapping[str, Optional[str]]:
+        now = time.monotonic()
+        version = get_settings_version()
+        if version != self._version or now - self._loaded_at > SETTINGS_SNAPSHOT_TTL:
+            # A write since the failed attempt means the table is reachable again
+            if now - self._failed_at >= SETTINGS_RETRY_SECONDS or version != self._failed_version:
+                self._load()
+        return self._data
+
+    # ── reads ─────────────────────────────────────────────────────────
+    def snapshot(self) -> Mapping[str, Optional[str]]:
+        """Immutable mapping of every setting; safe to keep for the duration of an update"""
+        return self._current()
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        value = self._current().get(key)
+        return default if value is None else value
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self._current().get(key)
+        if value is None or value == '':
+            return default
+        return str(value).strip().lower() in _TRUE
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        try:
+            return int(str(self._current().get(key)).strip())
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        try:
+            return float(str(self._current().get(key)).strip())
+        except (TypeError, ValueError):
+            return default
+
+    # ── writes ────────────────────────────────────────────────────────
+    def set_many(self, values: Dict[str, Optional[str]]):
+        """Upsert ``values`` and publish a new snapshot containing them"""
+        if not values:
+            return
+        values = {k: (None if v is None else str(v)) for k, v in values.items()}
+        with self._write_lock:
+            base = self._current()
+            expected = self._version + len(values)
+            for key, value in values.items():
+                execute_db(
+                    "INSERT INTO settings (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, value),
+                )
+            if get_settings_version() != expected:
+                # A write failed or someone else wrote meanwhile: take the table as truth
+                self._load()
+                return
+            data = dict(base)
+            data.update(values)
+            self._data = MappingProxyType(data)
+            self._version = expected
+
+    def set(self, key: str, value: Optional[str]):
+        self.set_many({key: value})
+
+    def reload(self):
+        if self._load():
+            logger.debug(f"settings snapshot reloaded ({len(self._data)} keys)")
+
+
+_settings: Optional[SettingsSnapshot] = None
+
+
+def get_settings() -> SettingsSnapshot:
+    global _settings
+    if _settings is None:
+        _settings = SettingsSnapshot()
+    return _settings
+
+
+def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
+    return get_settings().get(key, default)
+
+
+def settings_snapshot() -> Mapping[str, Optional[str]]:
+    return get_settings().snapshot()
+
+
+def set_setting(key: str, value: Optional[str]):
+    """Single write path for settings; readers see the new value immediately"""
+    get_settings().set(key, value)
+
+
+def set_settings(values: Dict[str, Optional[str]]):
+    get_settings().set_many(values)
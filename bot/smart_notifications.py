@@ -150,20 +150,44 @@ class SmartNotification:
     @staticmethod
     async def check_low_traffic(bot: Bot):
         """بررسی سرویس‌های با حجم کم"""
-        # سرویس‌هایی که کمتر از 1GB حجم دارند
-        services = query_db("""
-            SELECT o.user_id, o.id as order_id, u.first_name, 
-                   p.name as plan_name, o.remaining_traffic_gb
+        # سرویس‌هایی که حجم باقیمانده‌شان تازه به کمتر از 1GB رسیده (از اسنپ‌شات مصرف پنل)
+        # notified_low_traffic keeps it to one alert per service, also across restarts
+        from .usage_snapshot import GB, UsageThresholds, get_usage_collector
+        rows = query_db("""
+            SELECT o.user_id, o.id as order_id, o.panel_id, o.marzban_username,
+                   o.notified_low_traffic, u.first_name, p.name as plan_name
             FROM orders o
             JOIN users u ON o.user_id = u.user_id
             JOIN plans p ON o.plan_id = p.id
-            WHERE o.remaining_traffic_gb < 1.0
-            AND o.remaining_traffic_gb > 0
-            AND o.status = 'active'
+            WHERE o.status = 'approved'
+            AND o.marzban_username IS NOT NULL
+            AND o.panel_id IS NOT NULL
         """) or []
+        by_panel = {}
+        for r in rows:
+            by_panel.setdefault(r['panel_id'], []).append(r)
+        collector = get_usage_collector()
+        thresholds = UsageThresholds(remaining_bytes=(GB,))
+        services = []
+        for panel_id, panel_rows in by_panel.items():
+            snap = await collector.collect(panel_id, [r['marzban_username'] for r in panel_rows])
+            if snap is None:
+                continue
+            crossed = set(collector.diff('smart_low_traffic', snap, thresholds).crossed)
+            for r in panel_rows:
+                usage = snap.row(r['marzban_username']) if r['marzban_username'] in crossed else None
+                if not usage or usage['data_limit'] <= 0:
+                    continue
+                remaining = usage['data_limit'] - usage['used_traffic']
+                if 0 < remaining < GB:
+                    if not r.get('notified_low_traffic'):
+                        services.append(dict(r, remaining_bytes=remaining))
+                elif r.get('notified_low_traffic'):
+                    # Back above the threshold (renewed / more traffic): alert again next time
+                    execute_db("UPDATE orders SET notified_low_traffic = 0 WHERE id = ?", (r['order_id'],))
         
         for service in services:
-            traffic_mb = int(service['remaining_traffic_gb'] * 1024)
+            traffic_mb = int(service['remaining_bytes'] / (1024 ** 2))
             
             message = f"""
 📊 <b>هشدار حجم کم</b>
@@ -178,12 +202,13 @@ class SmartNotification:
 
 🎁 پیشنهاد ویژه: 20% تخفیف برای خرید حجم!
 """
-            await SmartNotification.send_notification(
+            if await SmartNotification.send_notification(
                 bot, 
                 service['user_id'], 
                 'traffic_low', 
                 message
-            )
+            ):
+                execute_db("UPDATE orders SET notified_low_traffic = 1 WHERE id = ?", (service['order_id'],))
     
     @staticmethod
     async def send_special_offer(bot: Bot, user_ids: List[int], offer_text: str):
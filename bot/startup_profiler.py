@@ -0,0 +1,109 @@
+"""
+Startup profiler
+Records the wall time of boot phases and logs a report once the bot is up
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from .config import logger
+
+# Set BOOT_PROFILE=1 to get the report at WARNING level (visible with the default LOG_LEVEL)
+BOOT_PROFILE = (os.getenv('BOOT_PROFILE') or '').lower() in ('1', 'true', 'yes')
+
+_BOOT_T0 = time.perf_counter()
+_phases: List[Tuple[str, float]] = []
+_import_times: Dict[str, float] = {}
+IMPORT_REPORT_TOP = int(os.getenv('BOOT_PROFILE_TOP', '15'))
+
+
+@contextmanager
+def boot_phase(name: str):
+    """Time a block of startup work: ``with boot_phase('db_setup'): ...``"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - t0))
+
+
+def record_phase(name: str, seconds: float):
+    _phases.append((name, seconds))
+
+
+def get_phases() -> List[Tuple[str, float]]:
+    return list(_phases)
+
+
+class _TimedLoader:
+    """Loader proxy that records how long a module body takes to execute (inclusive of its imports)"""
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        t0 = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            _import_times[module.__name__] = time.perf_counter() - t0
+
+
+class _ImportTimer:
+    """Meta path finder that wraps loaders of ``prefix.*`` modules in :class:`_TimedLoader`"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not (fullname == self.prefix or fullname.startswith(self.prefix + '.')):
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+def install_import_timer(prefix: str = 'bot'):
+    """Start timing imports of ``prefix`` modules (idempotent)"""
+    if not any(isinstance(f, _ImportTimer) for f in sys.meta_path):
+        sys.meta_path.insert(0, _ImportTimer(prefix))
+
+
+def get_import_times() -> Dict[str, float]:
+    return dict(_import_times)
+
+
+def boot_report() -> str:
+    total = time.perf_counter() - _BOOT_T0
+    lines = ["Boot phases:"]
+    for name, secs in _phases:
+        lines.append(f"  {name:<32} {secs * 1000:9.1f} ms")
+    lines.append(f"  {'total since bot import':<32} {total * 1000:9.1f} ms")
+    if _import_times:
+        lines.append(f"Slowest module imports (inclusive, top {IMPORT_REPORT_TOP}):")
+        slowest = sorted(_import_times.items(), key=lambda kv: kv[1], reverse=True)[:IMPORT_REPORT_TOP]
+        for name, secs in slowest:
+            lines.append(f"  {name:<48} {secs * 1000:9.1f} ms")
+    return "\n".join(lines)
+
+
+def log_boot_report():
+    text = boot_report()
+    if BOOT_PROFILE:
+        logger.warning(text)
+    else:
+        logger.info(text)
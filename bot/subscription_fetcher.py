@@ -0,0 +1,158 @@
+"""
+Async subscription-link fetcher
+One place that downloads a subscription URL and turns it into config URIs:
+* per-URL cache; entries younger than ``SUBSCRIPTION_CACHE_TTL`` are served as is,
+  older ones are revalidated with If-None-Match / If-Modified-Since when the
+  server sent an ETag / Last-Modified (a 304 costs no body)
+* concurrent requests for the same URL share one in-flight fetch
+* at most ``SUBSCRIPTION_FETCH_CONCURRENCY`` downloads at a time
+* download, base64 decoding and parsing run in a worker thread, off the event loop
+"""
+import asyncio
+import base64
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import requests
+
+from .config import logger
+from .metrics import get_metrics
+
+SUBSCRIPTION_CACHE_TTL = float(os.getenv('SUBSCRIPTION_CACHE_TTL', '30'))
+SUBSCRIPTION_CACHE_MAX = int(os.getenv('SUBSCRIPTION_CACHE_MAX', '512'))
+SUBSCRIPTION_FETCH_CONCURRENCY = int(os.getenv('SUBSCRIPTION_FETCH_CONCURRENCY', '8'))
+
+CONFIG_SCHEMES = ("vmess://", "vless://", "trojan://", "ss://", "hy2://")
+_HEADERS = {
+    'Accept': 'text/plain, application/octet-stream, */*',
+    'User-Agent': 'Mozilla/5.0',
+}
+
+
+def parse_subscription(raw: str) -> List[str]:
+    """Config URIs from a plain-text or base64-encoded subscription body"""
+    raw = (raw or '').strip()
+    if any(proto in raw for proto in CONFIG_SCHEMES):
+        text = raw
+    else:
+        compact = "".join(raw.split())
+        pad = len(compact) % 4
+        if pad:
+            compact += "=" * (4 - pad)
+        try:
+            text = base64.b64decode(compact, validate=False).decode('utf-8', errors='ignore')
+        except Exception:
+            text = raw
+    lines = (ln.strip() for ln in text.splitlines())
+    return [ln for ln in lines if ln.startswith(CONFIG_SCHEMES)]
+
+
+class _Entry:
+    __slots__ = ('configs', 'etag', 'last_modified', 'fetched_at')
+
+    def __init__(self, configs: List[str], etag: Optional[str], last_modified: Optional[str]):
+        self.configs = configs
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+
+
+class SubscriptionFetcher:
+    def __init__(self, ttl: float = SUBSCRIPTION_CACHE_TTL, max_entries: int = SUBSCRIPTION_CACHE_MAX,
+                 concurrency: int = SUBSCRIPTION_FETCH_CONCURRENCY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.concurrency = max(1, concurrency)
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.coalesced = 0
+
+    def _download(self, url: str, timeout: float, entry: Optional[_Entry]) -> _Entry:
+        """Blocking part, run in a worker thread"""
+        headers = dict(_HEADERS)
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        resp = requests.get(url, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            entry.fetched_at = time.monotonic()
+            return entry
+        resp.raise_for_status()
+        self.downloads += 1
+        return _Entry(parse_subscription(resp.text), resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+
+    async def _fetch(self, url: str, timeout: float) -> List[str]:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        t0 = time.perf_counter()
+        try:
+            async with self._sem:
+                entry = await asyncio.to_thread(self._download, url, timeout, self._cache.get(url))
+        except Exception as e:
+            logger.error(f"Failed to fetch/parse subscription from {url}: {e}")
+            return []
+        finally:
+            get_metrics().observe('subscription_fetch_seconds', time.perf_counter() - t0)
+        self._cache[url] = entry
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return entry.configs
+
+    async def fetch(self, url: str, timeout: float = 15, max_age: Optional[float] = None) -> List[str]:
+        """Config URIs of ``url``; ``max_age=0`` forces revalidation (e.g. right after a key change)"""
+        if not url:
+            return []
+        max_age = self.ttl if max_age is None else max_age
+        entry = self._cache.get(url)
+        if entry is not None and time.monotonic() - entry.fetched_at < max_age:
+            self.hits += 1
+            return list(entry.configs)
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url, timeout))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _t, u=url: self._inflight.pop(u, None))
+        else:
+            self.coalesced += 1
+        # Shielded: one caller giving up does not cancel the fetch the others wait on
+        return list(await asyncio.shield(task))
+
+    def invalidate(self, url: Optional[str] = None):
+        if url is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(url, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._cache),
+            'inflight': len(self._inflight),
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'downloads': self.downloads,
+            'coalesced': self.coalesced,
+        }
+
+
+_fetcher: Optional[SubscriptionFetcher] = None
+
+
+def get_subscription_fetcher() -> SubscriptionFetcher:
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = SubscriptionFetcher()
+    return _fetcher
+
+
+async def fetch_subscription_configs(sub_url: str, timeout_seconds: float = 15, max_age: Optional[float] = None) -> List[str]:
+    return await get_subscription_fetcher().fetch(sub_url, timeout_seconds, max_age)
@@ -0,0 +1,288 @@
+"""
+Columnar usage snapshots per panel
+The notification and expiry jobs used to fetch usage each in their own way
+(bulk listing here, per-user ``get_user`` there) and re-check every service
+on every run. :class:`UsageCollector` gathers one normalized snapshot per panel
+through ``lookup_users`` (which already picks the cheapest request pattern for
+the panel type) and keeps it in parallel arrays:
+
+    usernames  list            index  {username: row}
+    used       array('q')      limit  array('q')   bytes, 0 = unlimited
+    expire     array('q')      unix seconds, 0 = never
+    enabled    bytearray
+
+Each job ("consumer") describes what it cares about as :class:`UsageThresholds`;
+every row is reduced to a small band per threshold kind (how many usage /
+remaining / days-left thresholds it has reached). :meth:`UsageCollector.diff`
+compares the bands with the consumer's previous snapshot and reports only the
+users whose band changed, so a job handles a service once when it crosses a
+threshold instead of on every run. Baselines live in memory: after a restart the
+first diff (``UsageDiff.first``) reports everyone already past a threshold, and a
+user who dropped out of a lookup is reported again when they come back. A
+consumer that must not repeat a message keeps its own persistent per-order flag
+(``notified_traffic_80`` / ``notified_expiry_1d`` / ``notified_low_traffic``,
+``last_traffic_alert_date``) and treats a crossing as "look at this row again".
+"""
+import asyncio
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config import logger
+from .metrics import get_metrics
+from .panel_health import get_panel_breaker
+
+# A snapshot younger than this is shared by jobs running close together
+USAGE_SNAPSHOT_TTL = float(os.getenv('USAGE_SNAPSHOT_TTL', '60'))
+USAGE_COLLECT_TIMEOUT = float(os.getenv('USAGE_COLLECT_TIMEOUT', '120'))
+
+GB = 1024 ** 3
+
+
+class UsageSnapshot:
+    """Usage of a set of users on one panel at ``taken_at`` (unix seconds)"""
+
+    __slots__ = ('panel_id', 'taken_at', 'usernames', 'index', 'used', 'limit', 'expire', 'enabled')
+
+    def __init__(self, panel_id, taken_at: Optional[float] = None):
+        self.panel_id = panel_id
+        self.taken_at = int(taken_at if taken_at is not None else time.time())
+        self.usernames: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.used = array('q')
+        self.limit = array('q')
+        self.expire = array('q')
+        self.enabled = bytearray()
+
+    @classmethod
+    def from_entries(cls, panel_id, entries: Iterable[dict], taken_at: Optional[float] = None) -> 'UsageSnapshot':
+        """Build from ``lookup_users`` entries (username, used_traffic, data_limit, expire, enabled)"""
+        snap = cls(panel_id, taken_at)
+        for e in entries:
+            name = e.get('username')
+            if not name or name in snap.index:
+                continue
+            snap.index[name] = len(snap.usernames)
+            snap.usernames.append(name)
+            snap.used.append(max(0, int(e.get('used_traffic') or 0)))
+            snap.limit.append(max(0, int(e.get('data_limit') or 0)))
+            snap.expire.append(max(0, int(e.get('expire') or 0)))
+            snap.enabled.append(0 if e.get('enabled') is False else 1)
+        return snap
+
+    def __len__(self) -> int:
+        return len(self.usernames)
+
+    def __contains__(self, username) -> bool:
+        return username in self.index
+
+    def covers(self, usernames: Iterable[str]) -> bool:
+        return all(u in self.index for u in usernames)
+
+    def row(self, username: str) -> Optional[dict]:
+        """One user in the ``lookup_users`` / ``get_user`` shape"""
+        i = self.index.get(username)
+        if i is None:
+            return None
+        return {
+            'username': username,
+            'used_traffic': self.used[i],
+            'data_limit': self.limit[i],
+            'expire': self.expire[i],
+            'enabled': bool(self.enabled[i]),
+        }
+
+    def expired_before(self, ts: float) -> List[str]:
+        """Users whose (non-zero) expiry lies before ``ts``"""
+        exp = self.expire
+        return [u for i, u in enumerate(self.usernames) if 0 < exp[i] < ts]
+
+
+class UsageBands:
+    """Per-row threshold bands of one snapshot, columnar like the snapshot itself"""
+
+    __slots__ = ('usage', 'remaining', 'expiry', 'enabled')
+
+    def __init__(self, usage: array, remaining: array, expiry: array, enabled: bytearray):
+        self.usage = usage
+        self.remaining = remaining
+        self.expiry = expiry
+        self.enabled = enabled
+
+    def at(self, i: int) -> Tuple[int, int, int, int]:
+        return self.usage[i], self.remaining[i], self.expiry[i], self.enabled[i]
+
+
+class UsageThresholds:
+    """What a consumer reacts to
+
+    ``usage_percent``: used/limit percentages (80, 95); ``remaining_bytes``: bytes left
+    on the limit; ``expiry_days``: whole days left (``(expire - now) // 86400``, so 0
+    means under 24 hours). Expired services get a band beyond the last expiry
+    threshold, and enabling/disabling on the panel always counts as a crossing.
+    """
+
+    __slots__ = ('usage_percent', 'remaining_bytes', 'expiry_days')
+
+    def __init__(self, usage_percent: Iterable[float] = (), remaining_bytes: Iterable[float] = (),
+                 expiry_days: Iterable[int] = ()):
+        self.usage_percent = tuple(sorted(usage_percent))
+        self.remaining_bytes = tuple(sorted(remaining_bytes))
+        self.expiry_days = tuple(sorted(expiry_days))
+
+    def key(self) -> tuple:
+        return self.usage_percent, self.remaining_bytes, self.expiry_days
+
+    def bands(self, snap: UsageSnapshot) -> UsageBands:
+        n = len(snap)
+        usage = array('h', bytes(2 * n))
+        remaining = array('h', bytes(2 * n))
+        expiry = array('h', bytes(2 * n))
+        up, rb, ed = self.usage_percent, self.remaining_bytes, self.expiry_days
+        expired_band = len(ed) + 1
+        now = snap.taken_at
+        used, limit, expire = snap.used, snap.limit, snap.expire
+        for i in range(n):
+            lim = limit[i]
+            if lim > 0:
+                if up:
+                    # Number of percentage thresholds reached
+                    usage[i] = bisect_right(up, used[i] * 100.0 / lim)
+                if rb:
+                    # Number of remaining-bytes thresholds undercut
+                    remaining[i] = len(rb) - bisect_left(rb, max(0, lim - used[i]))
+            exp = expire[i]
+            if exp > 0 and ed:
+                left = exp - now
+                expiry[i] = expired_band if left < 0 else len(ed) - bisect_left(ed, left // 86400)
+        return UsageBands(usage, remaining, expiry, bytearray(snap.enabled))
+
+
+class UsageDiff:
+    """Result of comparing a snapshot with a consumer's previous one"""
+
+    __slots__ = ('snapshot', 'added', 'removed', 'changed', 'crossed', 'first')
+
+    def __init__(self, snapshot: UsageSnapshot, first: bool):
+        self.snapshot = snapshot
+        # No previous snapshot for this consumer/panel (first run since start)
+        self.first = first
+        self.added: List[str] = []
+        self.removed: List[str] = []
+        # Any column differs
+        self.changed: List[str] = []
+        # Some threshold band differs: what the consumer has to look at
+        self.crossed: List[str] = []
+
+
+class UsageCollector:
+    def __init__(self, ttl: float = USAGE_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._snapshots: Dict[str, UsageSnapshot] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # (consumer, panel) -> (thresholds key, snapshot, bands)
+        self._baselines: Dict[Tuple[str, str], tuple] = {}
+
+    def _fetch(self, panel_id, usernames: List[str]) -> Optional[UsageSnapshot]:
+        """Blocking part, run in a worker thread"""
+        from .panel import VpnPanelAPI
+        api = VpnPanelAPI(panel_id=panel_id)
+        t0 = time.monotonic()
+        found = api.lookup_users(usernames)
+        # Nothing came back and the panel failed meanwhile: no snapshot rather than an empty
+        # one, which would read as every user having been removed
+        if not found and usernames and get_panel_breaker(panel_id).last_failure >= t0:
+            return None
+        return UsageSnapshot.from_entries(panel_id, found.values())
+
+    async def collect(self, panel_id, usernames: Iterable[str]) -> Optional[UsageSnapshot]:
+        """Snapshot of ``usernames`` on a panel; None if the panel could not be read"""
+        key = str(panel_id)
+        names = list(dict.fromkeys(u for u in usernames if u))
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            snap = self._snapshots.get(key)
+            if snap is not None and time.time() - snap.taken_at < self.ttl and snap.covers(names):
+                return snap
+            if not get_panel_breaker(panel_id).available:
+                logger.warning(f"usage collector: panel {panel_id} unavailable, skipping")
+                return None
+            t0 = time.perf_counter()
+            try:
+                snap = await asyncio.wait_for(asyncio.to_thread(self._fetch, panel_id, names), USAGE_COLLECT_TIMEOUT)
+            except Exception as e:
+                logger.error(f"usage collector: panel {panel_id} failed: {e}")
+                return None
+            finally:
+                get_metrics().observe('usage_collect_seconds', time.perf_counter() - t0, panel=key)
+            if snap is None:
+                logger.warning(f"usage collector: panel {panel_id} returned no usage")
+                return None
+            self._snapshots[key] = snap
+            get_metrics().inc('usage_snapshot_rows_total', len(snap), panel=key)
+            return snap
+
+    def diff(self, consumer: str, snap: UsageSnapshot, thresholds: UsageThresholds) -> UsageDiff:
+        """Users of ``snap`` whose bands moved since ``consumer``'s last diff; ``snap`` becomes the new baseline"""
+        bkey = (consumer, str(snap.panel_id))
+        bands = thresholds.bands(snap)
+        prev = self._baselines.get(bkey)
+        # Baseline taken with other thresholds (settings changed): compare from scratch
+        if prev is not None and prev[0] != thresholds.key():
+            prev = None
+        out = UsageDiff(snap, first=prev is None)
+        if prev is None:
+            for i, u in enumerate(snap.usernames):
+                out.added.append(u)
+                b = bands.at(i)
+                if b[0] or b[1] or b[2] or not b[3]:
+                    out.crossed.append(u)
+        else:
+            _, psnap, pbands = prev
+            pindex = psnap.index
+            for i, u in enumerate(snap.usernames):
+                j = pindex.get(u)
+                if j is None:
+                    out.added.append(u)
+                    out.crossed.append(u)
+                    continue
+                if snap.used[i] != psnap.used[j] or snap.limit[i] != psnap.limit[j] \
+                        or snap.expire[i] != psnap.expire[j] or snap.enabled[i] != psnap.enabled[j]:
+                    out.changed.append(u)
+                if bands.at(i) != pbands.at(j):
+                    out.crossed.append(u)
+            out.removed = [u for u in psnap.usernames if u not in snap.index]
+        self._baselines[bkey] = (thresholds.key(), snap, bands)
+        get_metrics().inc('usage_diff_crossed_total', len(out.crossed), consumer=consumer)
+        return out
+
+    def retry_later(self, consumer: str, panel_id, usernames: Iterable[str]):
+        """Report ``usernames`` again in the next diff (e.g. their notification failed to send)"""
+        base = self._baselines.get((consumer, str(panel_id)))
+        if base is None:
+            return
+        _, snap, bands = base
+        for u in usernames:
+            i = snap.index.get(u)
+            if i is not None:
+                # A band no real state has, so the next comparison differs
+                bands.expiry[i] = -1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'panels': len(self._snapshots),
+            'rows': sum(len(s) for s in self._snapshots.values()),
+            'baselines': len(self._baselines),
+        }
+
+
+_collector: Optional[UsageCollector] = None
+
+
+def get_usage_collector() -> UsageCollector:
+    global _collector
+    if _collector is None:
+        _collector = UsageCollector()
+    return _collector
@@ -1,6 +1,7 @@
 from datetime import datetime
 from telegram import User, Update
 from .db import query_db, execute_db
+from .settings_store import settings_snapshot
 from .config import logger
 from telegram.constants import ParseMode
 
@@ -32,7 +33,7 @@ async def register_new_user(user: User, update: Update = None, referrer_hint: in
 			)
 		logger.info(f"Registered new user {user.id} ({user.first_name}), ref={referrer_id}")
 		# Signup bonus: credit wallet once for first-time users
-		settings = {s['key']: s['value'] for s in query_db("SELECT key, value FROM settings")}
+		settings = settings_snapshot()
 		if settings.get('signup_bonus_enabled', '0') == '1':
 			try:
 				amount = int((settings.get('signup_bonus_amount') or '0') or 0)
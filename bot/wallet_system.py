@@ -9,6 +9,7 @@ from decimal import Decimal
 
 from .db import query_db, execute_db
 from .config import logger
+from .migrations import ensure_schema
 
 
 class WalletError(Exception):
@@ -21,58 +22,10 @@ class WalletSystem:
     
     @staticmethod
     def setup_tables():
-        """ساخت جداول کیف پول"""
+        """ساخت جداول کیف پول (از طریق bot.migrations)"""
         try:
-            # جدول کیف پول کاربران
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS user_wallets (
-                    user_id INTEGER PRIMARY KEY,
-                    balance INTEGER DEFAULT 0,
-                    total_deposited INTEGER DEFAULT 0,
-                    total_spent INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # ایندکس برای کارایی بهتر
-            execute_db("""
-                CREATE INDEX IF NOT EXISTS idx_wallet_balance 
-                ON user_wallets(balance)
-            """)
-            
-            # جدول تراکنش‌ها
-            execute_db("""
-                CREATE TABLE IF NOT EXISTS wallet_transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    amount INTEGER NOT NULL,
-                    direction TEXT NOT NULL CHECK(direction IN ('credit', 'debit')),
-                    method TEXT,
-                    status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'approved', 'rejected', 'cancelled')),
-                    reference TEXT,
-                    description TEXT,
-                    admin_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # ایندکس‌های تراکنش
-            execute_db("""
-                CREATE INDEX IF NOT EXISTS idx_tx_user 
-                ON wallet_transactions(user_id, created_at DESC)
-            """)
-            execute_db("""
-                CREATE INDEX IF NOT EXISTS idx_tx_status 
-                ON wallet_transactions(status, created_at DESC)
-            """)
-            
-            logger.info("✅ Wallet system tables created")
+            ensure_schema()
             return True
-            
         except Exception as e:
             logger.error(f"❌ Error creating wallet tables: {e}")
             return False
@@ -0,0 +1,141 @@
+"""
+Bounded write-behind queue
+Moves non-critical SQLite writes (logs, counters, learning data) off the
+request path. Items are drained by a daemon thread and written in batches;
+under overload low-value items are sampled and, when the queue is full, dropped.
+"""
+import atexit
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .config import logger
+from .metrics import get_metrics
+
+_queues: Dict[str, 'WriteQueue'] = {}
+
+
+class WriteQueue:
+    """``submit`` never blocks; ``flush_fn(batch)`` runs on the writer thread"""
+
+    def __init__(self,
+                 name: str,
+                 flush_fn: Callable[[List], None],
+                 maxsize: int = 5000,
+                 batch_size: int = 200,
+                 flush_interval: float = 2.0,
+                 sample_above: float = 0.75,
+                 sample_every: int = 10):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_above = int(maxsize * sample_above)
+        self.sample_every = max(1, sample_every)
+        self._q: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._sample_tick = 0
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.failed_batches = 0
+        _queues[name] = self
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"writeq-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, item, droppable: bool = True) -> bool:
+        """Queue ``item``; returns False if it was sampled out or dropped"""
+        depth = self._q.qsize()
+        if droppable and depth >= self.sample_above:
+            self._sample_tick += 1
+            if self._sample_tick % self.sample_every:
+                self.sampled_out += 1
+                get_metrics().inc('write_queue_sampled_out_total', queue=self.name)
+                return False
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            get_metrics().inc('write_queue_dropped_total', queue=self.name)
+            return False
+        self.enqueued += 1
+        self._ensure_thread()
+        return True
+
+    def _take_batch(self, timeout: Optional[float]) -> List:
+        batch = []
+        try:
+            batch.append(self._q.get(timeout=timeout) if timeout else self._q.get_nowait())
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List):
+        if not batch:
+            return
+        try:
+            self.flush_fn(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"write queue '{self.name}': batch of {len(batch)} failed: {e}")
+        get_metrics().set_gauge('write_queue_depth', self._q.qsize(), queue=self.name)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch(self.flush_interval)
+            if not batch:
+                continue
+            # Let a small batch fill up a little before paying for a transaction
+            if len(batch) < self.batch_size:
+                time.sleep(min(0.2, self.flush_interval))
+                batch.extend(self._take_batch(None) if self._q.qsize() else [])
+            self._write(batch)
+
+    def flush(self):
+        """Synchronously drain everything queued so far (shutdown/tests)"""
+        while True:
+            batch = self._take_batch(None)
+            if not batch:
+                break
+            self._write(batch)
+
+    def stats(self) -> Dict:
+        return {
+            'name': self.name,
+            'depth': self._q.qsize(),
+            'maxsize': self.maxsize,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'failed_batches': self.failed_batches,
+        }
+
+
+def get_write_queues() -> List[WriteQueue]:
+    return list(_queues.values())
+
+
+@atexit.register
+def _flush_all():
+    for q in list(_queues.values()):
+        try:
+            q.flush()
+        except Exception:
+            pass
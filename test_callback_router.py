@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test of the trie/dict callback query router (no Telegram connection)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_callback_router.db'))
+
+from testkit import run_tests
+from bot.callback_router import EXACT, NUMERIC, PREFIX, REGEX, CallbackArgs, CallbackRouter, compile_pattern
+
+
+def _handler(name):
+    async def handler(update, context):
+        return name
+    handler.__name__ = name
+    return handler
+
+
+def _router():
+    return CallbackRouter().add_routes([
+        (r'^wallet_menu$', _handler('wallet_menu')),
+        (r'^plan_edit_\d+$', _handler('plan_edit')),
+        (r'^toggle_pay_card_(0|1)$', _handler('toggle_card')),
+        (r'^approve_auto_', _handler('approve_auto')),
+        (r'^approve_', _handler('approve_any')),
+        (r'^order_(\d+)_(ok|no)$', _handler('order_regex')),
+        (r'^wallet_', _handler('wallet_prefix')),
+    ])
+
+
+def _resolved(router, data):
+    hit = router.resolve(data)
+    return None if hit is None else hit[0].callback.__name__
+
+
+def test_compile_pattern_kinds():
+    assert compile_pattern(r'^wallet_menu$') == [(EXACT, 'wallet_menu')]
+    assert compile_pattern(r'^approve_auto_') == [(PREFIX, 'approve_auto_')]
+    assert compile_pattern(r'^plan_edit_\d+$') == [(NUMERIC, 'plan_edit_')]
+    assert compile_pattern(r'^toggle_(a|b)$') == [(EXACT, 'toggle_a'), (EXACT, 'toggle_b')]
+    assert compile_pattern(r'^order_(\d+)_x$') == [(REGEX, r'^order_(\d+)_x$')]
+    assert compile_pattern(r'wallet') == [(REGEX, 'wallet')]
+    assert compile_pattern(None) == [(PREFIX, '')]
+
+
+def test_resolve_routes():
+    router = _router()
+    assert _resolved(router, 'wallet_menu') == 'wallet_menu'
+    assert _resolved(router, 'plan_edit_12') == 'plan_edit'
+    assert _resolved(router, 'plan_edit_x') is None
+    assert _resolved(router, 'toggle_pay_card_1') == 'toggle_card'
+    assert _resolved(router, 'toggle_pay_card_2') is None
+    assert _resolved(router, 'order_5_ok') == 'order_regex'
+    assert _resolved(router, 'nothing_here') is None
+    assert router.stats() == {EXACT: 3, PREFIX: 3, NUMERIC: 1, REGEX: 1}
+
+
+def test_first_registered_route_wins():
+    router = _router()
+    # Both approve_auto_ and approve_ match; approve_auto_ was added first
+    assert _resolved(router, 'approve_auto_7') == 'approve_auto'
+    assert _resolved(router, 'approve_7') == 'approve_any'
+    # The exact route was registered before the wallet_ prefix
+    assert _resolved(router, 'wallet_menu') == 'wallet_menu'
+    assert _resolved(router, 'wallet_topup') == 'wallet_prefix'
+    # A regex registered later never shadows an earlier lookup route
+    late = CallbackRouter().add(r'^order_', _handler('prefix')).add(r'^order_(\d+)$', _handler('regex'))
+    assert _resolved(late, 'order_5') == 'prefix'
+
+
+def test_lookup_routes_get_parsed_args():
+    _, args = _router().resolve('approve_auto_12_3')
+    assert args == CallbackArgs('approve_auto_', ('12', '3'))
+
+
+def test_check_update_ignores_non_callbacks():
+    router = _router()
+    assert router.check_update(object()) is None
+
+
+def test_handle_update_sets_regex_matches():
+    router = _router()
+
+    class Context:
+        matches = None
+
+    ctx = Context()
+    check = router.resolve('order_9_no')
+    assert asyncio.run(router.handle_update(None, None, check, ctx)) == 'order_regex'
+    assert ctx.matches[0].group(1) == '9'
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
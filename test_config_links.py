@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test of the per-inbound config link templates (no panel, no network)
+"""
+import base64
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_config_links.db'))
+
+from testkit import run_tests
+from bot import config_links
+from bot.config_links import DIALECT_PANEL, DIALECT_SHARE, build_client_links, link_host, link_template
+from bot.panel_inbound import parse_inbound
+
+HOST = 'panel.example.com'
+CLIENT = {'id': 'u-1', 'password': 'pw', 'email': 'alice', 'flow': 'xtls-rprx-vision'}
+
+STREAMS = [
+    {'network': 'tcp', 'security': 'none'},
+    {'network': 'tcp', 'security': 'reality', 'realitySettings': {
+        'serverNames': ['www.example.com'], 'publicKey': 'PK', 'shortId': 'ab'}},
+    {'network': 'tcp', 'security': 'none', 'tcpSettings': {'header': {
+        'type': 'http', 'request': {'path': ['/dl'], 'headers': {'Host': ['cdn.example.com']}}}}},
+    {'network': 'ws', 'security': 'tls', 'wsSettings': {'path': '/ws', 'headers': {'Host': 'ws.example.com'}},
+     'tlsSettings': {'serverName': 'tls.example.com', 'alpn': ['h2', 'http/1.1']}},
+    {'network': 'grpc', 'security': 'tls', 'grpcSettings': {'serviceName': 'g'},
+     'tlsSettings': {'serverName': 't.example.com'}},
+]
+
+
+def _inbound(protocol, stream, remark='R 1', inbound_id=1):
+    return {'id': inbound_id, 'protocol': protocol, 'port': 443, 'remark': remark,
+            'settings': json.dumps({'clients': [CLIENT]}), 'streamSettings': json.dumps(stream)}
+
+
+def test_vless_reality_panel_link():
+    links = build_client_links(_inbound('vless', STREAMS[1]), CLIENT, 'alice', HOST)
+    assert links == ['vless://u-1@panel.example.com:443?type=tcp&security=reality'
+                     '&sni=www.example.com&flow=xtls-rprx-vision#alice'], links
+
+
+def test_vless_share_link_uses_remark():
+    links = build_client_links(_inbound('vless', STREAMS[1]), CLIENT, 'al ice', HOST, DIALECT_SHARE)
+    assert links == ['vless://u-1@panel.example.com:443?encryption=none&type=tcp&security=reality'
+                     '&sni=www.example.com&pbk=PK&sid=ab&fp=chrome#R%201'], links
+
+
+def test_vmess_fills_client_fields_as_json():
+    link = build_client_links(_inbound('vmess', STREAMS[3]), CLIENT, 'a"b', HOST)[0]
+    doc = json.loads(base64.b64decode(link[len('vmess://'):]))
+    assert doc['id'] == 'u-1' and doc['ps'] == 'a"b'
+    assert doc['net'] == 'ws' and doc['path'] == '/ws' and doc['host'] == 'ws.example.com'
+    assert doc['tls'] == 'tls' and doc['sni'] == 'tls.example.com'
+
+
+def test_trojan_needs_password():
+    inbound = _inbound('trojan', STREAMS[4])
+    assert build_client_links(inbound, CLIENT, 'x', 'h') == \
+        ['trojan://pw@h:443?type=grpc&serviceName=g&security=tls&sni=t.example.com#x']
+    assert build_client_links(inbound, {'email': 'x'}, 'x', 'h') == []
+
+
+def test_cached_template_matches_fresh_compile():
+    for dialect in (DIALECT_PANEL, DIALECT_SHARE):
+        for proto in ('vless', 'vmess', 'trojan'):
+            for stream in STREAMS:
+                parsed = parse_inbound(_inbound(proto, stream))
+                fresh = config_links._COMPILERS[dialect](parsed, HOST).render(CLIENT, 'alice')
+                assert link_template(parsed, HOST, dialect).render(CLIENT, 'alice') == fresh, (dialect, proto, stream)
+
+
+def test_template_reused_across_fetches_until_inbound_changes():
+    first = parse_inbound(_inbound('vless', STREAMS[0], remark='cache-test'))
+    tpl = link_template(first, HOST)
+    compiled = config_links.template_stats()['compiled']
+    # A later fetch of the same inbound is a new dict with the same content
+    again = parse_inbound(_inbound('vless', STREAMS[0], remark='cache-test'))
+    assert link_template(again, HOST) is tpl
+    assert config_links.template_stats()['compiled'] == compiled
+    changed = parse_inbound(_inbound('vless', STREAMS[3], remark='cache-test'))
+    assert link_template(changed, HOST) is not tpl
+    assert config_links.template_stats()['compiled'] == compiled + 1
+
+
+def test_link_host():
+    assert link_host('https://p.example.com:2053/path') == 'p.example.com'
+    assert link_host('p.example.com') == 'p.example.com'
+    assert link_host('') == ''
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Offline test of the USDT/IRT rate service (stub sources, no network)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Add project to path; throwaway DB so the service's settings reads find nothing
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_exchange_rate.db'))
+
+from testkit import run_tests
+from bot import exchange_rate
+from bot.exchange_rate import ExchangeRateService, stub_source
+
+
+def _service(sources, **kw):
+    kw.setdefault('timeout', 1.0)
+    return ExchangeRateService(sources=sources, persist=False, **kw)
+
+
+def test_median_of_sources():
+    svc = _service([('a', stub_source(100)), ('b', stub_source(110)), ('c', stub_source(300))])
+    assert asyncio.run(svc.refresh()) == 110
+    assert svc.get_price() == 110
+    assert not svc.is_stale()
+
+
+def test_first_strategy_takes_fastest():
+    svc = _service([('slow', stub_source(200, delay=0.3)), ('fast', stub_source(100))], strategy='first')
+    assert asyncio.run(svc.refresh()) == 100
+    assert svc.status()['source'] == 'fast'
+
+
+def test_failing_source_is_ignored():
+    svc = _service([('bad', stub_source(0, fail=True)), ('ok', stub_source(105))])
+    assert asyncio.run(svc.refresh()) == 105
+    assert svc.last_error.startswith('bad')
+
+
+def test_deadline_bounds_refresh():
+    svc = _service([('hung', stub_source(999, delay=1.5)), ('ok', stub_source(100))], timeout=0.5)
+
+    async def timed():
+        t0 = time.monotonic()
+        price = await svc.refresh()
+        return price, time.monotonic() - t0
+    # (asyncio.run itself still joins the hung worker thread on exit)
+    price, elapsed = asyncio.run(timed())
+    assert price == 100
+    assert elapsed < 1.0
+
+
+def test_no_quote_keeps_previous_price():
+    svc = _service([('ok', stub_source(100))])
+    asyncio.run(svc.refresh())
+    svc.sources = [('bad', stub_source(0, fail=True))]
+    assert asyncio.run(svc.refresh()) == 0.0
+    assert svc.get_price() == 100
+
+
+def test_source_budget_caps_chained_requests():
+    # A source chaining several hops gets at most its budget, not SOURCE_TIMEOUT per hop
+    budget = exchange_rate._Budget(0.5)
+    first = budget.request_timeout()
+    assert first is not None and first <= 0.5
+    time.sleep(0.5)
+    assert budget.request_timeout() is None
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
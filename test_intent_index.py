@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Test of the precompiled intent index used by the AI assistant (no DB, no network)
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_intent_index.db'))
+
+from testkit import run_tests
+from bot.intent_index import FUZZY_CONFIDENCE, SUBSTRING_CONFIDENCE, AhoCorasick, IntentIndex
+
+INTENTS = {
+    'buy': {'patterns': ['خرید سرویس', 'buy service'], 'priority': 0},
+    'support': {'patterns': ['پشتیبانی', 'support'], 'priority': 0.5},
+    'price': {'patterns': ['قیمت'], 'priority': 0},
+}
+
+
+def _index():
+    return IntentIndex.build(INTENTS, [{'pattern': 'how much is it', 'intent': 'price', 'confidence': 0.85}])
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    ac = AhoCorasick()
+    for i, p in enumerate(['he', 'she', 'hers', 'his']):
+        ac.add(p, i)
+    assert sorted(ac.find('ushers')) == [0, 1, 2]
+    assert list(ac.find('xyz')) == []
+
+
+def test_substring_match():
+    assert _index().match('میخوام خرید سرویس کنم') == ('buy', SUBSTRING_CONFIDENCE)
+
+
+def test_priority_breaks_ties_between_substring_hits():
+    intent, conf = _index().match('support please, buy service')
+    assert intent == 'support'
+    assert abs(conf - (SUBSTRING_CONFIDENCE + 0.05)) < 1e-9
+
+
+def test_match_is_case_and_space_insensitive():
+    assert _index().match('  SUPPORT ')[0] == 'support'
+
+
+def test_fuzzy_match_of_a_typo():
+    assert _index().match('buy servise') == ('buy', FUZZY_CONFIDENCE)
+
+
+def test_learned_patterns():
+    idx = _index()
+    assert idx.match('how much is it?') == ('price', 0.85)
+    size = len(idx)
+    # Same pattern again: no new document, but a higher confidence is kept
+    idx.add_learned('How much is it', 'price', 0.9)
+    assert len(idx) == size
+    assert idx.match('how much is it') == ('price', 0.9)
+
+
+def test_no_match():
+    assert _index().match('xyz qqq') == (None, 0.0)
+    assert _index().match('') == (None, 0.0)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
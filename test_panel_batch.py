@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test of batched client mutations on X-UI style inbounds (fake panel, no network)
+"""
+import copy
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_panel_batch.db'))
+
+from testkit import run_tests
+from bot.panel_batch import (
+    PANEL_BATCH_ATTEMPTS, ClientMutation, MutationResult, apply_mutations, lost_mutations, plan_mutations,
+    verify_plan,
+)
+from bot.panel_inbound import parse_inbound
+
+GB = 1024 ** 3
+DAY_MS = 86400 * 1000
+NOW_MS = 1_700_000_000_000
+
+
+def _inbound(clients):
+    return {'id': 1, 'protocol': 'vless', 'port': 443, 'settings': json.dumps({'clients': clients})}
+
+
+def _clients():
+    return [
+        {'email': 'alice', 'id': 'uuid-a', 'totalGB': 10 * GB, 'expiryTime': NOW_MS + DAY_MS, 'enable': True},
+        {'email': 'bob', 'id': 'uuid-b', 'totalGB': 5 * GB, 'expiryTime': 0, 'enable': True},
+        {'email': 'carol', 'id': 'uuid-c', 'totalGB': 0, 'expiryTime': NOW_MS - DAY_MS, 'enable': False},
+    ]
+
+
+def _written(plan):
+    """Inbound as the panel would store it after writing ``plan``"""
+    return _inbound(copy.deepcopy(plan.clients))
+
+
+def test_plan_applies_mutations_in_order():
+    parsed = parse_inbound(_inbound(_clients()))
+    mutations = [
+        ClientMutation.renew('alice', add_gb=2, add_days=30),
+        ClientMutation.delete('bob'),
+        ClientMutation.set_limits(client_id='uuid-c', total_bytes=GB, enable=True),
+        ClientMutation.renew('dave', add_gb=1, add_days=1),
+    ]
+    plan = plan_mutations(parsed, mutations, now_ms=NOW_MS)
+    assert plan.changed
+    assert [c['email'] for c in plan.clients] == ['alice', 'carol']
+    alice, carol = plan.clients
+    assert alice['totalGB'] == 12 * GB
+    assert alice['expiryTime'] == NOW_MS + 31 * DAY_MS
+    assert carol['totalGB'] == GB and carol['enable'] is True
+    assert not plan.results[3].ok
+    assert set(plan.targets) == {0, 1, 2}
+
+
+def test_plan_does_not_touch_the_shared_parse():
+    inbound = _inbound(_clients())
+    parsed = parse_inbound(inbound)
+    plan_mutations(parsed, [ClientMutation.renew('alice', add_gb=1, add_days=1)], now_ms=NOW_MS)
+    assert parse_inbound(inbound).find('alice').total_bytes == 10 * GB
+
+
+def test_renew_of_expired_client_starts_from_now():
+    parsed = parse_inbound(_inbound(_clients()))
+    plan = plan_mutations(parsed, [ClientMutation.renew('carol', add_gb=0, add_days=10)], now_ms=NOW_MS)
+    assert plan.slots[2]['expiryTime'] == NOW_MS + 10 * DAY_MS
+
+
+def test_verify_plan_accepts_written_state():
+    mutations = [ClientMutation.renew('alice', add_gb=2, add_days=30), ClientMutation.delete('bob')]
+    plan = plan_mutations(parse_inbound(_inbound(_clients())), mutations, now_ms=NOW_MS)
+    results = verify_plan(parse_inbound(_written(plan)), plan, mutations)
+    assert results[0].ok and results[0].client['totalGB'] == 12 * GB
+    assert results[1].ok
+
+
+def test_verify_plan_reports_unapplied_mutations():
+    mutations = [ClientMutation.renew('alice', add_gb=2, add_days=30), ClientMutation.delete('bob')]
+    plan = plan_mutations(parse_inbound(_inbound(_clients())), mutations, now_ms=NOW_MS)
+    # The panel kept the old clients list
+    results = verify_plan(parse_inbound(_inbound(_clients())), plan, mutations)
+    assert not results[0].ok
+    assert not results[1].ok
+
+
+def test_lost_writes_are_retried_but_changed_clients_are_not():
+    mutations = [ClientMutation.renew('alice', add_gb=2, add_days=30), ClientMutation.renew('bob', add_gb=1, add_days=0)]
+    plan = plan_mutations(parse_inbound(_inbound(_clients())), mutations, now_ms=NOW_MS)
+    # Another writer overwrote the inbound: alice is back to her old limits, bob got a
+    # different value than planned (e.g. someone edited him meanwhile)
+    after_clients = _clients()
+    after_clients[1]['totalGB'] = 7 * GB
+    after = parse_inbound(_inbound(after_clients))
+    results = verify_plan(after, plan, mutations)
+    assert not results[0].ok and not results[1].ok
+    assert lost_mutations(after, plan, mutations, results) == [0]
+
+
+class StubInboundAPI:
+    """One stored inbound; the first ``clobbered`` writes are overwritten by a concurrent writer"""
+
+    def __init__(self, clobbered=1):
+        self.stored = _inbound(_clients())
+        self.reads = 0
+        self.writes = 0
+        self.clobbered = clobbered
+
+    def fetch(self):
+        self.reads += 1
+        return copy.deepcopy(self.stored)
+
+    def write(self, full, clients):
+        self.writes += 1
+        if self.writes <= self.clobbered:
+            # The old list is put back right after our write
+            return True
+        self.stored = _inbound(copy.deepcopy(clients))
+        return True
+
+    def apply_singly(self, batch, parsed, plan):
+        raise AssertionError("batched update is available")
+
+
+def _apply(api, mutations):
+    return apply_mutations(mutations, api.fetch, api.write, api.apply_singly, panel_id='test', inbound_id=1)
+
+
+def test_conflict_path_replans_on_the_read_back():
+    api = StubInboundAPI()
+    results = _apply(api, [ClientMutation.renew('alice', add_gb=2, add_days=0)])
+    assert results[0].ok, results
+    assert api.writes == 2
+    # planning read + one read-back per write
+    assert api.reads == 3
+    assert parse_inbound(api.stored).find('alice').total_bytes == 12 * GB
+
+
+def test_gives_up_after_the_attempt_limit():
+    api = StubInboundAPI(clobbered=PANEL_BATCH_ATTEMPTS)
+    results = _apply(api, [ClientMutation.renew('alice', add_gb=2, add_days=0)])
+    assert not results[0].ok
+    assert api.writes == PANEL_BATCH_ATTEMPTS
+    assert parse_inbound(api.stored).find('alice').total_bytes == 10 * GB
+
+
+def test_falls_back_to_per_client_calls_without_a_batch_update():
+    api = StubInboundAPI()
+    api.write = lambda full, clients: None
+    api.apply_singly = lambda batch, parsed, plan: [MutationResult(True, "Success") for _ in batch]
+    mutations = [ClientMutation.delete('bob'), ClientMutation.delete('dave')]
+    assert [r.ok for r in _apply(api, mutations)] == [True, True]
+
+
+def test_missing_inbound():
+    api = StubInboundAPI()
+    api.fetch = lambda: None
+    results = _apply(api, [ClientMutation.delete('bob')])
+    assert not results[0].ok and results[0].message == "اینباند یافت نشد"
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test of the per-panel circuit breaker (no panel, no network)
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_panel_health.db'))
+
+from testkit import run_tests
+from bot import panel_health
+from bot.panel_health import (
+    PANEL_BREAKER_LISTING_SLOW_SECONDS, PANEL_BREAKER_SLOW_SECONDS, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN,
+    PanelBreaker, PanelUnavailable, last_known_usage, listing_requests, remember_usage, slow_request_seconds,
+)
+
+
+def _call(breaker, failed):
+    breaker.record(failed, 'boom' if failed else None, probe=breaker.before_request())
+
+
+def _rejects(breaker):
+    try:
+        breaker.before_request()
+    except PanelUnavailable:
+        return True
+    return False
+
+
+def _cool_down(breaker):
+    breaker._opened_at = time.monotonic() - breaker._cooldown - 1
+
+
+def _opened():
+    b = PanelBreaker('t')
+    for _ in range(panel_health.PANEL_BREAKER_CONSECUTIVE):
+        _call(b, True)
+    assert b.state == STATE_OPEN
+    return b
+
+
+def test_consecutive_failures_open_and_fail_fast():
+    b = _opened()
+    assert not b.available
+    assert _rejects(b)
+    assert b.retry_in() > 0
+
+
+def test_failure_ratio_opens():
+    b = PanelBreaker('t')
+    # Alternating, so never PANEL_BREAKER_CONSECUTIVE in a row
+    for i in range(panel_health.PANEL_BREAKER_MIN_CALLS):
+        _call(b, i % 2 == 1)
+    assert b.state == STATE_OPEN
+
+
+def test_successes_keep_it_closed():
+    b = PanelBreaker('t')
+    for _ in range(50):
+        _call(b, False)
+    _call(b, True)
+    assert b.state == STATE_CLOSED and b.available
+
+
+def test_half_open_lets_one_probe_through():
+    b = _opened()
+    _cool_down(b)
+    assert b.available
+    probe = b.before_request()
+    assert probe is True and b.state == STATE_HALF_OPEN
+    assert not b.available
+    assert _rejects(b)
+    b.record(False, probe=probe)
+    assert b.state == STATE_CLOSED
+
+
+def test_failed_probe_reopens_with_longer_cooldown():
+    b = _opened()
+    cooldown = b._cooldown
+    _cool_down(b)
+    b.record(True, 'boom', probe=b.before_request())
+    assert b.state == STATE_OPEN
+    assert b._cooldown == min(cooldown * 2, panel_health.PANEL_BREAKER_MAX_COOLDOWN)
+
+
+def test_request_from_closed_state_does_not_resolve_probe():
+    b = PanelBreaker('t')
+    # Let through while closed, still in flight when the breaker opens
+    straggler = b.before_request()
+    assert straggler is False
+    for _ in range(panel_health.PANEL_BREAKER_CONSECUTIVE):
+        _call(b, True)
+    _cool_down(b)
+    probe = b.before_request()
+    b.record(False, probe=straggler)
+    assert b.state == STATE_HALF_OPEN
+    assert _rejects(b)
+    b.record(True, 'boom', probe=probe)
+    assert b.state == STATE_OPEN
+
+
+def test_listings_get_their_own_slow_budget():
+    assert slow_request_seconds() == PANEL_BREAKER_SLOW_SECONDS
+    with listing_requests():
+        assert slow_request_seconds() == PANEL_BREAKER_LISTING_SLOW_SECONDS
+    assert slow_request_seconds() == PANEL_BREAKER_SLOW_SECONDS
+
+
+def test_last_known_usage_merges_partial_entries():
+    remember_usage(7, 'alice', {'used_traffic': 1, 'data_limit': 10, 'subscription_url': 'https://x/sub'})
+    remember_usage(7, 'alice', {'used_traffic': 2, 'data_limit': 10})
+    info, saved_at = last_known_usage(7, 'alice')
+    assert info['used_traffic'] == 2 and info['subscription_url'] == 'https://x/sub'
+    assert saved_at <= time.time()
+    assert last_known_usage(7, 'bob') is None
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test of the in-memory settings snapshot (throwaway sqlite DB)
+The handler tests run /start and the purchase flow with fake Telegram objects
+and count the statements that reach the settings table.
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import unittest
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_settings_store.db'))
+
+from testkit import run_tests
+from bot import db
+from bot.settings_store import SettingsSnapshot, get_settings
+
+db.db_setup()
+
+_SETTINGS_READ_RE = re.compile(r"\bFROM\s+settings\b", re.IGNORECASE)
+
+
+def _store():
+    db.execute_db("DELETE FROM settings")
+    db.execute_db("INSERT INTO settings (key, value) VALUES ('bot_active', '1'), ('pay_card_enabled', '0')")
+    store = SettingsSnapshot()
+    store.reload()
+    return store
+
+
+def test_reads_come_from_snapshot():
+    store = _store()
+    loads = store.loads
+    assert store.get_bool('bot_active') is True
+    assert store.get_bool('pay_card_enabled', True) is False
+    assert store.get('missing', 'x') == 'x'
+    assert store.loads == loads
+
+
+def test_write_is_visible_immediately():
+    store = _store()
+    store.set('bot_active', '0')
+    assert store.get('bot_active') == '0'
+    assert db.query_db("SELECT value FROM settings WHERE key='bot_active'", one=True)['value'] == '0'
+
+
+def test_failed_reload_keeps_previous_snapshot():
+    store = _store()
+    real = db.DB_NAME
+    # A path sqlite cannot open: query_db itself would answer []
+    db.DB_NAME = os.path.join(real + '.missing', 'nope.db')
+    try:
+        assert store.reload() is None
+        assert store.get('bot_active') == '1'
+        assert len(store.snapshot()) == 2
+    finally:
+        db.DB_NAME = real
+
+
+@contextmanager
+def _statements():
+    """Every statement passed to the DB layer's profiling hook while active"""
+    seen = []
+    real = db._record_statement
+
+    def record(query, seconds):
+        seen.append(query)
+        real(query, seconds)
+
+    db._record_statement = record
+    try:
+        yield seen
+    finally:
+        db._record_statement = real
+
+
+def _settings_reads(statements):
+    return [q for q in statements if _SETTINGS_READ_RE.search(q)]
+
+
+def _handlers():
+    try:
+        from bot.handlers import common, purchase
+    except SyntaxError as e:
+        raise unittest.SkipTest(f"handler modules do not import: {e}")
+    return common, purchase
+
+
+async def _noop(*args, **kwargs):
+    return SimpleNamespace(message_id=1)
+
+
+def _message(text=None):
+    return SimpleNamespace(text=text, chat_id=1, message_id=1, reply_text=_noop, edit_text=_noop,
+                           edit_reply_markup=_noop, delete=_noop)
+
+
+def _user(user_id):
+    return SimpleNamespace(id=user_id, first_name='t', last_name=None, username=None, is_bot=False)
+
+
+def _command_update(user_id, text):
+    return SimpleNamespace(effective_user=_user(user_id), effective_chat=SimpleNamespace(id=user_id),
+                           message=_message(text), effective_message=_message(text), callback_query=None)
+
+
+def _callback_update(user_id, data):
+    query = SimpleNamespace(data=data, from_user=_user(user_id), message=_message(), answer=_noop)
+    return SimpleNamespace(effective_user=query.from_user, effective_chat=SimpleNamespace(id=user_id),
+                           message=None, effective_message=query.message, callback_query=query)
+
+
+async def _member(*args, **kwargs):
+    return SimpleNamespace(status='member')
+
+
+def _context(user_data=None):
+    return SimpleNamespace(user_data=dict(user_data or {}),
+                           bot=SimpleNamespace(send_message=_noop, get_chat_member=_member))
+
+
+async def _start(common, update, context):
+    # The dispatcher runs the join/maintenance gate (group -1) before the command
+    await common.force_join_checker(update, context)
+    await common.start_command(update, context)
+
+
+def test_start_reads_no_settings_rows():
+    common, _ = _handlers()
+    get_settings().reload()
+    # First /start registers the user
+    asyncio.run(_start(common, _command_update(501, '/start'), _context()))
+    with _statements() as seen:
+        asyncio.run(_start(common, _command_update(501, '/start'), _context()))
+    assert seen, "handler issued no statements at all"
+    assert _settings_reads(seen) == [], _settings_reads(seen)
+
+
+def test_purchase_flow_reads_no_settings_rows():
+    _, purchase = _handlers()
+    get_settings().reload()
+    db.execute_db("INSERT INTO plans (name, description, price, duration_days, traffic_gb) VALUES ('p', 'd', 1000, 30, 10)")
+    plan_id = db.query_db("SELECT MAX(id) AS id FROM plans", one=True)['id']
+    context = _context({'desired_username': 'buyer'})
+    steps = [
+        (purchase.start_purchase_flow, 'buy_config_main'),
+        (purchase.show_plan_confirmation, f'select_plan_{plan_id}'),
+        (purchase.show_payment_method_selection, 'confirm_purchase'),
+    ]
+    with _statements() as seen:
+        for handler, data in steps:
+            asyncio.run(handler(_callback_update(502, data), context))
+    assert context.user_data.get('final_price') == 1000
+    assert _settings_reads(seen) == [], _settings_reads(seen)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test of the columnar usage snapshots, threshold bands and per-consumer diffs (no panel)
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test_usage_snapshot.db'))
+
+from testkit import run_tests
+from bot.usage_snapshot import GB, UsageCollector, UsageSnapshot, UsageThresholds
+
+NOW = 1_700_000_000
+DAY = 86400
+THRESHOLDS = UsageThresholds(usage_percent=(80, 95), remaining_bytes=(GB,), expiry_days=(2, 0))
+
+
+def _entry(name, used_gb=0.0, limit_gb=10, expire=0, enabled=True):
+    return {'username': name, 'used_traffic': int(used_gb * GB), 'data_limit': int(limit_gb * GB),
+            'expire': expire, 'enabled': enabled}
+
+
+def _snap(*entries, taken_at=NOW):
+    return UsageSnapshot.from_entries(1, entries, taken_at=taken_at)
+
+
+def test_snapshot_rows():
+    snap = _snap(_entry('alice', 1, expire=NOW + DAY), _entry('alice', 5), _entry('bob', enabled=False))
+    assert len(snap) == 2 and 'alice' in snap and snap.covers(['alice', 'bob'])
+    assert snap.row('alice') == {'username': 'alice', 'used_traffic': GB, 'data_limit': 10 * GB,
+                                 'expire': NOW + DAY, 'enabled': True}
+    assert snap.row('bob')['enabled'] is False
+    assert snap.row('carol') is None
+    assert _snap(_entry('old', expire=NOW - 1), _entry('new', expire=NOW + 1)).expired_before(NOW) == ['old']
+
+
+def test_usage_and_remaining_bands():
+    snap = _snap(_entry('low', 1), _entry('warn', 8.5), _entry('crit', 9.6), _entry('unlimited', 50, limit_gb=0))
+    bands = THRESHOLDS.bands(snap)
+    by_name = {u: bands.at(i) for i, u in enumerate(snap.usernames)}
+    assert by_name['low'][:2] == (0, 0)
+    assert by_name['warn'][:2] == (1, 0)
+    # 9.6 of 10 GB: past 95% and under 1 GB left
+    assert by_name['crit'][:2] == (2, 1)
+    assert by_name['unlimited'][:2] == (0, 0)
+
+
+def test_expiry_bands():
+    snap = _snap(
+        _entry('never'),
+        _entry('week', expire=NOW + 7 * DAY),
+        _entry('two_days', expire=NOW + 2 * DAY + 60),
+        _entry('hours', expire=NOW + 3600),
+        _entry('expired', expire=NOW - 60),
+    )
+    bands = THRESHOLDS.bands(snap)
+    expiry = {u: bands.expiry[i] for i, u in enumerate(snap.usernames)}
+    assert expiry == {'never': 0, 'week': 0, 'two_days': 1, 'hours': 2, 'expired': 3}
+
+
+def test_first_diff_reports_rows_past_a_threshold():
+    diff = UsageCollector().diff('c', _snap(_entry('fine', 1), _entry('crit', 9.6), _entry('off', enabled=False)), THRESHOLDS)
+    assert diff.first
+    assert sorted(diff.added) == ['crit', 'fine', 'off']
+    assert sorted(diff.crossed) == ['crit', 'off']
+
+
+def test_diff_reports_only_band_changes():
+    collector = UsageCollector()
+    collector.diff('c', _snap(_entry('alice', 1), _entry('bob', 8.5), _entry('gone', 1)), THRESHOLDS)
+    diff = collector.diff('c', _snap(_entry('alice', 2), _entry('bob', 9.6), _entry('new', 1)), THRESHOLDS)
+    assert not diff.first
+    # alice used more but stayed in her band
+    assert 'alice' in diff.changed and 'alice' not in diff.crossed
+    assert 'bob' in diff.crossed
+    assert diff.added == ['new'] and 'new' in diff.crossed
+    assert diff.removed == ['gone']
+    again = collector.diff('c', _snap(_entry('alice', 2), _entry('bob', 9.6), _entry('new', 1)), THRESHOLDS)
+    assert again.crossed == [] and again.changed == []
+
+
+def test_consumers_and_thresholds_keep_separate_baselines():
+    collector = UsageCollector()
+    snap = _snap(_entry('crit', 9.6))
+    collector.diff('a', snap, THRESHOLDS)
+    assert collector.diff('b', snap, THRESHOLDS).first
+    assert collector.diff('a', snap, UsageThresholds(usage_percent=(50,))).first
+
+
+def test_retry_later_reports_user_again():
+    collector = UsageCollector()
+    collector.diff('c', _snap(_entry('crit', 9.6), _entry('fine', 1)), THRESHOLDS)
+    collector.retry_later('c', 1, ['crit'])
+    diff = collector.diff('c', _snap(_entry('crit', 9.6), _entry('fine', 1)), THRESHOLDS)
+    assert diff.crossed == ['crit']
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_tests(globals()) else 1)
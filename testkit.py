@@ -0,0 +1,28 @@
+"""
+Shared runner for the root-level test scripts
+Each ``test_*.py`` holds plain pytest functions; ``python test_x.py`` runs them
+through :func:`run_tests` and prints one ✅/❌ line per test. A test raising
+``unittest.SkipTest`` is reported as skipped, by pytest and here alike.
+"""
+import traceback
+import unittest
+
+
+def run_tests(namespace: dict, verbose: bool = False) -> bool:
+    """Run every callable ``test_*`` in ``namespace`` (a module's ``globals()``); True if all passed"""
+    tests = [v for k, v in sorted(namespace.items()) if k.startswith('test_') and callable(v)]
+    failed = skipped = 0
+    for t in tests:
+        try:
+            t()
+            print(f"✅ {t.__name__}")
+        except unittest.SkipTest as e:
+            skipped += 1
+            print(f"⏭️ {t.__name__}: {e}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {t.__name__}: {e!r}")
+            if verbose:
+                traceback.print_exc()
+    print(f"{len(tests) - failed - skipped}/{len(tests)} passed" + (f", {skipped} skipped" if skipped else ""))
+    return failed == 0